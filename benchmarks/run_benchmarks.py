@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Benchmarks for project load, prepare, archive, download and env creation.
+
+Each run generates a synthetic project of the requested size, times
+each benchmark several times, and saves the results as JSON (by
+default in build/benchmarks/) so that runs can be compared later
+with ``--compare``.
+
+    python benchmarks/run_benchmarks.py --files 5000 --notebooks 200
+    python benchmarks/run_benchmarks.py --compare build/benchmarks/before.json
+"""
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from argparse import ArgumentParser
+from copy import deepcopy
+from os.path import dirname, realpath
+
+ROOT = dirname(dirname(realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conda_kapsel import archiver  # noqa: E402
+from conda_kapsel import project_ops  # noqa: E402
+from conda_kapsel.conda_manager import (CondaManager, CondaEnvironmentDeviations, push_conda_manager_class,  # noqa
+                                        pop_conda_manager_class)
+from conda_kapsel.internal import project_cache  # noqa: E402
+from conda_kapsel.local_state_file import LocalStateFile  # noqa: E402
+from conda_kapsel.prepare import prepare_without_interaction  # noqa: E402
+from conda_kapsel.project import Project  # noqa: E402
+from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME  # noqa: E402
+from conda_kapsel.provide import PROVIDE_MODE_CHECK  # noqa: E402
+
+# bump this if the results format changes incompatibly
+_RESULTS_FORMAT_VERSION = 1
+
+_FILES_PER_DIRECTORY = 50
+
+_NOTEBOOK = json.dumps(dict(cells=[], metadata={}, nbformat=4, nbformat_minor=0))
+
+
+class _FakeCondaManager(CondaManager):
+    """A CondaManager that says every environment is already fine, so we only time our own code."""
+
+    def find_environment_deviations(self, prefix, spec):
+        return CondaEnvironmentDeviations(summary="OK",
+                                          missing_packages=(),
+                                          wrong_version_packages=(),
+                                          missing_pip_packages=(),
+                                          wrong_version_pip_packages=())
+
+    def fix_environment_deviations(self, prefix, spec, deviations=None):
+        pass
+
+    def remove_packages(self, prefix, packages):
+        pass
+
+
+def _write_file(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def _variable_name(i):
+    return "VARIABLE_%d" % i
+
+
+def _download_filename(i):
+    return "data/download_%d.dat" % i
+
+
+def _make_synthetic_project(directory, options):
+    """Create a project with the number of things asked for in ``options``."""
+    lines = ["name: synthetic", "variables:"]
+    for i in range(options.variables):
+        lines.append("  %s: { default: 'value %d' }" % (_variable_name(i), i))
+    lines.append("downloads:")
+    for i in range(options.downloads):
+        lines.append("  DOWNLOAD_%d: { url: 'http://localhost:1/download_%d', filename: '%s' }" %
+                     (i, i, _download_filename(i)))
+    lines.append("env_specs:")
+    for i in range(options.env_specs):
+        lines.append("  env_%d:" % i)
+        lines.append("    packages: [%s]" % ", ".join(["package_%d_%d" % (i, j) for j in range(10)]))
+    _write_file(os.path.join(directory, DEFAULT_PROJECT_FILENAME), "\n".join(lines) + "\n")
+
+    # the downloads are already done, so prepare finds them
+    for i in range(options.downloads):
+        _write_file(os.path.join(directory, _download_filename(i)), b"downloaded")
+
+    # half the files compress well, half don't
+    for i in range(options.files):
+        path = os.path.join(directory, "src", "dir_%d" % (i // _FILES_PER_DIRECTORY), "file_%d.txt" % i)
+        if i % 2 == 0:
+            content = (("line %d of some text\n" % i) * (options.file_size // 20 + 1))[:options.file_size]
+            _write_file(path, content)
+        else:
+            _write_file(path, os.urandom(options.file_size))
+
+    for i in range(options.notebooks):
+        path = os.path.join(directory, "notebooks", "dir_%d" % (i // _FILES_PER_DIRECTORY), "notebook_%d.ipynb" % i)
+        _write_file(path, _NOTEBOOK)
+
+    local_state = LocalStateFile.load_for_directory(directory)
+    local_state.set_value('inherit_environment', True)
+    local_state.save()
+
+
+def _load_project(directory):
+    project = Project(directory)
+    # the project config is loaded lazily
+    if project.problems:
+        raise RuntimeError("Synthetic project has problems: %r" % project.problems)
+    return project
+
+
+def _bench_project_load_cold(directory, options):
+    def setup():
+        shutil.rmtree(os.path.join(directory, project_cache.CACHE_DIRECTORY), ignore_errors=True)
+
+    def run():
+        _load_project(directory)
+
+    return (setup, run, None)
+
+
+def _bench_project_load_warm(directory, options):
+    _load_project(directory)
+
+    def run():
+        _load_project(directory)
+
+    return (None, run, None)
+
+
+def _bench_prepare_check(directory, options):
+    project = _load_project(directory)
+    environ = deepcopy(os.environ)
+    for i in range(options.variables):
+        environ[_variable_name(i)] = "set"
+    push_conda_manager_class(_FakeCondaManager)
+
+    def run():
+        prepare_without_interaction(project, environ=environ, mode=PROVIDE_MODE_CHECK)
+
+    return (None, run, pop_conda_manager_class)
+
+
+def _archive_benchmark(extension):
+    def bench(directory, options):
+        project = _load_project(directory)
+        output_dir = tempfile.mkdtemp(prefix="kapsel-bench-archive-")
+        filename = os.path.join(output_dir, "project" + extension)
+
+        def run():
+            status = archiver._archive_project(project, filename)
+            if not status:
+                raise RuntimeError("%s: %r" % (status.status_description, status.errors))
+
+        def teardown():
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        return (None, run, teardown)
+
+    return bench
+
+
+def _bench_archive_listing_ignored_env(directory, options):
+    # a git checkout with a big gitignored environment in it; git
+    # and our own walk should both skip the environment quickly.
+    project_dir = tempfile.mkdtemp(prefix="kapsel-bench-ignored-env-")
+    try:
+        _write_file(os.path.join(project_dir, DEFAULT_PROJECT_FILENAME), "name: ignored_env\n")
+        _write_file(os.path.join(project_dir, ".gitignore"), "/env/\n")
+        for i in range(options.ignored_env_files):
+            _write_file(os.path.join(project_dir, "env", "lib", "dir_%d" % (i // _FILES_PER_DIRECTORY),
+                                     "module_%d.py" % i), "")
+        for i in range(_FILES_PER_DIRECTORY):
+            _write_file(os.path.join(project_dir, "src", "file_%d.py" % i), "")
+        subprocess.check_output(['git', 'init', '-q', project_dir])
+        project = _load_project(project_dir)
+    except Exception:
+        shutil.rmtree(project_dir, ignore_errors=True)
+        raise
+
+    def run():
+        errors = []
+        archive_filter = archiver._archive_filter(project_dir, errors, requirements=project.requirements)
+        if archive_filter is None:
+            raise RuntimeError("Failed to list files: %r" % errors)
+        for info in archiver._walk_project(project_dir, archive_filter, errors, leaves_only=True):
+            pass
+        if errors:
+            raise RuntimeError("Failed to list files: %r" % errors)
+
+    def teardown():
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    return (None, run, teardown)
+
+
+def _bench_download(directory, options):
+    # imported here so the other benchmarks still run without tornado
+    from tornado import gen
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+    from tornado.netutil import bind_sockets
+    from tornado.web import Application, RequestHandler
+    from conda_kapsel.internal.http_client import FileDownloader
+
+    chunk = os.urandom(64 * 1024)
+
+    class DownloadHandler(RequestHandler):
+        @gen.coroutine
+        def get(self):
+            self.set_header('Content-Length', str(options.download_size))
+            remaining = options.download_size
+            while remaining > 0:
+                to_write = chunk[:remaining]
+                remaining -= len(to_write)
+                self.write(to_write)
+                yield self.flush()
+            self.finish()
+
+    server = HTTPServer(Application([(r'/download', DownloadHandler)]))
+    sockets = bind_sockets(port=None, address='127.0.0.1')
+    server.add_sockets(sockets)
+    url = "http://127.0.0.1:%d/download" % sockets[0].getsockname()[1]
+    output_dir = tempfile.mkdtemp(prefix="kapsel-bench-download-")
+    filename = os.path.join(output_dir, "downloaded")
+
+    def run():
+        download = FileDownloader(url=url, filename=filename, hash_algorithm='md5')
+        response = IOLoop.current().run_sync(lambda: download.run(IOLoop.current()))
+        if download.errors or response is None:
+            raise RuntimeError("Download failed: %r" % download.errors)
+
+    def teardown():
+        server.stop()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return (None, run, teardown)
+
+
+# a conda that only pretends to fetch into its package cache and
+# link into environments, sleeping as long as the options say.
+_FAKE_CONDA = """#!%(python)s
+import json, os, sys, time
+args = sys.argv[1:]
+if args[:1] == ['info']:
+    print(json.dumps(dict(root_prefix=%(root)r, envs_dirs=[], envs=[], pkgs_dirs=[%(pkgs)r], conda_version='4.6.0')))
+elif args[:1] in (['create'], ['install']):
+    if '--download-only' in args:
+        time.sleep(%(fetch)r)
+    else:
+        time.sleep(%(link)r)
+        prefix = args[args.index('--prefix') + 1]
+        if not os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            os.makedirs(os.path.join(prefix, 'conda-meta'))
+elif args[:2] == ['list', '--explicit']:
+    print('@EXPLICIT')
+"""
+
+
+def _update_env_specs_benchmark(jobs):
+    def bench(directory, options):
+        if platform.system() == 'Windows':
+            raise RuntimeError("The fake conda is a script, which Windows can't run")
+        project = _load_project(directory)
+        conda_dir = tempfile.mkdtemp(prefix="kapsel-bench-conda-")
+        conda = os.path.join(conda_dir, "bin", "conda")
+        _write_file(conda, _FAKE_CONDA % dict(python=sys.executable,
+                                              root=conda_dir,
+                                              pkgs=os.path.join(conda_dir, "pkgs"),
+                                              fetch=options.fake_conda_fetch_seconds,
+                                              link=options.fake_conda_link_seconds))
+        os.chmod(conda, 0o755)
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([os.path.dirname(conda), old_path])
+
+        def setup():
+            shutil.rmtree(os.path.join(directory, "envs"), ignore_errors=True)
+
+        def run():
+            status = project_ops.update_env_specs(project, jobs=jobs)
+            if not status:
+                raise RuntimeError("%s: %r" % (status.status_description, status.errors))
+
+        def teardown():
+            os.environ['PATH'] = old_path
+            shutil.rmtree(os.path.join(directory, "envs"), ignore_errors=True)
+            shutil.rmtree(conda_dir, ignore_errors=True)
+
+        return (setup, run, teardown)
+
+    return bench
+
+
+# in the order they run; each returns a (setup, run, teardown)
+# tuple where setup is run untimed before each repetition.
+_BENCHMARKS = [('project_load_cold', _bench_project_load_cold), ('project_load_warm', _bench_project_load_warm),
+               ('prepare_check', _bench_prepare_check), ('archive_zip', _archive_benchmark(".zip")),
+               ('archive_tar', _archive_benchmark(".tar")), ('archive_tar_gz', _archive_benchmark(".tar.gz")),
+               ('archive_tar_bz2', _archive_benchmark(".tar.bz2")),
+               ('archive_listing_ignored_env', _bench_archive_listing_ignored_env), ('download', _bench_download),
+               ('update_env_specs_jobs_1', _update_env_specs_benchmark(1)),
+               ('update_env_specs_jobs_4', _update_env_specs_benchmark(4))]
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    else:
+        return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _run_benchmark(name, bench, directory, options):
+    try:
+        (setup, run, teardown) = bench(directory, options)
+    except Exception as e:
+        return dict(error=str(e))
+
+    times = []
+    try:
+        for i in range(options.repeat):
+            if setup is not None:
+                setup()
+            start = timeit.default_timer()
+            run()
+            times.append(timeit.default_timer() - start)
+    except Exception as e:
+        return dict(error=str(e))
+    finally:
+        if teardown is not None:
+            teardown()
+
+    return dict(times=times, min=min(times), median=_median(times), mean=sum(times) / len(times))
+
+
+def _print_result(name, result):
+    if 'error' in result:
+        print("%-20s failed: %s" % (name, result['error']))
+    else:
+        print("%-20s min %9.4fs  median %9.4fs  mean %9.4fs" %
+              (name, result['min'], result['median'], result['mean']))
+
+
+def _print_comparison(old_results, new_results):
+    print("")
+    print("%-20s %12s %12s %8s" % ("benchmark", "old median", "new median", "ratio"))
+    for (name, new) in sorted(new_results['results'].items()):
+        old = old_results['results'].get(name, {})
+        if 'median' not in old or 'median' not in new:
+            print("%-20s %12s %12s" % (name, old.get('median', '-'), new.get('median', '-')))
+            continue
+        ratio = new['median'] / old['median'] if old['median'] > 0 else float('inf')
+        print("%-20s %11.4fs %11.4fs %7.2fx" % (name, old['median'], new['median'], ratio))
+    if old_results['parameters'] != new_results['parameters']:
+        print("(note: the runs used different parameters: %r vs. %r)" %
+              (old_results['parameters'], new_results['parameters']))
+
+
+def _load_results(filename):
+    with codecs.open(filename, 'r', 'utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != _RESULTS_FORMAT_VERSION:
+        raise ValueError("%s has unknown results format version %r" % (filename, results.get('version')))
+    return results
+
+
+def main(argv):
+    """Run the benchmarks and return an exit code."""
+    parser = ArgumentParser(description="Time project load, prepare, archive, download and env creation on a "
+                            "synthetic project.")
+    parser.add_argument('--variables', type=int, default=50, help="Number of variables in the project")
+    parser.add_argument('--downloads', type=int, default=10, help="Number of downloads in the project")
+    parser.add_argument('--env-specs', type=int, default=5, help="Number of environment specs in the project")
+    parser.add_argument('--files', type=int, default=2000, help="Number of files in the project tree")
+    parser.add_argument('--file-size', type=int, default=4096, help="Size in bytes of each file")
+    parser.add_argument('--notebooks', type=int, default=50, help="Number of notebooks in the project tree")
+    parser.add_argument('--ignored-env-files', type=int, default=20000,
+                        help="Number of files in the gitignored environment for archive_listing_ignored_env")
+    parser.add_argument('--download-size', type=int, default=8 * 1024 * 1024, help="Bytes to download")
+    parser.add_argument('--fake-conda-fetch-seconds', type=float, default=0.2,
+                        help="How long the fake conda takes to fill its package cache for an environment")
+    parser.add_argument('--fake-conda-link-seconds', type=float, default=0.5,
+                        help="How long the fake conda takes to link an environment")
+    parser.add_argument('--repeat', type=int, default=5, help="Times to run each benchmark")
+    parser.add_argument('--only', metavar='NAME', action='append', help="Only run benchmarks with NAME in their name")
+    parser.add_argument('--output', metavar='FILENAME', default=None, help="Where to save the results")
+    parser.add_argument('--compare', metavar='FILENAME', default=None, help="Earlier results to compare against")
+    options = parser.parse_args(argv[1:])
+
+    old_results = None
+    if options.compare is not None:
+        old_results = _load_results(options.compare)
+
+    parameters = dict(variables=options.variables,
+                      downloads=options.downloads,
+                      env_specs=options.env_specs,
+                      files=options.files,
+                      file_size=options.file_size,
+                      notebooks=options.notebooks,
+                      ignored_env_files=options.ignored_env_files,
+                      download_size=options.download_size,
+                      fake_conda_fetch_seconds=options.fake_conda_fetch_seconds,
+                      fake_conda_link_seconds=options.fake_conda_link_seconds,
+                      repeat=options.repeat)
+
+    results = dict()
+    directory = tempfile.mkdtemp(prefix="kapsel-bench-project-")
+    try:
+        print("Generating synthetic project in %s" % directory)
+        _make_synthetic_project(directory, options)
+        for (name, bench) in _BENCHMARKS:
+            if options.only and not any(only in name for only in options.only):
+                continue
+            results[name] = _run_benchmark(name, bench, directory, options)
+            _print_result(name, results[name])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    all_results = dict(version=_RESULTS_FORMAT_VERSION,
+                       created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       python=sys.version,
+                       platform=platform.platform(),
+                       parameters=parameters,
+                       results=results)
+
+    output = options.output
+    if output is None:
+        output = os.path.join(ROOT, "build", "benchmarks", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with codecs.open(output, 'w', 'utf-8') as f:
+        json.dump(all_results, f, indent=2, sort_keys=True)
+    print("Saved results to %s" % output)
+
+    if old_results is not None:
+        _print_comparison(old_results, all_results)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,4 @@
+from __future__ import print_function
+import sys
+print("NOT_JSON")
+sys.exit(0)
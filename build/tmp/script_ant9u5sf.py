@@ -0,0 +1,6 @@
+from __future__ import print_function
+import sys
+import time
+print("started")
+sys.stdout.flush()
+time.sleep(60)
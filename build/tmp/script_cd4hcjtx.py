@@ -0,0 +1,7 @@
+from __future__ import print_function
+import sys
+print("one")
+sys.stdout.flush()
+print("warning", file=sys.stderr)
+print("two")
+sys.exit(3)
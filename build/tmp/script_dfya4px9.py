@@ -0,0 +1,5 @@
+from __future__ import print_function
+import sys
+print("TEST_ERROR", file=sys.stderr)
+print("{}")
+sys.exit(0)
@@ -0,0 +1,6 @@
+from __future__ import print_function
+import sys
+print("Fetching")
+sys.stdout.flush()
+print("TEST_WARNING", file=sys.stderr)
+sys.exit(0)
@@ -0,0 +1,9 @@
+from __future__ import print_function
+import sys
+import time
+print("Collecting flake8")
+sys.stdout.flush()
+print("TEST_WARNING", file=sys.stderr)
+sys.stderr.flush()
+if len(sys.argv) > 1:
+    time.sleep(60)
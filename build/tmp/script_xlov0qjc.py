@@ -0,0 +1,4 @@
+from __future__ import print_function
+import sys
+print(" ".join(sys.argv))
+sys.exit(0)
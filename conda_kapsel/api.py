@@ -30,7 +30,7 @@ class AnacondaProject(object):
         """Construct an API instance."""
         pass
 
-    def load_project(self, directory_path):
+    def load_project(self, directory_path, read_only=False):
         """Load a project from the given directory.
 
         If there's a problem, the returned Project instance will
@@ -40,14 +40,19 @@ class AnacondaProject(object):
         to a project; code must always be ready for a project to
         have some problems.
 
+        If ``read_only`` is True, the project files are loaded
+        with a faster loader meant for code that won't modify
+        them (modifying them still works, but is slower).
+
         Args:
             directory_path (str): path to the project directory
+            read_only (bool): True to optimize for reading the project files rather than modifying them
 
         Returns:
             a Project instance
 
         """
-        return project.Project(directory_path=directory_path)
+        return project.Project(directory_path=directory_path, read_only=read_only)
 
     def create_project(self, directory_path, make_directory=False, name=None, icon=None, description=None):
         """Create a project skeleton in the given directory.
@@ -83,7 +88,8 @@ class AnacondaProject(object):
                                 env_spec_name=None,
                                 command_name=None,
                                 command=None,
-                                extra_command_args=None):
+                                extra_command_args=None,
+                                force_full_check=False):
         """Prepare a project to run one of its commands.
 
         "Locally" means a machine where development will go on,
@@ -116,6 +122,10 @@ class AnacondaProject(object):
         result. So ``project.problems`` does not need to be checked in
         advance.
 
+        The result's ``timings`` property records how long each
+        prepare stage, requirement check, provider, and conda, pip,
+        or redis-server subprocess took.
+
         Args:
             project (Project): from the ``load_project`` method
             environ (dict): os.environ or the previously-prepared environ; not modified in-place
@@ -123,6 +133,7 @@ class AnacondaProject(object):
             command_name (str): which named command to choose from the project, None for default
             command (ProjectCommand): a command object (alternative to command_name)
             extra_command_args (list): extra args to include in the returned command argv
+            force_full_check (bool): True to check all requirements even if nothing seems to have changed
 
         Returns:
             a ``PrepareResult`` instance, which has a ``failed`` flag
@@ -134,7 +145,8 @@ class AnacondaProject(object):
                                                    env_spec_name=env_spec_name,
                                                    command_name=command_name,
                                                    command=command,
-                                                   extra_command_args=extra_command_args)
+                                                   extra_command_args=extra_command_args,
+                                                   force_full_check=force_full_check)
 
     def prepare_project_production(self,
                                    project,
@@ -142,7 +154,8 @@ class AnacondaProject(object):
                                    env_spec_name=None,
                                    command_name=None,
                                    command=None,
-                                   extra_command_args=None):
+                                   extra_command_args=None,
+                                   force_full_check=False):
         """Prepare a project to run one of its commands.
 
         "Production" means some sort of production deployment, so
@@ -166,6 +179,7 @@ class AnacondaProject(object):
             command_name (str): which named command to choose from the project, None for default
             command (ProjectCommand): a command object (alternative to command_name)
             extra_command_args (list): extra args to include in the returned command argv
+            force_full_check (bool): True to check all requirements even if nothing seems to have changed
 
         Returns:
             a ``PrepareResult`` instance, which has a ``failed`` flag
@@ -177,7 +191,8 @@ class AnacondaProject(object):
                                                    env_spec_name=env_spec_name,
                                                    command_name=command_name,
                                                    command=command,
-                                                   extra_command_args=extra_command_args)
+                                                   extra_command_args=extra_command_args,
+                                                   force_full_check=force_full_check)
 
     def prepare_project_check(self,
                               project,
@@ -185,7 +200,8 @@ class AnacondaProject(object):
                               env_spec_name=None,
                               command_name=None,
                               command=None,
-                              extra_command_args=None):
+                              extra_command_args=None,
+                              force_full_check=False):
         """Prepare a project to run one of its commands.
 
         This version only checks the status of the project's
@@ -204,6 +220,7 @@ class AnacondaProject(object):
             command_name (str): which named command to choose from the project, None for default
             command (ProjectCommand): a command object (alternative to command_name)
             extra_command_args (list): extra args to include in the returned command argv
+            force_full_check (bool): True to check all requirements even if nothing seems to have changed
 
         Returns:
             a ``PrepareResult`` instance, which has a ``failed`` flag
@@ -215,7 +232,8 @@ class AnacondaProject(object):
                                                    env_spec_name=env_spec_name,
                                                    command_name=command_name,
                                                    command=command,
-                                                   extra_command_args=extra_command_args)
+                                                   extra_command_args=extra_command_args,
+                                                   force_full_check=force_full_check)
 
     def prepare_project_browser(self,
                                 project,
@@ -442,6 +460,61 @@ class AnacondaProject(object):
         """
         return project_ops.remove_env_spec(project=project, name=name)
 
+    def refresh_lock(self, project, env_spec_name=None):
+        """Solve for an environment spec's packages again and save them in its lock file.
+
+        Environments are created from the lock file when it's up to
+        date, so package versions only change when this is called
+        (or when the env spec's packages change). The environment is
+        deleted and re-created from the new solution.
+
+        Returns a ``Status`` subtype (it won't be a
+        ``RequirementStatus`` as with some other functions, just a
+        plain status).
+
+        Args:
+            project (Project): the project
+            env_spec_name (str): environment spec name or None for the default
+
+        Returns:
+            ``Status`` instance
+        """
+        return project_ops.refresh_lock(project=project, env_spec_name=env_spec_name)
+
+    def update_env_specs(self, project, env_spec_names=None, jobs=None, environ=None,
+                         mode=provide.PROVIDE_MODE_DEVELOPMENT):
+        """Create or fix the environments for several env specs at once.
+
+        Up to ``jobs`` environments are worked on at a time. Each
+        environment is locked while it's changed, and conda commands
+        take turns filling each package cache (with conda 4.6 or
+        later, they then link environments at the same time), so
+        it's safe to run this alongside other conda-kapsel processes.
+
+        In ``PROVIDE_MODE_CHECK``, nothing is changed; the status
+        logs say what would be done, and it fails if any environment
+        needs changes.
+
+        Returns a ``Status`` subtype (it won't be a
+        ``RequirementStatus`` as with some other functions, just a
+        plain status).
+
+        Args:
+            project (Project): the project
+            env_spec_names (list of str): env spec names, or None for all of them
+            jobs (int): how many environments to work on at once, or None for the default
+            environ (dict): environment variables to use, or None for os.environ
+            mode (str): one of ``PROVIDE_MODE_PRODUCTION``, ``PROVIDE_MODE_DEVELOPMENT``, ``PROVIDE_MODE_CHECK``
+
+        Returns:
+            ``Status`` instance
+        """
+        return project_ops.update_env_specs(project=project,
+                                            env_spec_names=env_spec_names,
+                                            jobs=jobs,
+                                            environ=environ,
+                                            mode=mode)
+
     def add_packages(self, project, env_spec_name, packages, channels):
         """Attempt to install packages then add them to kapsel.yml.
 
@@ -609,17 +682,24 @@ class AnacondaProject(object):
         """
         return project_ops.clean(project=project, prepare_result=prepare_result)
 
-    def archive(self, project, filename):
+    def archive(self, project, filename, jobs=None, compression_level=None):
         """Make an archive of the non-ignored files in the project.
 
+        Compression is spread over ``jobs`` threads. The archive is
+        an ordinary zip or tarball either way. In a zip, files that
+        are already compressed (images, other archives, and so on)
+        are stored as they are.
+
         Args:
             project (``Project``): the project
             filename (str): name of a zip, tar.gz, or tar.bz2 archive file
+            jobs (int): how many threads to compress on, or None for one per CPU
+            compression_level (int): deflate level 0-9 for zip and tar.gz, or None for the default
 
         Returns:
             a ``Status``, if failed has ``errors``
         """
-        return project_ops.archive(project=project, filename=filename)
+        return project_ops.archive(project=project, filename=filename, jobs=jobs, compression_level=compression_level)
 
     def upload(self, project, site=None, username=None, token=None, log_level=None):
         """Upload the project to the Anaconda server.
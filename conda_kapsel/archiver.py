@@ -9,59 +9,234 @@ from __future__ import absolute_import, print_function
 
 import codecs
 import errno
-import fnmatch
 import os
 import platform
+import re
 import subprocess
+import sys
 import tarfile
+import time
 import uuid
 import zipfile
+import zlib
 
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.internal.directory_contains import subdirectory_relative_to_directory
 from conda_kapsel.internal.rename import rename_over_existing
+from conda_kapsel.internal import parallel
+from conda_kapsel.internal import parallel_compress
+from conda_kapsel.internal import project_cache
+from conda_kapsel.internal import py2_compat
 
 
 class _FileInfo(object):
-    def __init__(self, project_directory, filename, is_directory):
-        self.full_path = os.path.abspath(filename)
-        self.relative_path = os.path.relpath(self.full_path, start=project_directory)
-        if platform.system() == 'Windows':
-            self.unixified_relative_path = self.relative_path.replace("\\", "/")
+    # there's one of these per file in the project, so keep them small
+    __slots__ = ('full_path', 'relative_path', 'unixified_relative_path', 'basename', 'is_directory', 'is_link')
+
+    def __init__(self, full_path, relative_path, is_directory, is_link=False, unixify=False):
+        self.full_path = full_path
+        self.relative_path = relative_path
+        if unixify:
+            self.unixified_relative_path = relative_path.replace("\\", "/")
         else:
-            self.unixified_relative_path = self.relative_path
-        self.basename = os.path.basename(self.full_path)
+            self.unixified_relative_path = relative_path
+        self.basename = os.path.basename(relative_path)
         self.is_directory = is_directory
+        self.is_link = is_link
 
 
-def _list_project(project_directory, ignore_filter, errors):
-    try:
-        file_infos = []
-        for root, dirs, files in os.walk(project_directory):
-            filtered_dirs = []
-            for d in dirs:
-                info = _FileInfo(project_directory=project_directory, filename=os.path.join(root, d), is_directory=True)
-                if ignore_filter(info):
-                    continue
+def _scan_directory(project_directory, relative_dir):
+    """Make a _FileInfo for each entry in a directory of the project.
+
+    The type of each entry comes from scandir, which usually
+    knows it without a stat() per file.
+
+    Raises OSError if the directory can't be listed.
+    """
+    full_dir = os.path.join(os.path.abspath(project_directory), relative_dir)
+    unixify = platform.system() == 'Windows'
+    infos = []
+    for entry in list(py2_compat.scandir(full_dir)):
+        if relative_dir == '':
+            relative_path = entry.name
+        else:
+            relative_path = os.path.join(relative_dir, entry.name)
+        try:
+            is_directory = entry.is_dir()
+            is_link = is_directory and entry.is_symlink()
+        except OSError:
+            # vanished out from under us
+            continue
+        infos.append(_FileInfo(full_path=entry.path,
+                               relative_path=relative_path,
+                               is_directory=is_directory,
+                               is_link=is_link,
+                               unixify=unixify))
+    return infos
+
+
+def _walk_project(project_directory, ignore_filter, errors, leaves_only=False):
+    """Generate a _FileInfo for each file and directory in the project that isn't ignored.
+
+    Infos are generated as directories are listed, so callers
+    can use them right away. Ignored directories are never
+    listed, mostly because listing "envs" is very slow, and
+    neither are symlinks to directories. Like ``os.walk``, we
+    skip subdirectories that can't be listed.
+
+    Args:
+        project_directory (str): the project directory
+        ignore_filter (function): called as ``ignore_filter(info, parents_checked=True)``
+        errors (list of str): gets an error if the project directory can't be listed
+        leaves_only (bool): True to only include directories that have nothing to include in them
+
+    """
+    to_scan = [('', None)]
+    while to_scan:
+        (relative_dir, dir_info) = to_scan.pop()
+        try:
+            infos = _scan_directory(project_directory, relative_dir)
+        except OSError as e:
+            if relative_dir == '':
+                errors.append("Could not list files in %s: %s." % (project_directory, str(e)))
+                return
+            continue
+
+        # every directory we get here passed the filter, so the
+        # filter only has to look at each entry, not its parents.
+        infos = [info for info in infos if not ignore_filter(info, parents_checked=True)]
+
+        if leaves_only and dir_info is not None and len(infos) == 0:
+            yield dir_info
+
+        subdirs = []
+        for info in infos:
+            if info.is_directory:
+                if not leaves_only:
+                    yield info
+                if info.is_link:
+                    if leaves_only:
+                        yield info
                 else:
-                    filtered_dirs.append(d)
-                    file_infos.append(info)
+                    subdirs.append(info)
+            else:
+                yield info
+
+        # depth first, in the order scandir gave us
+        for info in reversed(subdirs):
+            to_scan.append((info.relative_path, info))
+
+
+def _glob_to_regex(glob):
+    # the same translation fnmatch does, but without the anchor and
+    # flags fnmatch.translate adds, so globs can be combined.
+    i = 0
+    n = len(glob)
+    res = ''
+    while i < n:
+        c = glob[i]
+        i += 1
+        if c == '*':
+            # "**" means the same as "*"
+            if not res.endswith('.*'):
+                res += '.*'
+        elif c == '?':
+            res += '.'
+        elif c == '[':
+            j = i
+            if j < n and glob[j] == '!':
+                j += 1
+            if j < n and glob[j] == ']':
+                j += 1
+            while j < n and glob[j] != ']':
+                j += 1
+            if j >= n:
+                res += '\\['
+            else:
+                stuff = glob[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                res += '[%s]' % stuff
+        else:
+            res += re.escape(c)
+    return res
 
-            # don't even recurse into filtered-out directories, mostly because recursing into
-            # "envs" is very slow
-            dirs[:] = filtered_dirs
 
-            for f in files:
-                info = _FileInfo(project_directory=project_directory,
-                                 filename=os.path.join(root, f),
-                                 is_directory=False)
-                if not ignore_filter(info):
-                    file_infos.append(info)
+class _PatternMatcher(object):
+    """A list of ignore patterns compiled into a few regular expressions.
 
-        return file_infos
-    except OSError as e:
-        errors.append("Could not list files in %s: %s." % (project_directory, str(e)))
-        return None
+    Unlike .gitignore, matching is path-unaware; like fnmatch,
+    "*" matches "/" too. A pattern starting with "/" has to match
+    the path (or one of its parents) from the project root,
+    otherwise it only has to match the end (an implicit "*/"). A
+    pattern ending with "/" only matches directories.
+    """
+
+    def __init__(self, patterns):
+        any_kind = []
+        directories_only = []
+        for pattern in patterns:
+            assert pattern != ''
+            if pattern.startswith("/"):
+                glob = pattern
+            else:
+                glob = "*/" + pattern
+            if glob.endswith("/"):
+                glob = glob[:-1]
+                kind = directories_only
+            else:
+                kind = any_kind
+            # "/" alone can't match anything
+            if glob != '':
+                kind.append(_glob_to_regex(glob))
+
+        # fnmatch is case-insensitive where paths are
+        flags = re.DOTALL
+        if os.path.normcase('A') == 'a':
+            flags = flags | re.IGNORECASE  # pragma: no cover (no Windows in the coverage run)
+
+        def compile_patterns(regexes, ending):
+            if len(regexes) == 0:
+                return None
+            return re.compile("(?:%s)%s" % ("|".join(regexes), ending), flags)
+
+        # a path matches if it, or any of its parents, matches;
+        # parents are the prefixes which are followed by "/".
+        self._any_kind = (compile_patterns(any_kind, "\\Z"), compile_patterns(any_kind, "(?:/|\\Z)"))
+        self._directories_only = (compile_patterns(directories_only, "\\Z"),
+                                  compile_patterns(directories_only, "(?:/|\\Z)"))
+
+    def matches(self, info, parents_checked=False):
+        """Check whether a file info matches any of the patterns.
+
+        Args:
+            info (_FileInfo): the file
+            parents_checked (bool): True if the parent directories are known not to match,
+                                    so only the path itself has to be checked
+
+        Returns:
+            True if some pattern matches
+        """
+        # on Windows, we have fixed up unixified_relative_path to
+        # have / instead of \, so that it will match patterns
+        # specified with /. So that */ matches even plain "foo" we
+        # need to start with /.
+        path = "/" + info.unixified_relative_path
+        index = 0 if parents_checked else 1
+        regex = self._any_kind[index]
+        if regex is not None and regex.match(path) is not None:
+            return True
+
+        # a pattern ending in "/" never matches a file, even if
+        # it matches the file's parent directory.
+        if info.is_directory:
+            regex = self._directories_only[index]
+            if regex is not None and regex.match(path) is not None:
+                return True
+        return False
 
 
 class _FilePattern(object):
@@ -69,40 +244,10 @@ class _FilePattern(object):
         assert pattern != ''
         # the glob string
         self.pattern = pattern
+        self._matcher = _PatternMatcher([pattern])
 
     def matches(self, info):
-        # Unlike .gitignore, this is a path-unaware match; fnmatch doesn't pay
-        # any attention to "/" as a special character. However, on Windows, we
-        # have fixed up unixified_relative_path to have / instead of \, so that
-        # it will match patterns specified with /.
-        def match(path, pattern):
-            assert path.startswith("/")
-            while path != '/':
-                if fnmatch.fnmatch(path, pattern):
-                    return True
-                # this assumes that on Windows, dirname on a unixified path
-                # will do the right thing...
-                path = os.path.dirname(path)
-            return False
-
-        if self.pattern.startswith("/"):
-            # we have to match the full path or one of its parents exactly
-            pattern = self.pattern
-        else:
-            # we only have to match the end of the path (implicit "*/")
-            pattern = "*/" + self.pattern
-
-        # So that */ matches even plain "foo" we need to start with /
-        match_against = "/" + info.unixified_relative_path
-
-        # ending with / means only match directories
-        if pattern.endswith("/"):
-            if info.is_directory:
-                return match(match_against, pattern[:-1])
-            else:
-                return False
-        else:
-            return match(match_against, pattern)
+        return self._matcher.matches(info)
 
 
 def _parse_ignore_file(filename, errors):
@@ -154,12 +299,12 @@ def _git_ignored_files(project_directory, errors):
     # --other means show untracked (not added) files
     # --ignored means show ignored files
     # --exclude-standard means use the usual .gitignore and other configuration
+    # --directory means show an ignored directory instead of everything in it
+    # -z means separate with NUL and don't quote unusual filenames
     try:
         output = subprocess.check_output(
-            ['git', 'ls-files', '--others', '--ignored', '--exclude-standard'],
+            ['git', 'ls-files', '--others', '--ignored', '--exclude-standard', '--directory', '-z'],
             cwd=project_directory)
-        # for whatever reason, git doesn't include the ".git" in the ignore list
-        return [".git"] + output.decode('utf-8').splitlines()
     except subprocess.CalledProcessError as e:
         message = e.output.decode('utf-8').replace("\n", " ")
         errors.append("'git ls-files' failed to list ignored files: %s." % (message))
@@ -168,6 +313,21 @@ def _git_ignored_files(project_directory, errors):
         errors.append("Failed to run 'git ls-files'; %s" % str(e))
         return None
 
+    entries = sorted([entry for entry in output.decode('utf-8').split('\0') if entry != ''])
+    # for whatever reason, git doesn't include the ".git" in the ignore list
+    ignored = [".git"]
+    for (i, entry) in enumerate(entries):
+        if entry.endswith("/"):
+            # git also shows an untracked directory that only has
+            # ignored files in it, followed by those files (which
+            # sort right after it); the directory itself isn't
+            # ignored.
+            if i + 1 < len(entries) and entries[i + 1].startswith(entry):
+                continue
+            entry = entry[:-1]
+        ignored.append(entry)
+    return ignored
+
 
 def _git_filter(project_directory, errors):
     git_ignored = _git_ignored_files(project_directory, errors)
@@ -175,15 +335,23 @@ def _git_filter(project_directory, errors):
         assert errors
         return None
 
+    # git gives us "/" separated paths, and only the top ignored
+    # directory of an ignored tree, so anything inside a listed
+    # path is ignored too.
     git_ignored = set(git_ignored)
 
-    def is_git_ignored(info):
-        path = info.relative_path
-        while path != '':
-            assert path != '/'  # would infinite loop
+    def is_git_ignored(info, parents_checked=False):
+        path = info.unixified_relative_path
+        if path in git_ignored:
+            return True
+        if parents_checked:
+            return False
+        slash = path.rfind('/')
+        while slash > 0:
+            path = path[:slash]
             if path in git_ignored:
                 return True
-            path = os.path.dirname(path)
+            slash = path.rfind('/')
         return False
 
     return is_git_ignored
@@ -195,94 +363,426 @@ def _ignore_file_filter(project_directory, errors):
         assert errors
         return None
 
-    def matches_some_pattern(info):
-        for pattern in patterns:
-            if pattern.matches(info):
-                return True
-        return False
+    matcher = _PatternMatcher([pattern.pattern for pattern in patterns])
+    return matcher.matches
+
+
+def _plugin_ignore_patterns(requirements):
+    # our own caches are never part of the project
+    plugin_patterns = set(["/" + project_cache.CACHE_DIRECTORY + "/"])
+    for req in requirements:
+        plugin_patterns = plugin_patterns.union(req.ignore_patterns)
+    return sorted(plugin_patterns)
 
-    return matches_some_pattern
 
+def _plugin_filter(requirements):
+    return _PatternMatcher(_plugin_ignore_patterns(requirements)).matches
 
-def _enumerate_archive_files(project_directory, errors, requirements):
+
+def _archive_filter(project_directory, errors, requirements):
     git_filter = _git_filter(project_directory, errors)
     ignore_file_filter = _ignore_file_filter(project_directory, errors)
     if git_filter is None or ignore_file_filter is None:
         assert errors
         return None
 
-    plugin_patterns = set()
-    for req in requirements:
-        plugin_patterns = plugin_patterns.union(req.ignore_patterns)
-    plugin_patterns = [_FilePattern(s) for s in plugin_patterns]
+    is_plugin_generated = _plugin_filter(requirements)
 
-    def is_plugin_generated(info):
-        for pattern in plugin_patterns:
-            if pattern.matches(info):
-                return True
-        return False
+    def all_filters(info, parents_checked=False):
+        return (git_filter(info, parents_checked) or ignore_file_filter(info, parents_checked) or
+                is_plugin_generated(info, parents_checked))
 
-    def all_filters(info):
-        return git_filter(info) or ignore_file_filter(info) or is_plugin_generated(info)
+    return all_filters
 
-    infos = _list_project(project_directory, all_filters, errors)
-    if infos is None:
-        assert errors
-        return None
 
-    return infos
+# what tarfile uses
+_DEFAULT_GZIP_COMPRESSION_LEVEL = 9
 
 
-def _leaf_infos(infos):
-    all_by_name = dict()
-    for info in infos:
-        all_by_name[info.relative_path] = info
-    for info in infos:
-        parent = os.path.dirname(info.relative_path)
-        while parent != '':
-            assert parent != '/'  # would be infinite loop
-            if parent in all_by_name:
-                del all_by_name[parent]
-            parent = os.path.dirname(parent)
+def _write_tar(archive_root_name, infos, filename, compression, logs, workers=1, level=None):
+    def add_all(tf):
+        for info in infos:
+            arcname = os.path.join(archive_root_name, info.relative_path)
+            logs.append("  added %s" % arcname)
+            tf.add(info.full_path, arcname=arcname)
+
+    if level is None:
+        level = _DEFAULT_GZIP_COMPRESSION_LEVEL
 
-    return all_by_name.values()
+    if compression == "gz" and workers > 1:
+        # the tar stream is the same, only the gzip blocks are
+        # compressed in parallel.
+        with open(filename, 'wb') as f:
+            with parallel_compress.ParallelGzipFile(f, level=level, workers=workers) as gz:
+                with tarfile.open(fileobj=gz, mode='w|') as tf:
+                    add_all(tf)
+        return
 
+    if compression == "gz":
+        with tarfile.open(filename, 'w:gz', compresslevel=level) as tf:
+            add_all(tf)
+        return
 
-def _write_tar(archive_root_name, infos, filename, compression, logs):
     if compression is None:
         compression = ""
     else:
         compression = ":" + compression
     with tarfile.open(filename, ('w%s' % compression)) as tf:
-        for info in _leaf_infos(infos):
-            arcname = os.path.join(archive_root_name, info.relative_path)
-            logs.append("  added %s" % arcname)
-            tf.add(info.full_path, arcname=arcname)
+        add_all(tf)
+
+
+# files bigger than this are left to zipfile, which streams them,
+# rather than read into memory and compressed on another thread.
+_MAX_PARALLEL_ZIP_MEMBER_SIZE = 8 * 1024 * 1024
+
+# how many files per worker we collect before compressing them
+_ZIP_MEMBERS_PER_WORKER = 16
+
+# zlib's own default
+_DEFAULT_ZIP_COMPRESSION_LEVEL = 6
+
+# formats that are already compressed, so deflate would only waste time
+_COMPRESSED_EXTENSIONS = set(['.7z', '.avi', '.bz2', '.docx', '.egg', '.feather', '.flac', '.gif', '.gz', '.h5',
+                              '.hdf5', '.jar', '.jpeg', '.jpg', '.lz4', '.lzma', '.mkv', '.mov', '.mp3', '.mp4',
+                              '.npz', '.ogg', '.parquet', '.pdf', '.png', '.pptx', '.rar', '.tbz2', '.tgz', '.webm',
+                              '.webp', '.whl', '.xlsx', '.xz', '.zip', '.zst'])
+
+# how much of a file we look at to guess if it's compressible
+_ENTROPY_SAMPLE_SIZE = 16 * 1024
+
+# files smaller than this aren't worth sampling
+_MIN_ENTROPY_SAMPLE_SIZE = 1024
+
+# a sample that deflates to more than this fraction of its size is
+# close to random, which is what compressed data looks like.
+_MAX_COMPRESSIBLE_SAMPLE_RATIO = 0.95
+
+
+def _extension(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '':
+        return "(no extension)"
+    else:
+        return extension
+
+
+def _looks_compressed(filename, sample):
+    """Guess whether deflating a file would be a waste of time."""
+    if _extension(filename) in _COMPRESSED_EXTENSIONS:
+        return True
+    if len(sample) < _MIN_ENTROPY_SAMPLE_SIZE:
+        return False
+    # a quick deflate of the sample estimates its entropy much
+    # faster than counting bytes in Python would.
+    sample = sample[:_ENTROPY_SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) > len(sample) * _MAX_COMPRESSIBLE_SAMPLE_RATIO
+
+
+def _zip_info_for_file(filename, arcname):
+    if hasattr(zipfile.ZipInfo, 'from_file'):  # pragma: no cover (py2/py3)
+        return zipfile.ZipInfo.from_file(filename, arcname)
+    else:  # pragma: no cover (py2/py3)
+        # what ZipFile.write does on py2
+        st = os.stat(filename)
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+        return zinfo
+
+
+def _compress_zip_member(member):
+    (full_path, arcname, level) = member
+    start = time.time()
+    zinfo = _zip_info_for_file(full_path, arcname)
+    with open(full_path, 'rb') as f:
+        data = f.read()
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    if level == 0 or _looks_compressed(full_path, data):
+        zinfo.compress_type = zipfile.ZIP_STORED
+        compressed = data
+    else:
+        # the same compressor settings zipfile uses, so we get the same bytes
+        compressed = parallel_compress.deflate(data, level)
+        if len(compressed) < len(data):
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+        else:
+            # the sample fooled us
+            zinfo.compress_type = zipfile.ZIP_STORED
+            compressed = data
+    zinfo.compress_size = len(compressed)
+    return (zinfo, compressed, time.time() - start)
+
 
+# the ZipFile internals _write_compressed_zip_member relies on
+_ZIP_FILE_INTERNALS = ('fp', '_writecheck', '_didModify', 'filelist', 'NameToInfo')
 
-def _write_zip(archive_root_name, infos, filename, logs):
+
+def _can_write_compressed_zip_members(zf):
+    """Whether this ZipFile has the internals we need to add precompressed data.
+
+    If it doesn't (some other Python, or a stream we can't seek in),
+    every file goes through ZipFile.write instead.
+    """
+    for name in _ZIP_FILE_INTERNALS:
+        if not hasattr(zf, name):
+            return False
+    if not hasattr(zipfile.ZipInfo, 'FileHeader'):
+        return False
+    return getattr(zf, '_seekable', True)
+
+
+def _write_compressed_zip_member_locked(zf, zinfo, compressed):
+    if getattr(zf, '_writing', False):
+        # what ZipFile.write says in the same situation
+        raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+    if hasattr(zf, 'start_dir'):  # pragma: no cover (py2/py3)
+        zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zf.fp.write(zinfo.FileHeader(False))
+    zf.fp.write(compressed)
+    if hasattr(zf, 'start_dir'):  # pragma: no cover (py2/py3)
+        zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _write_compressed_zip_member(zf, zinfo, compressed):
+    # ZipFile has no public way to add data that's already
+    # compressed, so this does what ZipFile.write does after
+    # compressing. Only call it if _can_write_compressed_zip_members.
+    lock = getattr(zf, '_lock', None)
+    if lock is None:  # pragma: no cover (py2/py3)
+        _write_compressed_zip_member_locked(zf, zinfo, compressed)
+    else:
+        with lock:
+            _write_compressed_zip_member_locked(zf, zinfo, compressed)
+
+
+def _write_big_zip_member(zf, full_path, arcname, level):
+    start = time.time()
+    with open(full_path, 'rb') as f:
+        sample = f.read(_ENTROPY_SAMPLE_SIZE)
+    if level == 0 or _looks_compressed(full_path, sample):
+        zf.write(full_path, arcname=arcname, compress_type=zipfile.ZIP_STORED)
+    elif sys.version_info >= (3, 7):  # pragma: no cover (py2/py3)
+        zf.write(full_path, arcname=arcname, compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+    else:  # pragma: no cover (py2/py3)
+        # no way to choose the level, so this gets the default
+        zf.write(full_path, arcname=arcname, compress_type=zipfile.ZIP_DEFLATED)
+    return (zf.infolist()[-1], time.time() - start)
+
+
+class _CompressionStats(object):
+    """How well each kind of file compressed, for the logs."""
+
+    def __init__(self):
+        # extension to [files, stored files, bytes in, bytes out, seconds]
+        self._by_extension = dict()
+
+    def add(self, zinfo, seconds):
+        stats = self._by_extension.setdefault(_extension(zinfo.filename), [0, 0, 0, 0, 0.0])
+        stats[0] += 1
+        if zinfo.compress_type == zipfile.ZIP_STORED:
+            stats[1] += 1
+        stats[2] += zinfo.file_size
+        stats[3] += zinfo.compress_size
+        stats[4] += seconds
+
+    def log_lines(self):
+        lines = []
+        if len(self._by_extension) > 0:
+            lines.append("Compression by file type:")
+        # biggest first, since those matter most
+        for (extension, stats) in sorted(self._by_extension.items(), key=lambda item: (-item[1][2], item[0])):
+            (files, stored, bytes_in, bytes_out, seconds) = stats
+            if bytes_in > 0:
+                ratio = "%.1f%%" % (100.0 * bytes_out / bytes_in)
+            else:
+                ratio = "-"
+            if seconds > 0:
+                throughput = "%.1f MB/s" % (bytes_in / seconds / 1e6)
+            else:
+                throughput = "- MB/s"
+            line = "  %s: %d files, %d -> %d bytes (%s), %s" % (extension, files, bytes_in, bytes_out, ratio,
+                                                                throughput)
+            if stored == files:
+                line += ", stored as-is"
+            elif stored > 0:
+                line += ", %d stored as-is" % stored
+            lines.append(line)
+        return lines
+
+
+def _write_zip(archive_root_name, infos, filename, logs, level=None, workers=1):
+    if level is None:
+        level = _DEFAULT_ZIP_COMPRESSION_LEVEL
+    stats = _CompressionStats()
     with zipfile.ZipFile(filename, 'w') as zf:
-        for info in _leaf_infos(infos):
+        can_write_compressed = _can_write_compressed_zip_members(zf)
+        # (full_path, arcname, level) to compress in parallel, in order
+        batch = []
+        batch_sizes = [0]
+
+        def write_batch():
+            for (zinfo, compressed, seconds) in parallel.parallel_map(_compress_zip_member,
+                                                                      batch,
+                                                                      max_workers=workers):
+                _write_compressed_zip_member(zf, zinfo, compressed)
+                stats.add(zinfo, seconds)
+            del batch[:]
+            batch_sizes[0] = 0
+
+        for info in infos:
             arcname = os.path.join(archive_root_name, info.relative_path)
             logs.append("  added %s" % arcname)
-            zf.write(info.full_path, arcname=arcname)
+            if info.is_directory:
+                # keep the files in order
+                write_batch()
+                zf.write(info.full_path, arcname=arcname)
+                continue
+            size = os.stat(info.full_path).st_size
+            if size > _MAX_PARALLEL_ZIP_MEMBER_SIZE or not can_write_compressed:
+                write_batch()
+                (zinfo, seconds) = _write_big_zip_member(zf, info.full_path, arcname, level)
+                stats.add(zinfo, seconds)
+                continue
+            batch.append((info.full_path, arcname, level))
+            batch_sizes[0] += size
+            if len(batch) >= workers * _ZIP_MEMBERS_PER_WORKER or \
+               batch_sizes[0] >= workers * _MAX_PARALLEL_ZIP_MEMBER_SIZE:
+                write_batch()
+        write_batch()
+    logs.extend(stats.log_lines())
+
+
+_NOTEBOOK_INDEX_CACHE_NAME = "notebook-index"
+
+# directories modified this recently might be modified again
+# without their mtime changing, so we don't trust their mtime.
+_MTIME_GRANULARITY_SECONDS = 2
+
+
+def _scan_notebook_directory(project_directory, relative_dir, prune_filter):
+    notebooks = []
+    subdirs = []
+    for info in _scan_directory(project_directory, relative_dir):
+        if info.is_directory:
+            # notebooks in top-level hidden directories are never
+            # wanted, and .git can be enormous.
+            if relative_dir == '' and info.basename.startswith('.'):
+                continue
+            # like os.walk, we don't follow symlinks to directories
+            if info.is_link:
+                continue
+            # we never scan an ignored directory, so only this one needs checking
+            if prune_filter(info, parents_checked=True):
+                continue
+            subdirs.append(info.basename)
+        elif info.basename.endswith('.ipynb'):
+            notebooks.append(info.basename)
+    return (sorted(notebooks), sorted(subdirs))
+
+
+def _list_notebook_candidates(project_directory, prune_filter, prune_key):
+    index_filename = project_cache.cache_filename(project_directory, _NOTEBOOK_INDEX_CACHE_NAME)
+    old_index = project_cache.load_cache(index_filename)
+    if isinstance(old_index, dict) and old_index.get('prune_key', None) == prune_key:
+        old_directories = old_index.get('directories', {})
+    else:
+        old_directories = {}
+
+    now = time.time()
+    directories = dict()
+    candidates = []
+    to_scan = ['']
+    while to_scan:
+        relative_dir = to_scan.pop()
+        try:
+            mtime = os.stat(os.path.join(project_directory, relative_dir)).st_mtime
+        except OSError:
+            if relative_dir == '':
+                raise
+            # vanished out from under us
+            continue
+
+        cached = old_directories.get(relative_dir, None)
+        if isinstance(cached, list) and len(cached) == 3 and cached[0] is not None and cached[0] == mtime:
+            (notebooks, subdirs) = (cached[1], cached[2])
+        else:
+            (notebooks, subdirs) = _scan_notebook_directory(project_directory, relative_dir, prune_filter)
+
+        if (now - mtime) < _MTIME_GRANULARITY_SECONDS:
+            mtime = None
+        directories[relative_dir] = [mtime, notebooks, subdirs]
+
+        for name in notebooks:
+            candidates.append(os.path.join(relative_dir, name))
+        for name in subdirs:
+            to_scan.append(os.path.join(relative_dir, name))
+
+    if directories != old_directories:
+        project_cache.save_cache(index_filename, dict(prune_key=prune_key, directories=directories))
+
+    return candidates
 
 
 # function exported for project.py
-def _list_relative_paths_for_unignored_project_files(project_directory, errors, requirements):
-    infos = _enumerate_archive_files(project_directory, errors, requirements=requirements)
-    if infos is None:
+def _list_relative_paths_for_unignored_notebooks(project_directory, errors, requirements):
+    """List notebooks in the project, reusing an index of unchanged directories.
+
+    The index is keyed by directory mtime, so only directories
+    where files were added, removed, or renamed get listed
+    again. Notebooks in hidden top-level directories are
+    skipped, as are ignored notebooks.
+    """
+    ignore_patterns = _load_ignore_file(project_directory, errors)
+    if ignore_patterns is None:
+        assert errors
         return None
-    return [info.relative_path for info in infos]
+    matcher = _PatternMatcher([pattern.pattern for pattern in ignore_patterns] +
+                              _plugin_ignore_patterns(requirements))
+    prune_filter = matcher.matches
+
+    # if the ignore patterns change we can't trust which
+    # directories we pruned last time.
+    prune_key = [[pattern.pattern for pattern in ignore_patterns], _plugin_ignore_patterns(requirements)]
+
+    try:
+        candidates = _list_notebook_candidates(project_directory, prune_filter, prune_key)
+    except OSError as e:
+        errors.append("Could not list files in %s: %s." % (project_directory, str(e)))
+        return None
+
+    unixify = platform.system() == 'Windows'
+    infos = [_FileInfo(full_path=os.path.join(project_directory, relative_path),
+                       relative_path=relative_path,
+                       is_directory=False,
+                       unixify=unixify) for relative_path in candidates]
+    # candidates are only ever found in unpruned directories
+    infos = [info for info in infos if not prune_filter(info, parents_checked=True)]
+    if len(infos) == 0:
+        # skip running git at all
+        return []
+
+    git_filter = _git_filter(project_directory, errors)
+    if git_filter is None:
+        assert errors
+        return None
+
+    return sorted([info.relative_path for info in infos if not git_filter(info)])
 
 
 # function exported for project_ops.py
-def _archive_project(project, filename):
+def _archive_project(project, filename, workers=None, level=None):
     """Make an archive of the non-ignored files in the project.
 
     Args:
         project (``Project``): the project
         filename (str): name for the new zip or tar.gz archive file
+        workers (int): how many threads to compress on, None for one per CPU
+        level (int): deflate level 0-9 for .zip and .tar.gz, None for the default
 
     Returns:
         a ``Status``, if failed has ``errors``
@@ -291,24 +791,41 @@ def _archive_project(project, filename):
     if failed is not None:
         return failed
 
+    if level is not None and (level < 0 or level > 9):
+        return SimpleStatus(success=False,
+                            description="Compression level must be from 0 to 9.",
+                            errors=["Unsupported compression level %r." % (level)])
+
     errors = []
-    infos = _enumerate_archive_files(project.directory_path, errors, requirements=project.requirements)
-    if infos is None:
+    archive_filter = _archive_filter(project.directory_path, errors, requirements=project.requirements)
+    if archive_filter is None:
         return SimpleStatus(success=False, description="Failed to list files in the project.", errors=errors)
 
+    tmp_filename = filename + ".tmp-" + str(uuid.uuid4())
+
     # don't put the destination zip into itself, since it's fairly natural to
-    # create a archive right in the project directory
-    relative_dest_file = subdirectory_relative_to_directory(filename, project.directory_path)
-    if not os.path.isabs(relative_dest_file):
-        infos = [info for info in infos if info.relative_path != relative_dest_file]
+    # create a archive right in the project directory; we're listing files
+    # while we write, so the temporary file has to be left out too.
+    excluded = set()
+    for excluded_file in (filename, tmp_filename):
+        relative_excluded_file = subdirectory_relative_to_directory(excluded_file, project.directory_path)
+        if not os.path.isabs(relative_excluded_file):
+            excluded.add(relative_excluded_file)
+
+    def ignore_filter(info, parents_checked=False):
+        return info.relative_path in excluded or archive_filter(info, parents_checked)
+
+    infos = _walk_project(project.directory_path, ignore_filter, errors, leaves_only=True)
+
+    if workers is None:
+        workers = parallel_compress.default_workers()
 
     logs = []
-    tmp_filename = filename + ".tmp-" + str(uuid.uuid4())
     try:
         if filename.lower().endswith(".zip"):
-            _write_zip(project.name, infos, tmp_filename, logs)
+            _write_zip(project.name, infos, tmp_filename, logs, level=level, workers=workers)
         elif filename.lower().endswith(".tar.gz"):
-            _write_tar(project.name, infos, tmp_filename, compression="gz", logs=logs)
+            _write_tar(project.name, infos, tmp_filename, compression="gz", logs=logs, workers=workers, level=level)
         elif filename.lower().endswith(".tar.bz2"):
             _write_tar(project.name, infos, tmp_filename, compression="bz2", logs=logs)
         elif filename.lower().endswith(".tar"):
@@ -317,6 +834,8 @@ def _archive_project(project, filename):
             return SimpleStatus(success=False,
                                 description="Project archive filename must be a .zip, .tar.gz, or .tar.bz2.",
                                 errors=["Unsupported archive filename %s." % (filename)])
+        if errors:
+            return SimpleStatus(success=False, description="Failed to list files in the project.", errors=errors)
         rename_over_existing(tmp_filename, filename)
     except IOError as e:
         return SimpleStatus(success=False,
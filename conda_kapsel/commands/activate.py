@@ -18,7 +18,7 @@ from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printin
 from conda_kapsel.project import Project
 
 
-def activate(dirname, ui_mode, conda_environment):
+def activate(dirname, ui_mode, conda_environment, force_full_check=False):
     """Prepare project and return lines to be sourced.
 
     Future direction: should also activate the proper conda env.
@@ -26,8 +26,11 @@ def activate(dirname, ui_mode, conda_environment):
     Returns:
         None on failure or a list of lines to print.
     """
-    project = Project(dirname)
-    result = prepare_with_ui_mode_printing_errors(project, ui_mode=ui_mode, env_spec_name=conda_environment)
+    project = Project(dirname, read_only=True)
+    result = prepare_with_ui_mode_printing_errors(project,
+                                                  ui_mode=ui_mode,
+                                                  env_spec_name=conda_environment,
+                                                  force_full_check=force_full_check)
     if result.failed:
         return None
 
@@ -44,7 +47,7 @@ def activate(dirname, ui_mode, conda_environment):
 
 def main(args):
     """Start the activate command and return exit status code."""
-    result = activate(args.directory, args.mode, args.env_spec)
+    result = activate(args.directory, args.mode, args.env_spec, force_full_check=args.force_check)
     if result is None:
         return 1
     else:
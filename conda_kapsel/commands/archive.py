@@ -12,14 +12,14 @@ from conda_kapsel.commands import console_utils
 import conda_kapsel.project_ops as project_ops
 
 
-def archive_command(project_dir, archive_filename):
-    """Make an archive of the project.
+def archive_command(project_dir, archive_filename, jobs=None, compression_level=None):
+    """Make an archive of the project, compressing on up to ``jobs`` threads.
 
     Returns:
         exit code
     """
     project = Project(project_dir)
-    status = project_ops.archive(project, archive_filename)
+    status = project_ops.archive(project, archive_filename, jobs=jobs, compression_level=compression_level)
     if status:
         for line in status.logs:
             print(line)
@@ -32,4 +32,4 @@ def archive_command(project_dir, archive_filename):
 
 def main(args):
     """Start the archive command and return exit status code."""
-    return archive_command(args.directory, args.filename)
+    return archive_command(args.directory, args.filename, jobs=args.jobs, compression_level=args.compression_level)
@@ -92,7 +92,7 @@ def list_commands(project_dir):
     Returns:
         int exit code
     """
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
 
@@ -53,7 +53,7 @@ def remove_download(project_dir, filename_variable):
 
 def list_downloads(project_dir):
     """List the downloads present in project."""
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
 
@@ -38,6 +38,18 @@ def remove_env_spec(project_dir, name):
     return _handle_status(status, "Removed environment {} from the project file.".format(name))
 
 
+def refresh_lock(project_dir, environment):
+    """Solve for an environment's packages again and update its lock file."""
+    project = Project(project_dir)
+    status = project_ops.refresh_lock(project, env_spec_name=environment)
+    if status:
+        print(status.status_description)
+        return 0
+    else:
+        console_utils.print_status_errors(status)
+        return 1
+
+
 def add_packages(project, environment, packages, channels):
     """Add packages to the project."""
     project = Project(project)
@@ -64,7 +76,7 @@ def remove_packages(project, environment, packages):
 
 def list_env_specs(project_dir):
     """List environments in the project."""
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
     print("Environments for project: {}\n".format(project_dir))
@@ -74,7 +86,7 @@ def list_env_specs(project_dir):
 
 def list_packages(project_dir, environment):
     """List the packages for an environment in the project."""
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
     if environment is None:
@@ -98,6 +110,11 @@ def main_remove(args):
     return remove_env_spec(args.directory, args.name)
 
 
+def main_refresh_lock(args):
+    """Start the refresh-lock command and return exit status code."""
+    return refresh_lock(args.directory, args.env_spec)
+
+
 def main_add_packages(args):
     """Start the add-packages command and return exit status code."""
     return add_packages(args.directory, args.env_spec, args.packages, args.channel)
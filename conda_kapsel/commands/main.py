@@ -7,6 +7,7 @@
 """The ``main`` function chooses and runs a subcommand."""
 from __future__ import absolute_import, print_function
 
+import importlib
 import os
 import sys
 from argparse import ArgumentParser, REMAINDER
@@ -18,18 +19,21 @@ from conda_kapsel.project import ALL_COMMAND_TYPES
 from conda_kapsel.plugins.registry import PluginRegistry
 from conda_kapsel.plugins.requirements.download import _hash_algorithms
 import conda_kapsel
-import conda_kapsel.commands.init as init
-import conda_kapsel.commands.run as run
-import conda_kapsel.commands.prepare as prepare
-import conda_kapsel.commands.clean as clean
-import conda_kapsel.commands.archive as archive
-import conda_kapsel.commands.upload as upload
-import conda_kapsel.commands.activate as activate
-import conda_kapsel.commands.variable_commands as variable_commands
-import conda_kapsel.commands.download_commands as download_commands
-import conda_kapsel.commands.service_commands as service_commands
-import conda_kapsel.commands.environment_commands as environment_commands
-import conda_kapsel.commands.command_commands as command_commands
+
+
+def _subcommand(module_name, function_name='main'):
+    """Get a main function that imports its subcommand module only when it runs.
+
+    Subcommand modules can drag in slow imports (tornado, requests,
+    binstar_client, keyring), so we don't want to load all of them
+    just to run one.
+    """
+
+    def main(args):
+        module = importlib.import_module('conda_kapsel.commands.' + module_name)
+        return getattr(module, function_name)(args)
+
+    return main
 
 
 def _parse_args_and_run_subcommand(argv):
@@ -67,6 +71,26 @@ def _parse_args_and_run_subcommand(argv):
                             choices=_all_ui_modes,
                             action='store',
                             help="One of " + ", ".join(_all_ui_modes))
+        preset.add_argument('--force-check',
+                            action='store_true',
+                            default=False,
+                            help="Check all requirements even if nothing has changed since the last prepare")
+
+    def add_timings_args(preset):
+        preset.add_argument('--timings',
+                            action='store_true',
+                            default=False,
+                            help="Print how long each part of preparing the project took")
+        preset.add_argument('--timings-json',
+                            metavar='FILENAME',
+                            default=None,
+                            action='store',
+                            help="Save how long each part of preparing the project took to a JSON file")
+        preset.add_argument('--trace',
+                            metavar='FILENAME',
+                            default=None,
+                            action='store',
+                            help="Save a trace of preparing the project, viewable in chrome://tracing or Perfetto")
 
     def add_env_spec_name_arg(preset):
         preset.add_argument('-n',
@@ -77,45 +101,69 @@ def _parse_args_and_run_subcommand(argv):
 
     preset = subparsers.add_parser('init', help="Initialize a directory with default project configuration")
     add_directory_arg(preset)
-    preset.set_defaults(main=init.main)
+    preset.set_defaults(main=_subcommand('init'))
 
     preset = subparsers.add_parser('run', help="Run the project, setting up requirements first")
     add_prepare_args(preset)
+    add_timings_args(preset)
     preset.add_argument('command',
                         metavar='COMMAND_NAME',
                         default=None,
                         nargs='?',
                         help="A command name from kapsel.yml")
     preset.add_argument('extra_args_for_command', metavar='EXTRA_ARGS_FOR_COMMAND', default=None, nargs=REMAINDER)
-    preset.set_defaults(main=run.main)
+    preset.set_defaults(main=_subcommand('run'))
 
     preset = subparsers.add_parser('prepare', help="Set up the project requirements, but does not run the project")
     add_prepare_args(preset)
-    preset.set_defaults(main=prepare.main)
+    add_timings_args(preset)
+    preset.add_argument('--all-env-specs',
+                        action='store_true',
+                        default=False,
+                        help="Create or update every environment spec in the project, not only the one used to run")
+    preset.add_argument('--jobs',
+                        metavar='N',
+                        type=int,
+                        default=None,
+                        action='store',
+                        help="How many environments to create or update at once with --all-env-specs")
+    preset.set_defaults(main=_subcommand('prepare'))
 
     preset = subparsers.add_parser('clean',
                                    help="Removes generated state (stops services, deletes environment files, etc)")
     add_directory_arg(preset)
-    preset.set_defaults(main=clean.main)
+    preset.set_defaults(main=_subcommand('clean'))
 
     if not conda_kapsel._beta_test_mode:
         preset = subparsers.add_parser('activate',
                                        help="Set up the project and output shell export commands reflecting the setup")
         add_prepare_args(preset)
-        preset.set_defaults(main=activate.main)
+        preset.set_defaults(main=_subcommand('activate'))
 
     preset = subparsers.add_parser('archive',
                                    help="Create a .zip, .tar.gz, or .tar.bz2 archive with project files in it")
     add_directory_arg(preset)
     preset.add_argument('filename', metavar='ARCHIVE_FILENAME')
-    preset.set_defaults(main=archive.main)
+    preset.add_argument('--jobs',
+                        metavar='N',
+                        type=int,
+                        default=None,
+                        action='store',
+                        help="How many threads to compress the archive on (default is one per CPU)")
+    preset.add_argument('--compression-level',
+                        metavar='LEVEL',
+                        type=int,
+                        default=None,
+                        action='store',
+                        help="Deflate level from 0 (store) to 9 (smallest) for .zip and .tar.gz archives")
+    preset.set_defaults(main=_subcommand('archive'))
 
     preset = subparsers.add_parser('upload', help="Upload the project to Anaconda Cloud")
     add_directory_arg(preset)
     preset.add_argument('-s', '--site', metavar='SITE', help='Select site to use')
     preset.add_argument('-t', '--token', metavar='TOKEN', help='Auth token or a path to a file containing a token')
     preset.add_argument('-u', '--user', metavar='USERNAME', help='User account, defaults to the current user')
-    preset.set_defaults(main=upload.main)
+    preset.set_defaults(main=_subcommand('upload'))
 
     preset = subparsers.add_parser('add-variable', help="Add a required environment variable to the project")
     preset.add_argument('vars_to_add', metavar='VARS_TO_ADD', default=None, nargs=REMAINDER)
@@ -124,26 +172,26 @@ def _parse_args_and_run_subcommand(argv):
                         default=None,
                         help='Default value if environment variable is unset')
     add_directory_arg(preset)
-    preset.set_defaults(main=variable_commands.main_add)
+    preset.set_defaults(main=_subcommand('variable_commands', 'main_add'))
 
     preset = subparsers.add_parser('remove-variable', help="Remove an environment variable from the project")
     add_directory_arg(preset)
     preset.add_argument('vars_to_remove', metavar='VARS_TO_REMOVE', default=None, nargs=REMAINDER)
-    preset.set_defaults(main=variable_commands.main_remove)
+    preset.set_defaults(main=_subcommand('variable_commands', 'main_remove'))
 
     preset = subparsers.add_parser('list-variables', help="List all variables on the project")
     add_directory_arg(preset)
-    preset.set_defaults(main=variable_commands.main_list)
+    preset.set_defaults(main=_subcommand('variable_commands', 'main_list'))
 
     preset = subparsers.add_parser('set-variable', help="Set an environment variable value in kapsel-local.yml")
     preset.add_argument('vars_and_values', metavar='VARS_AND_VALUES', default=None, nargs=REMAINDER)
     add_directory_arg(preset)
-    preset.set_defaults(main=variable_commands.main_set)
+    preset.set_defaults(main=_subcommand('variable_commands', 'main_set'))
 
     preset = subparsers.add_parser('unset-variable', help="Unset an environment variable value from kapsel-local.yml")
     add_directory_arg(preset)
     preset.add_argument('vars_to_unset', metavar='VARS_TO_UNSET', default=None, nargs=REMAINDER)
-    preset.set_defaults(main=variable_commands.main_unset)
+    preset.set_defaults(main=_subcommand('variable_commands', 'main_unset'))
 
     preset = subparsers.add_parser('add-download', help="Add a URL to be downloaded before running commands")
     add_directory_arg(preset)
@@ -155,16 +203,16 @@ def _parse_args_and_run_subcommand(argv):
                         default=None,
                         choices=_hash_algorithms)
     preset.add_argument('--hash-value', help="The expected checksum hash of the downloaded file", default=None)
-    preset.set_defaults(main=download_commands.main_add)
+    preset.set_defaults(main=_subcommand('download_commands', 'main_add'))
 
     preset = subparsers.add_parser('remove-download', help="Remove a download from the project and from the filesystem")
     add_directory_arg(preset)
     preset.add_argument('filename_variable', metavar='ENV_VAR_FOR_FILENAME', default=None)
-    preset.set_defaults(main=download_commands.main_remove)
+    preset.set_defaults(main=_subcommand('download_commands', 'main_remove'))
 
     preset = subparsers.add_parser('list-downloads', help="List all downloads on the project")
     add_directory_arg(preset)
-    preset.set_defaults(main=download_commands.main_list)
+    preset.set_defaults(main=_subcommand('download_commands', 'main_list'))
 
     service_types = PluginRegistry().list_service_types()
     service_choices = list(map(lambda s: s.name, service_types))
@@ -176,16 +224,16 @@ def _parse_args_and_run_subcommand(argv):
     add_directory_arg(preset)
     add_service_variable_name(preset)
     preset.add_argument('service_type', metavar='SERVICE_TYPE', default=None, choices=service_choices)
-    preset.set_defaults(main=service_commands.main_add)
+    preset.set_defaults(main=_subcommand('service_commands', 'main_add'))
 
     preset = subparsers.add_parser('remove-service', help="Remove a service from the project")
     add_directory_arg(preset)
     preset.add_argument('variable', metavar='SERVICE_REFERENCE', default=None)
-    preset.set_defaults(main=service_commands.main_remove)
+    preset.set_defaults(main=_subcommand('service_commands', 'main_remove'))
 
     preset = subparsers.add_parser('list-services', help="List services present in the project")
     add_directory_arg(preset)
-    preset.set_defaults(main=service_commands.main_list)
+    preset.set_defaults(main=_subcommand('service_commands', 'main_list'))
 
     def add_package_args(preset):
         preset.add_argument('-c',
@@ -199,33 +247,38 @@ def _parse_args_and_run_subcommand(argv):
     add_directory_arg(preset)
     add_package_args(preset)
     add_env_spec_name_arg(preset)
-    preset.set_defaults(main=environment_commands.main_add)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_add'))
 
     preset = subparsers.add_parser('remove-env-spec', help="Remove an environment spec from the project")
     add_directory_arg(preset)
     add_env_spec_name_arg(preset)
-    preset.set_defaults(main=environment_commands.main_remove)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_remove'))
 
     preset = subparsers.add_parser('list-env-specs', help="List all environment specs for the project")
     add_directory_arg(preset)
-    preset.set_defaults(main=environment_commands.main_list_env_specs)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_list_env_specs'))
+
+    preset = subparsers.add_parser('refresh-lock', help="Solve for packages again and update the lock file")
+    add_directory_arg(preset)
+    add_env_spec_arg(preset)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_refresh_lock'))
 
     preset = subparsers.add_parser('add-packages', help="Add packages to one or all project environments")
     add_directory_arg(preset)
     add_env_spec_arg(preset)
     add_package_args(preset)
-    preset.set_defaults(main=environment_commands.main_add_packages)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_add_packages'))
 
     preset = subparsers.add_parser('remove-packages', help="Remove packages from one or all project environments")
     add_directory_arg(preset)
     add_env_spec_arg(preset)
     preset.add_argument('packages', metavar='PACKAGE_NAME', default=None, nargs='+')
-    preset.set_defaults(main=environment_commands.main_remove_packages)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_remove_packages'))
 
     preset = subparsers.add_parser('list-packages', help="List packages for an environment on the project")
     add_directory_arg(preset)
     add_env_spec_arg(preset)
-    preset.set_defaults(main=environment_commands.main_list_packages)
+    preset.set_defaults(main=_subcommand('environment_commands', 'main_list_packages'))
 
     def add_command_name_arg(preset):
         preset.add_argument('name', metavar="NAME", help="Command name used to invoke it")
@@ -238,16 +291,16 @@ def _parse_args_and_run_subcommand(argv):
     add_command_name_arg(preset)
     add_env_spec_arg(preset)
     preset.add_argument('command', metavar="COMMAND", help="Command line or app filename to add")
-    preset.set_defaults(main=command_commands.main)
+    preset.set_defaults(main=_subcommand('command_commands'))
 
     preset = subparsers.add_parser('remove-command', help="Remove a command from the project")
     add_directory_arg(preset)
     add_command_name_arg(preset)
-    preset.set_defaults(main=command_commands.main_remove)
+    preset.set_defaults(main=_subcommand('command_commands', 'main_remove'))
 
     preset = subparsers.add_parser('list-commands', help="List the commands on the project")
     add_directory_arg(preset)
-    preset.set_defaults(main=command_commands.main_list)
+    preset.set_defaults(main=_subcommand('command_commands', 'main_list'))
 
     # argparse doesn't do this for us for whatever reason
     if len(argv) < 2:
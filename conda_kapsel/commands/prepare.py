@@ -7,25 +7,58 @@
 """The ``prepare`` command configures a project to run, asking the user questions if necessary."""
 from __future__ import absolute_import, print_function
 
-from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors
+from conda_kapsel.commands.prepare_with_mode import (prepare_with_ui_mode_printing_errors, print_timings,
+                                                     update_env_specs_with_ui_mode_printing_errors)
+from conda_kapsel.internal import timing
 from conda_kapsel.project import Project
 
 
-def prepare_command(project_dir, ui_mode, conda_environment):
+def prepare_command(project_dir,
+                    ui_mode,
+                    conda_environment,
+                    force_full_check=False,
+                    show_timings=False,
+                    timings_json_filename=None,
+                    trace_filename=None,
+                    all_env_specs=False,
+                    jobs=None):
     """Configure the project to run.
 
+    With ``all_env_specs``, every env spec's environment is
+    created or updated first, up to ``jobs`` at a time (or only
+    checked, in check mode).
+
     Returns:
         Prepare result (can be treated as True on success).
     """
-    project = Project(project_dir)
-    result = prepare_with_ui_mode_printing_errors(project, env_spec_name=conda_environment, ui_mode=ui_mode)
+    # record loading the project too, not only the prepare
+    with timing.recording(timing.Timings()):
+        project = Project(project_dir, read_only=True)
+        if all_env_specs:
+            if not update_env_specs_with_ui_mode_printing_errors(project, ui_mode=ui_mode, jobs=jobs):
+                return None
+        result = prepare_with_ui_mode_printing_errors(project,
+                                                      env_spec_name=conda_environment,
+                                                      ui_mode=ui_mode,
+                                                      force_full_check=force_full_check)
+
+    if not print_timings(result, show_timings, timings_json_filename, trace_filename):
+        return None
 
     return result
 
 
 def main(args):
     """Start the prepare command and return exit status code."""
-    if prepare_command(args.directory, args.mode, args.env_spec):
+    if prepare_command(args.directory,
+                       args.mode,
+                       args.env_spec,
+                       force_full_check=args.force_check,
+                       show_timings=args.timings,
+                       timings_json_filename=args.timings_json,
+                       trace_filename=args.trace,
+                       all_env_specs=args.all_env_specs,
+                       jobs=args.jobs):
         print("The project is ready to run commands.")
         print("Use `conda-kapsel list-commands` to see what's available.")
         return 0
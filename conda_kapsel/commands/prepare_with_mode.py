@@ -7,8 +7,14 @@
 """Command-line-specific project prepare utilities."""
 from __future__ import absolute_import, print_function
 
+import codecs
+import collections
+import json
+import sys
+
 from conda_kapsel import prepare
 from conda_kapsel import project_ops
+from conda_kapsel.internal import subprocess_runner
 from conda_kapsel.plugins.requirement import EnvVarRequirement
 
 from conda_kapsel.provide import (PROVIDE_MODE_PRODUCTION, PROVIDE_MODE_DEVELOPMENT, PROVIDE_MODE_CHECK)
@@ -69,18 +75,124 @@ def _interactively_fix_missing_variables(project, result):
         return start_over
 
 
+def _save_json(filename, content, what):
+    try:
+        with codecs.open(filename, 'w', 'utf-8') as f:
+            json.dump(content, f, indent=2)
+    except (IOError, OSError) as e:
+        print("Failed to save %s to %s: %s" % (what, filename, str(e)), file=sys.stderr)
+        return False
+    return True
+
+
+class _OutputLinePrinter(object):
+    """Prints conda and pip output as it arrives, remembering what it printed."""
+
+    def __init__(self):
+        self.printed = []
+
+    def __call__(self, stream, line):
+        # stdout is for the command we run (or the shell code from
+        # activate), so all of this goes to stderr
+        print(line, file=sys.stderr)
+        sys.stderr.flush()
+        self.printed.append(line)
+
+
+def _print_failure(result, already_printed):
+    # the logs include the conda and pip output we already showed
+    remaining = collections.Counter(already_printed)
+    for log in result.logs:
+        if remaining[log] > 0:
+            remaining[log] -= 1
+        else:
+            print(log, file=sys.stdout)
+    sys.stdout.flush()
+    for error in result.errors:
+        print(error, file=sys.stderr)
+
+
+def print_timings(result, show_timings=False, timings_json_filename=None, trace_filename=None):
+    """Print and/or save the timings from a prepare, as asked for on the command line.
+
+    Args:
+        result (PrepareResult): the prepare result
+        show_timings (bool): True to print a summary to stderr
+        timings_json_filename (str): file to save the timings to as JSON, or None
+        trace_filename (str): file to save the timings to as a Chrome trace, or None
+
+    Returns:
+        True on success, False if we couldn't save a file (after printing an error)
+    """
+    if show_timings:
+        print("Timings:", file=sys.stderr)
+        for line in result.timings.summary_lines():
+            print("  " + line, file=sys.stderr)
+
+    if timings_json_filename is not None:
+        if not _save_json(timings_json_filename, result.timings.to_json(), "timings"):
+            return False
+
+    if trace_filename is not None:
+        if not _save_json(trace_filename, result.timings.to_trace_json(), "trace"):
+            return False
+
+    return True
+
+
+def _provide_mode_for_ui_mode(ui_mode):
+    # returns (provide mode, whether to ask about missing variables)
+    if ui_mode == UI_MODE_TEXT_ASSUME_YES_PRODUCTION:
+        return (PROVIDE_MODE_PRODUCTION, False)
+    elif ui_mode == UI_MODE_TEXT_ASSUME_NO:
+        return (PROVIDE_MODE_CHECK, False)
+    elif ui_mode == UI_MODE_TEXT_DEVELOPMENT_DEFAULTS_OR_ASK:
+        return (PROVIDE_MODE_DEVELOPMENT, True)
+    else:
+        # the browser UI creates environments as development does
+        return (PROVIDE_MODE_DEVELOPMENT, False)
+
+
+def update_env_specs_with_ui_mode_printing_errors(project, ui_mode=UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, jobs=None):
+    """Create or fix the environments for all env specs, printing what went wrong.
+
+    Output from conda and pip is printed to stderr as it
+    arrives, and Ctrl-C stops the conda and pip processes on
+    every job. In ``UI_MODE_TEXT_ASSUME_NO`` nothing is changed,
+    and we only print the changes environments need.
+
+    Args:
+        project (Project): the project
+        ui_mode (str): one of the ``UI_MODE_`` values
+        jobs (int): how many environments to work on at once, or None for the default
+
+    Returns:
+        a ``Status`` instance
+    """
+    assert ui_mode in _all_ui_modes  # the arg parser should have guaranteed this
+    (provide_mode, ask) = _provide_mode_for_ui_mode(ui_mode)
+    with subprocess_runner.lines_to(_OutputLinePrinter()), subprocess_runner.cancelled_on_interrupt():
+        status = project_ops.update_env_specs(project, jobs=jobs, mode=provide_mode)
+    if not status:
+        console_utils.print_status_errors(status)
+    return status
+
+
 def prepare_with_ui_mode_printing_errors(project,
                                          environ=None,
                                          ui_mode=UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
                                          env_spec_name=None,
                                          command_name=None,
                                          command=None,
-                                         extra_command_args=None):
+                                         extra_command_args=None,
+                                         force_full_check=False):
     """Perform all steps needed to get a project ready to execute.
 
     This may need to ask the user questions, may start services,
     run scripts, load configuration, install packages... it can do
-    anything. Expect side effects.
+    anything. Expect side effects. In the text modes, output from
+    conda and pip is printed to stderr as it arrives, and Ctrl-C
+    stops any conda and pip processes we're waiting on.
 
     Args:
         project (Project): the project
@@ -91,6 +203,7 @@ def prepare_with_ui_mode_printing_errors(project,
         command_name (str): command name to use or None for default
         command (ProjectCommand): a command object or None
         extra_command_args (list of str): extra args for the command we prepare
+        force_full_check (bool): True to check all requirements even if nothing seems to have changed
 
     Returns:
         a ``PrepareResult`` instance
@@ -107,31 +220,25 @@ def prepare_with_ui_mode_printing_errors(project,
                                                  extra_command_args=extra_command_args,
                                                  keep_going_until_success=True)
     else:
-        ask = False
-        if ui_mode == UI_MODE_TEXT_ASSUME_YES_PRODUCTION:
-            provide_mode = PROVIDE_MODE_PRODUCTION
-        elif ui_mode == UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT:
-            provide_mode = PROVIDE_MODE_DEVELOPMENT
-        elif ui_mode == UI_MODE_TEXT_ASSUME_NO:
-            provide_mode = PROVIDE_MODE_CHECK
-        elif ui_mode == UI_MODE_TEXT_DEVELOPMENT_DEFAULTS_OR_ASK:
-            provide_mode = PROVIDE_MODE_DEVELOPMENT
-            ask = True
+        (provide_mode, ask) = _provide_mode_for_ui_mode(ui_mode)
 
         assert ui_mode != UI_MODE_TEXT_ASK_QUESTIONS  # Not implemented yet
 
         environ = None
         while True:
-            result = prepare.prepare_without_interaction(project,
-                                                         environ,
-                                                         mode=provide_mode,
-                                                         env_spec_name=env_spec_name,
-                                                         command_name=command_name,
-                                                         command=command,
-                                                         extra_command_args=extra_command_args)
+            printer = _OutputLinePrinter()
+            with subprocess_runner.lines_to(printer), subprocess_runner.cancelled_on_interrupt():
+                result = prepare.prepare_without_interaction(project,
+                                                             environ,
+                                                             mode=provide_mode,
+                                                             env_spec_name=env_spec_name,
+                                                             command_name=command_name,
+                                                             command=command,
+                                                             extra_command_args=extra_command_args,
+                                                             force_full_check=force_full_check)
 
             if result.failed:
-                result.print_output()
+                _print_failure(result, printer.printed)
 
                 if ask and _interactively_fix_missing_variables(project, result):
                     environ = result.environ
@@ -9,7 +9,8 @@ from __future__ import absolute_import, print_function
 
 import sys
 
-from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors
+from conda_kapsel.commands.prepare_with_mode import prepare_with_ui_mode_printing_errors, print_timings
+from conda_kapsel.internal import timing
 from conda_kapsel.project import Project
 from conda_kapsel.project_commands import ProjectCommand
 
@@ -30,23 +31,37 @@ def _command_from_name(project, command_name):
     return command
 
 
-def run_command(project_dir, ui_mode, conda_environment, command_name, extra_command_args):
+def run_command(project_dir,
+                ui_mode,
+                conda_environment,
+                command_name,
+                extra_command_args,
+                force_full_check=False,
+                show_timings=False,
+                timings_json_filename=None,
+                trace_filename=None):
     """Run the project.
 
     Returns:
         Does not return if successful.
     """
-    project = Project(project_dir)
-    environ = None
+    # record loading the project too, not only the prepare
+    with timing.recording(timing.Timings()):
+        project = Project(project_dir, read_only=True)
+        environ = None
 
-    command = _command_from_name(project, command_name)
+        command = _command_from_name(project, command_name)
 
-    result = prepare_with_ui_mode_printing_errors(project,
-                                                  ui_mode=ui_mode,
-                                                  env_spec_name=conda_environment,
-                                                  command=command,
-                                                  extra_command_args=extra_command_args,
-                                                  environ=environ)
+        result = prepare_with_ui_mode_printing_errors(project,
+                                                      ui_mode=ui_mode,
+                                                      env_spec_name=conda_environment,
+                                                      command=command,
+                                                      extra_command_args=extra_command_args,
+                                                      environ=environ,
+                                                      force_full_check=force_full_check)
+
+    if not print_timings(result, show_timings, timings_json_filename, trace_filename):
+        return
 
     if result.failed:
         # errors were printed already
@@ -63,6 +78,14 @@ def run_command(project_dir, ui_mode, conda_environment, command_name, extra_com
 
 def main(args):
     """Start the run command and return exit status code.."""
-    run_command(args.directory, args.mode, args.env_spec, args.command, args.extra_args_for_command)
+    run_command(args.directory,
+                args.mode,
+                args.env_spec,
+                args.command,
+                args.extra_args_for_command,
+                force_full_check=args.force_check,
+                show_timings=args.timings,
+                timings_json_filename=args.timings_json,
+                trace_filename=args.trace)
     # if we returned, we failed to run the command and should have printed an error
     return 1
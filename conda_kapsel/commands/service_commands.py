@@ -43,7 +43,7 @@ def remove_service(project_dir, variable_name):
 
 def list_services(project_dir):
     """List the services listed on the project."""
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
 
@@ -27,6 +27,7 @@ class Args(object):
         self.directory = "."
         self.env_spec = None
         self.mode = UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT
+        self.force_check = False
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
@@ -7,6 +7,7 @@
 from __future__ import absolute_import, print_function
 
 import os
+import tarfile
 
 from conda_kapsel.commands.main import _parse_args_and_run_subcommand
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
@@ -33,8 +34,12 @@ def test_archive_command_on_simple_project(capsys):
         assert code == 0
 
         out, err = capsys.readouterr()
-        assert ('  added %s\nCreated project archive %s\n' % (os.path.join(
-            os.path.basename(dirname), "foo.py"), archivefile)) == out
+        lines = out.splitlines()
+        assert ['  added %s' % os.path.join(os.path.basename(dirname), "foo.py"), 'Compression by file type:'] == \
+            lines[:2]
+        assert lines[2].startswith('  .py: 1 files, 15 -> 15 bytes (100.0%), ')
+        assert lines[2].endswith(' MB/s, stored as-is')
+        assert ['Created project archive %s' % archivefile] == lines[3:]
         assert '' == err
 
     with_directory_contents({'foo.py': 'print("hello")\n'}, check)
@@ -51,3 +56,38 @@ def test_archive_command_on_invalid_project(capsys):
                 'Unable to load the project.\n') == err
 
     with_directory_contents({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
+
+
+def test_archive_command_with_jobs(capsys):
+    def check(dirname):
+        archivefile = os.path.join(dirname, "foo.tar.gz")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'archive', '--directory', dirname, '--jobs', '3',
+                                               archivefile])
+        assert code == 0
+
+        out, err = capsys.readouterr()
+        assert out.endswith('Created project archive %s\n' % archivefile)
+        assert '' == err
+        with tarfile.open(archivefile, 'r:gz') as tf:
+            assert [os.path.join(os.path.basename(dirname), "foo.py")] == tf.getnames()
+
+    with_directory_contents({'foo.py': 'print("hello")\n'}, check)
+
+
+def test_archive_command_with_compression_level(capsys):
+    def check(dirname):
+        archivefile = os.path.join(dirname, "foo.zip")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'archive', '--directory', dirname,
+                                               '--compression-level', '0', archivefile])
+        assert code == 0
+        out, err = capsys.readouterr()
+        assert '  .py: 1 files, 1500 -> 1500 bytes (100.0%)' in out
+        assert '' == err
+
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'archive', '--directory', dirname,
+                                               '--compression-level', '10', archivefile])
+        assert code == 1
+        out, err = capsys.readouterr()
+        assert 'Unsupported compression level 10.\nCompression level must be from 0 to 9.\n' == err
+
+    with_directory_contents({'foo.py': 'print("hello")\n' * 100}, check)
@@ -217,6 +217,52 @@ def test_remove_env_spec_default(capsys, monkeypatch):
     with_directory_contents({}, check)
 
 
+def _monkeypatch_refresh_lock(monkeypatch, result):
+    params = {}
+
+    def mock_refresh_lock(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return result
+
+    monkeypatch.setattr("conda_kapsel.project_ops.refresh_lock", mock_refresh_lock)
+
+    return params
+
+
+def test_refresh_lock(capsys, monkeypatch):
+    def check(dirname):
+        _monkeypatch_pwd(monkeypatch, dirname)
+        params = _monkeypatch_refresh_lock(monkeypatch, SimpleStatus(success=True, description='Saved.'))
+
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'refresh-lock', '--env-spec', 'foo'])
+        assert code == 0
+
+        out, err = capsys.readouterr()
+        assert '' == err
+        assert 'Saved.\n' == out
+        assert 'foo' == params['kwargs']['env_spec_name']
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_fails(capsys, monkeypatch):
+    def check(dirname):
+        _monkeypatch_pwd(monkeypatch, dirname)
+        params = _monkeypatch_refresh_lock(monkeypatch,
+                                           SimpleStatus(success=False, description='Not saved.', errors=['nope']))
+
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'refresh-lock'])
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert '' == out
+        assert 'nope\nNot saved.\n' == err
+        assert params['kwargs']['env_spec_name'] is None
+
+    with_directory_contents(dict(), check)
+
+
 def test_add_env_spec_with_project_file_problems(capsys, monkeypatch):
     _test_environment_command_with_project_file_problems(capsys, monkeypatch,
                                                          ['conda-kapsel', 'add-env-spec', '--name', 'foo'])
@@ -7,16 +7,21 @@
 from __future__ import absolute_import, print_function
 from functools import partial
 
+import json
 import os
+import subprocess
+import sys
 
 import conda_kapsel
 from conda_kapsel.commands.main import _parse_args_and_run_subcommand
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 
 all_subcommands = ('init', 'run', 'prepare', 'clean', 'activate', 'archive', 'upload', 'add-variable',
                    'remove-variable', 'list-variables', 'set-variable', 'unset-variable', 'add-download',
                    'remove-download', 'list-downloads', 'add-service', 'remove-service', 'list-services',
-                   'add-env-spec', 'remove-env-spec', 'list-env-specs', 'add-packages', 'remove-packages',
-                   'list-packages', 'add-command', 'remove-command', 'list-commands')
+                   'add-env-spec', 'remove-env-spec', 'list-env-specs', 'refresh-lock', 'add-packages',
+                   'remove-packages', 'list-packages', 'add-command', 'remove-command', 'list-commands')
 all_subcommands_in_curlies = "{" + ",".join(all_subcommands) + "}"
 all_subcommands_comma_space = ", ".join(["'" + s + "'" for s in all_subcommands])
 
@@ -86,6 +91,7 @@ expected_usage_msg_format = \
         '    add-env-spec        Add a new environment spec to the project\n' \
         '    remove-env-spec     Remove an environment spec from the project\n' \
         '    list-env-specs      List all environment specs for the project\n' \
+        '    refresh-lock        Solve for packages again and update the lock file\n' \
         '    add-packages        Add packages to one or all project environments\n' \
         '    remove-packages     Remove packages from one or all project environments\n' \
         '    list-packages       List packages for an environment on the project\n' \
@@ -157,3 +163,47 @@ def test_main_calls_run(monkeypatch, capsys):
 
 def test_main_calls_prepare(monkeypatch, capsys):
     _main_calls_subcommand(monkeypatch, capsys, 'prepare')
+
+
+_print_imported_modules_script = """
+import json
+import sys
+from conda_kapsel.commands.main import _parse_args_and_run_subcommand
+code = _parse_args_and_run_subcommand(sys.argv[1:])
+sys.stdout.flush()
+sys.stderr.write("MODULES" + json.dumps(sorted(sys.modules.keys())))
+"""
+
+
+def _modules_imported_by(argv):
+    # this has to be a fresh process, since we've already
+    # imported everything in this one.
+    output = subprocess.check_output([sys.executable, '-c', _print_imported_modules_script] + argv,
+                                     stderr=subprocess.STDOUT)
+    output = output.decode('utf-8')
+    return set(json.loads(output[output.index("MODULES") + len("MODULES"):]))
+
+
+def _toplevel_modules(modules):
+    return set([module.split('.')[0] for module in modules])
+
+
+def test_main_help_does_not_import_subcommands():
+    modules = _modules_imported_by(['conda-kapsel', '--help'])
+    for module in ('conda_kapsel.commands.run', 'conda_kapsel.commands.upload', 'conda_kapsel.client'):
+        assert module not in modules
+    for module in ('tornado', 'requests', 'binstar_client', 'keyring'):
+        assert module not in _toplevel_modules(modules)
+
+
+def test_common_commands_only_import_what_they_need():
+    def check(dirname):
+        for subcommand in ('list-variables', 'list-commands', 'list-env-specs', 'list-downloads'):
+            modules = _modules_imported_by(['conda-kapsel', subcommand, '--directory', dirname])
+            for module in ('conda_kapsel.commands.run', 'conda_kapsel.commands.prepare',
+                           'conda_kapsel.commands.upload', 'conda_kapsel.client'):
+                assert module not in modules
+            for module in ('tornado', 'requests', 'binstar_client', 'keyring'):
+                assert module not in _toplevel_modules(modules)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "variables:\n  BAR: {}\n"}, check)
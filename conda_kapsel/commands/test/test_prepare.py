@@ -6,8 +6,11 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import json
 import os
 
+import pytest
+
 from conda_kapsel.commands.main import _parse_args_and_run_subcommand
 from conda_kapsel.commands.prepare import prepare_command, main
 from conda_kapsel.commands.prepare_with_mode import (UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT,
@@ -19,6 +22,7 @@ from conda_kapsel.local_state_file import LocalStateFile
 from conda_kapsel.test.project_utils import project_dir_disable_dedicated_env
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.internal import keyring
+from conda_kapsel.provide import PROVIDE_MODE_CHECK, PROVIDE_MODE_DEVELOPMENT
 
 
 class Args(object):
@@ -26,6 +30,12 @@ class Args(object):
         self.directory = "."
         self.env_spec = None
         self.mode = UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT
+        self.force_check = False
+        self.timings = False
+        self.timings_json = None
+        self.trace = None
+        self.all_env_specs = False
+        self.jobs = None
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
@@ -155,6 +165,100 @@ services:
     assert "" == err
 
 
+def test_main_prints_timings(monkeypatch, capsys):
+    can_connect_args = _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
+
+    def main_with_timings(dirname):
+        project_dir_disable_dedicated_env(dirname)
+        timings_json = os.path.join(dirname, "timings.json")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--mode',
+                                               UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, '--timings', '--timings-json',
+                                               timings_json])
+        assert code == 0
+
+        with open(timings_json) as f:
+            records = json.load(f)
+        assert 'REDIS_URL' in [record['name'] for record in records if record['kind'] == 'provide']
+        assert 'stage' in [record['kind'] for record in records]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, main_with_timings)
+
+    assert can_connect_args['port'] == 6379
+
+    out, err = capsys.readouterr()
+    assert "The project is ready to run commands." in out
+    assert err.startswith("Timings:\n")
+    assert "provide       REDIS_URL" in err
+    assert "stage         Set up project." in err
+
+
+def test_main_fails_to_save_timings(monkeypatch, capsys):
+    _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
+
+    def main_with_bad_timings_file(dirname):
+        project_dir_disable_dedicated_env(dirname)
+        timings_json = os.path.join(dirname, "nonexistent", "timings.json")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--mode',
+                                               UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, '--timings-json', timings_json])
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert err.startswith("Failed to save timings to %s: " % timings_json)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, main_with_bad_timings_file)
+
+
+def test_main_saves_trace(monkeypatch, capsys):
+    _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
+
+    def main_with_trace(dirname):
+        project_dir_disable_dedicated_env(dirname)
+        trace_filename = os.path.join(dirname, "trace.json")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--mode',
+                                               UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, '--trace', trace_filename])
+        assert code == 0
+
+        with open(trace_filename) as f:
+            trace = json.load(f)
+        events = trace['traceEvents']
+        spans = [(event['cat'], event['name']) for event in events if event['ph'] == 'X']
+        assert ('project_load', "Read project files in " + os.path.realpath(dirname)) in spans
+        assert ('yaml_parse', "Parse " + os.path.join(dirname, DEFAULT_PROJECT_FILENAME)) in spans
+        assert ('provide', 'REDIS_URL') in spans
+        assert ('stage', 'Set up project.') in spans
+        assert 'thread_name' in [event['name'] for event in events if event['ph'] == 'M']
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, main_with_trace)
+
+
+def test_main_fails_to_save_trace(monkeypatch, capsys):
+    _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
+
+    def main_with_bad_trace_file(dirname):
+        project_dir_disable_dedicated_env(dirname)
+        trace_filename = os.path.join(dirname, "nonexistent", "trace.json")
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--mode',
+                                               UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, '--trace', trace_filename])
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert err.startswith("Failed to save trace to %s: " % trace_filename)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, main_with_bad_trace_file)
+
+
 def test_main_dirname_not_provided_use_pwd(monkeypatch, capsys):
     can_connect_args = _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
     _monkeypatch_open_new_tab(monkeypatch)
@@ -246,6 +350,69 @@ services:
     assert "All ports from 6380 to 6449 were in use" in err
 
 
+def test_main_prints_conda_output_as_it_arrives(monkeypatch, capsys):
+    from conda_kapsel.internal import subprocess_runner
+    from conda_kapsel.prepare import PrepareFailure
+
+    printed_before_return = []
+
+    def mock_prepare_without_interaction(project, environ=None, **kwargs):
+        handler = subprocess_runner.current_line_handler()
+        assert handler is not None
+        handler('stdout', "Fetching package metadata ...")
+        handler('stderr', "Solving package specifications ...")
+        printed_before_return.append(capsys.readouterr())
+        return PrepareFailure(logs=["Fetching package metadata ...", "Solving package specifications ...",
+                                    "Not streamed"],
+                              statuses=(),
+                              errors=["Failed to create environment"],
+                              environ=dict(),
+                              overrides=None)
+
+    monkeypatch.setattr('conda_kapsel.prepare.prepare_without_interaction', mock_prepare_without_interaction)
+
+    def check(dirname):
+        code = main(Args(directory=dirname))
+        assert 1 == code
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+    assert len(printed_before_return) == 1
+    (out, err) = printed_before_return[0]
+    assert "" == out
+    assert "Fetching package metadata ...\nSolving package specifications ...\n" == err
+
+    # the streamed lines are not printed a second time
+    out, err = capsys.readouterr()
+    assert "Not streamed\n" == out
+    assert "Fetching package metadata" not in err
+    assert "Failed to create environment" in err
+
+
+def test_main_cancels_subprocesses_on_ctrl_c(monkeypatch):
+    from conda_kapsel.internal import subprocess_runner
+
+    cancellations = []
+
+    def mock_prepare_without_interaction(project, environ=None, **kwargs):
+        cancellation = subprocess_runner.current_cancellation()
+        assert cancellation is not None
+        assert not cancellation.cancelled
+        cancellations.append(cancellation)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr('conda_kapsel.prepare.prepare_without_interaction', mock_prepare_without_interaction)
+
+    def check(dirname):
+        with pytest.raises(KeyboardInterrupt):
+            main(Args(directory=dirname))
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+    assert len(cancellations) == 1
+    assert cancellations[0].cancelled
+
+
 def test_prepare_command_choose_environment(capsys, monkeypatch):
     def mock_conda_create(prefix, pkgs, channels):
         from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
@@ -256,6 +423,7 @@ def test_prepare_command_choose_environment(capsys, monkeypatch):
             open(pkgmeta, 'a').close()
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_conda_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.list_explicit', lambda prefix: "@EXPLICIT\n")
 
     def check_prepare_choose_environment(dirname):
         wrong_envdir = os.path.join(dirname, "envs", "foo")
@@ -535,3 +703,118 @@ variables:
 env_specs: 42
 
 """}, check)
+
+
+def test_prepare_command_all_env_specs(monkeypatch, capsys):
+    _monkeypatch_can_connect_to_socket_to_succeed(monkeypatch)
+    calls = []
+
+    def mock_update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=None):
+        calls.append((project.directory_path, env_spec_names, jobs, mode))
+        return SimpleStatus(success=True, description="Updated environments: default.")
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    def check(dirname):
+        project_dir_disable_dedicated_env(dirname)
+        code = _parse_args_and_run_subcommand(['conda-kapsel', 'prepare', '--directory', dirname, '--mode',
+                                               UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT, '--all-env-specs', '--jobs', '3'])
+        assert code == 0
+        assert [(dirname, None, 3, PROVIDE_MODE_DEVELOPMENT)] == calls
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, check)
+
+
+def test_prepare_command_all_env_specs_prints_conda_output_as_it_arrives(monkeypatch, capsys):
+    from conda_kapsel.internal import subprocess_runner
+
+    printed_before_return = []
+
+    def mock_update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=None):
+        handler = subprocess_runner.current_line_handler()
+        assert handler is not None
+        handler('stdout', "Fetching package metadata ...")
+        printed_before_return.append(capsys.readouterr())
+        return SimpleStatus(success=False, description="Failed to update some environments.",
+                            errors=["foo: conda install failed"])
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    def check(dirname):
+        code = main(Args(directory=dirname, all_env_specs=True))
+        assert code == 1
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+    assert len(printed_before_return) == 1
+    assert ("", "Fetching package metadata ...\n") == tuple(printed_before_return[0])
+    out, err = capsys.readouterr()
+    assert "foo: conda install failed\nFailed to update some environments.\n" == err
+
+
+def test_prepare_command_all_env_specs_cancels_subprocesses_on_ctrl_c(monkeypatch):
+    from conda_kapsel.internal import subprocess_runner
+
+    cancellations = []
+
+    def mock_update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=None):
+        cancellations.append(subprocess_runner.current_cancellation())
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    def check(dirname):
+        with pytest.raises(KeyboardInterrupt):
+            main(Args(directory=dirname, all_env_specs=True))
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+    assert len(cancellations) == 1
+    assert cancellations[0].cancelled
+
+
+def test_prepare_command_all_env_specs_check_mode(monkeypatch, capsys):
+    modes = []
+
+    def mock_update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=None):
+        modes.append(mode)
+        return SimpleStatus(success=False,
+                            description="Some environments need changes.",
+                            logs=["Environment /foo needs changes:", "  Create environment with: python"])
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    def check(dirname):
+        code = main(Args(directory=dirname, all_env_specs=True, mode=UI_MODE_TEXT_ASSUME_NO))
+        assert code == 1
+        assert [PROVIDE_MODE_CHECK] == modes
+
+        out, err = capsys.readouterr()
+        assert ("Environment /foo needs changes:\n  Create environment with: python\n" +
+                "Some environments need changes.\n") == err
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: ""}, check)
+
+
+def test_prepare_command_all_env_specs_fails(monkeypatch, capsys):
+    def mock_update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=None):
+        return SimpleStatus(success=False,
+                            description="Failed to update some environments.",
+                            errors=["foo: conda install failed"])
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    def check(dirname):
+        code = main(Args(directory=dirname, all_env_specs=True))
+        assert code == 1
+
+        out, err = capsys.readouterr()
+        assert "foo: conda install failed\nFailed to update some environments.\n" == err
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, check)
@@ -25,6 +25,10 @@ class Args(object):
         self.directory = "."
         self.env_spec = None
         self.mode = UI_MODE_TEXT_ASSUME_YES_DEVELOPMENT
+        self.force_check = False
+        self.timings = False
+        self.timings_json = None
+        self.trace = None
         self.command = None
         self.extra_args_for_command = None
         for key in kwargs:
@@ -51,7 +51,7 @@ def remove_variables(project_dir, vars_to_remove):
 
 def list_variables(project_dir):
     """List variables present in project."""
-    project = Project(project_dir)
+    project = Project(project_dir, read_only=True)
     if console_utils.print_project_problems(project):
         return 1
     print("Variables for project: {}\n".format(project_dir))
@@ -8,8 +8,11 @@
 from __future__ import absolute_import
 
 from abc import ABCMeta, abstractmethod
+import os
 
 from conda_kapsel.internal.metaclass import with_metaclass
+import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.pip_api as pip_api
 
 _conda_manager_classes = []
 
@@ -95,6 +98,47 @@ class CondaManager(with_metaclass(ABCMeta)):
         """
         pass  # pragma: no cover
 
+    def plan_environment_fix(self, prefix, spec, deviations=None):
+        """Compute a ``CondaEnvironmentPlan`` with the changes ``fix_environment_deviations()`` would make.
+
+        Raised exceptions that are user-interesting conda problems
+        should be subtypes of ``CondaManagerError``.
+
+        Args:
+            prefix (str): the environment prefix (absolute path)
+            spec (EnvSpec): specification for the environment
+            deviations (CondaEnvironmentDeviations): optional previous result from find_environment_deviations()
+
+        Returns:
+            a ``CondaEnvironmentPlan`` instance
+        """
+        if not os.path.isdir(os.path.join(prefix, 'conda-meta')):
+            # pip needs a python, and so do most project commands,
+            # so we always create the env with one
+            conda_packages = list(spec.conda_packages)
+            if 'python' not in spec.conda_package_names_set:
+                conda_packages.insert(0, 'python')
+            return CondaEnvironmentPlan(create=True,
+                                        conda_packages=conda_packages,
+                                        pip_packages=spec.pip_packages,
+                                        channels=spec.channels)
+
+        if deviations is None:
+            deviations = self.find_environment_deviations(prefix, spec)
+
+        # we use the full specs from the env spec, not only the
+        # names, so the versions come out right
+        conda_names = set(deviations.missing_packages).union(set(deviations.wrong_version_packages))
+        conda_packages = [package_spec for package_spec in spec.conda_packages
+                          if conda_api.parse_spec(package_spec).name in conda_names]
+        pip_names = set(deviations.missing_pip_packages).union(set(deviations.wrong_version_pip_packages))
+        pip_packages = [package_spec for package_spec in spec.pip_packages
+                        if pip_api.parse_spec(package_spec).name in pip_names]
+        return CondaEnvironmentPlan(create=False,
+                                    conda_packages=conda_packages,
+                                    pip_packages=pip_packages,
+                                    channels=spec.channels)
+
     @abstractmethod
     def remove_packages(self, prefix, packages):
         """Remove the given package name from the environment in prefix.
@@ -184,3 +228,62 @@ class CondaEnvironmentDeviations(object):
     def wrong_version_pip_packages(self):
         """Iterable collection of pip package names an unacceptable version installed."""
         return self._wrong_version_pip_packages
+
+
+class CondaEnvironmentPlan(object):
+    """The changes needed to make an environment match its spec.
+
+    Conda packages are installed in one conda command and pip
+    packages in one pip command.
+    """
+
+    def __init__(self, create, conda_packages, pip_packages, channels=()):
+        """Construct a ``CondaEnvironmentPlan``.
+
+        Args:
+          create (bool): True if the environment has to be created
+          conda_packages (iterable of str): conda package specs to create the env with or install
+          pip_packages (iterable of str): pip package specs to install
+          channels (iterable of str): channels to get conda packages from
+        """
+        self._create = create
+        self._conda_packages = tuple(conda_packages)
+        self._pip_packages = tuple(pip_packages)
+        self._channels = tuple(channels)
+
+    @property
+    def create(self):
+        """True if the environment has to be created."""
+        return self._create
+
+    @property
+    def conda_packages(self):
+        """Tuple of conda package specs to create the environment with or install."""
+        return self._conda_packages
+
+    @property
+    def pip_packages(self):
+        """Tuple of pip package specs to install."""
+        return self._pip_packages
+
+    @property
+    def channels(self):
+        """Tuple of channels to get conda packages from."""
+        return self._channels
+
+    @property
+    def empty(self):
+        """True if there's nothing to do."""
+        return not self._create and len(self._conda_packages) == 0 and len(self._pip_packages) == 0
+
+    @property
+    def summary_lines(self):
+        """List of human-readable lines describing the plan."""
+        lines = []
+        if self._create:
+            lines.append("Create environment with conda packages: %s" % ", ".join(self._conda_packages))
+        elif len(self._conda_packages) > 0:
+            lines.append("Install conda packages: %s" % ", ".join(self._conda_packages))
+        if len(self._pip_packages) > 0:
+            lines.append("Install pip packages: %s" % ", ".join(self._pip_packages))
+        return lines
@@ -30,7 +30,7 @@ class CondaMetaFile(YamlFile):
     """
 
     @classmethod
-    def load_for_directory(cls, directory):
+    def load_for_directory(cls, directory, read_only=False):
         """Load the meta.yml file from the given directory, even if it doesn't exist.
 
         If the directory has no project file, the loaded
@@ -44,6 +44,7 @@ class CondaMetaFile(YamlFile):
 
         Args:
             directory (str): path to the project directory
+            read_only (bool): True to load quickly for reading, see ``YamlFile``
 
         Returns:
             a new ``MetaFile``
@@ -52,8 +53,8 @@ class CondaMetaFile(YamlFile):
         for name in possible_meta_file_names:
             path = os.path.join(directory, META_DIRECTORY, name)
             if os.path.isfile(path):
-                return CondaMetaFile(path)
-        return CondaMetaFile(os.path.join(directory, DEFAULT_RELATIVE_META_PATH))
+                return CondaMetaFile(path, read_only=read_only)
+        return CondaMetaFile(os.path.join(directory, DEFAULT_RELATIVE_META_PATH), read_only=read_only)
 
     def _default_comment(self):
         return "Conda meta.yaml file"
@@ -7,6 +7,8 @@
 """Environment class representing a conda environment."""
 from __future__ import absolute_import
 
+import hashlib
+import json
 import os
 
 import conda_kapsel.internal.conda_api as conda_api
@@ -16,7 +18,7 @@ import conda_kapsel.internal.pip_api as pip_api
 class EnvSpec(object):
     """Represents a set of required conda packages we could potentially instantiate as a Conda environment."""
 
-    def __init__(self, name, conda_packages, channels, pip_packages=(), description=None):
+    def __init__(self, name, conda_packages, channels, pip_packages=(), description=None, lock_filename=None):
         """Construct a package set with the given name and packages.
 
         Args:
@@ -25,12 +27,14 @@ class EnvSpec(object):
             channels (list): list of channel names
             pip_packages (list): list of pip package specs to pass to pip
             description (str or None): one-sentence-ish summary of what this env is
+            lock_filename (str or None): file recording the exact conda packages to create the env from
         """
         self._name = name
         self._conda_packages = tuple(conda_packages)
         self._channels = tuple(channels)
         self._pip_packages = tuple(pip_packages)
         self._description = description
+        self._lock_filename = lock_filename
 
     @property
     def name(self):
@@ -60,6 +64,27 @@ class EnvSpec(object):
         """Get the pip packages to install in the environment as an iterable."""
         return self._pip_packages
 
+    @property
+    def lock_filename(self):
+        """Get the lock file listing the exact conda packages to use, or None if we don't have one."""
+        return self._lock_filename
+
+    @property
+    def conda_packages_hash(self):
+        """Hash of the conda packages and channels; a lock file is stale if this changes."""
+        content = json.dumps(dict(conda_packages=list(self.conda_packages), channels=list(self.channels)),
+                             sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @property
+    def packages_hash(self):
+        """Hash of the conda packages, pip packages, and channels; an environment made for another hash is stale."""
+        content = json.dumps(dict(conda_packages=list(self.conda_packages),
+                                  pip_packages=list(self.pip_packages),
+                                  channels=list(self.channels)),
+                             sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
     @property
     def conda_package_names_set(self):
         """Conda package names that we require, as a Python set."""
@@ -7,14 +7,17 @@
 from __future__ import absolute_import, print_function, division, unicode_literals
 
 import collections
-import errno
-import subprocess
+import contextlib
 import json
 import os
 import platform
 import re
+import struct
 import sys
+import threading
+import time
 
+from conda_kapsel.internal import conda_meta_index, file_lock, project_cache, subprocess_runner, timing
 from conda_kapsel.internal.directory_contains import subdirectory_relative_to_directory
 
 
@@ -38,21 +41,32 @@ def _get_conda_command(extra_args):
     return cmd_list
 
 
-def _call_conda(extra_args):
+def _call_conda(extra_args, stream_output=False, timeout=None):
     cmd_list = _get_conda_command(extra_args)
 
-    try:
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError as e:
-        raise CondaError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
-    (out, err) = p.communicate()
-    errstr = err.decode().strip()
-    if p.returncode != 0:
+    with timing.timed(timing.TIMING_KIND_SUBPROCESS, " ".join(["conda"] + list(extra_args[:1])),
+                      dict(argv=cmd_list)) as details:
+        try:
+            result = subprocess_runner.run(cmd_list, stream_output=stream_output, timeout=timeout)
+        except OSError as e:
+            raise CondaError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
+        details['returncode'] = result.returncode
+        if result.timed_out:
+            details['timed_out'] = True
+        if result.cancelled:
+            details['cancelled'] = True
+    errstr = result.stderr.decode().strip()
+    if result.cancelled:
+        raise CondaError('%s: cancelled' % " ".join(cmd_list))
+    elif result.timed_out:
+        raise CondaError('%s: timed out after %s seconds' % (" ".join(cmd_list), timeout))
+    elif result.returncode != 0:
         raise CondaError('%s: %s' % (" ".join(cmd_list), errstr))
-    elif errstr != '':
+    elif errstr != '' and not (stream_output and subprocess_runner.current_line_handler() is not None):
+        # nobody saw these lines as they were written
         for line in errstr.split("\n"):
             print("%s %s: %s" % (cmd_list[0], cmd_list[1], line), file=sys.stderr)
-    return out
+    return result.stdout
 
 
 def _call_and_parse_json(extra_args):
@@ -72,6 +86,112 @@ def info():
     return _call_and_parse_json(['info', '--json'])
 
 
+_INFO_CACHE_NAME = "conda-info"
+
+# an mtime this recent could change again without the mtime
+# changing, so we don't cache info that depends on it.
+_MTIME_GRANULARITY_SECONDS = 2
+
+
+# this function exists so we can monkeypatch it in tests
+def _info_cache_filename():
+    return project_cache.user_cache_filename(_INFO_CACHE_NAME)
+
+
+def _find_executable(program):
+    if os.path.isabs(program):
+        return program if os.path.isfile(program) else None
+    extensions = ['']
+    if platform.system() == 'Windows':
+        extensions.extend(os.environ.get('PATHEXT', '.EXE;.BAT').lower().split(';'))
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        for extension in extensions:
+            candidate = os.path.join(directory, program + extension)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                return candidate
+    return None
+
+
+def _mtime_or_none(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+# conda reads any CONDA_<SETTING> variable as configuration (such as
+# CONDA_ENVS_PATH, CONDA_PKGS_DIRS, or CONDARC); these others only
+# say which env is active, or are ours.
+_NOT_CONDA_CONFIG_VARIABLE_RE = re.compile(r'^CONDA_(PREFIX(_[0-9]+)?|DEFAULT_ENV|ENV_PATH|SHLVL|PROMPT_MODIFIER|'
+                                           r'EXE|PYTHON_EXE|KAPSEL_.*)$')
+
+
+def _info_cache_environ():
+    return sorted([name, value] for (name, value) in os.environ.items()
+                  if name.startswith('CONDA') and not _NOT_CONDA_CONFIG_VARIABLE_RE.match(name))
+
+
+def _info_cache_stamped_paths(conda, cached_info):
+    # conda itself, every condarc conda could read, and the envs
+    # dirs (creating or removing an env changes their mtime)
+    paths = [conda, os.path.expanduser(os.path.join('~', '.condarc'))]
+    if 'CONDARC' in os.environ:
+        paths.append(os.environ['CONDARC'])
+    if cached_info.get('root_prefix') is not None:
+        paths.append(os.path.join(cached_info['root_prefix'], '.condarc'))
+    paths.extend(cached_info.get('envs_dirs', []))
+    return paths
+
+
+def _load_info_cache(conda):
+    cached = project_cache.load_cache(_info_cache_filename())
+    if not isinstance(cached, dict) or cached.get('conda') != conda or not isinstance(cached.get('info'), dict):
+        return None
+    if cached.get('environ') != _info_cache_environ():
+        return None
+    if 'pkgs_dirs' not in cached['info'] or 'conda_version' not in cached['info']:
+        # saved before we cached them
+        return None
+    stamps = cached.get('stamps')
+    if stamps != [[path, _mtime_or_none(path)] for path in _info_cache_stamped_paths(conda, cached['info'])]:
+        return None
+    return cached['info']
+
+
+def _save_info_cache(conda, cached_info):
+    stamps = [[path, _mtime_or_none(path)] for path in _info_cache_stamped_paths(conda, cached_info)]
+    now = time.time()
+    if any(mtime is not None and (now - mtime) <= _MTIME_GRANULARITY_SECONDS for (path, mtime) in stamps):
+        return
+    project_cache.save_cache(_info_cache_filename(),
+                             dict(conda=conda, environ=_info_cache_environ(), stamps=stamps, info=cached_info))
+
+
+def _cached_info():
+    """Get the root_prefix, envs_dirs, envs, pkgs_dirs, and conda_version from ``info()``.
+
+    These are cached in the user's cache directory, so most runs
+    don't need to run ``conda info``. The cache is thrown away
+    when the conda executable, any condarc, any envs dir, or any
+    conda configuration environment variable changes.
+    """
+    conda = _find_executable(_get_conda_command([])[0])
+    if conda is not None:
+        cached_info = _load_info_cache(conda)
+        if cached_info is not None:
+            return cached_info
+
+    json = info()
+    cached_info = dict(root_prefix=json.get('root_prefix', None),
+                       envs_dirs=json.get('envs_dirs', []),
+                       envs=json.get('envs', []),
+                       pkgs_dirs=json.get('pkgs_dirs', []),
+                       conda_version=json.get('conda_version', None))
+    if conda is not None:
+        _save_info_cache(conda, cached_info)
+    return cached_info
+
+
 def resolve_env_to_prefix(name_or_prefix):
     """Convert an env name or path into a canonical prefix path.
 
@@ -81,7 +201,7 @@ def resolve_env_to_prefix(name_or_prefix):
     if os.path.isabs(name_or_prefix):
         return name_or_prefix
 
-    json = info()
+    json = _cached_info()
     root_prefix = json.get('root_prefix', None)
     if name_or_prefix == 'root':
         return root_prefix
@@ -93,6 +213,99 @@ def resolve_env_to_prefix(name_or_prefix):
     return None
 
 
+def pkgs_dirs():
+    """Get the list of package cache directories conda downloads and extracts into."""
+    return _cached_info().get('pkgs_dirs', [])
+
+
+# either one turns on offline mode
+OFFLINE_VARIABLES = ('CONDA_KAPSEL_OFFLINE', 'CONDA_OFFLINE')
+
+
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def offline_mode_from(environ):
+    """Context manager that makes ``offline_mode()`` on this thread look at ``environ``.
+
+    Callers preparing a project with an environment other than
+    ``os.environ`` use this around anything that runs conda, so
+    the conda commands see the same offline setting the project
+    does.
+    """
+    old = getattr(_current, 'environ', None)
+    _current.environ = environ
+    try:
+        yield
+    finally:
+        _current.environ = old
+
+
+def offline_mode(environ=None):
+    """Get whether packages may only come from local caches and file:// channels.
+
+    Args:
+        environ (dict): environment variables, or None for the ones
+            from ``offline_mode_from()``, or else os.environ
+
+    Returns:
+        True if ``CONDA_KAPSEL_OFFLINE`` or ``CONDA_OFFLINE`` is set to a true value
+    """
+    if environ is None:
+        environ = getattr(_current, 'environ', None)
+    if environ is None:
+        environ = os.environ
+    return any(environ.get(name, '').lower() in ('1', 'true', 'yes') for name in OFFLINE_VARIABLES)
+
+
+# conda doesn't expect several conda processes to download and
+# extract into the same package cache at once, so only one command
+# at a time fetches into each package cache.
+_PACKAGE_CACHE_LOCK_NAME = "conda-package-cache"
+
+# the first conda whose create and install can stop after filling
+# the package cache
+_DOWNLOAD_ONLY_CONDA_VERSION = (4, 6)
+
+
+def _package_cache_lock():
+    # conda fetches and extracts into the first pkgs dir it can write to
+    directories = pkgs_dirs()
+    writable = [directory for directory in directories
+                if os.access(directory, os.W_OK) or not os.path.exists(directory)]
+    if len(writable) > 0:
+        directory = writable[0]
+    elif len(directories) > 0:
+        directory = directories[0]
+    else:
+        return file_lock.named_lock(_PACKAGE_CACHE_LOCK_NAME)
+    return file_lock.named_lock(_PACKAGE_CACHE_LOCK_NAME + ":" + os.path.realpath(directory))
+
+
+def _conda_supports_download_only():
+    version = _cached_info().get('conda_version', None)
+    if version is None:
+        return False
+    numbers = tuple(int(number) for number in re.findall(r'\d+', version)[:2])
+    return numbers >= _DOWNLOAD_ONLY_CONDA_VERSION
+
+
+def _call_conda_with_package_cache(extra_args):
+    if offline_mode():
+        extra_args = extra_args[:1] + ['--offline'] + extra_args[1:]
+    if _conda_supports_download_only():
+        # only filling the package cache needs it to ourselves; then
+        # the real command just links from it, alongside any other
+        # conda commands.
+        with _package_cache_lock():
+            _call_conda(extra_args[:1] + ['--download-only'] + extra_args[1:], stream_output=True)
+        return _call_conda(extra_args, stream_output=True)
+    else:
+        with _package_cache_lock():
+            return _call_conda(extra_args, stream_output=True)
+
+
 def create(prefix, pkgs=None, channels=()):
     """Create an environment either by name or path with a specified set of packages."""
     if not pkgs or not isinstance(pkgs, (list, tuple)):
@@ -107,7 +320,7 @@ def create(prefix, pkgs=None, channels=()):
         cmd_list.extend(['--channel', channel])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda_with_package_cache(cmd_list)
 
 
 def install(prefix, pkgs=None, channels=()):
@@ -122,7 +335,7 @@ def install(prefix, pkgs=None, channels=()):
         cmd_list.extend(['--channel', channel])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda_with_package_cache(cmd_list)
 
 
 def remove(prefix, pkgs=None):
@@ -131,27 +344,60 @@ def remove(prefix, pkgs=None):
         raise TypeError('must specify a list of one or more packages to remove from existing environment')
 
     cmd_list = ['remove', '--yes', '--quiet']
+    if offline_mode():
+        cmd_list.append('--offline')
     cmd_list.extend(['--prefix', prefix])
 
     cmd_list.extend(pkgs)
-    return _call_conda(cmd_list)
+    return _call_conda(cmd_list, stream_output=True)
 
 
-def installed(prefix):
-    """Get a dict of package names to (name, version, build) tuples."""
-    meta_dir = os.path.join(prefix, 'conda-meta')
+def create_from_explicit(prefix, filename):
+    """Create an environment from an explicit package list such as ``conda list --explicit`` prints.
+
+    Explicit lists name exact package URLs, so conda doesn't need to solve anything.
+    """
+    if os.path.exists(prefix):
+        raise CondaEnvExistsError('Conda environment [%s] already exists' % prefix)
+
+    return _call_conda_with_package_cache(['create', '--yes', '--quiet', '--prefix', prefix, '--file', filename])
+
+
+def list_explicit(prefix):
+    """Get the explicit package list (one package URL per line) for an environment, as a string."""
+    return _call_conda(['list', '--explicit', '--prefix', prefix]).decode()
+
+
+def current_platform():
+    """Get the conda platform name (such as "linux-64") for the platform we're running on."""
+    bits = struct.calcsize("P") * 8
+    system = platform.system()
+    if system == 'Windows':
+        name = 'win'
+    elif system == 'Darwin':
+        name = 'osx'
+    else:
+        name = system.lower()
+    return "%s-%d" % (name, bits)
+
+
+def installed_packages(prefix):
+    """Get a dict of package names to ``conda_meta_index.InstalledPackage``.
+
+    This reads the conda-meta directory in-process rather than running conda,
+    and caches the result until the environment changes.
+    """
     try:
-        full_names = set(fn[:-5] for fn in os.listdir(meta_dir) if fn.endswith('.json'))
+        return conda_meta_index.installed_packages(prefix)
     except OSError as e:
-        if e.errno == errno.ENOENT:
-            full_names = set()
-        else:
-            raise CondaError(str(e))
+        raise CondaError(str(e))
+
+
+def installed(prefix):
+    """Get a dict of package names to (name, version, build) tuples."""
     result = dict()
-    for full_name in full_names:
-        pieces = full_name.rsplit('-', 2)
-        if len(pieces) == 3:
-            result[pieces[0]] = tuple(pieces)
+    for (name, package) in installed_packages(prefix).items():
+        result[name] = (package.name, package.version, package.build)
     return result
 
 
@@ -332,7 +578,7 @@ def environ_set_prefix(environ, prefix, varname=conda_prefix_variable()):
         global _envs_dirs
         global _root_dir
         if _envs_dirs is None:
-            i = info()
+            i = _cached_info()
             _envs_dirs = [os.path.normpath(d) for d in i.get('envs_dirs', [])]
             _root_dir = os.path.normpath(i.get('root_prefix'))
         if prefix == _root_dir:
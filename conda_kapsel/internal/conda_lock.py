@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Lock files recording the exact conda packages an env spec resolved to."""
+from __future__ import absolute_import
+
+import codecs
+import os
+import uuid
+
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.rename import rename_over_existing
+
+# relative to the project directory; unlike the cache directory,
+# lock files belong in source control and in archives.
+LOCK_DIRECTORY = "kapsel-locks"
+
+_HASH_HEADER = "# conda_packages_hash: "
+_PLATFORM_HEADER = "# platform: "
+
+
+def lock_filename(project_directory, env_spec_name, platform):
+    """Get the full path of the lock file for an env spec on a platform."""
+    return os.path.join(project_directory, LOCK_DIRECTORY, "%s-%s.txt" % (env_spec_name, platform))
+
+
+def _read_headers(filename):
+    headers = dict()
+    with codecs.open(filename, 'r', 'utf-8') as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            for prefix in (_HASH_HEADER, _PLATFORM_HEADER):
+                if line.startswith(prefix):
+                    headers[prefix] = line[len(prefix):].strip()
+    return headers
+
+
+def is_lock_current(filename, spec, platform):
+    """Check whether a lock file exists and was made from the env spec's current packages.
+
+    Args:
+        filename (str): the lock file
+        spec (EnvSpec): the env spec the lock is for
+        platform (str): the conda platform we want to create on
+
+    Returns:
+        True if we can create from the lock file
+    """
+    try:
+        headers = _read_headers(filename)
+    except (IOError, OSError, UnicodeDecodeError):
+        return False
+    return (headers.get(_HASH_HEADER) == spec.conda_packages_hash and headers.get(_PLATFORM_HEADER) == platform)
+
+
+def save_lock(filename, spec, platform, explicit):
+    """Atomically save a lock file.
+
+    Args:
+        filename (str): the lock file
+        spec (EnvSpec): the env spec the lock is for
+        platform (str): the conda platform the packages are for
+        explicit (str): output of ``conda list --explicit``
+
+    Returns:
+        True if the lock was saved
+    """
+    content = ("# conda-kapsel lock file for env spec %s; 'conda-kapsel refresh-lock' updates it.\n" % spec.name +
+               _PLATFORM_HEADER + platform + "\n" + _HASH_HEADER + spec.conda_packages_hash + "\n" + explicit)
+    if not content.endswith("\n"):
+        content = content + "\n"
+
+    tmp = filename + ".tmp-" + str(uuid.uuid4())
+    try:
+        makedirs_ok_if_exists(os.path.dirname(filename))
+        with codecs.open(tmp, 'w', 'utf-8') as f:
+            f.write(content)
+        rename_over_existing(tmp, filename)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        try:
+            os.remove(tmp)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Read the packages installed in a conda environment from its conda-meta directory."""
+from __future__ import absolute_import
+
+import codecs
+import collections
+import json
+import os
+import threading
+import time
+
+InstalledPackage = collections.namedtuple('InstalledPackage', ['name', 'version', 'build', 'channel', 'files'])
+
+# conda adds and removes conda-meta records rather than changing
+# them, so the directory mtime changes whenever the environment
+# does. But mtimes can be coarse, so we don't trust an mtime
+# that's so recent something else could happen within the same tick.
+_MTIME_GRANULARITY_SECONDS = 2
+
+# prefix -> (mtime, dict of name -> InstalledPackage)
+_index = dict()
+_index_lock = threading.Lock()
+
+
+def _package_from_filename(full_name):
+    pieces = full_name.rsplit('-', 2)
+    if len(pieces) != 3:
+        return None
+    return InstalledPackage(name=pieces[0], version=pieces[1], build=pieces[2], channel=None, files=())
+
+
+def _load_package(meta_dir, filename):
+    full_name = filename[:-5]
+    try:
+        with codecs.open(os.path.join(meta_dir, filename), 'r', 'utf-8') as f:
+            record = json.load(f)
+        return InstalledPackage(name=record['name'],
+                                version=record['version'],
+                                build=record['build'],
+                                channel=record.get('channel'),
+                                files=tuple(record.get('files', ())))
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        # the filename is still good enough to know what's installed
+        return _package_from_filename(full_name)
+
+
+def _load_packages(meta_dir):
+    packages = dict()
+    for filename in os.listdir(meta_dir):
+        if not filename.endswith('.json'):
+            continue
+        package = _load_package(meta_dir, filename)
+        if package is not None:
+            packages[package.name] = package
+    return packages
+
+
+def installed_packages(prefix):
+    """Get the packages installed in an environment.
+
+    The conda-meta records are read in-process and kept in memory
+    until the conda-meta directory is modified.
+
+    Args:
+        prefix (str): the environment prefix
+
+    Returns:
+        dict of package name to ``InstalledPackage``, empty if there's no conda-meta directory
+
+    Raises:
+        OSError if we can't read the conda-meta directory
+    """
+    meta_dir = os.path.join(prefix, 'conda-meta')
+    try:
+        mtime = os.stat(meta_dir).st_mtime
+    except OSError as e:
+        if not os.path.exists(meta_dir):
+            return dict()
+        raise e
+
+    with _index_lock:
+        cached = _index.get(prefix)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    packages = _load_packages(meta_dir)
+
+    if (time.time() - mtime) > _MTIME_GRANULARITY_SECONDS:
+        with _index_lock:
+            _index[prefix] = (mtime, packages)
+
+    return packages
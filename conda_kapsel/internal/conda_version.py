@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Check installed package versions against conda package specs, without running conda."""
+from __future__ import absolute_import
+
+import fnmatch
+import re
+
+# These follow conda's ordering rules closely enough for checking
+# an environment: "1.1dev < 1.1a1 < 1.1 < 1.1post1", numbers compare
+# numerically, and missing trailing parts count as zero.
+_DEV = (0, '')
+_POST = (3, '')
+_ZERO = (2, 0)
+
+_token_re = re.compile(r'\d+|[a-z]+')
+_constraint_re = re.compile(r'^(==|!=|<=|>=|<|>|=)?([^=<>!]+)$')
+
+
+def _version_key(version):
+    version = version.strip().lower().split('+')[0]
+    key = []
+    if '!' in version:
+        (epoch, version) = version.split('!', 1)
+        key.append((2, int(epoch)))
+    else:
+        key.append(_ZERO)
+    for component in re.split(r'[._-]', version):
+        tokens = _token_re.findall(component)
+        if len(tokens) > 0 and not tokens[0].isdigit():
+            key.append(_ZERO)
+        for token in tokens:
+            if token.isdigit():
+                key.append((2, int(token)))
+            elif token == 'dev':
+                key.append(_DEV)
+            elif token == 'post':
+                key.append(_POST)
+            else:
+                key.append((1, token))
+    return key
+
+
+def _padded(key, length):
+    return key + [_ZERO] * (length - len(key))
+
+
+def _compare(left, right):
+    length = max(len(left), len(right))
+    left = _padded(left, length)
+    right = _padded(right, length)
+    return (left > right) - (left < right)
+
+
+def _starts_with(version, prefix):
+    version_key = _version_key(version)
+    prefix_key = _version_key(prefix.rstrip('*').rstrip('.'))
+    return _padded(version_key, len(prefix_key))[:len(prefix_key)] == prefix_key
+
+
+def _matches_constraint(constraint, version):
+    match = _constraint_re.match(constraint)
+    if match is None:
+        raise ValueError("Can't understand version constraint '%s'" % constraint)
+    (operator, wanted) = match.groups()
+
+    if operator == '=' or ((operator is None or operator == '==') and wanted.endswith('*')):
+        return _starts_with(version, wanted)
+    elif operator == '!=' and wanted.endswith('*'):
+        return not _starts_with(version, wanted)
+
+    comparison = _compare(_version_key(version), _version_key(wanted))
+    if operator is None or operator == '==':
+        return comparison == 0
+    elif operator == '!=':
+        return comparison != 0
+    elif operator == '<':
+        return comparison < 0
+    elif operator == '<=':
+        return comparison <= 0
+    elif operator == '>':
+        return comparison > 0
+    else:
+        assert operator == '>='
+        return comparison >= 0
+
+
+def _matches_version_spec(version_spec, version):
+    # "|" means "or" and binds less tightly than "," which means "and"
+    for alternative in version_spec.split('|'):
+        if all(_matches_constraint(constraint, version) for constraint in alternative.split(',')):
+            return True
+    return False
+
+
+def package_matches(parsed_spec, version, build):
+    """Check whether an installed package satisfies a package spec.
+
+    Args:
+        parsed_spec (ParsedSpec): from ``conda_api.parse_spec``
+        version (str): the installed version
+        build (str): the installed build string
+
+    Returns:
+        True or False, or None if we don't understand the spec
+    """
+    try:
+        if parsed_spec.conda_constraint is not None:
+            # "=1.2" means any 1.2.x, while "=1.2=py35_0" means
+            # exactly version 1.2 with a matching build
+            pieces = parsed_spec.conda_constraint[1:].split('=')
+            if len(pieces) == 1:
+                return any(_starts_with(version, alternative) for alternative in pieces[0].split('|'))
+            else:
+                return _matches_version_spec(pieces[0], version) and fnmatch.fnmatchcase(build, pieces[1])
+        elif parsed_spec.pip_constraint is not None:
+            return _matches_version_spec(parsed_spec.pip_constraint, version)
+        else:
+            return True
+    except ValueError:
+        return None
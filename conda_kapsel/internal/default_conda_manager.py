@@ -5,32 +5,66 @@
 # The full license is in the file LICENSE.txt, distributed with this software.
 # ----------------------------------------------------------------------------
 """Abstract high-level interface to Conda."""
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
 
 import os
+import shutil
+import time
 
 from conda_kapsel.conda_manager import CondaManager, CondaEnvironmentDeviations, CondaManagerError
 import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.conda_lock as conda_lock
+import conda_kapsel.internal.conda_version as conda_version
+import conda_kapsel.internal.file_lock as file_lock
+import conda_kapsel.internal.package_cache as package_cache
 import conda_kapsel.internal.pip_api as pip_api
+import conda_kapsel.internal.project_cache as project_cache
+import conda_kapsel.internal.subprocess_runner as subprocess_runner
+
+# relative to the prefix; records that the environment matched an
+# env spec, so we don't have to look at every package again.
+_STAMP_FILENAME = ".kapsel-env-stamp.json"
+
+# an mtime this recent could change again without the mtime
+# changing, so a stamp doesn't vouch for it.
+_MTIME_GRANULARITY_SECONDS = 2
+
+
+def _log_warning(message):
+    # this goes wherever conda's own output is going, which during
+    # prepare is the provide result's logs
+    handler = subprocess_runner.current_line_handler()
+    if handler is not None:
+        handler(subprocess_runner.STDERR, message)
+
+
+def _mtime_or_none(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
 
 class DefaultCondaManager(CondaManager):
-    def _find_conda_missing(self, prefix, spec):
+    def _find_conda_deviations(self, prefix, spec):
         try:
-            installed = conda_api.installed(prefix)
+            installed = conda_api.installed_packages(prefix)
         except conda_api.CondaError as e:
             raise CondaManagerError("Conda failed while listing installed packages in %s: %s" % (prefix, str(e)))
 
-        # TODO: we don't verify that the environment contains the right versions
-        # https://github.com/Anaconda-Server/conda-kapsel/issues/77
-
         missing = set()
+        wrong_version = set()
 
-        for name in spec.conda_package_names_set:
-            if name not in installed:
-                missing.add(name)
+        for package_spec in spec.conda_packages:
+            parsed = conda_api.parse_spec(package_spec)
+            package = installed.get(parsed.name)
+            if package is None:
+                missing.add(parsed.name)
+            elif conda_version.package_matches(parsed, package.version, package.build) is False:
+                # if we don't understand the spec (None), we leave it to conda
+                wrong_version.add(parsed.name)
 
-        return sorted(list(missing))
+        return (sorted(list(missing)), sorted(list(wrong_version)))
 
     def _find_pip_missing(self, prefix, spec):
         # this is an important optimization to avoid a slow "pip
@@ -54,7 +88,46 @@ class DefaultCondaManager(CondaManager):
 
         return sorted(list(missing))
 
+    def _stamped_paths(self, prefix, spec):
+        # conda changes conda-meta when it changes anything, and pip
+        # changes site-packages
+        paths = [os.path.join(prefix, 'conda-meta')]
+        if len(spec.pip_packages) > 0:
+            paths.extend(pip_api._site_packages_dirs(prefix))
+        return paths
+
+    def _save_stamp(self, prefix, spec):
+        mtimes = [[path, _mtime_or_none(path)] for path in self._stamped_paths(prefix, spec)]
+        project_cache.save_cache(os.path.join(prefix, _STAMP_FILENAME),
+                                 dict(packages_hash=spec.packages_hash, mtimes=mtimes, saved=time.time()))
+
+    def _stamp_is_current(self, stamp, prefix, spec):
+        if not isinstance(stamp, dict) or stamp.get('packages_hash') != spec.packages_hash:
+            return False
+        mtimes = [[path, _mtime_or_none(path)] for path in self._stamped_paths(prefix, spec)]
+        if stamp.get('mtimes') != mtimes:
+            return False
+        # the stamp can't vouch for changes made in the same mtime tick as it was saved
+        saved = stamp.get('saved', 0)
+        return all(mtime is not None and (saved - mtime) > _MTIME_GRANULARITY_SECONDS for (path, mtime) in mtimes)
+
     def find_environment_deviations(self, prefix, spec):
+        # we only stamp environments we created, and the stamp says
+        # the full check below found nothing wrong
+        stamp = project_cache.load_cache(os.path.join(prefix, _STAMP_FILENAME))
+        if stamp is not None and self._stamp_is_current(stamp, prefix, spec):
+            return CondaEnvironmentDeviations(summary="OK",
+                                              missing_packages=(),
+                                              wrong_version_packages=(),
+                                              missing_pip_packages=(),
+                                              wrong_version_pip_packages=())
+
+        deviations = self._find_environment_deviations(prefix, spec)
+        if stamp is not None and deviations.ok:
+            self._save_stamp(prefix, spec)
+        return deviations
+
+    def _find_environment_deviations(self, prefix, spec):
         if not os.path.isdir(os.path.join(prefix, 'conda-meta')):
             return CondaEnvironmentDeviations(
                 summary="'%s' doesn't look like it contains a Conda environment yet." % (prefix),
@@ -64,14 +137,20 @@ class DefaultCondaManager(CondaManager):
                 wrong_version_pip_packages=(),
                 broken=True)
 
-        conda_missing = self._find_conda_missing(prefix, spec)
+        (conda_missing, conda_wrong_version) = self._find_conda_deviations(prefix, spec)
         pip_missing = self._find_pip_missing(prefix, spec)
 
+        problems = []
         if len(conda_missing) > 0 or len(pip_missing) > 0:
-            summary = "Conda environment is missing packages: %s" % (", ".join(conda_missing + pip_missing))
-            return CondaEnvironmentDeviations(summary=summary,
+            problems.append("Conda environment is missing packages: %s" % (", ".join(conda_missing + pip_missing)))
+        if len(conda_wrong_version) > 0:
+            problems.append("Conda environment has the wrong version of packages: %s" %
+                            (", ".join(conda_wrong_version)))
+
+        if len(problems) > 0:
+            return CondaEnvironmentDeviations(summary="; ".join(problems),
                                               missing_packages=conda_missing,
-                                              wrong_version_packages=(),
+                                              wrong_version_packages=conda_wrong_version,
                                               missing_pip_packages=pip_missing,
                                               wrong_version_pip_packages=())
         else:
@@ -81,34 +160,99 @@ class DefaultCondaManager(CondaManager):
                                               missing_pip_packages=(),
                                               wrong_version_pip_packages=())
 
+    def _lock_is_usable(self, spec):
+        return spec.lock_filename is not None and \
+            conda_lock.is_lock_current(spec.lock_filename, spec, conda_api.current_platform())
+
+    def _check_offline_packages(self, prefix, spec, plan):
+        # without the network, conda would only fail after timing
+        # out, so we look in the package caches first
+        if plan.create and self._lock_is_usable(spec):
+            try:
+                missing = package_cache.missing_tarballs_for_explicit(spec.lock_filename, conda_api.pkgs_dirs())
+            except (IOError, OSError) as e:
+                raise CondaManagerError("Failed to read %s: %s" % (spec.lock_filename, str(e)))
+        elif len(plan.conda_packages) > 0:
+            missing = package_cache.missing_packages_for_specs(plan.conda_packages, plan.channels,
+                                                               conda_api.pkgs_dirs(), conda_api.current_platform())
+        else:
+            return
+        if len(missing) > 0:
+            raise CondaManagerError("Offline mode is on, and the package cache doesn't have these packages "
+                                    "needed for %s: %s" % (prefix, ", ".join(missing)))
+
+    def _create_from_lock(self, prefix, spec):
+        if not self._lock_is_usable(spec):
+            return False
+        try:
+            conda_api.create_from_explicit(prefix=prefix, filename=spec.lock_filename)
+            return True
+        except conda_api.CondaError as e:
+            # the locked packages may no longer be downloadable; solving
+            # again still gets us an environment. We leave the lock alone
+            # since it's only replaced when someone refreshes it.
+            _log_warning("Failed to create environment from %s, solving for packages instead: %s" %
+                         (spec.lock_filename, str(e)))
+            shutil.rmtree(prefix, ignore_errors=True)
+            return False
+
+    def _update_lock(self, prefix, spec):
+        platform = conda_api.current_platform()
+        if spec.lock_filename is None or conda_lock.is_lock_current(spec.lock_filename, spec, platform):
+            return
+        try:
+            explicit = conda_api.list_explicit(prefix)
+        except conda_api.CondaError as e:
+            # the environment is fine, we just can't lock it
+            _log_warning("Failed to record package versions in %s: %s" % (spec.lock_filename, str(e)))
+            return
+        conda_lock.save_lock(spec.lock_filename, spec, platform, explicit)
+
     def fix_environment_deviations(self, prefix, spec, deviations=None):
-        if deviations is None:
-            deviations = self.find_environment_deviations(prefix, spec)
+        # another thread or process may be fixing the same prefix, in
+        # which case we look at the deviations again once it's done;
+        # a project env linked into the shared pool is the same prefix
+        # as the pool env, so we lock the real path
+        with file_lock.named_lock(os.path.realpath(prefix)):
+            if deviations is None:
+                deviations = self.find_environment_deviations(prefix, spec)
+            self._fix_environment_deviations(prefix, spec, deviations)
+
+    def _fix_environment_deviations(self, prefix, spec, deviations):
+        plan = self.plan_environment_fix(prefix, spec, deviations)
 
-        command_line_packages = set(['python']).union(set(spec.conda_packages))
+        if conda_api.offline_mode():
+            try:
+                self._check_offline_packages(prefix, spec, plan)
+            except conda_api.CondaError as e:
+                raise CondaManagerError("Failed to find the package cache: %s" % str(e))
 
-        if os.path.isdir(os.path.join(prefix, 'conda-meta')):
-            missing = deviations.missing_packages
-            if len(missing) > 0:
+        if plan.create:
+            # Create environment from scratch, from the lock file if
+            # we have one so conda doesn't have to solve anything
+            if not self._create_from_lock(prefix, spec):
                 try:
-                    # TODO we are ignoring package versions here
-                    # https://github.com/Anaconda-Server/conda-kapsel/issues/77
-                    conda_api.install(prefix=prefix, pkgs=list(missing), channels=spec.channels)
+                    conda_api.create(prefix=prefix, pkgs=list(plan.conda_packages), channels=plan.channels)
                 except conda_api.CondaError as e:
-                    raise CondaManagerError("Failed to install missing packages: " + ", ".join(missing))
-        else:
-            # Create environment from scratch
+                    raise CondaManagerError("Failed to create environment at %s: %s" % (prefix, str(e)))
+        elif len(plan.conda_packages) > 0:
             try:
-                conda_api.create(prefix=prefix, pkgs=list(command_line_packages), channels=spec.channels)
+                conda_api.install(prefix=prefix, pkgs=list(plan.conda_packages), channels=plan.channels)
             except conda_api.CondaError as e:
-                raise CondaManagerError("Failed to create environment at %s: %s" % (prefix, str(e)))
+                raise CondaManagerError("Failed to install missing packages: " + ", ".join(plan.conda_packages))
 
-        # now add pip if needed
-        if len(deviations.missing_pip_packages) > 0:
+        # this is cheap once the lock is current, and it records
+        # environments made before we had a lock file
+        self._update_lock(prefix, spec)
+
+        if len(plan.pip_packages) > 0:
             try:
-                pip_api.install(prefix=prefix, pkgs=list(deviations.missing_pip_packages))
+                pip_api.install(prefix=prefix, pkgs=list(plan.pip_packages))
             except pip_api.PipError as e:
-                raise CondaManagerError("Failed to install missing pip packages: " + ", ".join(missing))
+                raise CondaManagerError("Failed to install missing pip packages: " + ", ".join(plan.pip_packages))
+
+        if not deviations.ok:
+            self._save_stamp(prefix, spec)
 
     def remove_packages(self, prefix, packages):
         try:
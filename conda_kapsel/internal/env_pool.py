@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""A pool of conda environments shared by projects with identical env specs.
+
+Pool environments are named by a hash of the env spec's channels
+and packages, so any project needing the same packages can use
+them. A project's ``envs/<name>`` is a symlink into the pool, and
+each symlink is recorded in a ``<hash>.users`` directory next to
+the environment, so we know when the last project stops using it.
+Projects in other processes attach and release at the same time,
+so the links and records for an environment are only changed while
+holding the ``<hash>.lock`` file next to it.
+"""
+from __future__ import absolute_import
+
+import codecs
+import errno
+import hashlib
+import json
+import os
+import platform
+import shutil
+
+from conda_kapsel.internal.file_lock import FileLock
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+
+# set this to a directory to share environments among projects
+POOL_DIRECTORY_VARIABLE = 'CONDA_KAPSEL_ENV_POOL'
+
+_USERS_SUFFIX = ".users"
+_LOCK_SUFFIX = ".lock"
+
+
+def pool_directory(environ):
+    """Get the configured pool directory, or None if environments aren't shared."""
+    directory = environ.get(POOL_DIRECTORY_VARIABLE, '')
+    if directory == '':
+        return None
+    return os.path.abspath(os.path.expanduser(directory))
+
+
+def _normalized_specs(specs):
+    # whitespace and order don't change which packages we get
+    return sorted(set(" ".join(spec.split()) for spec in specs))
+
+
+def env_spec_key(spec):
+    """Get the hash naming the pool environment for an env spec."""
+    # channel order is a priority order, so we keep it
+    content = json.dumps(dict(channels=list(spec.channels),
+                              conda_packages=_normalized_specs(spec.conda_packages),
+                              pip_packages=_normalized_specs(spec.pip_packages)),
+                         sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def pool_prefix(pool, spec):
+    """Get the prefix of the pool environment for an env spec."""
+    return os.path.join(pool, env_spec_key(spec))
+
+
+def _users_directory(shared_prefix):
+    return shared_prefix + _USERS_SUFFIX
+
+
+def _lock(shared_prefix):
+    return FileLock(shared_prefix + _LOCK_SUFFIX)
+
+
+def _user_record(shared_prefix, link_path):
+    name = hashlib.sha1(os.path.abspath(link_path).encode('utf-8')).hexdigest()
+    return os.path.join(_users_directory(shared_prefix), name)
+
+
+def shared_prefix_for_link(link_path):
+    """Get the pool environment a project env links to, or None if it isn't a link into a pool."""
+    if not os.path.islink(link_path):
+        return None
+    target = os.readlink(link_path)
+    if not os.path.isabs(target):
+        target = os.path.join(os.path.dirname(link_path), target)
+    target = os.path.normpath(target)
+    if not os.path.isdir(_users_directory(target)):
+        return None
+    return target
+
+
+def users(shared_prefix):
+    """Get the project env paths which still link to a pool environment.
+
+    Records for links that were deleted or changed without telling
+    us (say, a project directory was removed) don't count.
+    """
+    directory = _users_directory(shared_prefix)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    result = []
+    for name in names:
+        try:
+            with codecs.open(os.path.join(directory, name), 'r', 'utf-8') as f:
+                link_path = f.read()
+        except (IOError, OSError):
+            continue
+        if shared_prefix_for_link(link_path) == shared_prefix:
+            result.append(link_path)
+    return sorted(result)
+
+
+def _symlink(target, link_path):
+    # Python 2 has no os.symlink on Windows, and on newer Windows
+    # making one needs a privilege most users don't have; some
+    # filesystems can't hold them at all.
+    symlink = getattr(os, 'symlink', None)
+    if symlink is None:
+        return False  # pragma: no cover (py2 on Windows only)
+    try:
+        symlink(target, link_path)
+    except NotImplementedError:  # pragma: no cover (py2 on Windows only)
+        return False  # pragma: no cover (py2 on Windows only)
+    except OSError as e:
+        if platform.system() == 'Windows' or e.errno in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS):
+            return False
+        raise
+    return True
+
+
+_symlinks_supported_in = dict()
+
+
+def symlinks_supported(pool):
+    """Check whether we can link to environments in the pool directory.
+
+    If we can't, projects should have their own unshared
+    environments instead. The answer is remembered for each pool.
+    """
+    if pool not in _symlinks_supported_in:
+        makedirs_ok_if_exists(pool)
+        probe = os.path.join(pool, ".symlink-probe-%d" % os.getpid())
+        if os.path.lexists(probe):
+            os.remove(probe)
+        supported = _symlink(pool, probe)
+        if supported:
+            os.remove(probe)
+        _symlinks_supported_in[pool] = supported
+    return _symlinks_supported_in[pool]
+
+
+def attach(shared_prefix, link_path, prepare=None):
+    """Make a project env path link to a pool environment.
+
+    ``prepare`` is for creating or fixing the pool environment.
+    It's called holding the same lock as ``release()``, so the
+    last other user can't delete the environment between
+    ``prepare`` and our link being recorded.
+
+    Args:
+        shared_prefix (str): the pool environment
+        link_path (str): the project env path to link
+        prepare (function): called with no arguments before linking, or None
+
+    Returns:
+        False if this system can't make the link, True if we made it
+
+    Raises:
+        OSError or IOError if we can't record the link or create it,
+        or whatever ``prepare`` raises
+    """
+    with _lock(shared_prefix):
+        if prepare is not None:
+            prepare()
+        makedirs_ok_if_exists(_users_directory(shared_prefix))
+        record = _user_record(shared_prefix, link_path)
+        with codecs.open(record, 'w', 'utf-8') as f:
+            f.write(os.path.abspath(link_path))
+
+        # a link left dangling by a removed pool environment
+        if os.path.islink(link_path):
+            os.remove(link_path)
+        makedirs_ok_if_exists(os.path.dirname(link_path))
+        if not _symlink(shared_prefix, link_path):
+            os.remove(record)
+            return False
+    return True
+
+
+def release(link_path):
+    """Remove a project's link to a pool environment, deleting the environment if nobody else uses it.
+
+    Returns:
+        True if the pool environment was deleted
+
+    Raises:
+        OSError or IOError if we can't remove things
+    """
+    shared_prefix = shared_prefix_for_link(link_path)
+    assert shared_prefix is not None
+
+    # someone attaching while we decide to delete would be left
+    # with a link to nothing
+    with _lock(shared_prefix):
+        os.remove(link_path)
+        record = _user_record(shared_prefix, link_path)
+        if os.path.exists(record):
+            os.remove(record)
+
+        if len(users(shared_prefix)) > 0:
+            return False
+
+        if os.path.isdir(shared_prefix):
+            shutil.rmtree(shared_prefix)
+        shutil.rmtree(_users_directory(shared_prefix))
+    return True
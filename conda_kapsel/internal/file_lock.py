@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Exclusive locks on files, held against other threads and other processes."""
+from __future__ import absolute_import
+
+import hashlib
+import os
+import platform
+import time
+
+from conda_kapsel.internal import project_cache
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+
+if platform.system() == 'Windows':  # pragma: no cover (no Windows in the coverage run)
+    import msvcrt
+
+    def _lock(f):
+        # LK_LOCK gives up after 10 seconds, so keep trying
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except (IOError, OSError):
+                time.sleep(0.1)
+
+    def _unlock(f):
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    # flock() locks belong to the open file, so two threads opening
+    # the file separately also exclude each other.
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock(object):
+    """Context manager holding an exclusive lock on a file.
+
+    The file is created if needed and left in place afterward.
+    """
+
+    def __init__(self, filename):
+        """Create a lock on the given file; it isn't locked until entered."""
+        self._filename = filename
+        self._file = None
+
+    @property
+    def filename(self):
+        """Get the lock file's name."""
+        return self._filename
+
+    def __enter__(self):
+        """Block until we have the lock."""
+        makedirs_ok_if_exists(os.path.dirname(self._filename))
+        self._file = open(self._filename, 'a')
+        try:
+            _lock(self._file)
+        except Exception:
+            self._file.close()
+            self._file = None
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release the lock."""
+        try:
+            _unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+# this function exists so we can monkeypatch it in tests
+def _lock_directory():
+    return os.path.join(project_cache.user_cache_directory(), 'locks')
+
+
+def named_lock(name):
+    """Get a ``FileLock`` on a name shared by every conda-kapsel process run by this user.
+
+    Args:
+        name (str): any string, such as a path the lock protects
+
+    Returns:
+        a ``FileLock``
+    """
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return FileLock(os.path.join(_lock_directory(), digest + ".lock"))
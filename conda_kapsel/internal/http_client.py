@@ -11,9 +11,11 @@ from tornado import gen
 
 import conda_kapsel.internal.makedirs as makedirs
 import conda_kapsel.internal.rename as rename
+from conda_kapsel.internal import timing
 
 import os
 import hashlib
+import time
 
 
 class FileDownloader(object):
@@ -72,7 +74,14 @@ class FileDownloader(object):
             except EnvironmentError:
                 pass
 
+        details = dict(url=self._url, filename=self._filename, bytes=0)
+        started = time.time()
+
         def writer(chunk):
+            if 'first_byte_seconds' not in details:
+                details['first_byte_seconds'] = time.time() - started
+            details['bytes'] += len(chunk)
+
             if len(self._errors) > 0:
                 return
 
@@ -93,7 +102,8 @@ class FileDownloader(object):
                                              streaming_callback=writer,
                                              request_timeout=timeout_in_seconds)
             try:
-                response = yield self._client.fetch(request, request_timeout=timeout_in_seconds)
+                with timing.timed(timing.TIMING_KIND_DOWNLOAD, "Download " + self._url, details):
+                    response = yield self._client.fetch(request, request_timeout=timeout_in_seconds)
             except Exception as e:
                 self._errors.append("Failed download to %s: %s" % (self._filename, str(e)))
                 raise gen.Return(None)
@@ -8,6 +8,7 @@
 from __future__ import absolute_import, print_function
 
 import sys
+import threading
 
 try:
     from urllib.parse import quote_plus
@@ -59,11 +60,29 @@ def fallback_data():
     return _fake_in_memory_keyring
 
 
-try:
-    import keyring
-except ImportError:  # pragma: no cover
-    keyring = None  # pragma: no cover
-    _onetime_keyring_complain_and_disable("Module 'keyring' not available, try installing the 'keyring' package.")
+# the keyring module is slow to import and most commands never
+# touch a password, so we import it the first time it's needed.
+keyring = None
+_keyring_imported = False
+_keyring_import_lock = threading.Lock()
+
+
+def _import_keyring():
+    global keyring
+    global _keyring_imported
+    # requirements are checked on several threads, so another
+    # thread may be importing right now; it must finish before
+    # we look at the module.
+    with _keyring_import_lock:
+        if not _keyring_imported:
+            try:
+                import keyring
+            except ImportError:  # pragma: no cover
+                keyring = None  # pragma: no cover
+                _onetime_keyring_complain_and_disable(  # pragma: no cover
+                    "Module 'keyring' not available, try installing the 'keyring' package.")
+            _keyring_imported = True
+    return keyring
 
 
 def _make_username(env_prefix, variable):
@@ -75,7 +94,7 @@ def _make_username(env_prefix, variable):
 
 def get(env_prefix, variable):
     name = _make_username(env_prefix, variable)
-    if not _use_fallback_keyring():
+    if not _use_fallback_keyring() and _import_keyring() is not None:
         try:
             got = keyring.get_password("anaconda", name)
             return got
@@ -92,7 +111,7 @@ def set(env_prefix, variable, value):
     assert value is not None
 
     name = _make_username(env_prefix, variable)
-    if not _use_fallback_keyring():
+    if not _use_fallback_keyring() and _import_keyring() is not None:
         try:
             keyring.set_password("anaconda", name, value)
             return
@@ -107,7 +126,7 @@ def set(env_prefix, variable, value):
 
 def unset(env_prefix, variable):
     name = _make_username(env_prefix, variable)
-    if not _use_fallback_keyring():
+    if not _use_fallback_keyring() and _import_keyring() is not None:
         try:
             keyring.delete_password("anaconda", name)
             return
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Find out whether conda could install packages without the network."""
+from __future__ import absolute_import
+
+import codecs
+import os
+import platform
+
+import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.conda_version as conda_version
+from conda_kapsel.plugins.network_util import urlparse
+
+_TARBALL_EXTENSION = ".tar.bz2"
+
+
+def _file_url_to_path(url):
+    path = urlparse.unquote(urlparse.urlsplit(url).path)
+    if platform.system() == 'Windows' and len(path) > 2 and path[0] == '/' and path[2] == ':':
+        path = path[1:]  # pragma: no cover (no Windows in the coverage run)
+    return path
+
+
+def _local_channel_dirs(channels, conda_platform):
+    # packages in a file:// channel can be installed offline too
+    dirs = []
+    for channel in channels:
+        if channel.startswith("file://"):
+            channel_dir = _file_url_to_path(channel)
+            dirs.append(os.path.join(channel_dir, conda_platform))
+            dirs.append(os.path.join(channel_dir, 'noarch'))
+    return dirs
+
+
+def _listdir_or_empty(directory):
+    try:
+        return os.listdir(directory)
+    except OSError:
+        return []
+
+
+def _cached_dists(directories):
+    """Get the set of ``name-version-build`` dists in the given package dirs."""
+    dists = set()
+    for directory in directories:
+        for entry in _listdir_or_empty(directory):
+            if entry.endswith(_TARBALL_EXTENSION):
+                dists.add(entry[:-len(_TARBALL_EXTENSION)])
+            elif os.path.isdir(os.path.join(directory, entry, 'info')):
+                # an extracted package
+                dists.add(entry)
+    return dists
+
+
+def missing_packages_for_specs(specs, channels, pkgs_dirs, conda_platform):
+    """Get the package specs that no cached package satisfies.
+
+    Only the packages named in the specs are checked, not their
+    dependencies, which would take a solve; conda's ``--offline``
+    mode catches anything we miss.
+
+    Args:
+        specs (iterable of str): conda package specs
+        channels (iterable of str): channels, of which only file:// ones are searched
+        pkgs_dirs (list of str): conda package cache directories
+        conda_platform (str): platform such as "linux-64"
+
+    Returns:
+        list of specs with nothing in the cache
+    """
+    dists = _cached_dists(list(pkgs_dirs) + _local_channel_dirs(channels, conda_platform))
+    by_name = dict()
+    for dist in dists:
+        pieces = dist.rsplit('-', 2)
+        if len(pieces) == 3:
+            by_name.setdefault(pieces[0].lower(), []).append((pieces[1], pieces[2]))
+
+    missing = []
+    for spec in specs:
+        parsed = conda_api.parse_spec(spec)
+        if parsed is None:
+            # conda will complain about it
+            continue
+        candidates = by_name.get(parsed.name, [])
+        # a spec we don't understand (None) might be satisfied
+        if not any(conda_version.package_matches(parsed, version, build) is not False
+                   for (version, build) in candidates):
+            missing.append(spec)
+    return missing
+
+
+def missing_tarballs_for_explicit(filename, pkgs_dirs):
+    """Get the tarballs in an explicit package list that aren't cached locally.
+
+    Args:
+        filename (str): file in ``conda list --explicit`` format
+        pkgs_dirs (list of str): conda package cache directories
+
+    Returns:
+        list of tarball names that aren't in any pkgs dir or local file:// location
+
+    Raises:
+        IOError or OSError if the file can't be read
+    """
+    dists = _cached_dists(pkgs_dirs)
+    missing = []
+    with codecs.open(filename, 'r', 'utf-8') as f:
+        for line in f:
+            url = line.strip()
+            if url == '' or url.startswith('#') or url.startswith('@'):
+                continue
+            url = url.split('#')[0]
+            tarball = url.rsplit('/', 1)[-1]
+            if tarball.endswith(_TARBALL_EXTENSION) and tarball[:-len(_TARBALL_EXTENSION)] in dists:
+                continue
+            if url.startswith("file://") and os.path.isfile(_file_url_to_path(url)):
+                continue
+            missing.append(tarball)
+    return missing
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Run blocking functions on a bounded set of threads."""
+from __future__ import absolute_import
+
+import sys
+import threading
+
+from conda_kapsel.internal import subprocess_runner, timing
+
+# Most of what we run in parallel is waiting on subprocesses,
+# sockets, or the filesystem rather than the CPU, so this isn't
+# tied to the number of CPUs.
+DEFAULT_MAX_WORKERS = 8
+
+
+def parallel_map(func, items, max_workers=None):
+    """Call ``func`` on each item using up to ``max_workers`` threads.
+
+    The results are returned in the same order as ``items``,
+    regardless of the order the calls finish in. If any call
+    raises an exception, the remaining calls still run to
+    completion and then the exception from the earliest item is
+    re-raised. If waiting is interrupted by ``KeyboardInterrupt``,
+    the caller's ``subprocess_runner.Cancellation`` (if any) is
+    cancelled and the calls are waited for before it propagates.
+
+    The calls record into the caller's current ``timing.Timings``,
+    if any, and subprocesses they run use the caller's
+    ``subprocess_runner`` line handler and cancellation.
+
+    Args:
+        func (function): takes one item and returns a result
+        items (iterable): the items
+        max_workers (int): maximum number of threads, None for ``DEFAULT_MAX_WORKERS``
+
+    Returns:
+        list of results
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    max_workers = min(max_workers, len(items))
+
+    if max_workers <= 1:
+        # no point paying for a thread
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    lock = threading.Lock()
+    remaining = iter(range(len(items)))
+    timings = timing.current()
+    line_handler = subprocess_runner.current_line_handler()
+    cancellation = subprocess_runner.current_cancellation()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(remaining, None)
+            if index is None:
+                return
+            try:
+                with timing.recording(timings), subprocess_runner.lines_to(line_handler), \
+                        subprocess_runner.cancelled_by(cancellation):
+                    results[index] = func(items[index])
+            except Exception:
+                errors[index] = sys.exc_info()
+
+    threads = [threading.Thread(target=worker) for i in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # stop the subprocesses the workers are waiting on, rather
+        # than exiting with them still running
+        if cancellation is not None:
+            cancellation.cancel()
+            for thread in threads:
+                thread.join()
+        raise
+
+    for error in errors:
+        if error is not None:
+            (exc_type, exc_value, exc_traceback) = error
+            raise exc_value
+
+    return results
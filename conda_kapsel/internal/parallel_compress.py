@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Compress data on several threads at once."""
+from __future__ import absolute_import
+
+import multiprocessing
+import struct
+import sys
+import time
+import zlib
+
+from conda_kapsel.internal import parallel
+
+# the same block size pigz uses by default
+DEFAULT_BLOCK_SIZE = 128 * 1024
+
+# each block is compressed with the end of the previous block as
+# its dictionary, so it compresses about as well as one stream.
+_DICTIONARY_SIZE = 32 * 1024
+
+# zlib only takes a preset dictionary for compression on py3
+_HAS_ZDICT = sys.version_info >= (3, 3)
+
+# how many blocks per worker we collect before compressing
+_BLOCKS_PER_WORKER = 4
+
+
+def default_workers():
+    """Get the number of compression threads to use when none is given.
+
+    Compression is CPU-bound (zlib lets go of the GIL while it
+    works), so this is the number of CPUs.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:  # pragma: no cover (we don't test on platforms without it)
+        return 1
+
+
+def deflate(data, level, dictionary=None, last=True):
+    """Compress bytes to a raw deflate stream, as in a .zip member or a gzip file.
+
+    Args:
+        data (bytes): what to compress
+        level (int): zlib compression level
+        dictionary (bytes): data that came right before this, or None
+        last (bool): False if more deflate data will be appended after this
+
+    Returns:
+        compressed bytes
+    """
+    if dictionary and _HAS_ZDICT:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                      zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data)
+    if last:
+        return compressed + compressor.flush(zlib.Z_FINISH)
+    else:
+        # a sync flush ends on a byte boundary without ending the
+        # stream, so the next block's data can simply follow it.
+        return compressed + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipFile(object):
+    """A write-only gzip file which compresses blocks of data on several threads.
+
+    Like pigz, data is cut into blocks that are compressed on
+    their own and written one after another as a single ordinary
+    gzip stream, which gzip, tarfile, and friends can read.
+    """
+
+    def __init__(self, fileobj, level=9, workers=None, block_size=DEFAULT_BLOCK_SIZE, mtime=None):
+        """Construct a ParallelGzipFile and write the gzip header.
+
+        Args:
+            fileobj (file): where to write the compressed data; it isn't closed for you
+            level (int): zlib compression level
+            workers (int): how many threads to use, None for ``default_workers()``
+            block_size (int): how much uncompressed data goes in each block
+            mtime (int): time to put in the header, None for now
+        """
+        if workers is None:
+            workers = default_workers()
+        self._fileobj = fileobj
+        self._level = level
+        self._workers = max(workers, 1)
+        self._block_size = block_size
+        self._pending = []
+        self._pending_size = 0
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+        self._closed = False
+
+        if mtime is None:
+            mtime = int(time.time())
+        if level == 9:
+            extra_flags = 2
+        elif level == 1:
+            extra_flags = 4
+        else:
+            extra_flags = 0
+        # magic, deflate, no flags, mtime, extra flags, unknown OS
+        self._fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<L', mtime & 0xffffffff) +
+                            struct.pack('<BB', extra_flags, 255))
+
+    def _compress_pending(self, last):
+        data = b''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+
+        blocks = []
+        start = 0
+        while start < len(data) or (last and start == 0):
+            block = data[start:start + self._block_size]
+            start += len(block)
+            blocks.append((block, self._dictionary, last and start >= len(data)))
+            self._dictionary = (self._dictionary + block)[-_DICTIONARY_SIZE:]
+            if len(block) == 0:
+                break
+
+        def compress(block):
+            (block_data, dictionary, block_is_last) = block
+            return deflate(block_data, self._level, dictionary=dictionary, last=block_is_last)
+
+        for compressed in parallel.parallel_map(compress, blocks, max_workers=self._workers):
+            self._fileobj.write(compressed)
+
+    def write(self, data):
+        """Add data to the file."""
+        assert not self._closed
+        if len(data) == 0:
+            return
+        data = bytes(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self._block_size * self._workers * _BLOCKS_PER_WORKER:
+            self._compress_pending(last=False)
+
+    def close(self):
+        """Compress whatever is left and write the gzip trailer."""
+        if self._closed:
+            return
+        self._closed = True
+        self._compress_pending(last=True)
+        self._fileobj.write(struct.pack('<LL', self._crc & 0xffffffff, self._size & 0xffffffff))
+
+    def __enter__(self):
+        """Allow ``with`` statements."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the file, unless an exception is on its way."""
+        if exc_type is None:
+            self.close()
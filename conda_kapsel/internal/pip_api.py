@@ -6,11 +6,15 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import codecs
 import collections
-import subprocess
 import os
 import re
 import sys
+import threading
+import time
+
+from conda_kapsel.internal import subprocess_runner, timing
 
 
 class PipError(Exception):
@@ -38,21 +42,32 @@ def _get_pip_command(prefix, extra_args):
     return cmd_list
 
 
-def _call_pip(prefix, extra_args):
+def _call_pip(prefix, extra_args, stream_output=False, timeout=None):
     cmd_list = _get_pip_command(prefix, extra_args)
 
-    try:
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError as e:
-        raise PipError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
-    (out, err) = p.communicate()
-    errstr = err.decode().strip()
-    if p.returncode != 0:
+    with timing.timed(timing.TIMING_KIND_SUBPROCESS, " ".join(["pip"] + list(extra_args[:1])),
+                      dict(argv=cmd_list)) as details:
+        try:
+            result = subprocess_runner.run(cmd_list, stream_output=stream_output, timeout=timeout)
+        except OSError as e:
+            raise PipError("failed to run: %r: %r" % (" ".join(cmd_list), repr(e)))
+        details['returncode'] = result.returncode
+        if result.timed_out:
+            details['timed_out'] = True
+        if result.cancelled:
+            details['cancelled'] = True
+    errstr = result.stderr.decode().strip()
+    if result.cancelled:
+        raise PipError('%s: cancelled' % " ".join(cmd_list))
+    elif result.timed_out:
+        raise PipError('%s: timed out after %s seconds' % (" ".join(cmd_list), timeout))
+    elif result.returncode != 0:
         raise PipError('%s: %s' % (" ".join(cmd_list), errstr))
-    elif errstr != '':
+    elif errstr != '' and not (stream_output and subprocess_runner.current_line_handler() is not None):
+        # nobody saw these lines as they were written
         for line in errstr.split("\n"):
             print("%s %s: %s" % (cmd_list[0], cmd_list[1], line), file=sys.stderr)
-    return out
+    return result.stdout
 
 
 def install(prefix, pkgs=None):
@@ -65,7 +80,7 @@ def install(prefix, pkgs=None):
     args = ['install', '--quiet', '--no-deps']
     args.extend(pkgs)
 
-    return _call_pip(prefix, extra_args=args)
+    return _call_pip(prefix, extra_args=args, stream_output=True)
 
 
 def remove(prefix, pkgs=None):
@@ -75,13 +90,10 @@ def remove(prefix, pkgs=None):
 
     args = ['uninstall', '--quiet', '--yes']
     args.extend(pkgs)
-    return _call_pip(prefix, extra_args=args)
+    return _call_pip(prefix, extra_args=args, stream_output=True)
 
 
-def installed(prefix):
-    """Get a dict of package names to (name, version) tuples."""
-    if not os.path.isdir(prefix):
-        return dict()
+def _installed_from_pip_list(prefix):
     try:
         out = _call_pip(prefix, extra_args=['list']).decode('utf-8')
         # on Windows, $ in a regex doesn't match \r\n, we need to get rid of \r
@@ -92,13 +104,164 @@ def installed(prefix):
     #   ympy (0.7.6.1)
     #   tables (3.2.2)
     #   terminado (0.5)
-    line_re = re.compile("^ *([^ ]+) *\(([^)]+)\)$", flags=re.MULTILINE)
+    line_re = re.compile(r"^ *([^ ]+) *\(([^)]+)\)$", flags=re.MULTILINE)
     result = dict()
     for match in line_re.finditer(out):
         result[match.group(1)] = (match.group(1), match.group(2))
     return result
 
 
+def _site_packages_dirs(prefix):
+    candidates = [os.path.join(prefix, 'Lib', 'site-packages')]
+    lib = os.path.join(prefix, 'lib')
+    if os.path.isdir(lib):
+        for name in sorted(os.listdir(lib)):
+            if name.startswith('python'):
+                candidates.append(os.path.join(lib, name, 'site-packages'))
+    return [candidate for candidate in candidates if os.path.isdir(candidate)]
+
+
+def _read_name_and_version(metadata_filename):
+    name = None
+    version = None
+    with codecs.open(metadata_filename, 'r', 'utf-8', errors='replace') as f:
+        for line in f:
+            # the headers end at the first blank line
+            if line.strip() == '':
+                break
+            if line.startswith('Name:'):
+                name = line[len('Name:'):].strip()
+            elif line.startswith('Version:'):
+                version = line[len('Version:'):].strip()
+    return (name, version)
+
+
+def _metadata_filename(site_packages, entry):
+    path = os.path.join(site_packages, entry)
+    if entry.endswith('.dist-info'):
+        return os.path.join(path, 'METADATA')
+    elif entry.endswith('.egg-info'):
+        if os.path.isdir(path):
+            return os.path.join(path, 'PKG-INFO')
+        else:
+            return path
+    elif entry.endswith('.egg'):
+        return os.path.join(path, 'EGG-INFO', 'PKG-INFO')
+    elif entry.endswith('.egg-link'):
+        return _egg_link_metadata_filename(site_packages, entry)
+    return None
+
+
+def _egg_link_metadata_filename(site_packages, entry):
+    # "pip install -e" leaves a link whose first line is the directory
+    # with the egg-info (often the source tree, or its "src"), and
+    # whose second line is the path from there to setup.py
+    with codecs.open(os.path.join(site_packages, entry), 'r', 'utf-8') as f:
+        lines = [line.strip() for line in f.readlines()]
+    if len(lines) == 0 or lines[0] == '':
+        return None
+    egg_base = os.path.realpath(os.path.join(site_packages, lines[0]))
+    candidates = [egg_base]
+    if len(lines) > 1 and lines[1] != '':
+        setup_dir = os.path.normpath(os.path.join(egg_base, lines[1]))
+        candidates.extend([setup_dir, os.path.join(setup_dir, 'src')])
+
+    # "My-Project.egg-link" goes with "My_Project.egg-info" or
+    # "My_Project-1.0.egg-info"
+    project = entry[:-len('.egg-link')].replace('-', '_').lower()
+    for directory in candidates:
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.endswith('.egg-info'))
+        except OSError:
+            continue
+        if len(names) == 0:
+            continue
+        # a source tree can hold several projects' egg-info
+        matching = [name for name in names if name[:-len('.egg-info')].split('-')[0].lower() == project]
+        if len(matching) > 0:
+            names = matching
+        egg_info = os.path.join(directory, names[0])
+        if os.path.isdir(egg_info):
+            return os.path.join(egg_info, 'PKG-INFO')
+        else:
+            return egg_info
+    return None
+
+
+def _scan_site_packages(site_packages):
+    result = dict()
+    for entry in os.listdir(site_packages):
+        try:
+            metadata_filename = _metadata_filename(site_packages, entry)
+            if metadata_filename is None:
+                continue
+            (name, version) = _read_name_and_version(metadata_filename)
+        except (IOError, OSError):
+            (name, version) = (None, None)
+        if name is None or version is None:
+            # "name-version.dist-info", "name-version-py3.5.egg-info"
+            pieces = entry.rsplit('.', 1)[0].split('-')
+            if len(pieces) < 2 or entry.endswith('.egg-link'):
+                continue
+            (name, version) = (pieces[0], pieces[1])
+        result[name] = (name, version)
+    return result
+
+
+# site-packages directory -> (mtime, dict of name -> (name, version))
+_site_packages_index = dict()
+_site_packages_index_lock = threading.Lock()
+
+# installing or removing a package adds or removes a metadata
+# directory, changing the site-packages mtime; but an mtime this
+# recent could change again without the mtime changing.
+_MTIME_GRANULARITY_SECONDS = 2
+
+
+def _installed_from_site_packages(site_packages):
+    mtime = os.stat(site_packages).st_mtime
+    with _site_packages_index_lock:
+        cached = _site_packages_index.get(site_packages)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    result = _scan_site_packages(site_packages)
+
+    if (time.time() - mtime) > _MTIME_GRANULARITY_SECONDS:
+        with _site_packages_index_lock:
+            _site_packages_index[site_packages] = (mtime, result)
+
+    return result
+
+
+def installed(prefix):
+    """Get a dict of package names to (name, version) tuples.
+
+    The package metadata in the environment's site-packages is read
+    in-process, and cached until site-packages is modified. If we
+    can't find or read site-packages, we fall back to ``pip list``.
+    """
+    if not os.path.isdir(prefix):
+        return dict()
+
+    try:
+        _get_pip_command(prefix, extra_args=[])
+    except PipNotInstalledError:
+        return dict()  # if pip isn't installed, there are no pip packages
+
+    try:
+        site_packages_dirs = _site_packages_dirs(prefix)
+        if len(site_packages_dirs) > 0:
+            result = dict()
+            for site_packages in site_packages_dirs:
+                result.update(_installed_from_site_packages(site_packages))
+            return result
+    except (IOError, OSError):
+        pass
+
+    return _installed_from_pip_list(prefix)
+
+
 ParsedPipSpec = collections.namedtuple('ParsedPipSpec', ['name'])
 
 _spec_pat = re.compile(' *([a-zA-Z0-9][-_.a-zA-Z0-9]+)')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Persistent JSON caches stored in the project directory or the user's cache directory."""
+from __future__ import absolute_import, print_function
+
+import codecs
+import json
+import os
+import platform
+import uuid
+
+from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
+from conda_kapsel.internal.rename import rename_over_existing
+
+# relative to the project directory; the archiver never
+# includes this directory in archives.
+CACHE_DIRECTORY = ".kapsel-cache"
+
+# bump this when the format of any cache file changes
+# incompatibly, so we ignore caches written by other
+# versions.
+_CACHE_FORMAT_VERSION = 1
+
+
+def cache_filename(project_directory, name):
+    """Get the full path of the named cache file for a project."""
+    return os.path.join(project_directory, CACHE_DIRECTORY, name + ".json")
+
+
+def user_cache_directory():
+    """Get the directory for caches that aren't specific to one project."""
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        return os.path.join(base, 'conda-kapsel', 'Cache')
+    elif platform.system() == 'Darwin':
+        return os.path.expanduser(os.path.join('~', 'Library', 'Caches', 'conda-kapsel'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache')))
+        return os.path.join(base, 'conda-kapsel')
+
+
+def user_cache_filename(name):
+    """Get the full path of the named cache file in the user's cache directory."""
+    return os.path.join(user_cache_directory(), name + ".json")
+
+
+def load_cache(filename):
+    """Load a cache file, returning None if it's missing, unreadable, or from another version."""
+    try:
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if not isinstance(data, dict) or data.get('version', None) != _CACHE_FORMAT_VERSION:
+        return None
+
+    return data.get('content', None)
+
+
+def save_cache(filename, content):
+    """Atomically save a JSON-compatible value to a cache file.
+
+    Caches are an optimization, so failing to write one is not an
+    error; we return False and the cache will be recomputed next
+    time.
+    """
+    try:
+        serialized = json.dumps(dict(version=_CACHE_FORMAT_VERSION, content=content))
+    except (TypeError, ValueError):
+        # values from YAML files can be things like dates,
+        # which we just don't cache.
+        return False
+
+    # JSON turns tuples into lists, non-string keys into strings,
+    # and so on; only cache things that will load back unchanged.
+    if json.loads(serialized)['content'] != content:
+        return False
+
+    tmp = filename + ".tmp-" + str(uuid.uuid4())
+    try:
+        makedirs_ok_if_exists(os.path.dirname(filename))
+        with codecs.open(tmp, 'w', 'utf-8') as f:
+            f.write(serialized)
+        rename_over_existing(tmp, filename)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        try:
+            os.remove(tmp)
+        except (IOError, OSError):
+            pass
@@ -6,6 +6,7 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import os
 import platform
 import sys
 
@@ -34,3 +35,34 @@ def env_without_unicode(environ):
         return environ_copy
     else:  # pragma: no cover (py2/py3)
         return environ
+
+
+class _ListdirEntry(object):
+    # just enough of os.DirEntry for py2, where there's no os.scandir
+    __slots__ = ('name', 'path')
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.stat(self.path)
+        else:
+            return os.lstat(self.path)
+
+
+def _listdir_scandir(directory):
+    return [_ListdirEntry(directory, name) for name in os.listdir(directory)]
+
+
+if hasattr(os, 'scandir'):  # pragma: no cover (py2/py3)
+    scandir = os.scandir
+else:  # pragma: no cover (py2/py3)
+    scandir = _listdir_scandir
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Run subprocesses, streaming their output a line at a time."""
+from __future__ import absolute_import
+
+import contextlib
+import subprocess
+import threading
+import time
+
+# how often we check for cancellation and timeouts
+_POLL_SECONDS = 0.1
+
+# how long a process has to exit after SIGTERM before we kill it
+_TERMINATE_GRACE_SECONDS = 5
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+
+class Cancellation(object):
+    """A flag telling running subprocesses to stop; it can be set from any thread."""
+
+    def __init__(self):
+        """Construct a Cancellation that hasn't been cancelled."""
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Stop subprocesses started under this Cancellation, now and in future."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Get whether ``cancel()`` has been called."""
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Wait up to ``seconds`` for ``cancel()``, returning True if it was called."""
+        self._event.wait(seconds)
+        return self._event.is_set()
+
+
+class SubprocessResult(object):
+    """How a subprocess run went."""
+
+    def __init__(self, args, returncode, stdout, stderr, duration, timed_out=False, cancelled=False):
+        """Construct a SubprocessResult.
+
+        Args:
+            args (list of str): the command line
+            returncode (int): the exit code
+            stdout (bytes): everything written to stdout, or None if it wasn't kept
+            stderr (bytes): everything written to stderr
+            duration (float): wall-clock seconds the process ran
+            timed_out (bool): True if we stopped it because it ran too long
+            cancelled (bool): True if we stopped it because of a ``Cancellation``
+        """
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+
+_current = threading.local()
+
+
+def current_line_handler():
+    """Get the function receiving output lines on this thread, or None."""
+    return getattr(_current, 'line_handler', None)
+
+
+@contextlib.contextmanager
+def lines_to(handler):
+    """Context manager that sends output from ``run()`` on this thread to ``handler``.
+
+    ``handler`` is called as ``handler(stream, line)``, where
+    stream is ``STDOUT`` or ``STDERR`` and line is a str without
+    the line ending. It's called from another thread, but never
+    for two lines at once. It may be None to send lines nowhere.
+    """
+    old = current_line_handler()
+    _current.line_handler = handler
+    try:
+        yield
+    finally:
+        _current.line_handler = old
+
+
+def current_cancellation():
+    """Get the ``Cancellation`` that applies on this thread, or None."""
+    return getattr(_current, 'cancellation', None)
+
+
+@contextlib.contextmanager
+def cancelled_by(cancellation):
+    """Context manager that makes ``run()`` on this thread stop when ``cancellation`` is cancelled."""
+    old = current_cancellation()
+    _current.cancellation = cancellation
+    try:
+        yield
+    finally:
+        _current.cancellation = old
+
+
+@contextlib.contextmanager
+def cancelled_on_interrupt():
+    """Context manager that cancels ``run()`` on every thread working for this one if Ctrl-C interrupts it.
+
+    Threads started with ``parallel_map`` inherit the
+    ``Cancellation`` installed here, so their subprocesses are
+    stopped too rather than left running behind us.
+    """
+    cancellation = Cancellation()
+    with cancelled_by(cancellation):
+        try:
+            yield cancellation
+        except KeyboardInterrupt:
+            cancellation.cancel()
+            raise
+
+
+def _stop(process):
+    process.terminate()
+    deadline = time.time() + _TERMINATE_GRACE_SECONDS
+    while process.poll() is None:
+        if time.time() > deadline:
+            process.kill()
+            break
+        time.sleep(_POLL_SECONDS)
+
+
+def run(args, stream_output=False, timeout=None):
+    """Run a command, waiting for it to exit.
+
+    Output is read as it's written rather than all at the end.
+    With ``stream_output``, each line goes to the current
+    ``lines_to()`` handler as it arrives and stdout isn't kept in
+    memory; otherwise stdout is kept for the caller to parse.
+    stderr is always kept, so it can go in error messages.
+
+    If ``timeout`` seconds pass, or the current ``Cancellation``
+    is cancelled, the process is terminated (then killed, if it
+    doesn't exit soon) and the result says why. If waiting is
+    interrupted by an exception such as ``KeyboardInterrupt``,
+    the process is stopped the same way before it propagates.
+
+    Args:
+        args (list of str): the command line
+        stream_output (bool): True to send lines to the handler instead of keeping stdout
+        timeout (float): seconds to allow, or None for no limit
+
+    Returns:
+        a ``SubprocessResult``
+
+    Raises:
+        OSError if the command can't be run
+    """
+    handler = current_line_handler() if stream_output else None
+    cancellation = current_cancellation()
+    start = time.time()
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    stdout_lines = None if stream_output else []
+    stderr_lines = []
+    handler_lock = threading.Lock()
+
+    def read(pipe, stream, kept):
+        try:
+            for line in iter(pipe.readline, b''):
+                if kept is not None:
+                    kept.append(line)
+                if handler is not None:
+                    with handler_lock:
+                        handler(stream, line.decode('utf-8', 'replace').rstrip('\r\n'))
+        finally:
+            pipe.close()
+
+    readers = [threading.Thread(target=read, args=(process.stdout, STDOUT, stdout_lines)),
+               threading.Thread(target=read, args=(process.stderr, STDERR, stderr_lines))]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    timed_out = False
+    cancelled = False
+    finished = False
+    try:
+        for reader in readers:
+            while reader.is_alive():
+                reader.join(_POLL_SECONDS)
+                if timed_out or cancelled:
+                    continue
+                if cancellation is not None and cancellation.cancelled:
+                    cancelled = True
+                elif timeout is not None and (time.time() - start) > timeout:
+                    timed_out = True
+                else:
+                    continue
+                _stop(process)
+        finished = True
+    finally:
+        # don't leave the process running if we're interrupted
+        if not finished and process.poll() is None:
+            _stop(process)
+
+    process.wait()
+    return SubprocessResult(args=args,
+                            returncode=process.returncode,
+                            stdout=None if stdout_lines is None else b''.join(stdout_lines),
+                            stderr=b''.join(stderr_lines),
+                            duration=time.time() - start,
+                            timed_out=timed_out,
+                            cancelled=cancelled)
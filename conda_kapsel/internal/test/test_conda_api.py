@@ -6,11 +6,16 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import json
 import os
 import platform
 import pytest
+import sys
+import time
 
 import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.file_lock as file_lock
+import conda_kapsel.internal.subprocess_runner as subprocess_runner
 
 from conda_kapsel.internal.test.tmpfile_utils import (with_directory_contents, tmp_script_commandline)
 
@@ -193,6 +198,63 @@ sys.exit(0)
     with_directory_contents(dict(), do_test)
 
 
+def test_conda_invoke_streams_output(monkeypatch, capsys):
+    def get_command(extra_args):
+        return tmp_script_commandline("""from __future__ import print_function
+import sys
+print("Fetching")
+sys.stdout.flush()
+print("TEST_WARNING", file=sys.stderr)
+sys.exit(0)
+""")
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', get_command)
+        _monkeypatch_conda_info(monkeypatch)
+        lines = []
+        with subprocess_runner.lines_to(lambda stream, line: lines.append(line)):
+            assert conda_api.install(prefix=dirname, pkgs=['python']) is None
+        assert ["Fetching", "TEST_WARNING"] == sorted(lines)
+        # the warning was streamed, so it isn't printed again
+        (out, err) = capsys.readouterr()
+        assert '' == err
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_invoke_times_out(monkeypatch):
+    def get_command(extra_args):
+        return tmp_script_commandline("""import time
+time.sleep(60)
+""")
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', get_command)
+        with pytest.raises(conda_api.CondaError) as excinfo:
+            conda_api._call_conda(['info'], timeout=0.2)
+        assert 'timed out after 0.2 seconds' in str(excinfo.value)
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_invoke_cancelled(monkeypatch):
+    def get_command(extra_args):
+        return tmp_script_commandline("""import time
+time.sleep(60)
+""")
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', get_command)
+        cancellation = subprocess_runner.Cancellation()
+        cancellation.cancel()
+        with subprocess_runner.cancelled_by(cancellation):
+            with pytest.raises(conda_api.CondaError) as excinfo:
+                conda_api._call_conda(['info'])
+        assert str(excinfo.value).endswith(': cancelled')
+
+    with_directory_contents(dict(), do_test)
+
+
 def test_conda_invoke_zero_returncode_with_invalid_json(monkeypatch, capsys):
     def get_command(extra_args):
         return tmp_script_commandline("""from __future__ import print_function
@@ -210,22 +272,210 @@ sys.exit(0)
     with_directory_contents(dict(), do_test)
 
 
+def _monkeypatch_conda_info(monkeypatch, conda_version='4.2.9', pkgs_dirs=('/pkgs', )):
+    info = dict(root_prefix='/root', envs_dirs=[], envs=[], pkgs_dirs=list(pkgs_dirs), conda_version=conda_version)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._cached_info', lambda: info)
+
+
 def test_conda_create_gets_channels(monkeypatch):
-    def mock_call_conda(extra_args):
+    _monkeypatch_conda_info(monkeypatch)
+
+    def mock_call_conda(extra_args, stream_output=False):
         assert ['create', '--yes', '--quiet', '--prefix', '/prefix', '--channel', 'foo', 'python'] == extra_args
+        assert stream_output
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
     conda_api.create(prefix='/prefix', pkgs=['python'], channels=['foo'])
 
 
 def test_conda_install_gets_channels(monkeypatch):
-    def mock_call_conda(extra_args):
+    _monkeypatch_conda_info(monkeypatch)
+
+    def mock_call_conda(extra_args, stream_output=False):
         assert ['install', '--yes', '--quiet', '--prefix', '/prefix', '--channel', 'foo', 'python'] == extra_args
+        assert stream_output
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
     conda_api.install(prefix='/prefix', pkgs=['python'], channels=['foo'])
 
 
+def test_conda_create_from_explicit(monkeypatch):
+    _monkeypatch_conda_info(monkeypatch)
+
+    def mock_call_conda(extra_args, stream_output=False):
+        assert ['create', '--yes', '--quiet', '--prefix', '/prefix', '--file', '/lock.txt'] == extra_args
+        assert stream_output
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    conda_api.create_from_explicit(prefix='/prefix', filename='/lock.txt')
+
+
+def test_conda_package_cache_commands_hold_lock(monkeypatch):
+    _monkeypatch_conda_info(monkeypatch)
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock_directory', lambda: dirname)
+        lock_filename = conda_api._package_cache_lock().filename
+        held = []
+
+        def mock_lock(f):
+            held.append(f.name)
+
+        def mock_unlock(f):
+            held.remove(f.name)
+
+        def mock_call_conda(extra_args, stream_output=False):
+            assert [lock_filename] == held
+
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock', mock_lock)
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._unlock', mock_unlock)
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+        conda_api.create(prefix='/prefix', pkgs=['python'])
+        conda_api.install(prefix='/prefix', pkgs=['python'])
+        conda_api.create_from_explicit(prefix=os.path.join(dirname, 'prefix'), filename='/lock.txt')
+        assert [] == held
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_package_cache_commands_download_first(monkeypatch):
+    _monkeypatch_conda_info(monkeypatch, conda_version='4.6.14')
+
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock_directory', lambda: dirname)
+        lock_filename = conda_api._package_cache_lock().filename
+        held = []
+        calls = []
+
+        def mock_lock(f):
+            held.append(f.name)
+
+        def mock_unlock(f):
+            held.remove(f.name)
+
+        def mock_call_conda(extra_args, stream_output=False):
+            assert stream_output
+            calls.append((extra_args, list(held)))
+
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock', mock_lock)
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._unlock', mock_unlock)
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+        conda_api.install(prefix='/prefix', pkgs=['python'])
+        # only the download holds the lock
+        assert [(['install', '--download-only', '--yes', '--quiet', '--prefix', '/prefix', 'python'], [lock_filename]),
+                (['install', '--yes', '--quiet', '--prefix', '/prefix', 'python'], [])] == calls
+        assert [] == held
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_supports_download_only(monkeypatch):
+    for (version, expected) in (('4.1.11', False), ('4.5.12', False), ('4.6.0', True), ('4.10.3', True),
+                                ('23.1.0', True), (None, False)):
+        _monkeypatch_conda_info(monkeypatch, conda_version=version)
+        assert expected == conda_api._conda_supports_download_only()
+
+
+def test_package_cache_lock_is_per_pkgs_dir(monkeypatch):
+    def do_test(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock_directory', lambda: dirname)
+        (first, second) = (os.path.join(dirname, 'first'), os.path.join(dirname, 'second'))
+
+        def lock_filename(pkgs_dirs):
+            _monkeypatch_conda_info(monkeypatch, pkgs_dirs=pkgs_dirs)
+            return conda_api._package_cache_lock().filename
+
+        assert lock_filename([first]) == lock_filename([first, second])
+        assert lock_filename([first]) != lock_filename([second])
+        assert lock_filename([]) == file_lock.named_lock(conda_api._PACKAGE_CACHE_LOCK_NAME).filename
+
+        # conda skips pkgs dirs it can't write to
+        monkeypatch.setattr('os.access', lambda path, mode: path != first)
+        os.makedirs(first)
+        assert lock_filename([first, second]) == lock_filename([second])
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_offline_mode(monkeypatch):
+    assert not conda_api.offline_mode(dict())
+    assert not conda_api.offline_mode(dict(CONDA_KAPSEL_OFFLINE='0'))
+    assert conda_api.offline_mode(dict(CONDA_KAPSEL_OFFLINE='1'))
+    assert conda_api.offline_mode(dict(CONDA_OFFLINE='True'))
+
+    monkeypatch.delenv('CONDA_OFFLINE', raising=False)
+    monkeypatch.setenv('CONDA_KAPSEL_OFFLINE', 'yes')
+    assert conda_api.offline_mode()
+
+
+def test_offline_mode_from(monkeypatch):
+    import threading
+
+    monkeypatch.delenv('CONDA_OFFLINE', raising=False)
+    monkeypatch.delenv('CONDA_KAPSEL_OFFLINE', raising=False)
+    assert not conda_api.offline_mode()
+
+    other_thread = []
+    with conda_api.offline_mode_from(dict(CONDA_KAPSEL_OFFLINE='1')):
+        assert conda_api.offline_mode()
+        # an explicit environ still wins
+        assert not conda_api.offline_mode(dict())
+        with conda_api.offline_mode_from(dict()):
+            assert not conda_api.offline_mode()
+        assert conda_api.offline_mode()
+
+        thread = threading.Thread(target=lambda: other_thread.append(conda_api.offline_mode()))
+        thread.start()
+        thread.join()
+    assert [False] == other_thread
+    assert not conda_api.offline_mode()
+
+
+def test_conda_commands_offline(monkeypatch):
+    _monkeypatch_conda_info(monkeypatch)
+    calls = []
+
+    def mock_call_conda(extra_args, stream_output=False):
+        calls.append(extra_args)
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    monkeypatch.setenv('CONDA_KAPSEL_OFFLINE', '1')
+    conda_api.create(prefix='/prefix', pkgs=['python'])
+    conda_api.install(prefix='/prefix', pkgs=['python'])
+    conda_api.remove(prefix='/prefix', pkgs=['python'])
+    assert [['create', '--offline', '--yes', '--quiet', '--prefix', '/prefix', 'python'],
+            ['install', '--offline', '--yes', '--quiet', '--prefix', '/prefix', 'python'],
+            ['remove', '--yes', '--quiet', '--offline', '--prefix', '/prefix', 'python']] == calls
+
+
+def test_conda_create_from_explicit_env_exists():
+    def do_test(dirname):
+        with pytest.raises(conda_api.CondaEnvExistsError) as excinfo:
+            conda_api.create_from_explicit(prefix=dirname, filename='/lock.txt')
+        assert 'already exists' in repr(excinfo.value)
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_conda_list_explicit(monkeypatch):
+    def mock_call_conda(extra_args):
+        assert ['list', '--explicit', '--prefix', '/prefix'] == extra_args
+        return b"@EXPLICIT\n"
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._call_conda', mock_call_conda)
+    assert "@EXPLICIT\n" == conda_api.list_explicit(prefix='/prefix')
+
+
+def test_current_platform(monkeypatch):
+    for (system, expected) in (('Linux', 'linux'), ('Darwin', 'osx'), ('Windows', 'win')):
+        monkeypatch.setattr('platform.system', lambda: system)
+        assert conda_api.current_platform() in (expected + '-32', expected + '-64')
+
+
+def _monkeypatch_no_info_cache(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._find_executable', lambda program: None)
+
+
 def test_resolve_root_prefix():
     prefix = conda_api.resolve_env_to_prefix('root')
     assert prefix is not None
@@ -237,6 +487,7 @@ def test_resolve_named_env(monkeypatch):
         return {'root_prefix': '/foo', 'envs': ['/foo/envs/bar']}
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api.info', mock_info)
+    _monkeypatch_no_info_cache(monkeypatch)
     prefix = conda_api.resolve_env_to_prefix('bar')
     assert "/foo/envs/bar" == prefix
 
@@ -246,10 +497,186 @@ def test_resolve_bogus_env(monkeypatch):
         return {'root_prefix': '/foo', 'envs': ['/foo/envs/bar']}
 
     monkeypatch.setattr('conda_kapsel.internal.conda_api.info', mock_info)
+    _monkeypatch_no_info_cache(monkeypatch)
     prefix = conda_api.resolve_env_to_prefix('nope')
     assert prefix is None
 
 
+def _age(path):
+    long_ago = time.time() - 60
+    os.utime(path, (long_ago, long_ago))
+
+
+def _check_cached_info(monkeypatch, check):
+    calls = []
+
+    def mock_info():
+        calls.append(1)
+        return {'root_prefix': '/foo',
+                'envs_dirs': [],
+                'envs': ['/foo/envs/bar'],
+                'pkgs_dirs': ['/foo/pkgs'],
+                'conda_version': '4.2.9',
+                'other': 'stuff'}
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.info', mock_info)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command', lambda extra_args: [sys.executable])
+
+    def do_test(dirname):
+        envs_dir = os.path.join(dirname, 'envs')
+        os.makedirs(envs_dir)
+        condarc = os.path.join(dirname, 'condarc')
+        with open(condarc, 'w') as f:
+            f.write("channels: []\n")
+        for path in (envs_dir, condarc):
+            _age(path)
+        monkeypatch.setenv('CONDARC', condarc)
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._info_cache_filename',
+                            lambda: os.path.join(dirname, 'cache', 'conda-info.json'))
+        check(dirname, calls)
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_cached_info(monkeypatch):
+    def check(dirname, calls):
+        expected = {'root_prefix': '/foo',
+                    'envs_dirs': [],
+                    'envs': ['/foo/envs/bar'],
+                    'pkgs_dirs': ['/foo/pkgs'],
+                    'conda_version': '4.2.9'}
+        assert expected == conda_api._cached_info()
+        assert 1 == len(calls)
+        assert os.path.isfile(os.path.join(dirname, 'cache', 'conda-info.json'))
+
+        # without running conda
+        assert expected == conda_api._cached_info()
+        assert '/foo/envs/bar' == conda_api.resolve_env_to_prefix('bar')
+        assert ['/foo/pkgs'] == conda_api.pkgs_dirs()
+        assert 1 == len(calls)
+
+        # editing the condarc throws away the cache
+        condarc = os.path.join(dirname, 'condarc')
+        with open(condarc, 'w') as f:
+            f.write("channels: [foo]\n")
+        assert expected == conda_api._cached_info()
+        assert 2 == len(calls)
+        # which we don't save again, since the condarc could still be changing
+        assert expected == conda_api._cached_info()
+        assert 3 == len(calls)
+
+        _age(condarc)
+        assert expected == conda_api._cached_info()
+        assert expected == conda_api._cached_info()
+        assert 4 == len(calls)
+
+        # a different condarc also throws it away
+        monkeypatch.setenv('CONDARC', os.path.join(dirname, 'other-condarc'))
+        assert expected == conda_api._cached_info()
+        assert 5 == len(calls)
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_cached_info_depends_on_conda_config_variables(monkeypatch):
+    def check(dirname, calls):
+        conda_api._cached_info()
+        conda_api._cached_info()
+        assert 1 == len(calls)
+
+        # settings conda reads from the environment throw it away
+        monkeypatch.setenv('CONDA_ENVS_PATH', os.path.join(dirname, 'envs'))
+        conda_api._cached_info()
+        conda_api._cached_info()
+        assert 2 == len(calls)
+        monkeypatch.setenv('CONDA_PKGS_DIRS', os.path.join(dirname, 'pkgs'))
+        conda_api._cached_info()
+        assert 3 == len(calls)
+        monkeypatch.delenv('CONDA_ENVS_PATH')
+        conda_api._cached_info()
+        assert 4 == len(calls)
+
+        # but which env is active, or our own settings, don't
+        monkeypatch.setenv('CONDA_DEFAULT_ENV', 'something')
+        monkeypatch.setenv('CONDA_PREFIX', os.path.join(dirname, 'something'))
+        monkeypatch.setenv('CONDA_SHLVL', '2')
+        monkeypatch.setenv('CONDA_KAPSEL_OFFLINE', '1')
+        conda_api._cached_info()
+        assert 4 == len(calls)
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_cached_info_ignores_other_conda(monkeypatch):
+    def check(dirname, calls):
+        conda_api._cached_info()
+        assert 1 == len(calls)
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command',
+                            lambda extra_args: [os.path.join(dirname, 'condarc')])
+        conda_api._cached_info()
+        assert 2 == len(calls)
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_cached_info_corrupt_cache(monkeypatch):
+    def check(dirname, calls):
+        conda_api._cached_info()
+        with open(os.path.join(dirname, 'cache', 'conda-info.json'), 'w') as f:
+            f.write(json.dumps(dict(version=1, content=dict(conda=sys.executable, info=[]))))
+        conda_api._cached_info()
+        assert 2 == len(calls)
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_cached_info_saved_without_pkgs_dirs(monkeypatch):
+    def check(dirname, calls):
+        conda_api._cached_info()
+        filename = os.path.join(dirname, 'cache', 'conda-info.json')
+        with open(filename) as f:
+            cached = json.load(f)
+        del cached['content']['info']['pkgs_dirs']
+        with open(filename, 'w') as f:
+            json.dump(cached, f)
+        assert ['/foo/pkgs'] == conda_api.pkgs_dirs()
+        assert 2 == len(calls)
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_cached_info_without_conda_executable(monkeypatch):
+    def check(dirname, calls):
+        monkeypatch.setattr('conda_kapsel.internal.conda_api._get_conda_command',
+                            lambda extra_args: ['not-a-real-conda-command'])
+        conda_api._cached_info()
+        conda_api._cached_info()
+        assert 2 == len(calls)
+        assert not os.path.exists(os.path.join(dirname, 'cache'))
+
+    _check_cached_info(monkeypatch, check)
+
+
+def test_find_executable(monkeypatch):
+    def check(dirname):
+        program = os.path.join(dirname, 'bin', 'myprogram')
+        other = os.path.join(dirname, 'bin', 'other.exe')
+        for path in (program, other):
+            os.chmod(path, 0o755)
+        assert program == conda_api._find_executable(program)
+        assert conda_api._find_executable(program + "-nope") is None
+
+        monkeypatch.setenv('PATH', os.pathsep.join([os.path.join(dirname, 'nope'), os.path.join(dirname, 'bin')]))
+        assert program == conda_api._find_executable('myprogram')
+        assert conda_api._find_executable('notmyprogram') is None
+
+        monkeypatch.setattr('platform.system', lambda: 'Windows')
+        monkeypatch.setenv('PATHEXT', '.COM;.EXE')
+        assert other == conda_api._find_executable('other')
+
+    with_directory_contents({'bin/myprogram': "", 'bin/other.exe': ""}, check)
+
+
 def test_resolve_env_prefix_from_dirname():
     prefix = conda_api.resolve_env_to_prefix('/foo/bar')
     assert "/foo/bar" == prefix
@@ -299,10 +726,30 @@ def test_installed_cannot_list_dir(monkeypatch):
     def mock_listdir(dirname):
         raise OSError("cannot list this")
 
-    monkeypatch.setattr("os.listdir", mock_listdir)
-    with pytest.raises(conda_api.CondaError) as excinfo:
-        conda_api.installed("/this/does/not/exist")
-    assert 'cannot list this' in repr(excinfo.value)
+    def check_installed(dirname):
+        monkeypatch.setattr("os.listdir", mock_listdir)
+        with pytest.raises(conda_api.CondaError) as excinfo:
+            conda_api.installed(dirname)
+        assert 'cannot list this' in repr(excinfo.value)
+
+    with_directory_contents({'conda-meta/foo-1.0-0.json': ""}, check_installed)
+
+
+def test_installed_packages_reads_records():
+    def check_installed(dirname):
+        packages = conda_api.installed_packages(dirname)
+        assert ['numpy'] == list(packages.keys())
+        assert ('numpy', '1.11.1', 'py35_0', 'defaults') == packages['numpy'][:4]
+        assert ('numpy', '1.11.1', 'py35_0') == conda_api.installed(dirname)['numpy']
+
+    files = {
+        'conda-meta/numpy-1.11.1-py35_0.json': json.dumps(dict(name='numpy',
+                                                               version='1.11.1',
+                                                               build='py35_0',
+                                                               channel='defaults',
+                                                               files=[]))
+    }
+    with_directory_contents(files, check_installed)
 
 
 def test_set_conda_env_in_path_unix(monkeypatch):
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import codecs
+import os
+
+from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.internal import conda_lock
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+_EXPLICIT = "@EXPLICIT\nhttps://repo.continuum.io/pkgs/free/linux-64/python-3.5.2-0.tar.bz2"
+
+
+def test_lock_filename():
+    expected = os.path.join('proj', 'kapsel-locks', 'foo-linux-64.txt')
+    assert expected == conda_lock.lock_filename('proj', 'foo', 'linux-64')
+
+
+def test_save_and_check_lock():
+    spec = EnvSpec(name='foo', conda_packages=['python'], channels=[])
+
+    def check(dirname):
+        filename = conda_lock.lock_filename(dirname, 'foo', 'linux-64')
+        assert not conda_lock.is_lock_current(filename, spec, 'linux-64')
+
+        assert conda_lock.save_lock(filename, spec, 'linux-64', _EXPLICIT)
+        assert conda_lock.is_lock_current(filename, spec, 'linux-64')
+        assert [os.path.basename(filename)] == os.listdir(os.path.dirname(filename))
+
+        with codecs.open(filename, 'r', 'utf-8') as f:
+            content = f.read()
+        assert content.endswith(_EXPLICIT + "\n")
+        assert "# platform: linux-64\n" in content
+
+        # another platform or other packages need a new lock
+        assert not conda_lock.is_lock_current(filename, spec, 'osx-64')
+        changed = EnvSpec(name='foo', conda_packages=['python=3.5'], channels=[])
+        assert not conda_lock.is_lock_current(filename, changed, 'linux-64')
+        changed = EnvSpec(name='foo', conda_packages=['python'], channels=['bar'])
+        assert not conda_lock.is_lock_current(filename, changed, 'linux-64')
+
+        # pip packages and description aren't locked
+        unlocked = EnvSpec(name='foo', conda_packages=['python'], channels=[], pip_packages=['flake8'],
+                           description="Foo")
+        assert conda_lock.is_lock_current(filename, unlocked, 'linux-64')
+
+    with_directory_contents(dict(), check)
+
+
+def test_lock_without_headers_is_not_current():
+    spec = EnvSpec(name='foo', conda_packages=['python'], channels=[])
+
+    def check(dirname):
+        assert not conda_lock.is_lock_current(os.path.join(dirname, 'foo.txt'), spec, 'linux-64')
+
+    with_directory_contents({'foo.txt': _EXPLICIT}, check)
+
+
+def test_save_lock_fails(monkeypatch):
+    spec = EnvSpec(name='foo', conda_packages=['python'], channels=[])
+
+    def mock_rename(src, dest):
+        raise OSError("no renaming")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_lock.rename_over_existing', mock_rename)
+
+    def check(dirname):
+        filename = conda_lock.lock_filename(dirname, 'foo', 'linux-64')
+        assert not conda_lock.save_lock(filename, spec, 'linux-64', _EXPLICIT + "\n")
+        assert [] == os.listdir(os.path.dirname(filename))
+
+    with_directory_contents(dict(), check)
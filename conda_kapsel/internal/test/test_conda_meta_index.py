@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+import pytest
+
+from conda_kapsel.internal import conda_meta_index
+from conda_kapsel.internal.conda_meta_index import InstalledPackage
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def _record(name, version, build, files=()):
+    return json.dumps(dict(name=name,
+                           version=version,
+                           build=build,
+                           channel='https://repo.continuum.io/pkgs/free/linux-64',
+                           files=list(files),
+                           depends=[]))
+
+
+def _age_conda_meta(dirname):
+    long_ago = time.time() - 60
+    os.utime(os.path.join(dirname, 'conda-meta'), (long_ago, long_ago))
+
+
+def test_reads_conda_meta_records():
+    def check(dirname):
+        packages = conda_meta_index.installed_packages(dirname)
+        assert set(['numpy', 'ipython-notebook', 'portaudio']) == set(packages.keys())
+        assert InstalledPackage(name='numpy',
+                                version='1.11.1',
+                                build='py35_0',
+                                channel='https://repo.continuum.io/pkgs/free/linux-64',
+                                files=('lib/foo.so', 'lib/bar.so')) == packages['numpy']
+        assert ('ipython-notebook', '4.0.4', 'py27_0') == packages['ipython-notebook'][:3]
+        # fell back to the filename
+        assert InstalledPackage(name='portaudio', version='19', build='0', channel=None,
+                                files=()) == packages['portaudio']
+
+    with_directory_contents(
+        {
+            'conda-meta/numpy-1.11.1-py35_0.json': _record('numpy', '1.11.1', 'py35_0', ['lib/foo.so', 'lib/bar.so']),
+            'conda-meta/ipython-notebook-4.0.4-py27_0.json': _record('ipython-notebook', '4.0.4', 'py27_0'),
+            'conda-meta/portaudio-19-0.json': "not json",
+            'conda-meta/history': "",
+            'conda-meta/no_proper_name.json': "{}"
+        }, check)
+
+
+def test_nonexistent_prefix():
+    assert dict() == conda_meta_index.installed_packages("/this/does/not/exist")
+
+
+def test_cannot_stat_conda_meta(monkeypatch):
+    def mock_stat(path):
+        raise OSError("cannot stat this")
+
+    monkeypatch.setattr('os.stat', mock_stat)
+    monkeypatch.setattr('os.path.exists', lambda path: True)
+    with pytest.raises(OSError) as excinfo:
+        conda_meta_index.installed_packages("/this/does/not/exist")
+    assert 'cannot stat this' in str(excinfo.value)
+
+
+def test_caches_until_conda_meta_changes():
+    def check(dirname):
+        _age_conda_meta(dirname)
+        first = conda_meta_index.installed_packages(dirname)
+        assert ['numpy'] == list(first.keys())
+        assert first is conda_meta_index.installed_packages(dirname)
+
+        with open(os.path.join(dirname, 'conda-meta', 'six-1.10.0-py35_0.json'), 'w') as f:
+            f.write(_record('six', '1.10.0', 'py35_0'))
+
+        # the mtime is too recent to trust, so we reload every time
+        second = conda_meta_index.installed_packages(dirname)
+        assert ['numpy', 'six'] == sorted(second.keys())
+        assert second is not conda_meta_index.installed_packages(dirname)
+
+        _age_conda_meta(dirname)
+        third = conda_meta_index.installed_packages(dirname)
+        assert ['numpy', 'six'] == sorted(third.keys())
+        assert third is conda_meta_index.installed_packages(dirname)
+
+    with_directory_contents({'conda-meta/numpy-1.11.1-py35_0.json': _record('numpy', '1.11.1', 'py35_0')}, check)
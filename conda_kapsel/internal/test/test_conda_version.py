@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+from conda_kapsel.internal.conda_api import parse_spec
+from conda_kapsel.internal.conda_version import package_matches
+
+
+def _matches(spec, version, build='py35_0'):
+    return package_matches(parse_spec(spec), version, build)
+
+
+def test_no_constraint():
+    assert _matches('numpy', '1.11.1')
+
+
+def test_conda_style_constraint_is_a_prefix():
+    assert _matches('numpy=1.11', '1.11')
+    assert _matches('numpy=1.11', '1.11.1')
+    assert _matches('numpy=1.11', '1.11.0rc1')
+    assert not _matches('numpy=1.11', '1.1')
+    assert not _matches('numpy=1.1', '1.11')
+    assert not _matches('numpy=1.11', '1.10.4')
+    assert _matches('numpy=1.10|1.11', '1.11.2')
+    assert _matches('numpy=1.11*', '1.11.2')
+
+
+def test_conda_style_constraint_with_build():
+    assert _matches('numpy=1.11.1=py35_0', '1.11.1')
+    assert _matches('numpy=1.11=py35_0', '1.11.0')
+    assert not _matches('numpy=1.11=py35_0', '1.11.1')
+    assert not _matches('numpy=1.11.1=py27_0', '1.11.1')
+    assert _matches('numpy=1.11.1=py35*', '1.11.1')
+    assert _matches('numpy=1.11*=py35_0', '1.11.1')
+
+
+def test_pip_style_constraints():
+    assert _matches('numpy>=1.11', '1.11.0')
+    assert _matches('numpy>=1.11', '1.12')
+    assert not _matches('numpy>=1.11', '1.9.3')
+    assert _matches('numpy>1.9', '1.10')
+    assert not _matches('numpy>1.10', '1.10.0')
+    assert _matches('numpy<2', '1.99')
+    assert not _matches('numpy<2', '2.0')
+    assert _matches('numpy<=2', '2.0.0')
+    assert _matches('numpy==1.11.0', '1.11')
+    assert not _matches('numpy==1.11.0', '1.11.1')
+    assert _matches('numpy==1.11.*', '1.11.1')
+    assert _matches('numpy!=1.11.0', '1.11.1')
+    assert not _matches('numpy!=1.11.*', '1.11.1')
+    assert _matches('numpy!=1.11.*', '1.12.1')
+    assert _matches('numpy >=1.10,<1.12', '1.11.3')
+    assert not _matches('numpy >=1.10,<1.12', '1.12.0')
+    assert _matches('numpy <1.9|>=1.11', '1.8')
+    assert not _matches('numpy <1.9|>=1.11', '1.10')
+
+
+def test_version_ordering():
+    assert _matches('foo<1.1', '1.1dev')
+    assert _matches('foo<1.1', '1.1a1')
+    assert _matches('foo<1.1a2', '1.1a1')
+    assert _matches('foo<1.1', '1.1rc1')
+    assert _matches('foo>1.1', '1.1post1')
+    assert _matches('foo>1.1', '1.1.1')
+    assert _matches('foo>1.1', '1.1_2')
+    assert _matches('foo>1.9', '1!0.1')
+    assert _matches('foo==1.0', '1.0+local')
+    assert _matches('foo<1.0', '1.0.dev1')
+    assert _matches('foo>1.0a', '1.0b')
+    assert _matches('foo<1.0', 'a.1')
+
+
+def test_unknown_constraint():
+    assert _matches('numpy>=x!1', '1.0') is None
+    assert _matches('numpy>=1.0,>>2', '1.0') is None
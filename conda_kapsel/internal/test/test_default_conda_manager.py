@@ -6,15 +6,24 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import codecs
+import json
 import os
 import platform
 import pytest
+import shutil
+import time
 
 from conda_kapsel.env_spec import EnvSpec
-from conda_kapsel.conda_manager import CondaManagerError
+from conda_kapsel.conda_manager import CondaEnvironmentDeviations, CondaManagerError
 
 from conda_kapsel.internal.default_conda_manager import DefaultCondaManager
+import conda_kapsel.internal.conda_api as conda_api
+import conda_kapsel.internal.conda_lock as conda_lock
+import conda_kapsel.internal.conda_meta_index as conda_meta_index
+import conda_kapsel.internal.file_lock as file_lock
 import conda_kapsel.internal.pip_api as pip_api
+import conda_kapsel.internal.subprocess_runner as subprocess_runner
 
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 from conda_kapsel.internal.test.test_conda_api import monkeypatch_conda_not_to_use_links
@@ -88,9 +97,531 @@ def test_conda_create_and_install_and_remove(monkeypatch):
             raise pip_api.PipError("pip fail")
 
         monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+        # make it fall back to running pip
+        monkeypatch.setattr('conda_kapsel.internal.pip_api._site_packages_dirs', lambda prefix: [])
 
         with pytest.raises(CondaManagerError) as excinfo:
             deviations = manager.find_environment_deviations(envdir, spec)
         assert 'pip failed while listing' in str(excinfo.value)
 
     with_directory_contents(dict(), do_test)
+
+
+def _conda_meta_record(name, version, build):
+    return json.dumps(dict(name=name, version=version, build=build, channel='defaults', files=[]))
+
+
+def test_find_wrong_version_packages():
+    spec = EnvSpec(name='myenv',
+                   conda_packages=['python', 'numpy>=1.11', 'bokeh=0.12', 'six', 'notthere'],
+                   pip_packages=[],
+                   channels=[])
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        deviations = manager.find_environment_deviations(dirname, spec)
+        assert deviations.missing_packages == ('notthere', )
+        assert deviations.wrong_version_packages == ('bokeh', 'numpy')
+        assert deviations.missing_pip_packages == ()
+        assert not deviations.ok
+        assert deviations.summary == ("Conda environment is missing packages: notthere; "
+                                      "Conda environment has the wrong version of packages: bokeh, numpy")
+
+    with_directory_contents(
+        {
+            'conda-meta/python-3.5.2-0.json': _conda_meta_record('python', '3.5.2', '0'),
+            'conda-meta/numpy-1.10.4-py35_0.json': _conda_meta_record('numpy', '1.10.4', 'py35_0'),
+            'conda-meta/bokeh-0.11.1-py35_0.json': _conda_meta_record('bokeh', '0.11.1', 'py35_0'),
+            'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')
+        }, check)
+
+
+def test_only_wrong_version_packages_then_fix(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['numpy>=1.11', 'six'], pip_packages=[], channels=['foo'])
+    installs = []
+
+    def mock_install(prefix, pkgs, channels):
+        installs.append((prefix, pkgs, channels))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        deviations = manager.find_environment_deviations(dirname, spec)
+        assert deviations.missing_packages == ()
+        assert deviations.wrong_version_packages == ('numpy', )
+        assert deviations.summary == "Conda environment has the wrong version of packages: numpy"
+
+        manager.fix_environment_deviations(dirname, spec, deviations)
+        assert [(dirname, ['numpy>=1.11'], ('foo', ))] == installs
+
+    with_directory_contents(
+        {
+            'conda-meta/numpy-1.10.4-py35_0.json': _conda_meta_record('numpy', '1.10.4', 'py35_0'),
+            'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')
+        }, check)
+
+
+def test_fix_installs_plan_in_one_conda_and_one_pip_call(monkeypatch):
+    spec = EnvSpec(name='myenv',
+                   conda_packages=['numpy>=1.11', 'six', 'bokeh'],
+                   pip_packages=['flake8==2.5.4', 'pep257'],
+                   channels=['foo'])
+    calls = []
+
+    def mock_install(prefix, pkgs, channels):
+        calls.append(('conda', pkgs, channels))
+
+    def mock_pip_install(prefix, pkgs):
+        calls.append(('pip', pkgs))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.install', mock_pip_install)
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        deviations = CondaEnvironmentDeviations(summary="test",
+                                                missing_packages=['bokeh'],
+                                                wrong_version_packages=['numpy'],
+                                                missing_pip_packages=['pep257'],
+                                                wrong_version_pip_packages=['flake8'])
+        manager.fix_environment_deviations(dirname, spec, deviations)
+        assert [('conda', ['numpy>=1.11', 'bokeh'], ('foo', )), ('pip', ['flake8==2.5.4', 'pep257'])] == calls
+
+    with_directory_contents({'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')},
+                            check)
+
+
+def test_fix_with_empty_plan_does_nothing(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['six'], pip_packages=[], channels=[])
+
+    def mock_install(prefix, pkgs, channels):
+        raise AssertionError("should not install")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.install', mock_install)
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.install', mock_install)
+
+    def check(dirname):
+        DefaultCondaManager().fix_environment_deviations(dirname, spec)
+
+    with_directory_contents({'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')},
+                            check)
+
+
+def test_fix_pip_install_fails(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=[], pip_packages=['flake8', 'pep257'], channels=[])
+
+    def mock_pip_install(prefix, pkgs):
+        raise pip_api.PipError("nope")
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api.install', mock_pip_install)
+
+    def check(dirname):
+        deviations = CondaEnvironmentDeviations(summary="test",
+                                                missing_packages=[],
+                                                wrong_version_packages=[],
+                                                missing_pip_packages=['flake8', 'pep257'],
+                                                wrong_version_pip_packages=[])
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(dirname, spec, deviations)
+        assert "Failed to install missing pip packages: flake8, pep257" == str(excinfo.value)
+
+    with_directory_contents({'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')},
+                            check)
+
+
+def test_cannot_read_conda_meta(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['numpy'], pip_packages=[], channels=[])
+
+    def mock_listdir(dirname):
+        raise OSError("cannot list this")
+
+    def check(dirname):
+        monkeypatch.setattr('os.listdir', mock_listdir)
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().find_environment_deviations(dirname, spec)
+        assert 'Conda failed while listing installed packages' in str(excinfo.value)
+
+    with_directory_contents({'conda-meta/numpy-1.10.4-py35_0.json': ""}, check)
+
+
+_EXPLICIT = "@EXPLICIT\nhttps://repo.continuum.io/pkgs/free/linux-64/python-3.5.2-0.tar.bz2\n"
+
+
+def _monkeypatch_conda_for_lock(monkeypatch, calls, create_fails=False, explicit_fails=False):
+    def mock_create(prefix, pkgs, channels):
+        calls.append(('create', pkgs))
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+
+    def mock_create_from_explicit(prefix, filename):
+        calls.append(('create_from_explicit', filename))
+        os.makedirs(os.path.join(prefix, 'conda-meta'))
+        if create_fails:
+            raise conda_api.CondaError("package went away")
+
+    def mock_list_explicit(prefix):
+        calls.append(('list_explicit', prefix))
+        if explicit_fails:
+            raise conda_api.CondaError("cannot list")
+        return _EXPLICIT
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create_from_explicit', mock_create_from_explicit)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.list_explicit', mock_list_explicit)
+
+
+def _lock_spec(dirname, conda_packages=('python', )):
+    return EnvSpec(name='myenv',
+                   conda_packages=list(conda_packages),
+                   channels=[],
+                   lock_filename=conda_lock.lock_filename(dirname, 'myenv', conda_api.current_platform()))
+
+
+def test_create_saves_lock_then_uses_it(monkeypatch):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls)
+        spec = _lock_spec(dirname)
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+        manager = DefaultCondaManager()
+
+        manager.fix_environment_deviations(envdir, spec)
+        assert [('create', ['python']), ('list_explicit', envdir)] == calls
+        assert conda_lock.is_lock_current(spec.lock_filename, spec, conda_api.current_platform())
+
+        # second create skips the solver and leaves the lock alone
+        shutil.rmtree(envdir)
+        del calls[:]
+        manager.fix_environment_deviations(envdir, spec)
+        assert [('create_from_explicit', spec.lock_filename)] == calls
+
+        # changing the packages makes the lock stale
+        shutil.rmtree(envdir)
+        del calls[:]
+        spec = _lock_spec(dirname, conda_packages=('python', 'numpy'))
+        manager.fix_environment_deviations(envdir, spec)
+        assert ('create', ['numpy', 'python']) == (calls[0][0], sorted(calls[0][1]))
+        assert [('list_explicit', envdir)] == calls[1:]
+        assert conda_lock.is_lock_current(spec.lock_filename, spec, conda_api.current_platform())
+
+    with_directory_contents(dict(), check)
+
+
+def test_create_from_lock_fails_then_solves(monkeypatch, capsys):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls, create_fails=True)
+        spec = _lock_spec(dirname)
+        assert conda_lock.save_lock(spec.lock_filename, spec, conda_api.current_platform(), _EXPLICIT)
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        lines = []
+        with subprocess_runner.lines_to(lambda stream, line: lines.append((stream, line))):
+            DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [('create_from_explicit', spec.lock_filename), ('create', ['python'])] == calls
+        assert os.path.isdir(os.path.join(envdir, 'conda-meta'))
+
+        assert [(subprocess_runner.STDERR,
+                 "Failed to create environment from %s, solving for packages instead: package went away" %
+                 spec.lock_filename)] == lines
+        assert ("", "") == tuple(capsys.readouterr())
+
+    with_directory_contents(dict(), check)
+
+
+def test_create_cannot_list_explicit(monkeypatch, capsys):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls, explicit_fails=True)
+        spec = _lock_spec(dirname)
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        lines = []
+        with subprocess_runner.lines_to(lambda stream, line: lines.append((stream, line))):
+            DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [('create', ['python']), ('list_explicit', envdir)] == calls
+        assert not os.path.exists(spec.lock_filename)
+
+        assert [(subprocess_runner.STDERR,
+                 "Failed to record package versions in %s: cannot list" % spec.lock_filename)] == lines
+        assert ("", "") == tuple(capsys.readouterr())
+
+    with_directory_contents(dict(), check)
+
+
+def test_create_without_lock_filename(monkeypatch):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls)
+        spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[])
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [('create', ['python'])] == calls
+
+    with_directory_contents(dict(), check)
+
+
+def _age(*paths):
+    old = time.time() - 60
+    for path in paths:
+        os.utime(path, (old, old))
+
+
+def _stamp_filename(prefix):
+    return os.path.join(prefix, '.kapsel-env-stamp.json')
+
+
+def test_stamp_skips_deviation_scan(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['numpy'], pip_packages=[], channels=[])
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        conda_meta = os.path.join(dirname, 'conda-meta')
+        _age(conda_meta)
+
+        # no stamp, so we scan and don't add a stamp
+        assert manager.find_environment_deviations(dirname, spec).ok
+        assert not os.path.exists(_stamp_filename(dirname))
+
+        manager._save_stamp(dirname, spec)
+
+        scans = []
+
+        def mock_installed_packages(prefix):
+            scans.append(prefix)
+            return conda_meta_index.installed_packages(prefix)
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.installed_packages', mock_installed_packages)
+
+        assert manager.find_environment_deviations(dirname, spec).ok
+        assert [] == scans
+
+        # another env spec doesn't match the stamp
+        other = EnvSpec(name='myenv', conda_packages=['numpy', 'six'], pip_packages=[], channels=[])
+        deviations = manager.find_environment_deviations(dirname, other)
+        assert ('six', ) == tuple(deviations.missing_packages)
+        assert [dirname] == scans
+
+        # changing conda-meta means we look again
+        os.remove(os.path.join(conda_meta, 'numpy-1.10.4-py35_0.json'))
+        deviations = manager.find_environment_deviations(dirname, spec)
+        assert ('numpy', ) == tuple(deviations.missing_packages)
+        assert [dirname, dirname] == scans
+
+    with_directory_contents({'conda-meta/numpy-1.10.4-py35_0.json': _conda_meta_record('numpy', '1.10.4', 'py35_0')},
+                            check)
+
+
+def test_stamp_too_recent_is_rechecked_and_resaved(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=['numpy'], pip_packages=[], channels=[])
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        manager._save_stamp(dirname, spec)
+        with codecs.open(_stamp_filename(dirname), 'r', 'utf-8') as f:
+            first_saved = json.load(f)['content']['saved']
+
+        scans = []
+
+        def mock_installed_packages(prefix):
+            scans.append(prefix)
+            return conda_meta_index.installed_packages(prefix)
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.installed_packages', mock_installed_packages)
+        monkeypatch.setattr('time.time', lambda: first_saved + 1)
+
+        # conda-meta changed just before the stamp was saved
+        assert manager.find_environment_deviations(dirname, spec).ok
+        assert [dirname] == scans
+
+        with codecs.open(_stamp_filename(dirname), 'r', 'utf-8') as f:
+            assert (first_saved + 1) == json.load(f)['content']['saved']
+
+    with_directory_contents({'conda-meta/numpy-1.10.4-py35_0.json': _conda_meta_record('numpy', '1.10.4', 'py35_0')},
+                            check)
+
+
+def test_stamp_includes_site_packages_for_pip(monkeypatch):
+    spec = EnvSpec(name='myenv', conda_packages=[], pip_packages=['flake8'], channels=[])
+
+    def check(dirname):
+        manager = DefaultCondaManager()
+        site_packages = os.path.join(dirname, 'lib', 'python3.5', 'site-packages')
+        _age(os.path.join(dirname, 'conda-meta'), site_packages)
+        manager._save_stamp(dirname, spec)
+
+        def mock_installed(prefix):
+            raise AssertionError("should not have listed pip packages")
+
+        monkeypatch.setattr('conda_kapsel.internal.pip_api.installed', mock_installed)
+        assert manager.find_environment_deviations(dirname, spec).ok
+
+        # pip changed something
+        os.remove(os.path.join(site_packages, 'flake8-2.5.4.dist-info', 'METADATA'))
+        os.rmdir(os.path.join(site_packages, 'flake8-2.5.4.dist-info'))
+        monkeypatch.undo()
+        deviations = manager.find_environment_deviations(dirname, spec)
+        assert ('flake8', ) == tuple(deviations.missing_pip_packages)
+
+    with_directory_contents(
+        {
+            'conda-meta/pip-8.1.2-py35_0.json': _conda_meta_record('pip', '8.1.2', 'py35_0'),
+            'lib/python3.5/site-packages/flake8-2.5.4.dist-info/METADATA': "Name: flake8\nVersion: 2.5.4\n"
+        }, check)
+
+
+def test_fix_saves_stamp(monkeypatch):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls)
+        spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[])
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        manager = DefaultCondaManager()
+        manager.fix_environment_deviations(envdir, spec)
+        with codecs.open(_stamp_filename(envdir), 'r', 'utf-8') as f:
+            assert spec.packages_hash == json.load(f)['content']['packages_hash']
+
+        # nothing to fix doesn't save it again
+        os.remove(_stamp_filename(envdir))
+        manager.fix_environment_deviations(envdir, spec, deviations=CondaEnvironmentDeviations(
+            summary="OK",
+            missing_packages=(),
+            wrong_version_packages=(),
+            missing_pip_packages=(),
+            wrong_version_pip_packages=()))
+        assert not os.path.exists(_stamp_filename(envdir))
+
+    with_directory_contents(dict(), check)
+
+
+def test_fix_holds_prefix_lock(monkeypatch):
+    def check(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock_directory', lambda: os.path.join(dirname, 'locks'))
+        spec = EnvSpec(name='myenv', conda_packages=['python'], channels=[])
+        # a project env linked into a shared pool has the same lock
+        # as the pool env
+        shared = os.path.join(dirname, 'pool', 'abc')
+        os.makedirs(shared)
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+        os.makedirs(os.path.dirname(envdir))
+        os.symlink(shared, envdir)
+        lock_filename = file_lock.named_lock(os.path.realpath(shared)).filename
+        held = []
+
+        def mock_lock(f):
+            held.append(f.name)
+
+        def mock_unlock(f):
+            held.remove(f.name)
+
+        def mock_find(self, prefix, spec):
+            assert [lock_filename] == held
+            return CondaEnvironmentDeviations(summary="OK",
+                                              missing_packages=(),
+                                              wrong_version_packages=(),
+                                              missing_pip_packages=(),
+                                              wrong_version_pip_packages=())
+
+        def mock_fix(self, prefix, spec, deviations):
+            assert [lock_filename] == held
+            assert deviations.ok
+
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock', mock_lock)
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._unlock', mock_unlock)
+        monkeypatch.setattr(DefaultCondaManager, 'find_environment_deviations', mock_find)
+        monkeypatch.setattr(DefaultCondaManager, '_fix_environment_deviations', mock_fix)
+
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [] == held
+
+    with_directory_contents(dict(), check)
+
+
+def _monkeypatch_offline(monkeypatch, pkgs_dir):
+    monkeypatch.setenv('CONDA_KAPSEL_OFFLINE', '1')
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.pkgs_dirs', lambda: [pkgs_dir])
+
+
+def test_offline_create_fails_fast(monkeypatch):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls)
+        _monkeypatch_offline(monkeypatch, os.path.join(dirname, 'pkgs'))
+        spec = EnvSpec(name='myenv', conda_packages=['numpy', 'six'], channels=[])
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert ("Offline mode is on, and the package cache doesn't have these packages needed for %s: numpy" %
+                envdir) == str(excinfo.value)
+        assert [] == calls
+
+        # with the package cached, we go ahead
+        os.makedirs(os.path.join(dirname, 'pkgs', 'numpy-1.11.1-py35_0', 'info'))
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert ('create', ['numpy', 'python', 'six']) == (calls[0][0], sorted(calls[0][1]))
+
+    with_directory_contents({'pkgs/python-3.5.2-0.tar.bz2': '', 'pkgs/six-1.10.0-py35_0.tar.bz2': ''}, check)
+
+
+def test_offline_create_from_lock_fails_fast(monkeypatch):
+    def check(dirname):
+        calls = []
+        _monkeypatch_conda_for_lock(monkeypatch, calls)
+        _monkeypatch_offline(monkeypatch, os.path.join(dirname, 'pkgs'))
+        spec = _lock_spec(dirname)
+        conda_lock.save_lock(spec.lock_filename, spec, conda_api.current_platform(),
+                             "@EXPLICIT\nhttps://repo.continuum.io/pkgs/free/linux-64/python-3.5.2-0.tar.bz2\n")
+        envdir = os.path.join(dirname, 'envs', 'myenv')
+
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert str(excinfo.value).endswith(": python-3.5.2-0.tar.bz2")
+        assert [] == calls
+
+        os.makedirs(os.path.join(dirname, 'pkgs'))
+        with open(os.path.join(dirname, 'pkgs', 'python-3.5.2-0.tar.bz2'), 'w') as f:
+            f.write("")
+        DefaultCondaManager().fix_environment_deviations(envdir, spec)
+        assert [('create_from_explicit', spec.lock_filename)] == calls
+
+    with_directory_contents(dict(), check)
+
+
+def test_offline_cannot_read_lock(monkeypatch):
+    def check(dirname):
+        _monkeypatch_offline(monkeypatch, os.path.join(dirname, 'pkgs'))
+        spec = _lock_spec(dirname)
+        monkeypatch.setattr('conda_kapsel.internal.conda_lock.is_lock_current', lambda filename, spec, platform: True)
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(os.path.join(dirname, 'envs', 'myenv'), spec)
+        assert str(excinfo.value).startswith("Failed to read %s: " % spec.lock_filename)
+
+    with_directory_contents(dict(), check)
+
+
+def test_offline_cannot_find_package_cache(monkeypatch):
+    def check(dirname):
+        def mock_pkgs_dirs():
+            raise conda_api.CondaError("no conda")
+
+        monkeypatch.setenv('CONDA_KAPSEL_OFFLINE', '1')
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.pkgs_dirs', mock_pkgs_dirs)
+        spec = EnvSpec(name='myenv', conda_packages=['numpy'], channels=[])
+        with pytest.raises(CondaManagerError) as excinfo:
+            DefaultCondaManager().fix_environment_deviations(os.path.join(dirname, 'envs', 'myenv'), spec)
+        assert "Failed to find the package cache: no conda" == str(excinfo.value)
+
+    with_directory_contents(dict(), check)
+
+
+def test_offline_nothing_to_install(monkeypatch):
+    def check(dirname):
+        _monkeypatch_offline(monkeypatch, os.path.join(dirname, 'pkgs'))
+        spec = EnvSpec(name='myenv', conda_packages=['six'], channels=[])
+        DefaultCondaManager().fix_environment_deviations(dirname, spec)
+
+    with_directory_contents({'conda-meta/six-1.10.0-py35_0.json': _conda_meta_record('six', '1.10.0', 'py35_0')},
+                            check)
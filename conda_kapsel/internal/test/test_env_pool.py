@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import errno
+import os
+
+from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.internal import env_pool
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_pool_directory():
+    assert env_pool.pool_directory(dict()) is None
+    assert env_pool.pool_directory({env_pool.POOL_DIRECTORY_VARIABLE: ''}) is None
+    assert os.path.abspath('pool') == env_pool.pool_directory({env_pool.POOL_DIRECTORY_VARIABLE: 'pool'})
+
+
+def test_env_spec_key():
+    spec = EnvSpec(name='foo', conda_packages=['numpy', 'python >=3'], channels=['a', 'b'], pip_packages=['flake8'])
+    same = EnvSpec(name='bar',
+                   conda_packages=['python  >=3', 'numpy', 'numpy'],
+                   channels=['a', 'b'],
+                   pip_packages=['flake8'],
+                   description="Bar")
+    assert env_pool.env_spec_key(spec) == env_pool.env_spec_key(same)
+    assert os.path.join('pool', env_pool.env_spec_key(spec)) == env_pool.pool_prefix('pool', spec)
+
+    different = (EnvSpec(name='foo', conda_packages=['numpy', 'python >=3'], channels=['b', 'a'],
+                         pip_packages=['flake8']),
+                 EnvSpec(name='foo', conda_packages=['numpy', 'python'], channels=['a', 'b'], pip_packages=['flake8']),
+                 EnvSpec(name='foo', conda_packages=['numpy', 'python >=3'], channels=['a', 'b']))
+    for other in different:
+        assert env_pool.env_spec_key(spec) != env_pool.env_spec_key(other)
+
+
+def test_attach_and_release():
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        os.makedirs(os.path.join(shared, 'conda-meta'))
+        first = os.path.join(dirname, 'one', 'envs', 'default')
+        second = os.path.join(dirname, 'two', 'envs', 'default')
+
+        assert env_pool.shared_prefix_for_link(first) is None
+        assert [] == env_pool.users(shared)
+
+        env_pool.attach(shared, first)
+        env_pool.attach(shared, second)
+        assert shared == env_pool.shared_prefix_for_link(first)
+        assert os.path.isdir(os.path.join(first, 'conda-meta'))
+        assert [first, second] == env_pool.users(shared)
+
+        assert not env_pool.release(first)
+        assert not os.path.lexists(first)
+        assert os.path.isdir(shared)
+        assert [second] == env_pool.users(shared)
+
+        assert env_pool.release(second)
+        assert not os.path.lexists(second)
+        assert ['abc.lock'] == os.listdir(os.path.join(dirname, 'pool'))
+
+    with_directory_contents(dict(), check)
+
+
+def test_users_ignores_stale_records():
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        other = os.path.join(dirname, 'pool', 'def')
+        os.makedirs(shared)
+        os.makedirs(other)
+        first = os.path.join(dirname, 'one', 'envs', 'default')
+        second = os.path.join(dirname, 'two', 'envs', 'default')
+        third = os.path.join(dirname, 'three', 'envs', 'default')
+        env_pool.attach(shared, first)
+        env_pool.attach(shared, second)
+        env_pool.attach(shared, third)
+
+        # a project was deleted, and another was pointed elsewhere
+        os.remove(second)
+        os.remove(third)
+        env_pool.attach(other, third)
+        # and a record we can't read
+        os.makedirs(os.path.join(shared + '.users', 'unreadable'))
+
+        assert [first] == env_pool.users(shared)
+        assert env_pool.release(first)
+        assert not os.path.exists(shared)
+        assert os.path.isdir(other)
+
+    with_directory_contents(dict(), check)
+
+
+def test_relative_and_non_pool_links():
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        os.makedirs(shared + '.users')
+        link = os.path.join(dirname, 'envs', 'default')
+        os.makedirs(os.path.dirname(link))
+        os.symlink(os.path.join('..', 'pool', 'abc'), link)
+        assert shared == env_pool.shared_prefix_for_link(link)
+
+        plain = os.path.join(dirname, 'envs', 'plain')
+        os.symlink(os.path.join(dirname, 'elsewhere'), plain)
+        assert env_pool.shared_prefix_for_link(plain) is None
+
+    with_directory_contents(dict(), check)
+
+
+def test_attach_replaces_dangling_link_and_release_missing_env():
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        link = os.path.join(dirname, 'envs', 'default')
+        os.makedirs(os.path.dirname(link))
+        os.symlink(os.path.join(dirname, 'gone'), link)
+
+        # the shared env itself was never created
+        env_pool.attach(shared, link)
+        assert shared == env_pool.shared_prefix_for_link(link)
+        assert env_pool.release(link)
+        # the lock stays, since someone else may be waiting on it
+        assert ['abc.lock'] == os.listdir(os.path.join(dirname, 'pool'))
+
+    with_directory_contents(dict(), check)
+
+
+def test_attach_prepares_while_holding_lock():
+    import threading
+
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        os.makedirs(os.path.join(shared, 'conda-meta'))
+        keeper = os.path.join(dirname, 'keeper', 'envs', 'default')
+        link = os.path.join(dirname, 'envs', 'default')
+        env_pool.attach(shared, keeper)
+
+        released = []
+        releaser = threading.Thread(target=lambda: released.append(env_pool.release(keeper)))
+
+        def prepare():
+            # the last other user leaves while we're fixing the env
+            releaser.start()
+            releaser.join(0.3)
+            assert releaser.is_alive()
+            assert os.path.isdir(shared)
+
+        assert env_pool.attach(shared, link, prepare=prepare)
+        releaser.join()
+
+        # we were attached before the release could look for users
+        assert [False] == released
+        assert os.path.isdir(shared)
+        assert [link] == env_pool.users(shared)
+
+    with_directory_contents(dict(), check)
+
+
+def test_attach_without_symlinks(monkeypatch):
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        link = os.path.join(dirname, 'envs', 'default')
+
+        def mock_symlink(target, link_path):
+            raise OSError(errno.EPERM, "A required privilege is not held by the client")
+
+        monkeypatch.setattr('os.symlink', mock_symlink)
+        monkeypatch.setattr('conda_kapsel.internal.env_pool._symlinks_supported_in', dict())
+
+        assert not env_pool.symlinks_supported(os.path.join(dirname, 'pool'))
+        assert not env_pool.attach(shared, link)
+        assert not os.path.lexists(link)
+        assert [] == env_pool.users(shared)
+        assert [] == os.listdir(os.path.join(dirname, 'pool', 'abc.users'))
+
+    with_directory_contents(dict(), check)
+
+
+def test_symlinks_supported():
+    def check(dirname):
+        pool = os.path.join(dirname, 'pool')
+        assert env_pool.symlinks_supported(pool)
+        # the probe link is cleaned up
+        assert [] == os.listdir(pool)
+
+    with_directory_contents(dict(), check)
+
+
+def test_attach_and_release_from_several_threads():
+    import threading
+
+    def check(dirname):
+        shared = os.path.join(dirname, 'pool', 'abc')
+        os.makedirs(os.path.join(shared, 'conda-meta'))
+        keeper = os.path.join(dirname, 'keeper', 'envs', 'default')
+        env_pool.attach(shared, keeper)
+
+        errors = []
+
+        def attach_and_release(index):
+            link = os.path.join(dirname, 'project%d' % index, 'envs', 'default')
+            try:
+                for i in range(10):
+                    assert env_pool.attach(shared, link)
+                    assert not env_pool.release(link)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=attach_and_release, args=(index, )) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert [] == errors
+        assert [keeper] == env_pool.users(shared)
+        assert env_pool.release(keeper)
+        assert not os.path.exists(shared)
+
+    with_directory_contents(dict(), check)
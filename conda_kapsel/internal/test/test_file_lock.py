@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+import threading
+import time
+
+import pytest
+
+from conda_kapsel.internal import file_lock
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_lock_creates_file_and_directory():
+    def check(dirname):
+        filename = os.path.join(dirname, 'a', 'b', 'foo.lock')
+        lock = file_lock.FileLock(filename)
+        assert filename == lock.filename
+        assert not os.path.exists(filename)
+        with lock as entered:
+            assert lock is entered
+            assert os.path.isfile(filename)
+        assert os.path.isfile(filename)
+        # the lock can be taken again after release
+        with lock:
+            pass
+
+    with_directory_contents(dict(), check)
+
+
+def test_lock_excludes_other_threads():
+    def check(dirname):
+        filename = os.path.join(dirname, 'foo.lock')
+        events = []
+
+        def hold(name):
+            with file_lock.FileLock(filename):
+                events.append(name + " start")
+                time.sleep(0.05)
+                events.append(name + " end")
+
+        threads = [threading.Thread(target=hold, args=(str(i), )) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert 8 == len(events)
+        for i in range(0, 8, 2):
+            assert events[i].endswith(" start")
+            assert events[i + 1] == events[i].replace(" start", " end")
+
+    with_directory_contents(dict(), check)
+
+
+def test_lock_released_on_exception():
+    def check(dirname):
+        filename = os.path.join(dirname, 'foo.lock')
+        with pytest.raises(RuntimeError):
+            with file_lock.FileLock(filename):
+                raise RuntimeError("oops")
+
+        acquired = []
+
+        def take():
+            with file_lock.FileLock(filename):
+                acquired.append(True)
+
+        thread = threading.Thread(target=take)
+        thread.start()
+        thread.join(10)
+        assert [True] == acquired
+
+    with_directory_contents(dict(), check)
+
+
+def test_lock_fails_to_lock(monkeypatch):
+    def check(dirname):
+        def mock_lock(f):
+            raise IOError("no locks here")
+
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock', mock_lock)
+        lock = file_lock.FileLock(os.path.join(dirname, 'foo.lock'))
+        with pytest.raises(IOError) as excinfo:
+            with lock:
+                pass
+        assert "no locks here" in str(excinfo.value)
+
+    with_directory_contents(dict(), check)
+
+
+def test_named_lock(monkeypatch):
+    def check(dirname):
+        monkeypatch.setattr('conda_kapsel.internal.file_lock._lock_directory', lambda: dirname)
+        lock = file_lock.named_lock("/some/prefix")
+        assert dirname == os.path.dirname(lock.filename)
+        assert lock.filename.endswith(".lock")
+        assert lock.filename == file_lock.named_lock("/some/prefix").filename
+        assert lock.filename != file_lock.named_lock("/other/prefix").filename
+
+    with_directory_contents(dict(), check)
+
+
+def test_lock_directory_in_user_cache(monkeypatch):
+    monkeypatch.setattr('conda_kapsel.internal.project_cache.user_cache_directory', lambda: "/cache")
+    assert os.path.join("/cache", "locks") == file_lock._lock_directory()
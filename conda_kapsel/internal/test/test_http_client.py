@@ -6,6 +6,7 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+from conda_kapsel.internal import timing
 from conda_kapsel.internal.http_client import FileDownloader
 from conda_kapsel.internal.test.http_server import HttpServerTestContext
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
@@ -50,6 +51,28 @@ def test_download_small_file_hashless():
     _download_file(1024, None)
 
 
+def test_download_records_timing():
+    def inside_directory_download_file(dirname):
+        filename = os.path.join(dirname, "downloaded-file")
+        timings = timing.Timings()
+        with HttpServerTestContext() as server:
+            url = server.new_download_url(download_length=1024, hash_algorithm=None)
+            download = FileDownloader(url=url, filename=filename)
+            with timing.recording(timings):
+                response = IOLoop.current().run_sync(lambda: download.run(IOLoop.current()))
+            assert response.code == 200
+
+        [record] = timings.records
+        assert timing.TIMING_KIND_DOWNLOAD == record.kind
+        assert "Download " + url == record.name
+        assert url == record.args['url']
+        assert filename == record.args['filename']
+        assert 1024 == record.args['bytes']
+        assert record.args['first_byte_seconds'] <= record.duration
+
+    with_directory_contents(dict(), inside_directory_download_file)
+
+
 def test_download_medium_file_md5():
     _download_file(1024 * 1024, 'md5')
 
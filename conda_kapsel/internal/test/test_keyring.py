@@ -144,3 +144,41 @@ def test_unset_using_broken(monkeypatch, capsys):
     assert (expected_broken_message % "deleting") == err
 
     keyring.reset_keyring_module()
+
+
+def test_import_keyring_from_several_threads(monkeypatch):
+    import importlib
+    import threading
+    import time
+    try:
+        import builtins
+    except ImportError:  # pragma: no cover (py2 only)
+        import __builtin__ as builtins  # pragma: no cover (py2 only)
+
+    real_module = importlib.import_module('keyring')
+    monkeypatch.setattr('conda_kapsel.internal.keyring.keyring', None)
+    monkeypatch.setattr('conda_kapsel.internal.keyring._keyring_imported', False)
+
+    # make the import slow so the other threads ask for the module
+    # while the first one is still importing it
+    original_import = builtins.__import__
+
+    def slow_import(name, *args, **kwargs):
+        if name == 'keyring':
+            time.sleep(0.1)
+        return original_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', slow_import)
+
+    results = []
+
+    def import_keyring():
+        results.append(keyring._import_keyring())
+
+    threads = [threading.Thread(target=import_keyring) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [real_module] * 4 == results
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+
+from conda_kapsel.internal import package_cache
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def _file_url(path):
+    if not path.startswith('/'):
+        path = '/' + path.replace('\\', '/')  # pragma: no cover (no Windows in the coverage run)
+    return 'file://' + path
+
+
+def test_missing_packages_for_specs():
+    def check(dirname):
+        pkgs = os.path.join(dirname, 'pkgs')
+        channel = os.path.join(dirname, 'channel')
+        specs = ['numpy>=1.11', 'six', 'bokeh=0.12', 'python 3.5*', 'requests', 'flask', 'not a valid spec!']
+        missing = package_cache.missing_packages_for_specs(specs,
+                                                           channels=['defaults', _file_url(channel)],
+                                                           pkgs_dirs=[pkgs, os.path.join(dirname, 'nope')],
+                                                           conda_platform='linux-64')
+        assert ['numpy>=1.11', 'flask'] == missing
+
+    with_directory_contents(
+        {
+            # too old
+            'pkgs/numpy-1.10.4-py35_0.tar.bz2': '',
+            # extracted but no tarball
+            'pkgs/six-1.10.0-py35_0/info/index.json': '{}',
+            'pkgs/bokeh-0.12.1-py35_0.tar.bz2': '',
+            'pkgs/python-3.5.2-0.tar.bz2': '',
+            # not a package
+            'pkgs/urls.txt': '',
+            'pkgs/flask/info/index.json': '{}',
+            'channel/linux-64/requests-2.10.0-py35_0.tar.bz2': '',
+            # wrong platform
+            'channel/osx-64/flask-0.11-py35_0.tar.bz2': ''
+        }, check)
+
+
+def test_missing_packages_for_specs_noarch_channel():
+    def check(dirname):
+        channel = os.path.join(dirname, 'channel')
+        assert [] == package_cache.missing_packages_for_specs(['six'], [_file_url(channel)], [], 'linux-64')
+        assert ['six'] == package_cache.missing_packages_for_specs(['six'], [], [], 'linux-64')
+
+    with_directory_contents({'channel/noarch/six-1.10.0-py_0.tar.bz2': ''}, check)
+
+
+def test_missing_tarballs_for_explicit():
+    def check(dirname):
+        local = os.path.join(dirname, 'local', 'foo-1.0-0.tar.bz2')
+        lock = os.path.join(dirname, 'lock.txt')
+        with open(lock, 'w') as f:
+            f.write("# platform: linux-64\n"
+                    "@EXPLICIT\n"
+                    "\n"
+                    "https://repo.continuum.io/pkgs/free/linux-64/python-3.5.2-0.tar.bz2\n"
+                    "https://repo.continuum.io/pkgs/free/linux-64/six-1.10.0-py35_0.tar.bz2#abcdef\n"
+                    "https://repo.continuum.io/pkgs/free/linux-64/numpy-1.11.1-py35_0.tar.bz2\n" +
+                    _file_url(local) + "\n" +
+                    _file_url(os.path.join(dirname, 'local', 'gone-1.0-0.tar.bz2')) + "\n")
+        missing = package_cache.missing_tarballs_for_explicit(lock, [os.path.join(dirname, 'pkgs')])
+        assert ['numpy-1.11.1-py35_0.tar.bz2', 'gone-1.0-0.tar.bz2'] == missing
+
+    with_directory_contents(
+        {
+            'pkgs/python-3.5.2-0.tar.bz2': '',
+            'pkgs/six-1.10.0-py35_0/info/index.json': '{}',
+            'local/foo-1.0-0.tar.bz2': ''
+        }, check)
+
+
+def test_missing_tarballs_for_explicit_cannot_read():
+    def check(dirname):
+        with pytest.raises(IOError):
+            package_cache.missing_tarballs_for_explicit(os.path.join(dirname, 'nope.txt'), [])
+
+    with_directory_contents(dict(), check)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+import threading
+import time
+
+import pytest
+
+from conda_kapsel.internal import subprocess_runner
+from conda_kapsel.internal.parallel import parallel_map
+
+
+def test_parallel_map_keeps_order():
+    def slow_in_reverse(i):
+        time.sleep(0.01 * (10 - i))
+        return i * 2
+
+    assert [i * 2 for i in range(10)] == parallel_map(slow_in_reverse, range(10))
+
+
+def test_parallel_map_empty_and_single():
+    assert [] == parallel_map(lambda x: x, [])
+    assert [threading.current_thread()] == parallel_map(lambda x: threading.current_thread(), [1])
+
+
+def test_parallel_map_runs_concurrently():
+    barrier_count = [0]
+    lock = threading.Lock()
+    all_arrived = threading.Event()
+
+    def wait_for_all(i):
+        with lock:
+            barrier_count[0] += 1
+            if barrier_count[0] == 4:
+                all_arrived.set()
+        # deadlocks (times out) unless all four run at once
+        return all_arrived.wait(10)
+
+    assert [True] * 4 == parallel_map(wait_for_all, range(4), max_workers=4)
+
+
+def test_parallel_map_bounded_workers():
+    active = [0]
+    max_active = [0]
+    lock = threading.Lock()
+
+    def track(i):
+        with lock:
+            active[0] += 1
+            max_active[0] = max(max_active[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return i
+
+    assert list(range(20)) == parallel_map(track, range(20), max_workers=3)
+    assert max_active[0] <= 3
+
+
+def test_parallel_map_raises_earliest_error_after_finishing():
+    finished = []
+
+    def fail_some(i):
+        if i in (3, 7):
+            raise ValueError("failed %d" % i)
+        finished.append(i)
+        return i
+
+    with pytest.raises(ValueError) as excinfo:
+        parallel_map(fail_some, range(10), max_workers=4)
+    assert "failed 3" in repr(excinfo.value)
+    assert sorted(finished) == [0, 1, 2, 4, 5, 6, 8, 9]
+
+
+def test_parallel_map_passes_on_subprocess_handler_and_cancellation():
+    def handler(stream, line):
+        pass
+
+    cancellation = subprocess_runner.Cancellation()
+
+    def get_current(item):
+        return (subprocess_runner.current_line_handler(), subprocess_runner.current_cancellation())
+
+    with subprocess_runner.lines_to(handler), subprocess_runner.cancelled_by(cancellation):
+        results = parallel_map(get_current, range(3), max_workers=3)
+    assert [(handler, cancellation)] * 3 == results
+
+
+def test_parallel_map_cancels_workers_when_interrupted(monkeypatch):
+    cancellation = subprocess_runner.Cancellation()
+    finished = []
+
+    def wait_for_cancel(item):
+        finished.append(subprocess_runner.current_cancellation().wait(30))
+
+    real_join = threading.Thread.join
+    interrupted = []
+
+    def join_interrupted_once(thread, *args, **kwargs):
+        if not interrupted:
+            interrupted.append(True)
+            raise KeyboardInterrupt()
+        return real_join(thread, *args, **kwargs)
+
+    monkeypatch.setattr('threading.Thread.join', join_interrupted_once)
+    with subprocess_runner.cancelled_by(cancellation):
+        with pytest.raises(KeyboardInterrupt):
+            parallel_map(wait_for_cancel, range(3), max_workers=3)
+
+    assert cancellation.cancelled
+    assert [True] * 3 == finished
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import gzip
+import io
+import os
+import struct
+import zlib
+
+import pytest
+
+from conda_kapsel.internal import parallel_compress
+
+# some that compresses well, and some that doesn't
+_DATA = (b"all work and no play makes jack a dull boy\n" * 20000) + os.urandom(200000)
+
+
+def _gunzip(compressed):
+    with gzip.GzipFile(fileobj=io.BytesIO(compressed), mode='rb') as f:
+        return f.read()
+
+
+def _parallel_gzip(chunks, **kwargs):
+    out = io.BytesIO()
+    with parallel_compress.ParallelGzipFile(out, **kwargs) as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return out.getvalue()
+
+
+def test_default_workers():
+    assert parallel_compress.default_workers() >= 1
+
+
+def test_deflate_matches_zlib():
+    # the same bytes zipfile gets with its own compressor
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    expected = compressor.compress(_DATA) + compressor.flush()
+    assert expected == parallel_compress.deflate(_DATA, zlib.Z_DEFAULT_COMPRESSION)
+
+
+def test_deflate_blocks_concatenate():
+    first = _DATA[:100000]
+    second = _DATA[100000:]
+    compressed = (parallel_compress.deflate(first, 6, last=False) +
+                  parallel_compress.deflate(second, 6, dictionary=first[-32768:], last=True))
+    assert _DATA == zlib.decompress(compressed, -zlib.MAX_WBITS)
+
+
+def test_parallel_gzip_round_trip():
+    for workers in (1, 3, 8):
+        compressed = _parallel_gzip([_DATA], workers=workers, block_size=16 * 1024)
+        assert _DATA == _gunzip(compressed)
+        # the dictionaries keep it close to single-stream gzip
+        assert len(compressed) < len(zlib.compress(_DATA, 9)) * 1.05
+
+
+def test_parallel_gzip_small_writes():
+    chunks = [_DATA[i:i + 1000] for i in range(0, len(_DATA), 1000)]
+    assert _DATA == _gunzip(_parallel_gzip(chunks, workers=4, block_size=4096))
+
+
+def test_parallel_gzip_empty():
+    compressed = _parallel_gzip([b''], workers=4)
+    assert b'' == _gunzip(compressed)
+
+
+def test_parallel_gzip_header_and_trailer():
+    compressed = _parallel_gzip([b'hello'], level=1, workers=2, mtime=1234)
+    assert b'\x1f\x8b\x08\x00' == compressed[:4]
+    assert (1234, 4, 255) == struct.unpack('<LBB', compressed[4:10])
+    assert (zlib.crc32(b'hello') & 0xffffffff, 5) == struct.unpack('<LL', compressed[-8:])
+
+    assert struct.unpack('<B', _parallel_gzip([b''], level=9)[8:9])[0] == 2
+    assert struct.unpack('<B', _parallel_gzip([b''], level=6)[8:9])[0] == 0
+
+
+def test_parallel_gzip_close_twice_and_exception():
+    out = io.BytesIO()
+    f = parallel_compress.ParallelGzipFile(out, workers=2)
+    f.write(b'hello')
+    f.close()
+    size = len(out.getvalue())
+    f.close()
+    assert size == len(out.getvalue())
+
+    out = io.BytesIO()
+    with pytest.raises(RuntimeError):
+        with parallel_compress.ParallelGzipFile(out, workers=2) as f:
+            f.write(b'hello')
+            raise RuntimeError("oops")
+    # no trailer on a file that failed
+    assert 10 == len(out.getvalue())
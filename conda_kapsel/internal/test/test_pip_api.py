@@ -9,9 +9,11 @@ from __future__ import absolute_import, print_function
 import os
 import platform
 import pytest
+import time
 
 import conda_kapsel.internal.conda_api as conda_api
 import conda_kapsel.internal.pip_api as pip_api
+import conda_kapsel.internal.subprocess_runner as subprocess_runner
 
 from conda_kapsel.internal.test.tmpfile_utils import (with_directory_contents, tmp_script_commandline)
 from conda_kapsel.internal.test.test_conda_api import monkeypatch_conda_not_to_use_links
@@ -140,6 +142,164 @@ def test_installed_on_nonexistent_prefix():
     assert dict() == installed
 
 
+def _age(path):
+    long_ago = time.time() - 60
+    os.utime(path, (long_ago, long_ago))
+
+
+_PIP_AND_SITE_PACKAGES = {
+    'bin/pip': "",
+    'lib/python3.5/site-packages/six-1.10.0.dist-info/METADATA': "Metadata-Version: 2.0\nName: six\nVersion: 1.10.0\n",
+    'lib/python3.5/site-packages/ruamel.yaml-0.11.14.dist-info/METADATA':
+    "Name: ruamel.yaml\nVersion: 0.11.14\n\nName: not-the-name\n",
+    'lib/python3.5/site-packages/no_metadata-2.0.dist-info/RECORD': "",
+    'lib/python3.5/site-packages/tables-3.2.2-py3.5.egg-info/PKG-INFO': "Name: tables\nVersion: 3.2.2\n",
+    'lib/python3.5/site-packages/terminado-0.5-py3.5.egg-info': "Name: terminado\nVersion: 0.5\n",
+    'lib/python3.5/site-packages/flake8-3.0.4-py3.5.egg/EGG-INFO/PKG-INFO': "Name: flake8\nVersion: 3.0.4\n",
+    'lib/python3.5/site-packages/six.py': "",
+    'lib/python3.5/site-packages/weird.dist-info/RECORD': "",
+    'lib/python3.5/site-packages/broken.egg-link': "/this/does/not/exist\n.\n",
+    'lib/python2.7/site-packages/sympy-0.7.6.1-py2.7.egg-info/PKG-INFO': "Name: sympy\nVersion: 0.7.6.1\n",
+    'lib/libfoo.so': ""
+}
+
+
+def test_installed_reads_site_packages_metadata():
+    def check(dirname):
+        source = os.path.join(dirname, 'src', 'mine')
+        os.makedirs(os.path.join(source, 'mine.egg-info'))
+        with open(os.path.join(source, 'mine.egg-info', 'PKG-INFO'), 'w') as f:
+            f.write("Name: mine\nVersion: 0.1.dev0\n")
+        with open(os.path.join(dirname, 'lib/python3.5/site-packages/mine.egg-link'), 'w') as f:
+            f.write(source + "\n.\n")
+
+        installed = pip_api.installed(prefix=dirname)
+        assert {
+            'six': ('six', '1.10.0'),
+            'ruamel.yaml': ('ruamel.yaml', '0.11.14'),
+            'no_metadata': ('no_metadata', '2.0'),
+            'tables': ('tables', '3.2.2'),
+            'terminado': ('terminado', '0.5'),
+            'flake8': ('flake8', '3.0.4'),
+            'mine': ('mine', '0.1.dev0'),
+            'sympy': ('sympy', '0.7.6.1')
+        } == installed
+
+    with_directory_contents(_PIP_AND_SITE_PACKAGES, check)
+
+
+def test_installed_reads_egg_links():
+    def check(dirname):
+        site_packages = os.path.join(dirname, 'lib/python3.5/site-packages')
+
+        def link(name, *lines):
+            with open(os.path.join(site_packages, name), 'w') as f:
+                f.write("".join(line + "\n" for line in lines))
+
+        # "pip install -e" of a src layout points at the src directory
+        link('src-layout.egg-link', os.path.join(dirname, 'projects', 'srclayout', 'src'), '../')
+        # an older one points at the source tree while setup.py put
+        # the egg-info in src
+        link('elsewhere.egg-link', os.path.join(dirname, 'projects', 'elsewhere'), '.')
+        # a relative path, to a tree with several projects' egg-info
+        link('My-Project.egg-link', os.path.join('..', '..', '..', 'projects', 'several'), '.')
+        # an egg-info that's a file
+        link('flat.egg-link', os.path.join(dirname, 'projects', 'flat'), '.')
+
+        installed = pip_api._scan_site_packages(site_packages)
+        assert ('src-layout', '1.0') == installed['src-layout']
+        assert ('elsewhere', '2.0.dev0') == installed['elsewhere']
+        assert ('My-Project', '3.0') == installed['My-Project']
+        assert ('flat', '4.0') == installed['flat']
+        assert 'other' not in installed
+        assert 'broken' not in installed
+
+    with_directory_contents({
+        'lib/python3.5/site-packages/broken.egg-link': "/this/does/not/exist\n.\n",
+        'projects/srclayout/setup.py': "",
+        'projects/srclayout/src/src_layout.egg-info/PKG-INFO': "Name: src-layout\nVersion: 1.0\n",
+        'projects/elsewhere/setup.py': "",
+        'projects/elsewhere/src/elsewhere.egg-info/PKG-INFO': "Name: elsewhere\nVersion: 2.0.dev0\n",
+        'projects/several/another.egg-info/PKG-INFO': "Name: another\nVersion: 9.9\n",
+        'projects/several/My_Project.egg-info/PKG-INFO': "Name: My-Project\nVersion: 3.0\n",
+        'projects/flat/flat.egg-info': "Name: flat\nVersion: 4.0\n"
+    }, check)
+
+
+def test_installed_reads_windows_site_packages():
+    def check(dirname):
+        assert dict(six=('six', '1.10.0')) == pip_api.installed(prefix=dirname)
+
+    with_directory_contents({'Scripts/pip.exe': "",
+                             'Lib/site-packages/six-1.10.0.dist-info/METADATA': "Name: six\nVersion: 1.10.0\n"}, check)
+
+
+def test_installed_caches_until_site_packages_changes(monkeypatch):
+    def check(dirname):
+        site_packages = os.path.join(dirname, 'lib/python3.5/site-packages')
+        _age(site_packages)
+        _age(os.path.join(dirname, 'lib/python2.7/site-packages'))
+        assert 'six' in pip_api.installed(prefix=dirname)
+
+        os.rename(os.path.join(site_packages, 'six-1.10.0.dist-info'), os.path.join(dirname, 'six-1.10.0.dist-info'))
+        # the old mtime was cached but doesn't match anymore
+        assert 'six' not in pip_api.installed(prefix=dirname)
+
+        _age(site_packages)
+        installed = pip_api.installed(prefix=dirname)
+        assert 'six' not in installed
+
+        def mock_scan(site_packages):
+            raise AssertionError("should not rescan")
+
+        monkeypatch.setattr('conda_kapsel.internal.pip_api._scan_site_packages', mock_scan)
+        assert installed == pip_api.installed(prefix=dirname)
+
+    with_directory_contents(_PIP_AND_SITE_PACKAGES, check)
+
+
+def test_installed_without_pip():
+    def check(dirname):
+        assert dict() == pip_api.installed(prefix=dirname)
+
+    with_directory_contents({'lib/python3.5/site-packages/six-1.10.0.dist-info/METADATA': "Name: six\n"}, check)
+
+
+def test_installed_falls_back_to_pip_list(monkeypatch):
+    def mock_call_pip(prefix, extra_args):
+        assert ['list'] == extra_args
+        return "sympy (0.7.6.1)\r\ntables (3.2.2)\r\n".encode('utf-8')
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+
+    def check_no_site_packages(dirname):
+        expected = dict(sympy=('sympy', '0.7.6.1'), tables=('tables', '3.2.2'))
+        assert expected == pip_api.installed(prefix=dirname)
+
+    with_directory_contents({'bin/pip': ""}, check_no_site_packages)
+
+    def check_cannot_list_site_packages(dirname):
+        from os import listdir as real_listdir
+
+        def mock_listdir(path):
+            if path.endswith('site-packages'):
+                raise OSError("cannot list this")
+            return real_listdir(path)
+
+        monkeypatch.setattr('os.listdir', mock_listdir)
+        assert 'sympy' in pip_api.installed(prefix=dirname)
+
+    with_directory_contents(_PIP_AND_SITE_PACKAGES, check_cannot_list_site_packages)
+
+
+def test_installed_from_pip_list_without_pip(monkeypatch):
+    def mock_call_pip(prefix, extra_args):
+        raise pip_api.PipNotInstalledError("no pip")
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api._call_pip', mock_call_pip)
+    assert dict() == pip_api._installed_from_pip_list("/nope")
+
+
 def test_parse_spec():
     # just a package name
     assert "foo" == pip_api.parse_spec("foo").name
@@ -158,3 +318,45 @@ def test_parse_spec():
                  'SomeProject~=1.4.2', "SomeProject ==5.4 ; python_version < '2.7'",
                  "SomeProject; sys_platform == 'win32'"]:
         assert "SomeProject" == pip_api.parse_spec(spec).name
+
+
+def test_pip_streams_output_and_can_be_cancelled(monkeypatch, capsys):
+    script = """from __future__ import print_function
+import sys
+import time
+print("Collecting flake8")
+sys.stdout.flush()
+print("TEST_WARNING", file=sys.stderr)
+sys.stderr.flush()
+if len(sys.argv) > 1:
+    time.sleep(60)
+"""
+
+    def get_command(prefix, extra_args):
+        if 'uninstall' in extra_args:
+            return tmp_script_commandline(script) + ['slow']
+        else:
+            return tmp_script_commandline(script)
+
+    monkeypatch.setattr('conda_kapsel.internal.pip_api._get_pip_command', get_command)
+
+    lines = []
+    with subprocess_runner.lines_to(lambda stream, line: lines.append(line)):
+        pip_api.install(prefix='/prefix', pkgs=['flake8'])
+    assert ["Collecting flake8", "TEST_WARNING"] == sorted(lines)
+    (out, err) = capsys.readouterr()
+    assert '' == err
+
+    cancellation = subprocess_runner.Cancellation()
+
+    def on_line(stream, line):
+        cancellation.cancel()
+
+    with subprocess_runner.lines_to(on_line), subprocess_runner.cancelled_by(cancellation):
+        with pytest.raises(pip_api.PipError) as excinfo:
+            pip_api.remove(prefix='/prefix', pkgs=['flake8'])
+    assert str(excinfo.value).endswith(': cancelled')
+
+    with pytest.raises(pip_api.PipError) as excinfo:
+        pip_api._call_pip('/prefix', ['uninstall'], timeout=0.2)
+    assert 'timed out after 0.2 seconds' in str(excinfo.value)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import datetime
+import json
+import os
+
+from conda_kapsel.internal.project_cache import (cache_filename, load_cache, save_cache, user_cache_directory,
+                                                 user_cache_filename)
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_save_and_load_cache():
+    def check(dirname):
+        filename = cache_filename(dirname, "foo")
+        assert filename == os.path.join(dirname, ".kapsel-cache", "foo.json")
+        assert load_cache(filename) is None
+        assert save_cache(filename, dict(a=[1, 2], b="c"))
+        assert dict(a=[1, 2], b="c") == load_cache(filename)
+        # no temporary files left behind
+        assert ["foo.json"] == os.listdir(os.path.dirname(filename))
+
+    with_directory_contents(dict(), check)
+
+
+def test_load_cache_wrong_version():
+    def check(dirname):
+        filename = cache_filename(dirname, "foo")
+        assert save_cache(filename, "bar")
+        with open(filename, 'w') as f:
+            json.dump(dict(version=-1, content="bar"), f)
+        assert load_cache(filename) is None
+
+    with_directory_contents(dict(), check)
+
+
+def test_load_cache_corrupted():
+    def check(dirname):
+        filename = os.path.join(dirname, "foo.json")
+        assert load_cache(filename) is None
+
+    with_directory_contents({"foo.json": "{ this is not json"}, check)
+
+
+def test_save_cache_unserializable():
+    def check(dirname):
+        filename = cache_filename(dirname, "foo")
+        assert not save_cache(filename, dict(a=datetime.date(2016, 1, 1)))
+        # would not load back the same
+        assert not save_cache(filename, dict(a=(1, 2)))
+        assert not save_cache(filename, {1: 2})
+        assert not os.path.exists(filename)
+
+    with_directory_contents(dict(), check)
+
+
+def test_save_cache_fails_to_write():
+    def check(dirname):
+        # a file where the cache directory should be
+        filename = os.path.join(dirname, "blocker", "foo.json")
+        assert not save_cache(filename, "bar")
+
+    with_directory_contents(dict(blocker="not a directory"), check)
+
+
+def test_user_cache_directory(monkeypatch):
+    monkeypatch.setattr('os.path.expanduser', lambda path: path.replace('~', '/home/me'))
+
+    monkeypatch.setattr('platform.system', lambda: 'Linux')
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    assert os.path.join('/home/me', '.cache', 'conda-kapsel') == user_cache_directory()
+    monkeypatch.setenv('XDG_CACHE_HOME', '/xdg')
+    assert os.path.join('/xdg', 'conda-kapsel') == user_cache_directory()
+    assert os.path.join('/xdg', 'conda-kapsel', 'foo.json') == user_cache_filename('foo')
+
+    monkeypatch.setattr('platform.system', lambda: 'Darwin')
+    assert os.path.join('/home/me', 'Library', 'Caches', 'conda-kapsel') == user_cache_directory()
+
+    monkeypatch.setattr('platform.system', lambda: 'Windows')
+    monkeypatch.setenv('LOCALAPPDATA', 'C:\\Local')
+    assert os.path.join('C:\\Local', 'conda-kapsel', 'Cache') == user_cache_directory()
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import os
+
+from conda_kapsel.internal import py2_compat
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
+
+
+def test_listdir_scandir():
+    def check(dirname):
+        entries = dict((entry.name, entry) for entry in py2_compat._listdir_scandir(dirname))
+        assert ['bar', 'foo.txt'] == sorted(entries.keys())
+        assert os.path.join(dirname, 'foo.txt') == entries['foo.txt'].path
+        assert entries['bar'].is_dir()
+        assert not entries['foo.txt'].is_dir()
+        assert not entries['bar'].is_symlink()
+        assert 3 == entries['foo.txt'].stat().st_size
+        assert 3 == entries['foo.txt'].stat(follow_symlinks=False).st_size
+
+    with_directory_contents({'foo.txt': 'abc', 'bar/baz': ''}, check)
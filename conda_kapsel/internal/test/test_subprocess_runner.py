@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import, print_function
+
+import subprocess
+import threading
+import time
+
+import pytest
+
+from conda_kapsel.internal import subprocess_runner
+from conda_kapsel.internal.test.tmpfile_utils import tmp_script_commandline
+
+_chatty_script = """from __future__ import print_function
+import sys
+print("one")
+sys.stdout.flush()
+print("warning", file=sys.stderr)
+print("two")
+sys.exit(3)
+"""
+
+_slow_script = """from __future__ import print_function
+import sys
+import time
+print("started")
+sys.stdout.flush()
+time.sleep(60)
+"""
+
+
+def test_run_keeps_output():
+    result = subprocess_runner.run(tmp_script_commandline(_chatty_script))
+    assert 3 == result.returncode
+    assert b"one\ntwo\n" == result.stdout.replace(b"\r\n", b"\n")
+    assert b"warning" == result.stderr.strip()
+    assert result.duration > 0
+    assert not result.timed_out
+    assert not result.cancelled
+
+
+def test_run_streams_lines():
+    lines = []
+
+    def on_line(stream, line):
+        lines.append((stream, line))
+
+    with subprocess_runner.lines_to(on_line):
+        # without stream_output, the handler isn't used
+        subprocess_runner.run(tmp_script_commandline(_chatty_script))
+        assert [] == lines
+
+        result = subprocess_runner.run(tmp_script_commandline(_chatty_script), stream_output=True)
+
+    assert subprocess_runner.current_line_handler() is None
+    assert result.stdout is None
+    assert b"warning" == result.stderr.strip()
+    assert [(subprocess_runner.STDOUT, "one"), (subprocess_runner.STDOUT, "two")] == \
+        [line for line in lines if line[0] == subprocess_runner.STDOUT]
+    assert [(subprocess_runner.STDERR, "warning")] == [line for line in lines if line[0] == subprocess_runner.STDERR]
+
+
+def test_run_streams_without_handler():
+    result = subprocess_runner.run(tmp_script_commandline(_chatty_script), stream_output=True)
+    assert 3 == result.returncode
+    assert result.stdout is None
+
+
+def test_run_times_out():
+    lines = []
+
+    with subprocess_runner.lines_to(lambda stream, line: lines.append(line)):
+        result = subprocess_runner.run(tmp_script_commandline(_slow_script), stream_output=True, timeout=0.5)
+
+    assert result.timed_out
+    assert not result.cancelled
+    assert 0 != result.returncode
+    assert result.duration < 30
+    assert ["started"] == lines
+
+
+def test_run_cancelled():
+    cancellation = subprocess_runner.Cancellation()
+    assert not cancellation.cancelled
+    started = []
+
+    def on_line(stream, line):
+        started.append(line)
+        cancellation.cancel()
+
+    with subprocess_runner.lines_to(on_line), subprocess_runner.cancelled_by(cancellation):
+        result = subprocess_runner.run(tmp_script_commandline(_slow_script), stream_output=True)
+
+    assert subprocess_runner.current_cancellation() is None
+    assert cancellation.cancelled
+    assert result.cancelled
+    assert not result.timed_out
+    assert result.duration < 30
+    assert ["started"] == started
+
+
+def test_run_cancelled_before_start():
+    cancellation = subprocess_runner.Cancellation()
+    cancellation.cancel()
+    with subprocess_runner.cancelled_by(cancellation):
+        result = subprocess_runner.run(tmp_script_commandline(_slow_script))
+    assert result.cancelled
+
+
+def test_run_stops_process_when_interrupted(monkeypatch):
+    processes = []
+    real_popen = subprocess.Popen
+
+    def recording_popen(*args, **kwargs):
+        process = real_popen(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr('subprocess.Popen', recording_popen)
+
+    class InterruptingCancellation(object):
+        @property
+        def cancelled(self):
+            raise KeyboardInterrupt()
+
+    with subprocess_runner.cancelled_by(InterruptingCancellation()):
+        with pytest.raises(KeyboardInterrupt):
+            subprocess_runner.run(tmp_script_commandline(_slow_script))
+
+    assert 1 == len(processes)
+    assert processes[0].poll() is not None
+
+
+def test_cancelled_on_interrupt():
+    with subprocess_runner.cancelled_on_interrupt() as cancellation:
+        assert subprocess_runner.current_cancellation() is cancellation
+    assert not cancellation.cancelled
+
+    with pytest.raises(KeyboardInterrupt):
+        with subprocess_runner.cancelled_on_interrupt() as cancellation:
+            raise KeyboardInterrupt()
+    assert cancellation.cancelled
+    assert subprocess_runner.current_cancellation() is None
+
+
+def test_cancellation_wait():
+    cancellation = subprocess_runner.Cancellation()
+    assert not cancellation.wait(0.01)
+
+    thread = threading.Thread(target=cancellation.cancel)
+    thread.start()
+    assert cancellation.wait(10)
+    thread.join()
+
+
+def test_stop_kills_after_grace_period(monkeypatch):
+    class FakeProcess(object):
+        def __init__(self):
+            self.calls = []
+
+        def terminate(self):
+            self.calls.append('terminate')
+
+        def kill(self):
+            self.calls.append('kill')
+
+        def poll(self):
+            if 'kill' in self.calls:
+                return -9
+            return None
+
+    monkeypatch.setattr('conda_kapsel.internal.subprocess_runner._TERMINATE_GRACE_SECONDS', 0.2)
+    process = FakeProcess()
+    start = time.time()
+    subprocess_runner._stop(process)
+    assert ['terminate', 'kill'] == process.calls
+    assert time.time() - start >= 0.2
+
+
+def test_run_nonexistent_command():
+    with pytest.raises(OSError):
+        subprocess_runner.run(['this-command-does-not-exist-kapsel'])
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+
+import pytest
+
+from conda_kapsel.internal import timing
+from conda_kapsel.internal.parallel import parallel_map
+
+
+def test_timings_records_in_start_order():
+    timings = timing.Timings()
+    timings.add('b', 'second', 20.0, 25.0)
+    timings.add('a', 'first', 10.0, 11.5)
+    with timings.time('c', 'third'):
+        pass
+
+    records = timings.records
+    assert ['first', 'second', 'third'] == [record.name for record in records]
+    assert 1.5 == records[0].duration
+    assert 5.0 == records[1].duration
+    assert records[2].duration >= 0
+    assert threading.current_thread().ident == records[0].thread
+    assert 5.0 == timings.total('b')
+    assert 0 == timings.total('nope')
+
+
+def test_timings_to_json():
+    timings = timing.Timings()
+    timings.add(timing.TIMING_KIND_STAGE, 'Set up project.', 10.0, 12.0)
+    json_records = json.loads(json.dumps(timings.to_json()))
+    assert 1 == len(json_records)
+    assert timing.TIMING_KIND_STAGE == json_records[0]['kind']
+    assert 'Set up project.' == json_records[0]['name']
+    assert 2.0 == json_records[0]['duration']
+    assert set(['kind', 'name', 'start', 'duration', 'thread']) == set(json_records[0].keys())
+
+
+def test_timings_to_json_includes_args():
+    timings = timing.Timings()
+    timings.add(timing.TIMING_KIND_SUBPROCESS, 'conda list', 10.0, 12.0, dict(argv=['conda', 'list']))
+    assert dict(argv=['conda', 'list']) == timings.to_json()[0]['args']
+
+
+def test_timings_to_trace_json():
+    timings = timing.Timings()
+    timings.add(timing.TIMING_KIND_STAGE, 'Set up project.', timings._started + 1.0, timings._started + 3.0)
+    timings.add(timing.TIMING_KIND_SUBPROCESS, 'conda list', timings._started + 1.5, timings._started + 2.0,
+                dict(argv=['conda', 'list']))
+    trace = json.loads(json.dumps(timings.to_trace_json()))
+    assert 'ms' == trace['displayTimeUnit']
+
+    [stage, subprocess, thread_name] = trace['traceEvents']
+    assert 'Set up project.' == stage['name']
+    assert timing.TIMING_KIND_STAGE == stage['cat']
+    assert 'X' == stage['ph']
+    assert 1000000.0 == stage['ts']
+    assert 2000000.0 == stage['dur']
+    assert os.getpid() == stage['pid']
+    assert threading.current_thread().ident == stage['tid']
+    assert 'args' not in stage
+
+    assert 1500000.0 == subprocess['ts']
+    assert 500000.0 == subprocess['dur']
+    assert dict(argv=['conda', 'list']) == subprocess['args']
+
+    assert 'M' == thread_name['ph']
+    assert 'thread_name' == thread_name['name']
+    assert threading.current_thread().ident == thread_name['tid']
+    assert dict(name=threading.current_thread().name) == thread_name['args']
+
+
+def test_timed_yields_args_to_fill_in():
+    timings = timing.Timings()
+    with timing.recording(timings):
+        with timing.timed(timing.TIMING_KIND_DOWNLOAD, 'Download', dict(url='http://example.com/')) as details:
+            details['bytes'] = 42
+        with timing.timed(timing.TIMING_KIND_STAGE, 'Stage') as details:
+            assert dict() == details
+    [download, stage] = timings.records
+    assert dict(url='http://example.com/', bytes=42) == download.args
+    assert dict() == stage.args
+
+    # without a Timings we still get something to fill in
+    with timing.timed(timing.TIMING_KIND_STAGE, 'Stage', dict(a=1)) as details:
+        assert dict(a=1) == details
+
+
+def test_timings_summary_lines():
+    timings = timing.Timings()
+    timings.add(timing.TIMING_KIND_SUBPROCESS, 'conda list', 10.0, 10.25)
+    assert ["    0.250s  subprocess    conda list"] == timings.summary_lines()
+
+
+def test_timed_without_recording():
+    assert timing.current() is None
+    with timing.timed(timing.TIMING_KIND_STAGE, 'nothing'):
+        pass
+    assert timing.current() is None
+
+
+def test_timed_records_even_on_exception():
+    timings = timing.Timings()
+    with timing.recording(timings):
+        assert timing.current() is timings
+        with pytest.raises(RuntimeError):
+            with timing.timed(timing.TIMING_KIND_PROVIDE, 'FOO'):
+                raise RuntimeError("nope")
+    assert timing.current() is None
+    assert ['FOO'] == [record.name for record in timings.records]
+
+
+def test_recording_nests():
+    outer = timing.Timings()
+    inner = timing.Timings()
+    with timing.recording(outer):
+        with timing.recording(inner):
+            with timing.timed('kind', 'inner'):
+                pass
+        with timing.timed('kind', 'outer'):
+            pass
+    assert ['inner'] == [record.name for record in inner.records]
+    assert ['outer'] == [record.name for record in outer.records]
+
+
+def test_parallel_map_records_to_callers_timings():
+    timings = timing.Timings()
+
+    def work(i):
+        with timing.timed('work', str(i)):
+            return i
+
+    with timing.recording(timings):
+        assert [0, 1, 2, 3] == parallel_map(work, range(4), max_workers=4)
+
+    assert ['0', '1', '2', '3'] == sorted([record.name for record in timings.records])
@@ -9,6 +9,7 @@ from __future__ import absolute_import, print_function
 import pytest
 
 from conda_kapsel.internal.toposort import toposort_from_dependency_info, CycleError
+from conda_kapsel.internal.toposort import toposort_levels_from_dependency_info
 
 
 # sort tuples of the form (thing, (dep1, dep2))
@@ -86,3 +87,49 @@ def test_dependency_not_in_list_but_can_ignore_that():
     unsorted = [(1, (2, ))]
     sorted = sort_tuples(unsorted, can_ignore=set([2]))
     assert [1] == sorted
+
+
+def levels_of_tuples(tuples, can_ignore=None):
+    def get_node_key(t):
+        return t[0]
+
+    def get_dependency_keys(t):
+        return t[1]
+
+    def can_ignore_key(k):
+        return k in can_ignore
+
+    if can_ignore is None:
+        can_ignore_func = None
+    else:
+        can_ignore_func = can_ignore_key
+
+    levels = toposort_levels_from_dependency_info(tuples, get_node_key, get_dependency_keys, can_ignore_func)
+    return [[t[0] for t in level] for level in levels]
+
+
+def test_levels_empty():
+    assert [] == levels_of_tuples([])
+
+
+def test_levels_independent():
+    unsorted = [(1, ()), (2, ()), (3, ())]
+    assert [sort_tuples(unsorted)] == levels_of_tuples(unsorted)
+
+
+def test_levels_chain_and_fan_out():
+    unsorted = [(1, ('env', )), (2, ('env', )), ('env', ()), (3, (1, 'outside'))]
+    assert [['env'], [2, 1], [3]] == levels_of_tuples(unsorted, can_ignore=('outside', ))
+
+
+def test_levels_longest_path_wins():
+    unsorted = [(1, (2, 3)), (2, (3, )), (3, ()), (4, ())]
+    levels = levels_of_tuples(unsorted)
+    assert 3 == len(levels)
+    assert sorted(levels[0]) == [3, 4]
+    assert [[2], [1]] == levels[1:]
+
+
+def test_levels_cycle():
+    with pytest.raises(CycleError):
+        levels_of_tuples([(1, (2, )), (2, (1, ))])
@@ -9,6 +9,7 @@ from __future__ import absolute_import, print_function
 from bs4 import BeautifulSoup
 from tornado.ioloop import IOLoop
 
+from conda_kapsel.internal import subprocess_runner
 from conda_kapsel.internal.plugin_html import _BEAUTIFUL_SOUP_BACKEND
 from conda_kapsel.project import Project
 from conda_kapsel.prepare import ConfigurePrepareContext, _FunctionPrepareStage, PrepareSuccess
@@ -20,10 +21,10 @@ from conda_kapsel.local_state_file import LocalStateFile
 from conda_kapsel.plugins.requirement import EnvVarRequirement, UserConfigOverrides
 
 
-def _no_op_prepare(config_context):
+def _no_op_prepare(config_context, logs=()):
     def _do_nothing(stage):
         stage.set_result(
-            PrepareSuccess(logs=[],
+            PrepareSuccess(logs=list(logs),
                            statuses=(),
                            command_exec_info=None,
                            environ=dict(),
@@ -62,6 +63,63 @@ def test_ui_server_empty():
     with_directory_contents(dict(), do_test)
 
 
+def test_ui_server_unlisten_cancels_subprocesses():
+    def do_test(dirname):
+        io_loop = IOLoop()
+        io_loop.make_current()
+
+        cancellations = []
+
+        def _record_cancellation(stage):
+            cancellations.append(subprocess_runner.current_cancellation())
+            stage.set_result(
+                PrepareSuccess(logs=[],
+                               statuses=(),
+                               command_exec_info=None,
+                               environ=dict(),
+                               overrides=UserConfigOverrides()),
+                [])
+            return None
+
+        project = Project(dirname)
+        local_state_file = LocalStateFile.load_for_directory(dirname)
+        context = ConfigurePrepareContext(dict(), local_state_file, 'default', UserConfigOverrides(), [])
+        stage = _FunctionPrepareStage(dict(), UserConfigOverrides(), "Record", [], _record_cancellation, context)
+        server = UIServer(project, stage, lambda event: None, io_loop)
+
+        http_post(io_loop, server.url, body="")
+
+        assert len(cancellations) == 1
+        assert cancellations[0] is not None
+        assert not cancellations[0].cancelled
+
+        server.unlisten()
+
+        assert cancellations[0].cancelled
+
+    with_directory_contents(dict(), do_test)
+
+
+def test_ui_server_shows_logs():
+    def do_test(dirname):
+        io_loop = IOLoop()
+        io_loop.make_current()
+
+        project = Project(dirname)
+        local_state_file = LocalStateFile.load_for_directory(dirname)
+        context = ConfigurePrepareContext(dict(), local_state_file, 'default', UserConfigOverrides(), [])
+        server = UIServer(project,
+                          _no_op_prepare(context, logs=["Fetching packages", "<done>"]), lambda event: None, io_loop)
+
+        post_response = http_post(io_loop, server.url, body="")
+        server.unlisten()
+
+        soup = BeautifulSoup(post_response.body, _BEAUTIFUL_SOUP_BACKEND)
+        assert "Fetching packages\n<done>" == soup.find('pre').get_text()
+
+    with_directory_contents(dict(), do_test)
+
+
 def test_ui_server_with_form():
     def do_test(dirname):
         io_loop = IOLoop()
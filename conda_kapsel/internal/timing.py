@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+# Copyright © 2016, Continuum Analytics, Inc. All rights reserved.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Record how long the parts of an operation take."""
+from __future__ import absolute_import
+
+import contextlib
+import os
+import threading
+import time
+
+# these strings end up in JSON output, so they are user-visible
+TIMING_KIND_STAGE = 'stage'
+TIMING_KIND_CHECK_STATUS = 'check_status'
+TIMING_KIND_PROVIDE = 'provide'
+TIMING_KIND_SUBPROCESS = 'subprocess'
+TIMING_KIND_FINGERPRINT = 'fingerprint'
+TIMING_KIND_PROJECT_LOAD = 'project_load'
+TIMING_KIND_YAML_PARSE = 'yaml_parse'
+TIMING_KIND_DOWNLOAD = 'download'
+
+
+class TimingRecord(object):
+    """How long one thing took."""
+
+    def __init__(self, kind, name, start, duration, thread, thread_name=None, args=None):
+        """Construct a TimingRecord.
+
+        Args:
+            kind (str): one of the ``TIMING_KIND_`` constants
+            name (str): what was timed
+            start (float): seconds since the ``Timings`` was created
+            duration (float): wall-clock seconds
+            thread (int): identifier of the thread the work ran on
+            thread_name (str): name of the thread the work ran on
+            args (dict): JSON-compatible details such as a subprocess argv, or None
+        """
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.thread = thread
+        self.thread_name = thread_name
+        self.args = args
+
+    def to_json(self):
+        """Get a JSON-compatible dict for the record."""
+        json = dict(kind=self.kind, name=self.name, start=self.start, duration=self.duration, thread=self.thread)
+        if self.args:
+            json['args'] = self.args
+        return json
+
+
+class Timings(object):
+    """A growing list of ``TimingRecord``, which may be added to from several threads."""
+
+    def __init__(self):
+        """Construct an empty Timings."""
+        self._started = time.time()
+        self._records = []
+        self._lock = threading.Lock()
+
+    @property
+    def records(self):
+        """Get the ``TimingRecord`` list, ordered by start time."""
+        with self._lock:
+            records = list(self._records)
+        return sorted(records, key=lambda record: record.start)
+
+    def add(self, kind, name, start, end, args=None):
+        """Add a record given ``time.time()`` values for the start and end."""
+        thread = threading.current_thread()
+        record = TimingRecord(kind=kind,
+                              name=name,
+                              start=start - self._started,
+                              duration=end - start,
+                              thread=thread.ident,
+                              thread_name=thread.name,
+                              args=args)
+        with self._lock:
+            self._records.append(record)
+
+    @contextlib.contextmanager
+    def time(self, kind, name, args=None):
+        """Context manager that adds a record for the time spent inside it.
+
+        ``args`` is stored on the record, so details discovered
+        while the work runs can be added to it before it ends.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(kind, name, start, time.time(), args)
+
+    def total(self, kind):
+        """Get the sum of the durations of all records of the given kind."""
+        return sum([record.duration for record in self.records if record.kind == kind])
+
+    def to_json(self):
+        """Get a JSON-compatible list of dicts, one per record."""
+        return [record.to_json() for record in self.records]
+
+    def to_trace_json(self):
+        """Get a JSON-compatible dict in the Chrome trace-event format.
+
+        The result can be loaded into chrome://tracing or
+        Perfetto. Each record becomes a "complete" event on its
+        thread's track; records that run inside one another on
+        the same thread show up nested.
+        """
+        pid = os.getpid()
+        events = []
+        thread_names = dict()
+        for record in self.records:
+            event = dict(name=record.name,
+                         cat=record.kind,
+                         ph='X',
+                         ts=record.start * 1000000.0,
+                         dur=record.duration * 1000000.0,
+                         pid=pid,
+                         tid=record.thread)
+            if record.args:
+                event['args'] = record.args
+            events.append(event)
+            if record.thread_name is not None:
+                thread_names[record.thread] = record.thread_name
+        for (thread, thread_name) in sorted(thread_names.items()):
+            events.append(dict(name='thread_name', ph='M', pid=pid, tid=thread, args=dict(name=thread_name)))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def summary_lines(self):
+        """Get human-readable lines describing the records."""
+        lines = []
+        for record in self.records:
+            lines.append("%9.3fs  %-13s %s" % (record.duration, record.kind, record.name))
+        return lines
+
+
+_current = threading.local()
+
+
+def current():
+    """Get the ``Timings`` being recorded to on this thread, or None."""
+    return getattr(_current, 'timings', None)
+
+
+@contextlib.contextmanager
+def recording(timings):
+    """Context manager that makes ``timed()`` on this thread record to ``timings``.
+
+    ``timings`` may be None to record nothing.
+    """
+    old = current()
+    _current.timings = timings
+    try:
+        yield
+    finally:
+        _current.timings = old
+
+
+@contextlib.contextmanager
+def timed(kind, name, args=None):
+    """Context manager that records its duration to the current ``Timings``, if any.
+
+    Yields the ``args`` dict (a new one if None was passed), which
+    may be updated to add details to the record.
+    """
+    if args is None:
+        args = dict()
+    timings = current()
+    if timings is None:
+        yield args
+    else:
+        with timings.time(kind, name, args):
+            yield args
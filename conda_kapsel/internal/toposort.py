@@ -85,3 +85,40 @@ def toposort_from_dependency_info(nodes, get_node_key, get_dependency_keys, can_
                 node_depended_on_by[dep_key].add(node)
 
     return toposort(nodes, lambda n: node_depended_on_by[get_node_key(n)])
+
+
+def toposort_levels_from_dependency_info(nodes, get_node_key, get_dependency_keys, can_ignore_dependency=None):
+    """Group nodes that depend on other nodes into levels, in dependency-first order.
+
+    Each node is in the level after the last level containing one
+    of its dependencies, so the nodes within a level don't depend
+    on each other. Within a level, nodes are in the same order
+    ``toposort_from_dependency_info()`` would put them in.
+
+    All dependencies must be in the list of nodes.
+
+    Args:
+        nodes (iterable): iterable of some kind of node
+        get_node_key (function): get identifier for a node
+        get_dependency_keys (function): get iterable of node identifiers a node depends on
+
+    Returns:
+        new list of lists of nodes
+    """
+    nodes = list(nodes)
+    sorted_nodes = toposort_from_dependency_info(nodes, get_node_key, get_dependency_keys, can_ignore_dependency)
+
+    level_by_key = dict()
+    levels = []
+    for node in sorted_nodes:
+        # dependencies come first in sorted_nodes, so they have levels already
+        level = 0
+        for dep_key in get_dependency_keys(node):
+            if dep_key in level_by_key:
+                level = max(level, level_by_key[dep_key] + 1)
+        level_by_key[get_node_key(node)] = level
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(node)
+
+    return levels
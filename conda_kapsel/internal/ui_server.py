@@ -15,6 +15,7 @@ from tornado.httpserver import HTTPServer
 from tornado.netutil import bind_sockets
 from tornado.web import Application, RequestHandler
 
+from conda_kapsel.internal import subprocess_runner
 from conda_kapsel.internal.plugin_html import cleanup_and_scope_form, html_tag
 
 
@@ -82,6 +83,11 @@ class PrepareViewHandler(RequestHandler):
 
         return html
 
+    def _html_for_logs(self, logs):
+        if len(logs) == 0:
+            return ""
+        return "<details><summary>Output</summary><pre>%s</pre></details>\n" % _html_escape("\n".join(logs))
+
     def _result_page(self, result, latest_statuses):
         # TODO: clean this up, we should show the usual status
         # list with errors embedded and possibly config html to
@@ -97,12 +103,12 @@ class PrepareViewHandler(RequestHandler):
                 error_html = error_html + ("<li>%s</li>\n" % _html_escape(error))
             error_html = error_html + "</ul>\n"
 
-            return self._outer_page(error_html)
+            return self._outer_page(error_html + self._html_for_logs(result.logs))
         else:
             status_list_html = self._html_for_status_list(latest_statuses, with_config=False)
             return self._outer_page("""
 <div>Done! Close this window now if you like.</div>
-""" + status_list_html)
+""" + status_list_html + self._html_for_logs(result.logs))
 
     def get(self, *args, **kwargs):
         if self.application.prepare_stage is None:
@@ -156,7 +162,8 @@ class PrepareViewHandler(RequestHandler):
 
             prepare_context.local_state_file.save()
 
-        next_stage = self.application.prepare_stage.execute()
+        with subprocess_runner.cancelled_by(self.application.cancellation):
+            next_stage = self.application.prepare_stage.execute()
         self.application.latest_statuses = self.application.prepare_stage.statuses_after_execute
         if next_stage is None:
             self.application.last_stage_result = self.application.prepare_stage.result
@@ -175,6 +182,8 @@ class UIApplication(Application):
         self.prepare_stage = prepare_stage
         self.last_stage_result = None
         self.latest_statuses = prepare_stage.statuses_before_execute
+        # cancelled when the server shuts down, stopping conda and pip
+        self.cancellation = subprocess_runner.Cancellation()
 
         self._requirements_by_id = {}
         self._ids_by_requirement = {}
@@ -249,6 +258,10 @@ class UIServer(object):
         return "http://localhost:%d/" % self.port
 
     def unlisten(self):
-        """Permanently close down the HTTP server, no longer listen on any sockets."""
+        """Permanently close down the HTTP server, no longer listen on any sockets.
+
+        Any conda or pip processes still running for the prepare are stopped.
+        """
+        self._application.cancellation.cancel()
         self._http.close_all_connections()
         self._http.stop()
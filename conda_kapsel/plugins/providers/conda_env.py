@@ -10,7 +10,7 @@ from __future__ import absolute_import, print_function
 import os
 import shutil
 
-from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import conda_api, env_pool, subprocess_runner
 from conda_kapsel.internal.simple_status import SimpleStatus
 from conda_kapsel.conda_manager import new_conda_manager, CondaManagerError
 from conda_kapsel.plugins.provider import EnvVarProvider
@@ -19,7 +19,18 @@ from conda_kapsel.provide import PROVIDE_MODE_CHECK
 
 def _remove_env_path(env_path):
     """Also used by project_ops.py to delete environment files."""
-    if os.path.exists(env_path):
+    shared_prefix = env_pool.shared_prefix_for_link(env_path)
+    if shared_prefix is not None:
+        try:
+            if env_pool.release(env_path):
+                description = "Deleted shared environment files in %s." % shared_prefix
+            else:
+                description = "Stopped using shared environment %s, other projects still use it." % shared_prefix
+            return SimpleStatus(success=True, description=description)
+        except (IOError, OSError) as e:
+            problem = "Failed to stop using shared environment {}: {}.".format(shared_prefix, str(e))
+            return SimpleStatus(success=False, description=problem)
+    elif os.path.exists(env_path):
         try:
             shutil.rmtree(env_path)
             return SimpleStatus(success=True, description=("Deleted environment files in %s." % env_path))
@@ -183,6 +194,59 @@ class CondaEnvProvider(EnvVarProvider):
 </form>
 """ % (options_html)
 
+    def _use_shared_env(self, pool, prefix, env_spec):
+        shared_prefix = env_pool.pool_prefix(pool, env_spec)
+        current = env_pool.shared_prefix_for_link(prefix)
+        if current == shared_prefix:
+            return
+        if current is not None:
+            # the env spec changed; never modify a shared env
+            # to match, since other projects still want the old one
+            env_pool.release(prefix)
+        elif os.path.exists(prefix):
+            # an unshared env created before the pool was configured
+            return
+        if not env_pool.symlinks_supported(pool):
+            # the project gets its own env instead
+            return
+        env_pool.attach(shared_prefix, prefix,
+                        prepare=lambda: self._conda.fix_environment_deviations(shared_prefix, env_spec))
+
+    def update_environment(self, environ, prefix, env_spec):
+        """Create or fix the environment for an env spec.
+
+        Args:
+            environ (dict): environment variables, which may configure a shared env pool or offline mode
+            prefix (str): the project's prefix for the env spec
+            env_spec (EnvSpec): the env spec
+
+        Raises:
+            CondaManagerError, or IOError or OSError when sharing the environment
+        """
+        # the conda manager checks for offline mode in our environ
+        with conda_api.offline_mode_from(environ):
+            pool = env_pool.pool_directory(environ)
+            if pool is not None:
+                self._use_shared_env(pool, prefix, env_spec)
+            self._conda.fix_environment_deviations(prefix, env_spec)
+
+    def plan_environment_update(self, environ, prefix, env_spec):
+        """Compute the changes ``update_environment()`` would make, without making them.
+
+        Args:
+            environ (dict): environment variables, which may configure offline mode
+            prefix (str): the project's prefix for the env spec
+            env_spec (EnvSpec): the env spec
+
+        Returns:
+            a ``CondaEnvironmentPlan``
+
+        Raises:
+            CondaManagerError
+        """
+        with conda_api.offline_mode_from(environ):
+            return self._conda.plan_environment_fix(prefix, env_spec)
+
     def provide(self, requirement, context):
         """Override superclass to create or update our environment."""
         assert 'PATH' in context.environ
@@ -211,22 +275,47 @@ class CondaEnvProvider(EnvVarProvider):
 
         assert prefix is not None
 
-        if context.mode != PROVIDE_MODE_CHECK:
-            # we update the environment in both prod and dev mode
+        env_spec = None
+        for env in requirement.env_specs.values():
+            if env.path(project_dir) == prefix:
+                env_spec = env
+                break
 
-            env_spec = None
-            for env in requirement.env_specs.values():
-                if env.path(project_dir) == prefix:
-                    env_spec = env
-                    break
+        if context.mode == PROVIDE_MODE_CHECK:
+            # say what we would have done
+            if env_spec is not None:
+                try:
+                    plan = self._conda.plan_environment_fix(prefix, env_spec)
+                except CondaManagerError as e:
+                    return super_result.copy_with_additions(errors=[str(e)])
+                if not plan.empty:
+                    super_result = super_result.copy_with_additions(
+                        logs=["Environment %s needs changes:" % prefix] + ["  " + line for line in plan.summary_lines])
+        else:
+            # we update the environment in both prod and dev mode
 
             # TODO if not creating a named env, we could use the
             # shared packages, but for now we leave it alone
             if env_spec is not None:
+                # conda and pip output goes in our logs, and also to
+                # whoever is watching prepare as it happens
+                logs = []
+                outer_handler = subprocess_runner.current_line_handler()
+
+                def on_line(stream, line):
+                    logs.append(line)
+                    if outer_handler is not None:
+                        outer_handler(stream, line)
+
                 try:
-                    self._conda.fix_environment_deviations(prefix, env_spec)
+                    with subprocess_runner.lines_to(on_line):
+                        self.update_environment(context.environ, prefix, env_spec)
                 except CondaManagerError as e:
-                    return super_result.copy_with_additions(errors=[str(e)])
+                    return super_result.copy_with_additions(errors=[str(e)], logs=logs)
+                except (IOError, OSError) as e:
+                    return super_result.copy_with_additions(
+                        errors=["Failed to share environment %s: %s" % (prefix, str(e))], logs=logs)
+                super_result = super_result.copy_with_additions(logs=logs)
 
         conda_api.environ_set_prefix(context.environ, prefix, varname=requirement.env_var)
 
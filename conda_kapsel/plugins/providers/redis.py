@@ -18,7 +18,7 @@ from conda_kapsel.plugins.provider import (EnvVarProvider, ProviderAnalysis, shu
                                            delete_service_directory)
 import conda_kapsel.plugins.network_util as network_util
 from conda_kapsel.provide import PROVIDE_MODE_DEVELOPMENT
-from conda_kapsel.internal import py2_compat
+from conda_kapsel.internal import py2_compat, timing
 
 _DEFAULT_SYSTEM_REDIS_HOST = "localhost"
 _DEFAULT_SYSTEM_REDIS_PORT = 6379
@@ -244,17 +244,18 @@ class RedisProvider(EnvVarProvider):
             # we don't close_fds=True because on Windows that is documented to
             # keep us from collected stderr. But on Unix it's kinda broken not
             # to close_fds. Hmm.
-            try:
-                popen = subprocess.Popen(args=command,
-                                         stderr=subprocess.PIPE,
-                                         env=py2_compat.env_without_unicode(context.environ))
-            except Exception as e:
-                errors.append("Error executing redis-server: %s" % (str(e)))
-                return None
-
-            # communicate() waits for the process to exit, which
-            # is supposed to happen immediately due to --daemonize
-            (out, err) = popen.communicate()
+            with timing.timed(timing.TIMING_KIND_SUBPROCESS, "redis-server", dict(argv=command)):
+                try:
+                    popen = subprocess.Popen(args=command,
+                                             stderr=subprocess.PIPE,
+                                             env=py2_compat.env_without_unicode(context.environ))
+                except Exception as e:
+                    errors.append("Error executing redis-server: %s" % (str(e)))
+                    return None
+
+                # communicate() waits for the process to exit, which
+                # is supposed to happen immediately due to --daemonize
+                (out, err) = popen.communicate()
             assert out is None  # because we didn't PIPE it
             err = err.decode(errors='replace')
 
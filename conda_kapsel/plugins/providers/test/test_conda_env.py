@@ -6,11 +6,13 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import
 
+import errno
 import os
 import platform
 
 import conda_kapsel.internal.conda_api as conda_api
 import conda_kapsel.internal.pip_api as pip_api
+from conda_kapsel.internal import env_pool, subprocess_runner
 from conda_kapsel.test.environ_utils import (minimal_environ, minimal_environ_no_conda_env,
                                              strip_environ_keeping_conda_env)
 from conda_kapsel.internal.test.http_utils import http_get_async, http_post_async
@@ -89,6 +91,27 @@ def test_prepare_and_unprepare_project_scoped_env(monkeypatch):
     with_directory_contents(dict(), prepare_project_scoped_env)
 
 
+def test_prepare_project_scoped_env_offline_from_environ(monkeypatch):
+    def mock_create(prefix, pkgs, channels):
+        raise AssertionError("should not have run conda")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.pkgs_dirs', lambda: [])
+    monkeypatch.delenv('CONDA_OFFLINE', raising=False)
+    monkeypatch.delenv('CONDA_KAPSEL_OFFLINE', raising=False)
+
+    def prepare_offline(dirname):
+        project = Project(dirname)
+        # offline mode is only in the environ we prepare with
+        environ = minimal_environ(PROJECT_DIR=dirname, CONDA_KAPSEL_OFFLINE='1')
+        result = prepare_without_interaction(project, environ=environ)
+        assert not result
+        assert any(error.startswith("Offline mode is on, and the package cache doesn't have these packages")
+                   for error in result.errors)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "packages: ['foo']\n"}, prepare_offline)
+
+
 def test_prepare_project_scoped_env_conda_create_fails(monkeypatch):
     def mock_create(prefix, pkgs, channels):
         raise conda_api.CondaError("error_from_conda_create")
@@ -113,6 +136,42 @@ def test_prepare_project_scoped_env_conda_create_fails(monkeypatch):
     with_directory_contents(dict(), prepare_project_scoped_env_fails)
 
 
+def test_prepare_project_scoped_env_logs_conda_output(monkeypatch):
+    def mock_create(prefix, pkgs, channels):
+        handler = subprocess_runner.current_line_handler()
+        handler(subprocess_runner.STDOUT, "Linking python")
+        if 'fail' in prefix:
+            raise conda_api.CondaError("error_from_conda_create")
+        os.makedirs(os.path.join(prefix, "conda-meta"))
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+
+    def mock_list_explicit(prefix):
+        raise conda_api.CondaError("cannot list")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.list_explicit', mock_list_explicit)
+
+    def prepare_project_scoped_env(dirname):
+        watched = []
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname)
+        with subprocess_runner.lines_to(lambda stream, line: watched.append((stream, line))):
+            result = prepare_without_interaction(project, environ=environ)
+        assert result
+        # warnings from the conda manager arrive along with conda's output
+        warning = "Failed to record package versions in %s: cannot list" % project.env_specs['default'].lock_filename
+        assert ["Linking python", warning] == result.logs
+        assert [(subprocess_runner.STDOUT, "Linking python"), (subprocess_runner.STDERR, warning)] == watched
+
+        project = Project(dirname)
+        result = prepare_without_interaction(project, environ=environ, env_spec_name='fail')
+        assert not result
+        assert ["Linking python"] == result.logs
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "env_specs:\n  default: {}\n  fail: {}\n"},
+                            prepare_project_scoped_env)
+
+
 def test_unprepare_gets_error_on_delete(monkeypatch):
     def mock_create(prefix, pkgs, channels):
         os.makedirs(os.path.join(prefix, "conda-meta"))
@@ -146,6 +205,161 @@ def test_unprepare_gets_error_on_delete(monkeypatch):
     with_directory_contents(dict(), prepare_project_scoped_env)
 
 
+def _monkeypatch_create_for_pool(monkeypatch):
+    created = []
+
+    def mock_create(prefix, pkgs, channels):
+        created.append(prefix)
+        os.makedirs(os.path.join(prefix, "conda-meta"))
+        for pkg in pkgs:
+            open(os.path.join(prefix, "conda-meta", "%s-0.1-pyNN.json" % pkg), 'a').close()
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.list_explicit', lambda prefix: "@EXPLICIT\n")
+    return created
+
+
+def test_prepare_and_unprepare_shared_env(monkeypatch):
+    created = _monkeypatch_create_for_pool(monkeypatch)
+
+    def prepare_shared_env(dirname):
+        pool = os.path.join(dirname, "pool")
+        projects = [os.path.join(dirname, "one"), os.path.join(dirname, "two")]
+        results = []
+        for project_dir in projects:
+            os.makedirs(project_dir)
+            project = Project(project_dir)
+            environ = minimal_environ(PROJECT_DIR=project_dir, CONDA_KAPSEL_ENV_POOL=pool)
+            result = prepare_without_interaction(project, environ=environ)
+            assert result
+            results.append((project, result))
+
+        shared = env_pool.pool_prefix(pool, results[0][0].env_specs['default'])
+        assert [shared] == created
+        for project_dir in projects:
+            env_path = os.path.join(project_dir, "envs", "default")
+            assert shared == env_pool.shared_prefix_for_link(env_path)
+            assert os.path.isdir(os.path.join(env_path, "conda-meta"))
+        assert os.path.join(projects[1], "envs", "default") == results[1][1].environ[conda_env_var]
+
+        status = unprepare(results[0][0], results[0][1])
+        assert status
+        assert status.status_description == ("Stopped using shared environment %s, other projects still use it." %
+                                             shared)
+        assert os.path.isdir(shared)
+
+        status = unprepare(results[1][0], results[1][1])
+        assert status
+        assert status.status_description == ("Deleted shared environment files in %s." % shared)
+        assert not os.path.exists(shared)
+
+    with_directory_contents(dict(), prepare_shared_env)
+
+
+def test_prepare_shared_env_after_env_spec_changes(monkeypatch):
+    created = _monkeypatch_create_for_pool(monkeypatch)
+
+    def prepare_changed_env(dirname):
+        pool = os.path.join(dirname, "pool")
+        project_dir = os.path.join(dirname, "project")
+        os.makedirs(project_dir)
+        environ = minimal_environ(PROJECT_DIR=project_dir, CONDA_KAPSEL_ENV_POOL=pool)
+        env_path = os.path.join(project_dir, "envs", "default")
+
+        project = Project(project_dir)
+        assert prepare_without_interaction(project, environ=environ)
+        old_shared = env_pool.shared_prefix_for_link(env_path)
+
+        project.project_file.set_value('packages', ['python'])
+        project.project_file.save()
+        assert prepare_without_interaction(project, environ=environ)
+        new_shared = env_pool.shared_prefix_for_link(env_path)
+
+        assert new_shared == env_pool.pool_prefix(pool, project.env_specs['default'])
+        assert [old_shared, new_shared] == created
+        assert not os.path.exists(old_shared)
+
+    with_directory_contents(dict(), prepare_changed_env)
+
+
+def test_prepare_shared_env_leaves_unshared_env_alone(monkeypatch):
+    created = _monkeypatch_create_for_pool(monkeypatch)
+
+    def prepare_unshared_env(dirname):
+        pool = os.path.join(dirname, "pool")
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname, CONDA_KAPSEL_ENV_POOL=pool)
+        assert prepare_without_interaction(project, environ=environ)
+        assert [] == created
+        assert not os.path.islink(os.path.join(dirname, "envs", "default"))
+
+    with_directory_contents({"envs/default/conda-meta/foo": ""}, prepare_unshared_env)
+
+
+def test_prepare_shared_env_fails_to_link(monkeypatch):
+    _monkeypatch_create_for_pool(monkeypatch)
+
+    def mock_symlink(src, dest):
+        raise OSError("no links")
+
+    monkeypatch.setattr('os.symlink', mock_symlink)
+
+    def prepare_shared_env_fails(dirname):
+        pool = os.path.join(dirname, "pool")
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname, CONDA_KAPSEL_ENV_POOL=pool)
+        result = prepare_without_interaction(project, environ=environ)
+        assert not result
+        assert ("Failed to share environment %s: no links" % os.path.join(dirname, "envs", "default")) in result.errors
+
+    with_directory_contents(dict(), prepare_shared_env_fails)
+
+
+def test_prepare_shared_env_without_symlinks(monkeypatch):
+    created = _monkeypatch_create_for_pool(monkeypatch)
+
+    def mock_symlink(src, dest):
+        raise OSError(errno.EPERM, "A required privilege is not held by the client")
+
+    monkeypatch.setattr('os.symlink', mock_symlink)
+
+    def prepare_unshared_env(dirname):
+        pool = os.path.join(dirname, "pool")
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname, CONDA_KAPSEL_ENV_POOL=pool)
+        result = prepare_without_interaction(project, environ=environ)
+        assert result
+        env_path = os.path.join(dirname, "envs", "default")
+        assert [env_path] == created
+        assert not os.path.islink(env_path)
+
+    with_directory_contents(dict(), prepare_unshared_env)
+
+
+def test_unprepare_shared_env_fails(monkeypatch):
+    _monkeypatch_create_for_pool(monkeypatch)
+
+    def unprepare_shared_env_fails(dirname):
+        pool = os.path.join(dirname, "pool")
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname, CONDA_KAPSEL_ENV_POOL=pool)
+        result = prepare_without_interaction(project, environ=environ)
+        assert result
+        shared = env_pool.pool_prefix(pool, project.env_specs['default'])
+
+        def mock_rmtree(path):
+            raise IOError("I will never rm the tree!")
+
+        monkeypatch.setattr('shutil.rmtree', mock_rmtree)
+        status = unprepare(project, result)
+        monkeypatch.undo()
+        assert not status
+        assert status.status_description == ("Failed to stop using shared environment %s: I will never rm the tree!."
+                                             % shared)
+
+    with_directory_contents(dict(), unprepare_shared_env_fails)
+
+
 def test_prepare_project_scoped_env_not_attempted_in_check_mode(monkeypatch):
     def mock_create(prefix, pkgs, channels):
         raise Exception("Should not have attempted to create env")
@@ -163,6 +377,8 @@ def test_prepare_project_scoped_env_not_attempted_in_check_mode(monkeypatch):
              'The project needs a Conda environment containing all required packages.'),
             "  '%s' doesn't look like it contains a Conda environment yet." % expected_env_path
         ] == result.errors
+        assert ["Environment %s needs changes:" % expected_env_path,
+                "  Create environment with conda packages: python"] == result.logs
 
         # unprepare should not have anything to do
         status = unprepare(project, result)
@@ -173,6 +389,23 @@ def test_prepare_project_scoped_env_not_attempted_in_check_mode(monkeypatch):
     with_directory_contents(dict(), prepare_project_scoped_env_not_attempted)
 
 
+def test_prepare_project_scoped_env_check_mode_cannot_plan(monkeypatch):
+    def mock_installed_packages(prefix):
+        raise conda_api.CondaError("cannot list")
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.installed_packages', mock_installed_packages)
+
+    def check(dirname):
+        project = Project(dirname)
+        environ = minimal_environ(PROJECT_DIR=dirname)
+        result = prepare_without_interaction(project, environ=environ, mode=provide.PROVIDE_MODE_CHECK)
+        assert not result
+        assert ("Conda failed while listing installed packages in %s: cannot list" %
+                os.path.join(dirname, "envs", "default")) in result.errors
+
+    with_directory_contents({'envs/default/conda-meta/foo': ''}, check)
+
+
 def test_prepare_project_scoped_env_with_packages(monkeypatch):
     monkeypatch_conda_not_to_use_links(monkeypatch)
 
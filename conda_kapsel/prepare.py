@@ -9,6 +9,10 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 from abc import ABCMeta, abstractmethod
+import errno
+import glob
+import hashlib
+import json
 import os
 import sys
 from copy import deepcopy
@@ -16,13 +20,20 @@ from copy import deepcopy
 from conda_kapsel.internal.metaclass import with_metaclass
 from conda_kapsel.internal import prepare_ui
 from conda_kapsel.internal.simple_status import SimpleStatus
-from conda_kapsel.internal.toposort import toposort_from_dependency_info
+from conda_kapsel.internal.toposort import toposort_from_dependency_info, toposort_levels_from_dependency_info
+from conda_kapsel.internal.parallel import parallel_map
 from conda_kapsel.internal import conda_api
+from conda_kapsel.internal import keyring
+from conda_kapsel.internal import project_cache
+from conda_kapsel.internal import timing
 from conda_kapsel.internal.py2_compat import is_string
 from conda_kapsel.local_state_file import LocalStateFile
-from conda_kapsel.provide import (_all_provide_modes, PROVIDE_MODE_DEVELOPMENT)
+from conda_kapsel.provide import (_all_provide_modes, PROVIDE_MODE_DEVELOPMENT, PROVIDE_MODE_CHECK)
 from conda_kapsel.plugins.provider import ProvideContext
 from conda_kapsel.plugins.requirement import EnvVarRequirement, UserConfigOverrides
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
+from conda_kapsel.plugins.requirements.download import DownloadRequirement
+from conda_kapsel.plugins.requirements.service import ServiceRequirement
 
 
 def _update_environ(dest, src):
@@ -40,12 +51,17 @@ def _update_environ(dest, src):
 class PrepareResult(with_metaclass(ABCMeta)):
     """Abstract class describing the result of preparing the project to run."""
 
-    def __init__(self, logs, statuses, environ, overrides):
+    def __init__(self, logs, statuses, environ, overrides, timings=None):
         """Construct an abstract PrepareResult."""
         self._logs = logs
         self._statuses = tuple(statuses)
         self._environ = environ
         self._overrides = overrides
+        if timings is None:
+            timings = timing.current()
+            if timings is None:
+                timings = timing.Timings()
+        self._timings = timings
 
     def __bool__(self):
         """True if we were successful."""
@@ -114,13 +130,30 @@ class PrepareResult(with_metaclass(ABCMeta)):
         """Override object which was passed to prepare()."""
         return self._overrides
 
+    @property
+    def timings(self):
+        """``Timings`` recording how long the parts of prepare took.
+
+        There are records for each stage executed, each requirement
+        status check, each call to a provider, each conda, pip,
+        or redis-server subprocess, and each download; ``timings.to_json()``
+        gives a list of dicts with ``kind``, ``name``, ``start``, ``duration``
+        and ``thread`` keys, and ``timings.to_trace_json()`` gives a
+        Chrome trace-event file.
+
+        If prepare was called while recording to a ``Timings``
+        (see ``conda_kapsel.internal.timing.recording``), this is
+        that ``Timings``, so it can also include loading the project.
+        """
+        return self._timings
+
 
 class PrepareSuccess(PrepareResult):
     """Class describing the successful result of preparing the project to run."""
 
-    def __init__(self, logs, statuses, command_exec_info, environ, overrides):
+    def __init__(self, logs, statuses, command_exec_info, environ, overrides, timings=None):
         """Construct a PrepareSuccess indicating a successful prepare stage."""
-        super(PrepareSuccess, self).__init__(logs, statuses, environ, overrides)
+        super(PrepareSuccess, self).__init__(logs, statuses, environ, overrides, timings)
         self._command_exec_info = command_exec_info
 
     @property
@@ -144,9 +177,9 @@ class PrepareSuccess(PrepareResult):
 class PrepareFailure(PrepareResult):
     """Class describing the failed result of preparing the project to run."""
 
-    def __init__(self, logs, statuses, errors, environ, overrides):
+    def __init__(self, logs, statuses, errors, environ, overrides, timings=None):
         """Construct a PrepareFailure indicating a failed prepare stage."""
-        super(PrepareFailure, self).__init__(logs, statuses, environ, overrides)
+        super(PrepareFailure, self).__init__(logs, statuses, environ, overrides, timings)
         self._errors = errors
 
     @property
@@ -282,6 +315,10 @@ class _FunctionPrepareStage(PrepareStage):
         self._statuses_before_execute = statuses
         self._execute = execute
         self._config_context = config_context
+        # stages are created either while we set up prepare or
+        # while executing the previous stage, so this is the
+        # Timings for the whole prepare.
+        self._timings = timing.current()
 
     # def __repr__(self):
     #    return "_FunctionPrepareStage(%r)" % (self._description)
@@ -298,7 +335,9 @@ class _FunctionPrepareStage(PrepareStage):
         return self._config_context
 
     def execute(self):
-        return self._execute(self)
+        with timing.recording(self._timings):
+            with timing.timed(timing.TIMING_KIND_STAGE, self._description):
+                return self._execute(self)
 
     @property
     def result(self):
@@ -395,7 +434,7 @@ def _after_stage_success(stage, and_then):
     return _AndThenPrepareStage(stage, and_then)
 
 
-def _sort_statuses(environ, local_state, statuses, missing_vars_getter):
+def _status_graph_functions(environ, missing_vars_getter):
     def get_node_key(status):
         # If we add a Requirement that isn't an EnvVarRequirement,
         # we can simply return the requirement object here as its
@@ -415,7 +454,50 @@ def _sort_statuses(environ, local_state, statuses, missing_vars_getter):
         # toposorting
         return key in environ
 
-    return toposort_from_dependency_info(statuses, get_node_key, get_dependency_keys, can_ignore_dependency_on_key)
+    return (get_node_key, get_dependency_keys, can_ignore_dependency_on_key)
+
+
+def _sort_statuses(environ, local_state, statuses, missing_vars_getter):
+    return toposort_from_dependency_info(statuses, *_status_graph_functions(environ, missing_vars_getter))
+
+
+def _sort_statuses_into_levels(environ, local_state, statuses, missing_vars_getter):
+    levels = toposort_levels_from_dependency_info(statuses, *_status_graph_functions(environ, missing_vars_getter))
+
+    # Every requirement may need the PATH and other variables that
+    # the conda environment sets (a service has to find its
+    # executable, for example), but they only list the environment
+    # as a dependency when it isn't already set. So the environment
+    # always gets its own level, before everything else; it doesn't
+    # depend on anything itself.
+    conda_env_statuses = [status for level in levels for status in level
+                          if isinstance(status.requirement, CondaEnvRequirement)]
+    if len(conda_env_statuses) == 0:
+        return levels
+    other_levels = [[status for status in level if not isinstance(status.requirement, CondaEnvRequirement)]
+                    for level in levels]
+    return [conda_env_statuses] + [level for level in other_levels if len(level) > 0]
+
+
+def _merge_environ_changes(environ, original, modified):
+    for (key, value) in modified.items():
+        if key not in original or original[key] != value:
+            environ[key] = value
+    for key in original:
+        if key not in modified and key in environ:
+            del environ[key]
+
+
+def _requirement_timing_name(requirement):
+    return getattr(requirement, 'env_var', requirement.title)
+
+
+def _timed_check_status(requirement):
+    return timing.timed(timing.TIMING_KIND_CHECK_STATUS, _requirement_timing_name(requirement))
+
+
+def _timed_provide(requirement):
+    return timing.timed(timing.TIMING_KIND_PROVIDE, _requirement_timing_name(requirement))
 
 
 def _in_provide_whitelist(provide_whitelist, requirement):
@@ -442,40 +524,69 @@ def _configure_and_provide(project, environ, local_state, statuses, all_statuses
         def get_missing_to_provide(status):
             return status.analysis.missing_env_vars_to_provide
 
-        sorted = _sort_statuses(environ, local_state, statuses, get_missing_to_provide)
+        levels = _sort_statuses_into_levels(environ, local_state, statuses, get_missing_to_provide)
+
+        def recheck(status):
+            with _timed_check_status(status.requirement):
+                return status.recheck(environ, local_state, default_env_spec_name, overrides)
 
         # we have to recheck all the statuses in case configuration happened
-        rechecked = []
-        for status in sorted:
-            rechecked.append(status.recheck(environ, local_state, default_env_spec_name, overrides))
+        rechecked_levels = [parallel_map(recheck, level) for level in levels]
 
         logs = []
         errors = []
         did_any_providing = False
         results_by_status = dict()
 
-        for status in rechecked:
-            if not _in_provide_whitelist(provide_whitelist, status.requirement):
-                continue
-            elif status.has_been_provided:
+        # Requirements in the same level don't depend on each
+        # other, so we provide them all at once; each gets its own
+        # copy of the environment, and we apply the changes in
+        # order, so the outcome doesn't depend on timing.
+        for level in rechecked_levels:
+            to_provide = [status for status in level
+                          if _in_provide_whitelist(provide_whitelist, status.requirement) and
+                          not status.has_been_provided]
+            if len(to_provide) == 0:
                 continue
+            did_any_providing = True
+
+            if len(to_provide) == 1:
+                context = ProvideContext(environ, local_state, default_env_spec_name, to_provide[0], mode)
+                with _timed_provide(to_provide[0].requirement):
+                    results = [to_provide[0].provider.provide(to_provide[0].requirement, context)]
+                environ_copies = None
             else:
-                did_any_providing = True
-                context = ProvideContext(environ, local_state, default_env_spec_name, status, mode)
-                result = status.provider.provide(status.requirement, context)
+                original_environ = deepcopy(environ)
+                environ_copies = [deepcopy(original_environ) for status in to_provide]
+
+                def provide(index):
+                    status = to_provide[index]
+                    context = ProvideContext(environ_copies[index], local_state, default_env_spec_name, status, mode)
+                    with _timed_provide(status.requirement):
+                        return status.provider.provide(status.requirement, context)
+
+                results = parallel_map(provide, range(len(to_provide)))
+
+            for (index, (status, result)) in enumerate(zip(to_provide, results)):
+                if environ_copies is not None:
+                    _merge_environ_changes(environ, original_environ, environ_copies[index])
                 logs.extend(result.logs)
                 errors.extend(result.errors)
                 results_by_status[status] = result
 
+        rechecked = [status for level in rechecked_levels for status in level]
+
         if did_any_providing:
-            old = rechecked
-            rechecked = []
-            for status in old:
-                rechecked.append(status.recheck(environ,
-                                                local_state,
-                                                default_env_spec_name,
-                                                overrides,
-                                                latest_provide_result=results_by_status.get(status)))
+
+            def recheck_after_provide(status):
+                with _timed_check_status(status.requirement):
+                    return status.recheck(environ,
+                                          local_state,
+                                          default_env_spec_name,
+                                          overrides,
+                                          latest_provide_result=results_by_status.get(status))
+
+            rechecked = parallel_map(recheck_after_provide, rechecked)
 
         failed = False
         for status in rechecked:
@@ -492,7 +603,8 @@ def _configure_and_provide(project, environ, local_state, statuses, all_statuses
                                statuses=result_statuses,
                                errors=errors,
                                environ=environ,
-                               overrides=overrides),
+                               overrides=overrides,
+                               timings=timing.current()),
                 rechecked)
             if keep_going_until_success:
                 return _start_over(stage.statuses_after_execute, rechecked)
@@ -508,7 +620,8 @@ def _configure_and_provide(project, environ, local_state, statuses, all_statuses
                                statuses=result_statuses,
                                command_exec_info=exec_info,
                                environ=environ,
-                               overrides=overrides),
+                               overrides=overrides,
+                               timings=timing.current()),
                 rechecked)
             return None
 
@@ -699,17 +812,27 @@ def _internal_prepare_in_stages(project, environ_copy, overrides, keep_going_unt
 
     local_state = LocalStateFile.load_for_directory(project.directory_path)
 
-    statuses = []
-    for requirement in project.requirements:
-        status = requirement.check_status(environ_copy,
-                                          local_state,
-                                          project.default_env_spec_name_for_command(command),
-                                          overrides,
-                                          latest_provide_result=None)
-        statuses.append(status)
+    default_env_spec_name = project.default_env_spec_name_for_command(command)
 
-    return _first_stage(project, environ_copy, local_state, statuses, keep_going_until_success, mode, provide_whitelist,
-                        overrides, command, extra_command_args)
+    def check(requirement):
+        with _timed_check_status(requirement):
+            return requirement.check_status(environ_copy,
+                                            local_state,
+                                            default_env_spec_name,
+                                            overrides,
+                                            latest_provide_result=None)
+
+    timings = timing.current()
+    if timings is None:
+        timings = timing.Timings()
+
+    with timing.recording(timings):
+        # checking status can mean running conda or pip, connecting to
+        # services, and so on; so do the checks at the same time.
+        statuses = parallel_map(check, project.requirements)
+
+        return _first_stage(project, environ_copy, local_state, statuses, keep_going_until_success, mode,
+                            provide_whitelist, overrides, command, extra_command_args)
 
 
 def prepare_in_stages(project,
@@ -804,6 +927,232 @@ def _check_prepare_prerequisites(project, env_spec_name, command_name, command,
     return failed
 
 
+def _json_sha1(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _stat_stamp(path):
+    try:
+        info = os.stat(path)
+        return [info.st_size, info.st_mtime]
+    except OSError:
+        return None
+
+
+def _encrypted_requirements(project):
+    return [requirement for requirement in project.find_requirements(klass=EnvVarRequirement)
+            if requirement.encrypted]
+
+
+def _pid_is_alive(pid):
+    if sys.platform == 'win32':
+        # os.kill() would terminate the process on Windows
+        return None  # pragma: no cover (windows only)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _service_pid_stamps(project):
+    # services we started leave a pidfile in PROJECT_DIR/services/VAR;
+    # if one of those processes went away, we have to restart it.
+    stamps = []
+    for requirement in project.find_requirements(klass=ServiceRequirement):
+        service_dir = os.path.join(project.directory_path, "services", requirement.env_var)
+        for pidfile in sorted(glob.glob(os.path.join(service_dir, "*.pid"))):
+            try:
+                with open(pidfile, 'r') as f:
+                    pid = int(f.read().strip())
+            except (IOError, OSError, ValueError):
+                stamps.append([pidfile, None, None])
+                continue
+            stamps.append([pidfile, pid, _pid_is_alive(pid)])
+    return stamps
+
+
+def _prepare_fingerprint_cache_name(mode, overrides, command_name, command):
+    # the extra command args are saved in the cache rather than
+    # named by it, so running with new args each time doesn't
+    # leave a cache file behind for every one of them.
+    if command is not None:
+        command_key = [command.name, command._attributes]
+    else:
+        command_key = command_name
+    key = [mode, overrides.env_spec_name, overrides.inherited_env, command_key]
+    try:
+        return "prepare-" + _json_sha1(key)
+    except (TypeError, ValueError):
+        # something in the command attributes that isn't JSON
+        return None
+
+
+def _status_reused(requirement):
+    # conda environments and downloads take real work to check,
+    # but nothing their status depends on can change without
+    # changing the fingerprint. Everything else is checked again:
+    # variables only need a look at the environ, while services
+    # can go away and passwords come from the keyring.
+    return isinstance(requirement, (CondaEnvRequirement, DownloadRequirement))
+
+
+def _prepare_fingerprint(project, environ_before, environ_after):
+    # inputs to prepare that can change without any change to the
+    # project files: the starting environment, the local state file
+    # (which includes service run states), the running services,
+    # the keyring, the conda environments we could use, and the
+    # downloads.
+    project_hash = project.project_file.contents_hash
+    meta_hash = project.conda_meta_file.contents_hash
+    if project_hash is None or meta_hash is None:
+        # unsaved changes in memory
+        return None
+
+    local_state_hash = LocalStateFile.load_for_directory(project.directory_path).contents_hash
+
+    prefixes = set([env_spec.path(project.directory_path) for env_spec in project.env_specs.values()])
+    prefix = environ_after.get(conda_api.conda_prefix_variable(), None)
+    if prefix is not None:
+        prefixes.add(prefix)
+    prefix_stamps = [[prefix, _stat_stamp(os.path.join(prefix, 'conda-meta'))] for prefix in sorted(prefixes)]
+
+    # we only note which passwords are in the keyring; the values
+    # themselves are looked up again every time.
+    keyring_stamps = []
+    for requirement in _encrypted_requirements(project):
+        in_keyring = prefix is not None and keyring.get(prefix, requirement.env_var) is not None
+        keyring_stamps.append([requirement.env_var, in_keyring])
+
+    download_stamps = []
+    for requirement in project.find_requirements(klass=DownloadRequirement):
+        filename = os.path.join(project.directory_path, requirement.filename)
+        download_stamps.append([filename, _stat_stamp(filename)])
+
+    return dict(project_file=project_hash,
+                conda_meta_file=meta_hash,
+                local_state_file=local_state_hash,
+                environ=_json_sha1(environ_before),
+                prefixes=prefix_stamps,
+                keyring=keyring_stamps,
+                services=_service_pid_stamps(project),
+                downloads=download_stamps)
+
+
+def _load_fingerprinted_prepare(project, cache_name, environ_before, overrides, mode, command, extra_command_args):
+    content = project_cache.load_cache(project_cache.cache_filename(project.directory_path, cache_name))
+    if content is None:
+        return None
+
+    environ = deepcopy(environ_before)
+    try:
+        if content['extra_command_args'] != _json_args(extra_command_args):
+            return None
+        saved_statuses = content['statuses']
+        if [saved[0] for saved in saved_statuses] != [requirement.title for requirement in project.requirements]:
+            return None
+        for (key, value) in content['environ_changes'].items():
+            environ[key] = value
+        for key in content['environ_removed']:
+            environ.pop(key, None)
+        fingerprint = _prepare_fingerprint(project, environ_before, environ)
+        if fingerprint is None or fingerprint != content['fingerprint']:
+            return None
+    except (KeyError, TypeError, AttributeError, IndexError):
+        return None
+
+    local_state = LocalStateFile.load_for_directory(project.directory_path)
+    default_env_spec_name = project.default_env_spec_name_for_command(command)
+
+    def check(requirement):
+        with _timed_check_status(requirement):
+            return requirement.check_status(environ,
+                                            local_state,
+                                            default_env_spec_name,
+                                            overrides,
+                                            latest_provide_result=None)
+
+    # passwords were not saved, so have their provider find them
+    # again (usually in the keyring).
+    for status in parallel_map(check, _encrypted_requirements(project)):
+        context = ProvideContext(environ, local_state, default_env_spec_name, status, mode)
+        with _timed_provide(status.requirement):
+            provide_result = status.provider.provide(status.requirement, context)
+        if provide_result.errors:
+            return None
+
+    def reuse_or_check(requirement_and_saved):
+        (requirement, (title, provider_class_name, status_description)) = requirement_and_saved
+        if not _status_reused(requirement):
+            return check(requirement)
+        # the fingerprint says nothing this status depends on has
+        # changed, so it's still met
+        return requirement._create_status(environ,
+                                          local_state,
+                                          default_env_spec_name=default_env_spec_name,
+                                          overrides=overrides,
+                                          latest_provide_result=None,
+                                          has_been_provided=True,
+                                          status_description=status_description,
+                                          provider_class_name=provider_class_name)
+
+    statuses = parallel_map(reuse_or_check, list(zip(project.requirements, saved_statuses)))
+    if not all(statuses):
+        return None
+
+    if command is None:
+        exec_info = None
+    else:
+        exec_info = command.exec_info_for_environment(environ, extra_args=extra_command_args)
+
+    return PrepareSuccess(logs=[],
+                          statuses=tuple(statuses),
+                          command_exec_info=exec_info,
+                          environ=environ,
+                          overrides=overrides,
+                          timings=timing.current())
+
+
+def _json_args(extra_command_args):
+    if extra_command_args is None:
+        return None
+    return list(extra_command_args)
+
+
+def _save_fingerprinted_prepare(project, cache_name, environ_before, extra_command_args, result):
+    fingerprint = _prepare_fingerprint(project, environ_before, result.environ)
+    if fingerprint is None:
+        return
+
+    # we only save what the providers changed, and never passwords;
+    # those are in the caller's environ or the keyring next time.
+    secrets = set([requirement.env_var for requirement in _encrypted_requirements(project)])
+    changes = dict()
+    for (key, value) in result.environ.items():
+        if key not in secrets and environ_before.get(key, None) != value:
+            changes[key] = value
+    removed = [key for key in environ_before if key not in result.environ]
+
+    # enough of each status to rebuild it without checking again
+    statuses = []
+    for requirement in project.requirements:
+        status = [status for status in result.statuses if status.requirement is requirement]
+        if len(status) != 1:
+            return
+        if _status_reused(requirement):
+            statuses.append([requirement.title, type(status[0].provider).__name__, status[0].status_description])
+        else:
+            statuses.append([requirement.title, None, None])
+
+    project_cache.save_cache(
+        project_cache.cache_filename(project.directory_path, cache_name),
+        dict(fingerprint=fingerprint,
+             extra_command_args=_json_args(extra_command_args),
+             statuses=statuses,
+             environ_changes=changes,
+             environ_removed=removed))
+
+
 def prepare_without_interaction(project,
                                 environ=None,
                                 mode=PROVIDE_MODE_DEVELOPMENT,
@@ -811,7 +1160,8 @@ def prepare_without_interaction(project,
                                 env_spec_name=None,
                                 command_name=None,
                                 command=None,
-                                extra_command_args=None):
+                                extra_command_args=None,
+                                force_full_check=False):
     """Prepare a project to run one of its commands.
 
     This method doesn't ask the user any questions, so the
@@ -843,6 +1193,23 @@ def prepare_without_interaction(project,
     result. So ``project.problems`` does not need to be checked in
     advance.
 
+    After a successful prepare (in any mode but
+    ``PROVIDE_MODE_CHECK``, and without a ``provide_whitelist``),
+    we save a fingerprint of its inputs: the project files, the
+    starting environment, the local state file (including service
+    run states), the pidfiles of services we started, which
+    passwords are in the keyring, the conda environment prefixes,
+    and the downloaded files. We also save the environment
+    variables the providers set, except for passwords, and the
+    statuses of the conda environments and downloads. If nothing in the fingerprint or the
+    ``extra_command_args`` has changed next time, we rebuild the
+    ``environ`` from those variables, passwords from the keyring,
+    and the passed-in ``environ``. The saved statuses of conda
+    environments and downloads are reused without checking them;
+    the other requirements are checked again, and if they are all
+    met the result has those ``statuses`` but no ``logs``. Pass
+    ``force_full_check=True`` to always do a full prepare.
+
     Args:
         project (Project): from the ``load_project`` method
         environ (dict): os.environ or the previously-prepared environ; not modified in-place
@@ -852,6 +1219,7 @@ def prepare_without_interaction(project,
         command_name (str): which named command to choose from the project, None for default
         command (ProjectCommand): command object, None for default
         extra_command_args (list): extra args to include in the returned command argv
+        force_full_check (bool): True to check all requirements even if nothing seems to have changed
 
     Returns:
         a ``PrepareResult`` instance, which has a ``failed`` flag
@@ -863,17 +1231,42 @@ def prepare_without_interaction(project,
     if failure is not None:
         return failure
 
-    stage = _internal_prepare_in_stages(project,
-                                        environ_copy=environ_copy,
-                                        overrides=overrides,
-                                        keep_going_until_success=False,
-                                        mode=mode,
-                                        provide_whitelist=provide_whitelist,
-                                        command_name=command_name,
-                                        command=command,
-                                        extra_command_args=extra_command_args)
+    timings = timing.current()
+    if timings is None:
+        timings = timing.Timings()
+
+    with timing.recording(timings):
+        fingerprint_cache_name = None
+        if mode != PROVIDE_MODE_CHECK and provide_whitelist is None:
+            fingerprint_cache_name = _prepare_fingerprint_cache_name(mode, overrides, command_name, command)
+            environ_before = deepcopy(environ_copy)
+            if fingerprint_cache_name is not None and not force_full_check:
+                if command is None:
+                    resolved_command = project.command_for_name(command_name)
+                else:
+                    resolved_command = command
+                with timing.timed(timing.TIMING_KIND_FINGERPRINT, "Check for changes since the last prepare"):
+                    result = _load_fingerprinted_prepare(project, fingerprint_cache_name, environ_before, overrides,
+                                                         mode, resolved_command, extra_command_args)
+                if result is not None:
+                    return result
+
+        stage = _internal_prepare_in_stages(project,
+                                            environ_copy=environ_copy,
+                                            overrides=overrides,
+                                            keep_going_until_success=False,
+                                            mode=mode,
+                                            provide_whitelist=provide_whitelist,
+                                            command_name=command_name,
+                                            command=command,
+                                            extra_command_args=extra_command_args)
+
+        result = prepare_execute_without_interaction(stage)
+
+        if fingerprint_cache_name is not None and not result.failed:
+            _save_fingerprinted_prepare(project, fingerprint_cache_name, environ_before, extra_command_args, result)
 
-    return prepare_execute_without_interaction(stage)
+    return result
 
 
 def prepare_with_browser_ui(project,
@@ -19,10 +19,11 @@ from conda_kapsel.plugins.requirements.download import DownloadRequirement
 from conda_kapsel.plugins.requirements.service import ServiceRequirement
 from conda_kapsel.project_commands import ProjectCommand
 from conda_kapsel.project_file import ProjectFile
-from conda_kapsel.archiver import _list_relative_paths_for_unignored_project_files
+from conda_kapsel.archiver import _list_relative_paths_for_unignored_notebooks
 
 from conda_kapsel.internal.py2_compat import is_string
 from conda_kapsel.internal.simple_status import SimpleStatus
+from conda_kapsel.internal import conda_lock, project_cache, timing
 import conda_kapsel.internal.conda_api as conda_api
 import conda_kapsel.internal.pip_api as pip_api
 
@@ -38,6 +39,76 @@ ALL_COMMAND_TYPES = (COMMAND_TYPE_CONDA_APP_ENTRY, COMMAND_TYPE_SHELL, COMMAND_T
                      COMMAND_TYPE_BOKEH_APP)
 
 
+_CONFIG_CACHE_NAME = "project-config"
+
+
+def _env_spec_to_json(env_spec):
+    return dict(name=env_spec.name,
+                conda_packages=list(env_spec.conda_packages),
+                channels=list(env_spec.channels),
+                pip_packages=list(env_spec.pip_packages),
+                description=env_spec._description)
+
+
+def _lock_filename(directory_path, env_spec_name):
+    return conda_lock.lock_filename(directory_path, env_spec_name, conda_api.current_platform())
+
+
+def _env_spec_from_json(directory_path, json):
+    return EnvSpec(name=json['name'],
+                   conda_packages=json['conda_packages'],
+                   channels=json['channels'],
+                   pip_packages=json['pip_packages'],
+                   description=json['description'],
+                   lock_filename=_lock_filename(directory_path, json['name']))
+
+
+def _requirement_to_json(requirement):
+    # we re-create requirements the same way _ConfigCache does
+    # when it parses the project file; requirement classes we
+    # don't know about make the config uncacheable.
+    if requirement.__class__ is EnvVarRequirement:
+        return dict(kind='variable', env_var=requirement.env_var, options=requirement.options)
+    elif requirement.__class__ is DownloadRequirement:
+        return dict(kind='download',
+                    env_var=requirement.env_var,
+                    url=requirement.url,
+                    filename=requirement.filename,
+                    hash_algorithm=requirement.hash_algorithm,
+                    hash_value=requirement.hash_value,
+                    unzip=requirement.unzip,
+                    description=requirement.options.get('description', None))
+    elif isinstance(requirement, ServiceRequirement):
+        return dict(kind='service', env_var=requirement.env_var, options=requirement.options)
+    elif requirement.__class__ is CondaEnvRequirement:
+        return dict(kind='conda_env')
+    else:
+        return None
+
+
+def _requirement_from_json(registry, env_specs, json):
+    kind = json['kind']
+    if kind == 'variable':
+        return registry.find_requirement_by_env_var(json['env_var'], options=json['options'])
+    elif kind == 'download':
+        return DownloadRequirement(registry,
+                                   env_var=json['env_var'],
+                                   url=json['url'],
+                                   filename=json['filename'],
+                                   hash_algorithm=json['hash_algorithm'],
+                                   hash_value=json['hash_value'],
+                                   unzip=json['unzip'],
+                                   description=json['description'])
+    elif kind == 'service':
+        return registry.find_requirement_by_service_type(service_type=json['options']['type'],
+                                                         env_var=json['env_var'],
+                                                         options=json['options'])
+    elif kind == 'conda_env':
+        return CondaEnvRequirement(registry=registry, env_specs=env_specs)
+    else:
+        return None
+
+
 class _ConfigCache(object):
     def __init__(self, directory_path, registry):
         self.directory_path = directory_path
@@ -48,6 +119,7 @@ class _ConfigCache(object):
         self.name = None
         self.description = ''
         self.icon = None
+        self.discover_notebooks = True
         self.commands = dict()
         self.default_command_name = None
         self.project_file_count = 0
@@ -63,6 +135,10 @@ class _ConfigCache(object):
         self.project_file_count = project_file.change_count
         self.conda_meta_file_count = conda_meta_file.change_count
 
+        with timing.timed(timing.TIMING_KIND_PROJECT_LOAD, "Load project config for " + self.directory_path):
+            self._update(project_file, conda_meta_file)
+
+    def _update(self, project_file, conda_meta_file):
         requirements = []
         problems = []
 
@@ -70,33 +146,137 @@ class _ConfigCache(object):
         if not project_exists:
             problems.append("Project directory '%s' does not exist." % self.directory_path)
 
-        if project_file.corrupted:
-            problems.append("%s has a syntax error that needs to be fixed by hand: %s" %
-                            (project_file.filename, project_file.corrupted_error_message))
-        if conda_meta_file.corrupted:
-            problems.append("%s has a syntax error that needs to be fixed by hand: %s" %
-                            (conda_meta_file.filename, conda_meta_file.corrupted_error_message))
-
-        if project_exists and not (project_file.corrupted or conda_meta_file.corrupted):
-            self._update_name(problems, project_file, conda_meta_file)
-            self._update_description(problems, project_file)
-            self._update_icon(problems, project_file, conda_meta_file)
-            # future: we could un-hardcode this so plugins can add stuff here
-            self._update_variables(requirements, problems, project_file)
-            self._update_downloads(requirements, problems, project_file)
-            self._update_services(requirements, problems, project_file)
-            self._update_env_specs(problems, project_file)
-            # this MUST be after we _update_variables since we may get CondaEnvRequirement
-            # options in the variables section, and after _update_env_specs
-            # since we use those
-            self._update_conda_env_requirements(requirements, problems, project_file)
-
-            # this MUST be after we update env reqs so we have the valid env spec names
-            self._update_commands(problems, project_file, conda_meta_file, requirements)
+        if project_exists and self._load_from_disk_cache(requirements, problems, project_file, conda_meta_file):
+            config_loaded = True
+        else:
+            if project_file.corrupted:
+                problems.append("%s has a syntax error that needs to be fixed by hand: %s" %
+                                (project_file.filename, project_file.corrupted_error_message))
+            if conda_meta_file.corrupted:
+                problems.append("%s has a syntax error that needs to be fixed by hand: %s" %
+                                (conda_meta_file.filename, conda_meta_file.corrupted_error_message))
+
+            config_loaded = project_exists and not (project_file.corrupted or conda_meta_file.corrupted)
+            if config_loaded:
+                self._update_from_files(requirements, problems, project_file, conda_meta_file)
+                self._save_to_disk_cache(requirements, problems, project_file, conda_meta_file)
+
+        if config_loaded:
+            # this MUST be after we parse the commands, and isn't
+            # cached on disk since it depends on the files in the
+            # project directory rather than on the config files.
+            self._update_commands(problems, requirements)
 
         self.requirements = requirements
         self.problems = problems
 
+    def _update_from_files(self, requirements, problems, project_file, conda_meta_file):
+        self._update_name(problems, project_file, conda_meta_file)
+        self._update_description(problems, project_file)
+        self._update_icon(problems, project_file, conda_meta_file)
+        self._update_discover_notebooks(problems, project_file)
+        # future: we could un-hardcode this so plugins can add stuff here
+        self._update_variables(requirements, problems, project_file)
+        self._update_downloads(requirements, problems, project_file)
+        self._update_services(requirements, problems, project_file)
+        self._update_env_specs(problems, project_file)
+        # this MUST be after we _update_variables since we may get CondaEnvRequirement
+        # options in the variables section, and after _update_env_specs
+        # since we use those
+        self._update_conda_env_requirements(requirements, problems, project_file)
+
+        # this MUST be after we update env reqs so we have the valid env spec names
+        self._parse_commands(problems, project_file, conda_meta_file)
+
+    def _disk_cache_key(self, project_file, conda_meta_file):
+        # we can only use the disk cache for files that match
+        # what's on disk, not for unsaved changes.
+        if project_file.contents_hash is None or conda_meta_file.contents_hash is None:
+            return None
+        return dict(directory_path=self.directory_path,
+                    project_file=[project_file.filename, project_file.contents_hash],
+                    conda_meta_file=[conda_meta_file.filename, conda_meta_file.contents_hash])
+
+    def _save_to_disk_cache(self, requirements, problems, project_file, conda_meta_file):
+        key = self._disk_cache_key(project_file, conda_meta_file)
+        if key is None:
+            return
+
+        requirements_json = []
+        for requirement in requirements:
+            requirement_json = _requirement_to_json(requirement)
+            if requirement_json is None:
+                # some plugin we don't know how to save
+                return
+            requirements_json.append(requirement_json)
+
+        content = dict(key=key,
+                       name=self.name,
+                       description=self.description,
+                       icon=self.icon,
+                       checked_icon_file=self._checked_icon_file,
+                       discover_notebooks=self.discover_notebooks,
+                       problems=problems,
+                       requirements=requirements_json,
+                       env_specs=[_env_spec_to_json(env_spec) for env_spec in self.env_specs.values()],
+                       default_env_spec_name=self.default_env_spec_name,
+                       configured_commands=[[name, command._attributes]
+                                            for (name, command) in self._configured_commands.items()],
+                       configured_commands_failed=self._configured_commands_failed,
+                       first_command_name=self._first_command_name,
+                       app_entry=self._app_entry)
+
+        project_cache.save_cache(project_cache.cache_filename(self.directory_path, _CONFIG_CACHE_NAME), content)
+
+    def _load_from_disk_cache(self, requirements, problems, project_file, conda_meta_file):
+        key = self._disk_cache_key(project_file, conda_meta_file)
+        if key is None:
+            return False
+
+        content = project_cache.load_cache(project_cache.cache_filename(self.directory_path, _CONFIG_CACHE_NAME))
+        if content is None or content.get('key', None) != key:
+            return False
+
+        try:
+            checked_icon_file = content['checked_icon_file']
+            if checked_icon_file is not None:
+                (icon_path, icon_existed) = checked_icon_file
+                if os.path.isfile(icon_path) != icon_existed:
+                    return False
+
+            env_specs = dict()
+            for env_spec_json in content['env_specs']:
+                env_spec = _env_spec_from_json(self.directory_path, env_spec_json)
+                env_specs[env_spec.name] = env_spec
+
+            loaded_requirements = [_requirement_from_json(self.registry, env_specs, requirement_json)
+                                   for requirement_json in content['requirements']]
+            if None in loaded_requirements:
+                return False
+
+            configured_commands = dict()
+            for (name, attributes) in content['configured_commands']:
+                configured_commands[name] = ProjectCommand(name=name, attributes=attributes)
+
+            self.name = content['name']
+            self.description = content['description']
+            self.icon = content['icon']
+            self._checked_icon_file = checked_icon_file
+            self.discover_notebooks = content['discover_notebooks']
+            self.env_specs = env_specs
+            self.default_env_spec_name = content['default_env_spec_name']
+            self._configured_commands = configured_commands
+            self._configured_commands_failed = content['configured_commands_failed']
+            self._first_command_name = content['first_command_name']
+            self._app_entry = content['app_entry']
+            requirements.extend(loaded_requirements)
+            problems.extend(content['problems'])
+        except (KeyError, TypeError, ValueError):
+            # cache file is damaged somehow, we'll overwrite it
+            return False
+
+        return True
+
     def _update_name(self, problems, project_file, conda_meta_file):
         name = project_file.get_value('name', None)
         if name is not None:
@@ -130,6 +310,15 @@ class _ConfigCache(object):
 
         self.description = desc
 
+    def _update_discover_notebooks(self, problems, project_file):
+        discover = project_file.get_value('discover_notebooks', True)
+        if not isinstance(discover, bool):
+            problems.append("%s: discover_notebooks: field should have a boolean value not %r" %
+                            (project_file.filename, discover))
+            discover = True
+
+        self.discover_notebooks = discover
+
     def _update_icon(self, problems, project_file, conda_meta_file):
         icon = project_file.get_value('icon', None)
         if icon is not None and not is_string(icon):
@@ -146,9 +335,13 @@ class _ConfigCache(object):
                 # relative to conda.recipe
                 icon = os.path.join(META_DIRECTORY, icon)
 
+        self._checked_icon_file = None
         if icon is not None:
             icon = os.path.join(self.directory_path, icon)
-            if not os.path.isfile(icon):
+            icon_exists = os.path.isfile(icon)
+            # remember this so our disk cache can notice if it changes
+            self._checked_icon_file = [icon, icon_exists]
+            if not icon_exists:
                 problems.append("Icon file %s does not exist." % icon)
                 icon = None
 
@@ -317,7 +510,8 @@ class _ConfigCache(object):
                                                conda_packages=all_deps,
                                                pip_packages=all_pip_deps,
                                                channels=all_channels,
-                                               description=description)
+                                               description=description,
+                                               lock_filename=_lock_filename(self.directory_path, name))
         else:
             problems.append(
                 "%s: env_specs should be a dictionary from environment name to environment attributes, not %r" %
@@ -330,7 +524,8 @@ class _ConfigCache(object):
                                                 conda_packages=shared_deps,
                                                 pip_packages=shared_pip_deps,
                                                 channels=shared_channels,
-                                                description="Default")
+                                                description="Default",
+                                                lock_filename=_lock_filename(self.directory_path, 'default'))
 
         # this is only used for commands that don't specify anything
         self.default_env_spec_name = 'default'
@@ -342,7 +537,7 @@ class _ConfigCache(object):
         env_requirement = CondaEnvRequirement(registry=self.registry, env_specs=self.env_specs)
         requirements.append(env_requirement)
 
-    def _update_commands(self, problems, project_file, conda_meta_file, requirements):
+    def _parse_commands(self, problems, project_file, conda_meta_file):
         failed = False
 
         app_entry_from_meta_yaml = conda_meta_file.app_entry
@@ -429,7 +624,19 @@ class _ConfigCache(object):
                 if not failed:
                     commands[name] = ProjectCommand(name=name, attributes=copied_attrs)
 
-        self._add_notebook_commands(commands, problems, requirements)
+        self._configured_commands = commands
+        self._configured_commands_failed = failed
+        self._first_command_name = first_command_name
+        self._app_entry = app_entry_from_meta_yaml
+
+    def _update_commands(self, problems, requirements):
+        commands = copy(self._configured_commands)
+        failed = self._configured_commands_failed
+        first_command_name = self._first_command_name
+        app_entry_from_meta_yaml = self._app_entry
+
+        if self.discover_notebooks:
+            self._add_notebook_commands(commands, problems, requirements)
 
         if failed:
             self.commands = dict()
@@ -457,9 +664,9 @@ class _ConfigCache(object):
             self.default_command_name = first_command_name
 
     def _add_notebook_commands(self, commands, problems, requirements):
-        files = _list_relative_paths_for_unignored_project_files(self.directory_path,
-                                                                 problems,
-                                                                 requirements=requirements)
+        files = _list_relative_paths_for_unignored_notebooks(self.directory_path,
+                                                             problems,
+                                                             requirements=requirements)
         if files is None:
             assert problems != []
             return
@@ -472,12 +679,11 @@ class _ConfigCache(object):
         files = [f for f in files if not f[0] == '.']
 
         for relative_name in files:
-            if relative_name.endswith('.ipynb'):
-                if relative_name not in commands:
-                    commands[relative_name] = ProjectCommand(name=relative_name,
-                                                             attributes={'notebook': relative_name,
-                                                                         'auto_generated': True,
-                                                                         'env_spec': self.default_env_spec_name})
+            if relative_name not in commands:
+                commands[relative_name] = ProjectCommand(name=relative_name,
+                                                         attributes={'notebook': relative_name,
+                                                                     'auto_generated': True,
+                                                                     'env_spec': self.default_env_spec_name})
 
 
 class Project(object):
@@ -488,16 +694,24 @@ class Project(object):
     the project directory or global user configuration.
     """
 
-    def __init__(self, directory_path, plugin_registry=None):
+    def __init__(self, directory_path, plugin_registry=None, read_only=False):
         """Construct a Project with the given directory and plugin registry.
 
+        If ``read_only`` is True, the project files are loaded
+        with a faster loader that's intended for commands that
+        won't modify them. They can still be modified (it's just
+        slower), but values from ``project_file.get_value()`` must
+        not be modified in place.
+
         Args:
             directory_path (str): path to the project directory
             plugin_registry (PluginRegistry): where to look up Requirement and Provider instances, None for default
+            read_only (bool): True to optimize for reading the project files rather than modifying them
         """
         self._directory_path = os.path.realpath(directory_path)
-        self._project_file = ProjectFile.load_for_directory(directory_path)
-        self._conda_meta_file = CondaMetaFile.load_for_directory(directory_path)
+        with timing.timed(timing.TIMING_KIND_PROJECT_LOAD, "Read project files in " + self._directory_path):
+            self._project_file = ProjectFile.load_for_directory(directory_path, read_only=read_only)
+            self._conda_meta_file = CondaMetaFile.load_for_directory(directory_path, read_only=read_only)
         self._directory_basename = os.path.basename(self._directory_path)
         self._config_cache = _ConfigCache(self._directory_path, plugin_registry)
 
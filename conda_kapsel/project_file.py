@@ -41,7 +41,7 @@ class ProjectFile(YamlFile):
     """
 
     @classmethod
-    def load_for_directory(cls, directory):
+    def load_for_directory(cls, directory, read_only=False):
         """Load the project file from the given directory, even if it doesn't exist.
 
         If the directory has no project file, the loaded
@@ -57,6 +57,7 @@ class ProjectFile(YamlFile):
 
         Args:
             directory (str): path to the project directory
+            read_only (bool): True to load quickly for reading, see ``YamlFile``
 
         Returns:
             a new ``ProjectFile``
@@ -65,10 +66,10 @@ class ProjectFile(YamlFile):
         for name in possible_project_file_names:
             path = os.path.join(directory, name)
             if os.path.isfile(path):
-                return ProjectFile(path)
-        return ProjectFile(os.path.join(directory, DEFAULT_PROJECT_FILENAME))
+                return ProjectFile(path, read_only=read_only)
+        return ProjectFile(os.path.join(directory, DEFAULT_PROJECT_FILENAME), read_only=read_only)
 
-    def __init__(self, filename):
+    def __init__(self, filename, read_only=False):
         """Construct a ``ProjectFile`` with the given filename and requirement registry.
 
         It's easier to use ``ProjectFile.load_for_directory()`` in most cases.
@@ -82,9 +83,10 @@ class ProjectFile(YamlFile):
 
         Args:
             filename (str): path to the project file
+            read_only (bool): True to load quickly for reading, see ``YamlFile``
 
         """
-        super(ProjectFile, self).__init__(filename)
+        super(ProjectFile, self).__init__(filename, read_only=read_only)
 
     def _default_content(self):
         header = (
@@ -15,7 +15,6 @@ import tempfile
 from conda_kapsel.project import Project, ALL_COMMAND_TYPES
 from conda_kapsel import prepare
 from conda_kapsel import archiver
-from conda_kapsel import client
 from conda_kapsel.local_state_file import LocalStateFile
 from conda_kapsel.plugins.requirement import EnvVarRequirement
 from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
@@ -23,10 +22,11 @@ from conda_kapsel.plugins.requirements.download import DownloadRequirement
 from conda_kapsel.plugins.requirements.download import _hash_algorithms
 from conda_kapsel.plugins.requirements.service import ServiceRequirement
 from conda_kapsel.plugins.providers.conda_env import _remove_env_path
+from conda_kapsel.provide import PROVIDE_MODE_CHECK, PROVIDE_MODE_DEVELOPMENT
 from conda_kapsel.internal.simple_status import SimpleStatus
 import conda_kapsel.conda_manager as conda_manager
 from conda_kapsel.internal.conda_api import parse_spec
-from conda_kapsel.internal import keyring
+from conda_kapsel.internal import env_pool, keyring, parallel
 
 _default_projectignore = """
 # project-local contains your personal configuration choices and state
@@ -413,6 +413,61 @@ def remove_env_spec(project, name):
     return status
 
 
+def refresh_lock(project, env_spec_name=None):
+    """Solve for an environment spec's packages again and save them in its lock file.
+
+    Environments are created from the lock file when it's up to
+    date, so package versions only change when this is called
+    (or when the env spec's packages change). The environment is
+    deleted and re-created from the new solution.
+
+    Returns a ``Status`` subtype (it won't be a
+    ``RequirementStatus`` as with some other functions, just a
+    plain status).
+
+    Args:
+        project (Project): the project
+        env_spec_name (str): environment spec name or None for the default
+
+    Returns:
+        ``Status`` instance
+    """
+    failed = project.problems_status()
+    if failed is not None:
+        return failed
+
+    if env_spec_name is None:
+        env_spec_name = project.default_env_spec_name
+    if env_spec_name not in project.env_specs:
+        problem = "Environment spec {} doesn't exist.".format(env_spec_name)
+        return SimpleStatus(success=False, description=problem)
+
+    env_spec = project.env_specs[env_spec_name]
+    try:
+        if os.path.exists(env_spec.lock_filename):
+            os.remove(env_spec.lock_filename)
+    except (IOError, OSError) as e:
+        problem = "Failed to remove {}: {}.".format(env_spec.lock_filename, str(e))
+        return SimpleStatus(success=False, description=problem)
+
+    status = _remove_env_path(env_spec.path(project.directory_path))
+    if not status:
+        return status
+
+    (env_prefix, status) = _prepare_env_prefix(project, env_spec_name)
+    if env_prefix is None:
+        return status
+
+    if not os.path.isfile(env_spec.lock_filename):
+        problem = "Failed to save package versions for environment {} in {}.".format(
+            env_spec_name, env_spec.lock_filename)
+        return SimpleStatus(success=False, description=problem)
+
+    return SimpleStatus(success=True,
+                        description="Saved package versions for environment {} in {}.".format(
+                            env_spec_name, env_spec.lock_filename))
+
+
 def add_packages(project, env_spec_name, packages, channels):
     """Attempt to install packages then add them to kapsel.yml.
 
@@ -498,6 +553,11 @@ def remove_packages(project, env_spec_name, packages):
 
     for env in envs:
         prefix = env.path(project.directory_path)
+        if env_pool.shared_prefix_for_link(prefix) is not None:
+            # other projects may use a shared env, so we stop using
+            # it and prepare will find or create one without the packages
+            _remove_env_path(prefix)
+            continue
         try:
             if os.path.isdir(prefix):
                 conda.remove_packages(prefix, packages)
@@ -545,6 +605,100 @@ def remove_packages(project, env_spec_name, packages):
     return status
 
 
+def update_env_specs(project, env_spec_names=None, jobs=None, environ=None, mode=PROVIDE_MODE_DEVELOPMENT):
+    """Create or fix the environments for several env specs at once.
+
+    Up to ``jobs`` environments are worked on at a time. Each
+    environment is locked while it's changed, and conda commands
+    take turns filling each package cache (with conda 4.6 or
+    later, they then link environments at the same time), so
+    it's safe to run this alongside other conda-kapsel processes.
+
+    In ``PROVIDE_MODE_CHECK``, nothing is changed; the status
+    logs say what would be done, and it fails if any environment
+    needs changes.
+
+    Returns a ``Status`` subtype (it won't be a
+    ``RequirementStatus`` as with some other functions, just a
+    plain status).
+
+    Args:
+        project (Project): the project
+        env_spec_names (list of str): env spec names, or None for all of them
+        jobs (int): how many environments to work on at once, or None for the default
+        environ (dict): environment variables to use, or None for os.environ
+        mode (str): one of ``PROVIDE_MODE_PRODUCTION``, ``PROVIDE_MODE_DEVELOPMENT``, ``PROVIDE_MODE_CHECK``
+
+    Returns:
+        ``Status`` instance
+    """
+    failed = project.problems_status()
+    if failed is not None:
+        return failed
+
+    if env_spec_names is None:
+        env_spec_names = sorted(project.env_specs.keys())
+    for name in env_spec_names:
+        if name not in project.env_specs:
+            problem = "Environment spec {} doesn't exist.".format(name)
+            return SimpleStatus(success=False, description=problem)
+
+    if environ is None:
+        environ = os.environ.copy()
+
+    provider = project.plugin_registry.find_provider_by_class_name('CondaEnvProvider')
+
+    def check(name):
+        env_spec = project.env_specs[name]
+        prefix = env_spec.path(project.directory_path)
+        try:
+            plan = provider.plan_environment_update(environ, prefix, env_spec)
+        except conda_manager.CondaManagerError as e:
+            return ([], "{}: {}".format(name, str(e)))
+        if plan.empty:
+            return ([], None)
+        else:
+            return (["Environment %s needs changes:" % prefix] + ["  " + line for line in plan.summary_lines], None)
+
+    def update(name):
+        env_spec = project.env_specs[name]
+        prefix = env_spec.path(project.directory_path)
+        try:
+            provider.update_environment(environ, prefix, env_spec)
+            return ([], None)
+        except conda_manager.CondaManagerError as e:
+            return ([], "{}: {}".format(name, str(e)))
+        except (IOError, OSError) as e:
+            return ([], "{}: Failed to share environment {}: {}".format(name, prefix, str(e)))
+
+    if mode == PROVIDE_MODE_CHECK:
+        work = check
+    else:
+        work = update
+
+    logs = []
+    errors = []
+    for (more_logs, error) in parallel.parallel_map(work, env_spec_names, max_workers=jobs):
+        logs.extend(more_logs)
+        if error is not None:
+            errors.append(error)
+    if len(errors) > 0:
+        if mode == PROVIDE_MODE_CHECK:
+            problem = "Failed to check some environments."
+        else:
+            problem = "Failed to update some environments."
+        return SimpleStatus(success=False, description=problem, logs=logs, errors=errors)
+    elif mode == PROVIDE_MODE_CHECK:
+        if len(logs) > 0:
+            return SimpleStatus(success=False, description="Some environments need changes.", logs=logs)
+        else:
+            return SimpleStatus(success=True,
+                                description="Environments are up to date: {}.".format(", ".join(env_spec_names)))
+    else:
+        return SimpleStatus(success=True,
+                            description="Updated environments: {}.".format(", ".join(env_spec_names)))
+
+
 def _prepare_env_prefix(project, env_spec_name):
     failed = project.problems_status()
     if failed is not None:
@@ -1037,8 +1191,20 @@ def clean(project, prepare_result):
             except Exception as e:
                 errors.append("Error removing %s: %s." % (dirname, str(e)))
 
+    # let go of shared envs first, so they're deleted if this was their last user
+    envs_dir = os.path.join(project.directory_path, "envs")
+    if os.path.isdir(envs_dir):
+        for name in sorted(os.listdir(envs_dir)):
+            env_path = os.path.join(envs_dir, name)
+            if env_pool.shared_prefix_for_link(env_path) is not None:
+                env_status = _remove_env_path(env_path)
+                if env_status:
+                    logs.append(env_status.status_description)
+                else:
+                    errors.append(env_status.status_description)
+
     cleanup_dir(os.path.join(project.directory_path, "services"))
-    cleanup_dir(os.path.join(project.directory_path, "envs"))
+    cleanup_dir(envs_dir)
 
     if status and len(errors) == 0:
         return SimpleStatus(success=True, description="Cleaned.", logs=logs, errors=errors)
@@ -1046,17 +1212,24 @@ def clean(project, prepare_result):
         return SimpleStatus(success=False, description="Failed to clean everything up.", logs=logs, errors=errors)
 
 
-def archive(project, filename):
+def archive(project, filename, jobs=None, compression_level=None):
     """Make an archive of the non-ignored files in the project.
 
+    Compression is spread over ``jobs`` threads. The archive is
+    an ordinary zip or tarball either way. In a zip, files that
+    are already compressed (images, other archives, and so on)
+    are stored as they are.
+
     Args:
         project (``Project``): the project
         filename (str): name of a zip, tar.gz, or tar.bz2 archive file
+        jobs (int): how many threads to compress on, or None for one per CPU
+        compression_level (int): deflate level 0-9 for zip and tar.gz, or None for the default
 
     Returns:
         a ``Status``, if failed has ``errors``
     """
-    return archiver._archive_project(project, filename)
+    return archiver._archive_project(project, filename, workers=jobs, level=compression_level)
 
 
 def upload(project, site=None, username=None, token=None, log_level=None):
@@ -1088,6 +1261,9 @@ def upload(project, site=None, username=None, token=None, log_level=None):
         status = archive(project, tmp_tarfile.name)
         if not status:
             return status
+        # requests and binstar_client are slow to import, so
+        # only load them when we really upload.
+        from conda_kapsel import client
         status = client._upload(project,
                                 tmp_tarfile.name,
                                 uploaded_basename=(project.name + suffix),
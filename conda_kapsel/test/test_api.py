@@ -52,7 +52,7 @@ def test_load_project(monkeypatch):
 
     monkeypatch.setattr('conda_kapsel.project.Project', MockProject)
     p = api.AnacondaProject()
-    kwargs = dict(directory_path='foo')
+    kwargs = dict(directory_path='foo', read_only=True)
     project = p.load_project(**kwargs)
     assert kwargs == project.kwargs
 
@@ -83,7 +83,8 @@ def _test_prepare_without_interaction(monkeypatch, api_method, provide_mode):
                   env_spec_name='someenv',
                   command_name='foo',
                   command=1234,
-                  extra_command_args=['1', '2'])
+                  extra_command_args=['1', '2'],
+                  force_full_check=True)
     result = getattr(p, api_method)(**kwargs)
     assert 42 == result
     assert params['kwargs']['mode'] == provide_mode
@@ -330,6 +331,46 @@ def test_remove_env_spec(monkeypatch):
     assert kwargs == params['kwargs']
 
 
+def test_refresh_lock(monkeypatch):
+    import conda_kapsel.project_ops as project_ops
+    _verify_args_match(api.AnacondaProject.refresh_lock, project_ops.refresh_lock)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_refresh_lock(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.project_ops.refresh_lock', mock_refresh_lock)
+
+    p = api.AnacondaProject()
+    kwargs = dict(project=43, env_spec_name='foo')
+    result = p.refresh_lock(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
+def test_update_env_specs(monkeypatch):
+    import conda_kapsel.project_ops as project_ops
+    _verify_args_match(api.AnacondaProject.update_env_specs, project_ops.update_env_specs)
+
+    params = dict(args=(), kwargs=dict())
+
+    def mock_update_env_specs(*args, **kwargs):
+        params['args'] = args
+        params['kwargs'] = kwargs
+        return 42
+
+    monkeypatch.setattr('conda_kapsel.project_ops.update_env_specs', mock_update_env_specs)
+
+    p = api.AnacondaProject()
+    kwargs = dict(project=43, env_spec_names=['foo'], jobs=2, environ=dict(), mode=provide.PROVIDE_MODE_CHECK)
+    result = p.update_env_specs(**kwargs)
+    assert 42 == result
+    assert kwargs == params['kwargs']
+
+
 def test_add_packages(monkeypatch):
     import conda_kapsel.project_ops as project_ops
     _verify_args_match(api.AnacondaProject.add_packages, project_ops.add_packages)
@@ -507,7 +548,7 @@ def test_archive(monkeypatch):
     monkeypatch.setattr('conda_kapsel.project_ops.archive', mock_archive)
 
     p = api.AnacondaProject()
-    kwargs = dict(project=43, filename=123)
+    kwargs = dict(project=43, filename=123, jobs=2, compression_level=9)
     result = p.archive(**kwargs)
     assert 42 == result
     assert kwargs == params['kwargs']
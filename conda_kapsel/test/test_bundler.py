@@ -6,10 +6,18 @@
 # ----------------------------------------------------------------------------
 from __future__ import absolute_import, print_function
 
+import fnmatch
+import gzip
 import os
+import pytest
+import sys
+import tarfile
+import zipfile
+import zlib
 
 from conda_kapsel import archiver
 from conda_kapsel import project_ops
+from conda_kapsel.internal import py2_compat
 from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 
 
@@ -159,3 +167,491 @@ def test_file_pattern_matcher_with_directories():
     tests['/foo/'] = tests['/foo']
 
     _test_file_pattern_matcher(tests, is_directory=True)
+
+
+def _fnmatch_reference(pattern, path, is_directory):
+    # the straightforward one-glob-per-parent way to match
+    if pattern.startswith("/"):
+        glob = pattern
+    else:
+        glob = "*/" + pattern
+    if glob.endswith("/"):
+        if not is_directory:
+            return False
+        glob = glob[:-1]
+    path = "/" + path
+    while path != '/':
+        if fnmatch.fnmatch(path, glob):
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def test_pattern_matcher_agrees_with_fnmatch():
+    class FakeInfo(object):
+        def __init__(self, path, is_directory):
+            self.unixified_relative_path = path
+            self.is_directory = is_directory
+
+    patterns = ['foo', '/foo', 'foo/', '/foo/', '*.pyc', '/envs/', 'a/b', '/a/*/c', 'b?r', '[fb]oo', '[!f]oo',
+                'x[', '**/bar', '/', '*/', 'foo.bar', 'f(o)+o', '/.ipynb_checkpoints', '__pycache__/']
+    paths = ['foo', 'bar/foo', 'foo/bar', 'foobar', 'barfoo', 'boo', 'a/b', 'a/b/c', 'a/x/c', 'a/x/y/c/d',
+             'x.pyc', 'y/x.pyc', 'envs', 'envs/default/bin', 'bar', 'bor', 'x[', 'foo.bar', 'fooxbar',
+             'f(o)+o', '.ipynb_checkpoints/x', 'q/__pycache__', 'q/__pycache__/x.pyc']
+
+    for is_directory in (True, False):
+        for path in paths:
+            info = FakeInfo(path, is_directory)
+            expected = [pattern for pattern in patterns if _fnmatch_reference(pattern, path, is_directory)]
+            matched = [pattern for pattern in patterns if archiver._FilePattern(pattern).matches(info)]
+            assert expected == matched
+            combined = archiver._PatternMatcher(patterns)
+            assert (len(expected) > 0) == combined.matches(info)
+
+
+def test_pattern_matcher_checks_only_the_path_when_parents_checked():
+    class FakeInfo(object):
+        def __init__(self, path, is_directory):
+            self.unixified_relative_path = path
+            self.is_directory = is_directory
+
+    matcher = archiver._PatternMatcher(['/envs/', 'foo', '*.pyc'])
+    assert matcher.matches(FakeInfo('envs/default/bin', is_directory=True))
+    assert not matcher.matches(FakeInfo('envs/default/bin', is_directory=True), parents_checked=True)
+    assert matcher.matches(FakeInfo('envs', is_directory=True), parents_checked=True)
+    assert not matcher.matches(FakeInfo('envs', is_directory=False), parents_checked=True)
+    assert matcher.matches(FakeInfo('bar/foo', is_directory=False), parents_checked=True)
+    assert matcher.matches(FakeInfo('bar/x.pyc', is_directory=False), parents_checked=True)
+
+    assert not archiver._PatternMatcher([]).matches(FakeInfo('foo', is_directory=False))
+
+
+def test_walk_project_prunes_ignored_directories():
+    def check(dirname):
+        checked = []
+
+        def ignore_filter(info, parents_checked=False):
+            assert parents_checked
+            checked.append(info.unixified_relative_path)
+            return info.basename == 'envs'
+
+        errors = []
+        infos = list(archiver._walk_project(dirname, ignore_filter, errors))
+        assert [] == errors
+        assert ['foo.py', 'lib', 'lib/bar.py'] == sorted([info.unixified_relative_path for info in infos])
+        bar_paths = [info.full_path for info in infos if info.basename == 'bar.py']
+        assert [os.path.join(dirname, 'lib', 'bar.py')] == bar_paths
+        # one check for the ignored directory, none for its contents
+        assert ['envs', 'foo.py', 'lib', 'lib/bar.py'] == sorted(checked)
+
+    with_directory_contents(
+        {
+            'foo.py': '',
+            'lib/bar.py': '',
+            'envs/default/bin/python': '',
+            'envs/default/lib/big.so': ''
+        }, check)
+
+
+def test_walk_project_leaves_only():
+    def check(dirname):
+        os.makedirs(os.path.join(dirname, 'empty', 'nested'))
+        os.makedirs(os.path.join(dirname, 'only_ignored'))
+        with open(os.path.join(dirname, 'only_ignored', 'x.pyc'), 'w') as f:
+            f.write('')
+
+        def ignore_filter(info, parents_checked=False):
+            return info.basename.endswith('.pyc')
+
+        errors = []
+        infos = archiver._walk_project(dirname, ignore_filter, errors, leaves_only=True)
+        assert ['a/b/c.py', 'a/d.py', 'empty/nested', 'foo.py', 'only_ignored'] == \
+            sorted([info.unixified_relative_path for info in infos])
+        assert [] == errors
+
+        infos = archiver._walk_project(dirname, ignore_filter, errors)
+        assert ['a', 'a/b', 'a/b/c.py', 'a/d.py', 'empty', 'empty/nested', 'foo.py', 'only_ignored'] == \
+            sorted([info.unixified_relative_path for info in infos])
+
+    with_directory_contents({'foo.py': '', 'a/d.py': '', 'a/b/c.py': ''}, check)
+
+
+def test_walk_project_streams_infos(monkeypatch):
+    def check(dirname):
+        listed = []
+        real_scan = archiver._scan_directory
+
+        def mock_scan(project_directory, relative_dir):
+            listed.append(relative_dir)
+            return real_scan(project_directory, relative_dir)
+
+        monkeypatch.setattr('conda_kapsel.archiver._scan_directory', mock_scan)
+        errors = []
+        infos = archiver._walk_project(dirname, lambda info, parents_checked=False: False, errors)
+        # nothing is listed until someone asks
+        assert [] == listed
+        first = next(infos)
+        assert [''] == listed
+        assert 'a' == first.relative_path
+        assert first.is_directory
+        assert [os.path.join('a', 'b')] == [info.relative_path for info in infos]
+        assert ['', 'a'] == listed
+
+    with_directory_contents({'a/b': ''}, check)
+
+
+def test_walk_project_does_not_follow_directory_symlinks():
+    if not hasattr(os, 'symlink'):
+        return  # pragma: no cover (no symlinks)
+
+    def check(dirname):
+        os.symlink(os.path.join(dirname, 'real'), os.path.join(dirname, 'link'))
+
+        errors = []
+        infos = list(archiver._walk_project(dirname, lambda info, parents_checked=False: False, errors,
+                                            leaves_only=True))
+        assert [] == errors
+        by_path = dict((info.unixified_relative_path, info) for info in infos)
+        assert ['link', 'real/foo.py'] == sorted(by_path.keys())
+        assert by_path['link'].is_directory
+        assert by_path['link'].is_link
+        assert not by_path['real/foo.py'].is_link
+
+    with_directory_contents({'real/foo.py': ''}, check)
+
+
+def test_walk_project_cannot_list(monkeypatch):
+    def check(dirname):
+        def mock_scandir(path):
+            if path == os.path.join(dirname, 'sub'):
+                raise OSError("Nope sub")
+            raise OSError("NOPE")
+
+        monkeypatch.setattr('conda_kapsel.internal.py2_compat.scandir', mock_scandir)
+        errors = []
+        assert [] == list(archiver._walk_project(dirname, lambda info, parents_checked=False: False, errors))
+        assert ["Could not list files in %s: NOPE." % dirname] == errors
+
+    with_directory_contents({'sub/foo.py': ''}, check)
+
+
+def test_walk_project_skips_unlistable_subdirectory(monkeypatch):
+    def check(dirname):
+        real_scandir = py2_compat.scandir
+
+        def mock_scandir(path):
+            if path == os.path.join(dirname, 'sub'):
+                raise OSError("NOPE")
+            return real_scandir(path)
+
+        monkeypatch.setattr('conda_kapsel.internal.py2_compat.scandir', mock_scandir)
+        errors = []
+        infos = archiver._walk_project(dirname, lambda info, parents_checked=False: False, errors)
+        assert ['foo.py', 'sub'] == sorted([info.relative_path for info in infos])
+        assert [] == errors
+
+    with_directory_contents({'sub/bar.py': '', 'foo.py': ''}, check)
+
+
+_GIT_LS_FILES_OUTPUT = b'envs/\0onlyignored/\0onlyignored/x.pyc\0sub/b.pyc\0with\nnewline.pyc\0'
+
+
+def _mock_git_ls_files(monkeypatch, calls):
+    def mock_check_output(args, cwd):
+        calls.append(args)
+        return _GIT_LS_FILES_OUTPUT
+
+    monkeypatch.setattr('subprocess.check_output', mock_check_output)
+
+
+def test_git_ignored_files_collapses_directories(monkeypatch):
+    def check(dirname):
+        calls = []
+        _mock_git_ls_files(monkeypatch, calls)
+        errors = []
+        ignored = archiver._git_ignored_files(dirname, errors)
+        assert [] == errors
+        assert ['--directory', '-z'] == calls[0][-2:]
+        # onlyignored isn't ignored itself, only everything in it is
+        assert ['.git', 'envs', 'onlyignored/x.pyc', 'sub/b.pyc', 'with\nnewline.pyc'] == ignored
+
+    with_directory_contents({'.git/config': ''}, check)
+
+
+def test_git_filter_ignores_everything_in_ignored_directories(monkeypatch):
+    class FakeInfo(object):
+        def __init__(self, path):
+            self.unixified_relative_path = path
+
+    def check(dirname):
+        _mock_git_ls_files(monkeypatch, [])
+        errors = []
+        is_git_ignored = archiver._git_filter(dirname, errors)
+        assert [] == errors
+
+        for path in ('envs', 'envs/default/bin/python', '.git/config', 'onlyignored/x.pyc', 'sub/b.pyc'):
+            assert is_git_ignored(FakeInfo(path))
+        for path in ('envsx', 'env', 'onlyignored', 'onlyignored/y.py', 'sub', 'sub/c.pyc'):
+            assert not is_git_ignored(FakeInfo(path))
+
+        # the walk has already checked the parents
+        assert is_git_ignored(FakeInfo('envs'), parents_checked=True)
+        assert not is_git_ignored(FakeInfo('envs/default/bin/python'), parents_checked=True)
+
+    with_directory_contents({'.git/config': ''}, check)
+
+
+def _archive_test_infos(dirname):
+    return list(archiver._walk_project(dirname, lambda info, parents_checked=False: False, [], leaves_only=True))
+
+
+_ARCHIVE_TEST_CONTENTS = {
+    'foo.py': 'print("hello")\n' * 100,
+    'lib/bar.txt': 'bar\n' * 10000,
+    'lib/empty.txt': '',
+    'lib/big.txt': 'big\n' * 100000,
+    'data/unicode_é.txt': 'é',
+    'emptydir': None
+}
+
+
+def test_write_zip_in_parallel_is_byte_identical(monkeypatch):
+    def check(dirname):
+        out_dir = os.path.join(dirname, 'out')
+        project_dir = os.path.join(dirname, 'project')
+        infos = _archive_test_infos(project_dir)
+
+        serial = os.path.join(out_dir, 'serial.zip')
+        logs = []
+        archiver._write_zip('proj', infos, serial, logs, workers=1)
+
+        # small limits so we get several batches and one file too big to batch
+        monkeypatch.setattr('conda_kapsel.archiver._MAX_PARALLEL_ZIP_MEMBER_SIZE', 100000)
+        monkeypatch.setattr('conda_kapsel.archiver._ZIP_MEMBERS_PER_WORKER', 1)
+        parallel = os.path.join(out_dir, 'parallel.zip')
+        parallel_logs = []
+        archiver._write_zip('proj', infos, parallel, parallel_logs, workers=2)
+
+        added = [line for line in logs if line.startswith("  added ")]
+        assert len(infos) == len(added)
+        assert added == [line for line in parallel_logs if line.startswith("  added ")]
+        with open(serial, 'rb') as f:
+            serial_bytes = f.read()
+        with open(parallel, 'rb') as f:
+            assert serial_bytes == f.read()
+
+        with zipfile.ZipFile(parallel, 'r') as zf:
+            assert zf.testzip() is None
+            assert ('bar\n' * 10000).encode('utf-8') == zf.read('proj/lib/bar.txt')
+            assert ('big\n' * 100000).encode('utf-8') == zf.read('proj/lib/big.txt')
+            assert zipfile.ZIP_DEFLATED == zf.getinfo('proj/lib/bar.txt').compress_type
+            assert zipfile.ZIP_DEFLATED == zf.getinfo('proj/lib/big.txt').compress_type
+            # deflate would make it bigger
+            assert zipfile.ZIP_STORED == zf.getinfo('proj/lib/empty.txt').compress_type
+
+    with_directory_contents(dict([('project/' + name, content) for (name, content) in _ARCHIVE_TEST_CONTENTS.items()] +
+                                 [('out', None)]), check)
+
+
+def test_write_zip_without_zip_file_internals(monkeypatch):
+    def check(dirname):
+        out_dir = os.path.join(dirname, 'out')
+        infos = _archive_test_infos(os.path.join(dirname, 'project'))
+
+        with_internals = os.path.join(out_dir, 'with_internals.zip')
+        archiver._write_zip('proj', infos, with_internals, [], workers=2)
+
+        monkeypatch.setattr('conda_kapsel.archiver._can_write_compressed_zip_members', lambda zf: False)
+
+        def mock_write_compressed_zip_member(zf, zinfo, compressed):
+            raise AssertionError("should have used ZipFile.write")
+
+        monkeypatch.setattr('conda_kapsel.archiver._write_compressed_zip_member', mock_write_compressed_zip_member)
+        without_internals = os.path.join(out_dir, 'without_internals.zip')
+        logs = []
+        archiver._write_zip('proj', infos, without_internals, logs, workers=2)
+        assert len(infos) == len([line for line in logs if line.startswith("  added ")])
+
+        with zipfile.ZipFile(with_internals, 'r') as expected:
+            with zipfile.ZipFile(without_internals, 'r') as zf:
+                assert zf.testzip() is None
+                assert expected.namelist() == zf.namelist()
+                for zinfo in expected.infolist():
+                    assert expected.read(zinfo.filename) == zf.read(zinfo.filename)
+                assert zipfile.ZIP_DEFLATED == zf.getinfo('proj/lib/bar.txt').compress_type
+
+    with_directory_contents(dict([('project/' + name, content) for (name, content) in _ARCHIVE_TEST_CONTENTS.items()] +
+                                 [('out', None)]), check)
+
+
+def test_can_write_compressed_zip_members():
+    def check(dirname):
+        with zipfile.ZipFile(os.path.join(dirname, 'foo.zip'), 'w') as zf:
+            assert archiver._can_write_compressed_zip_members(zf)
+
+        class NotQuiteZipFile(object):
+            fp = None
+            filelist = []
+            NameToInfo = {}
+
+        assert not archiver._can_write_compressed_zip_members(NotQuiteZipFile())
+
+    with_directory_contents(dict(), check)
+
+
+def test_write_compressed_zip_member_while_writing_handle_is_open():
+    if sys.version_info < (3, 6):
+        pytest.skip("ZipFile can't open members for writing")
+
+    def check(dirname):
+        filename = os.path.join(dirname, 'foo.zip')
+        with zipfile.ZipFile(filename, 'w') as zf:
+            zinfo = zipfile.ZipInfo('bar.txt')
+            zinfo.file_size = zinfo.compress_size = 3
+            zinfo.CRC = zlib.crc32(b'bar') & 0xffffffff
+            with zf.open('foo.txt', 'w') as f:
+                with pytest.raises(ValueError) as excinfo:
+                    archiver._write_compressed_zip_member(zf, zinfo, b'bar')
+                assert "open writing handle" in str(excinfo.value)
+                f.write(b'foo')
+            archiver._write_compressed_zip_member(zf, zinfo, b'bar')
+        with zipfile.ZipFile(filename, 'r') as zf:
+            assert zf.testzip() is None
+            assert b'foo' == zf.read('foo.txt')
+            assert b'bar' == zf.read('bar.txt')
+
+    with_directory_contents(dict(), check)
+
+
+def test_looks_compressed():
+    random_bytes = os.urandom(100000)
+    text = b"some text that compresses well\n" * 1000
+    assert archiver._looks_compressed("foo.png", b"")
+    assert archiver._looks_compressed("foo.PARQUET", text)
+    assert archiver._looks_compressed("foo/bar.tar.gz", text)
+    assert archiver._looks_compressed("foo.dat", random_bytes)
+    assert not archiver._looks_compressed("foo.dat", text)
+    assert not archiver._looks_compressed("foo.csv", text + random_bytes)
+    # too small to bother sampling
+    assert not archiver._looks_compressed("foo.dat", random_bytes[:100])
+
+
+def _check_compression_heuristics(dirname, level=None):
+    project_dir = os.path.join(dirname, 'project')
+    with open(os.path.join(project_dir, 'random.dat'), 'wb') as f:
+        f.write(os.urandom(50000))
+    infos = _archive_test_infos(project_dir)
+    filename = os.path.join(dirname, 'out', 'heuristics.zip')
+    logs = []
+    archiver._write_zip('proj', infos, filename, logs, level=level, workers=2)
+    with zipfile.ZipFile(filename, 'r') as zf:
+        assert zf.testzip() is None
+        compress_types = dict((zinfo.filename, zinfo.compress_type) for zinfo in zf.infolist())
+    return (compress_types, logs)
+
+
+def test_write_zip_stores_compressed_files(monkeypatch):
+    def check(dirname):
+        # make sure the streamed path makes the same choices
+        monkeypatch.setattr('conda_kapsel.archiver._MAX_PARALLEL_ZIP_MEMBER_SIZE', 40000)
+        (compress_types, logs) = _check_compression_heuristics(dirname)
+        assert zipfile.ZIP_DEFLATED == compress_types['proj/notes.txt']
+        assert zipfile.ZIP_DEFLATED == compress_types['proj/big.csv']
+        assert zipfile.ZIP_STORED == compress_types['proj/image.png']
+        assert zipfile.ZIP_STORED == compress_types['proj/random.dat']
+        assert zipfile.ZIP_STORED == compress_types['proj/image.PNG']
+
+        assert "Compression by file type:" in logs
+        stats = [line for line in logs if line.startswith("  .") or line.startswith("  (")]
+        # biggest first
+        assert stats[0].startswith("  .csv: 1 files, 99000 -> ")
+        assert "MB/s" in stats[0]
+        assert "  .dat: 1 files, 50000 -> 50000 bytes (100.0%)" in stats[1]
+        assert stats[1].endswith(", stored as-is")
+        png = [line for line in stats if line.startswith("  .png:")][0]
+        assert png.startswith("  .png: 2 files, ")
+        assert png.endswith(", stored as-is")
+        txt = [line for line in stats if line.startswith("  .txt:")][0]
+        assert "stored" not in txt
+
+    with_directory_contents({'project/notes.txt': 'notes\n' * 1000,
+                             'project/big.csv': '1,2,3\n' * 16500,
+                             'project/image.png': 'not really a png',
+                             'project/image.PNG': 'not really a png',
+                             'out': None}, check)
+
+
+def test_write_zip_with_level_zero_stores_everything(monkeypatch):
+    def check(dirname):
+        monkeypatch.setattr('conda_kapsel.archiver._MAX_PARALLEL_ZIP_MEMBER_SIZE', 40000)
+        (compress_types, logs) = _check_compression_heuristics(dirname, level=0)
+        assert set([zipfile.ZIP_STORED]) == set(compress_types.values())
+        csv = [line for line in logs if line.startswith("  .csv")][0]
+        assert csv.startswith("  .csv: 1 files, 99000 -> 99000 bytes (100.0%), ")
+
+    with_directory_contents({'project/notes.txt': 'notes\n' * 1000,
+                             'project/big.csv': '1,2,3\n' * 16500,
+                             'out': None}, check)
+
+
+def test_write_zip_compression_level(monkeypatch):
+    def check(dirname):
+        sizes = []
+        for level in (1, 9):
+            filename = os.path.join(dirname, 'out', '%d.zip' % level)
+            archiver._write_zip('proj', _archive_test_infos(os.path.join(dirname, 'project')), filename, [],
+                                level=level)
+            with zipfile.ZipFile(filename, 'r') as zf:
+                sizes.append(zf.getinfo('proj/words.txt').compress_size)
+                assert _WORDS == zf.read('proj/words.txt').decode('utf-8')
+        assert sizes[1] < sizes[0]
+
+    with_directory_contents({'project/words.txt': _WORDS, 'out': None}, check)
+
+
+_WORDS = " ".join(["word%d" % (i * 7919 % 1000) for i in range(50000)])
+
+
+def test_compression_stats_log_lines():
+    assert [] == archiver._CompressionStats().log_lines()
+
+    stats = archiver._CompressionStats()
+    empty = zipfile.ZipInfo('proj/README')
+    empty.compress_type = zipfile.ZIP_DEFLATED
+    stats.add(empty, 0.0)
+    assert ["Compression by file type:", "  (no extension): 1 files, 0 -> 0 bytes (-), - MB/s"] == stats.log_lines()
+
+    for (compress_type, size) in ((zipfile.ZIP_DEFLATED, 100), (zipfile.ZIP_STORED, 1000)):
+        zinfo = zipfile.ZipInfo('proj/foo.DAT')
+        zinfo.compress_type = compress_type
+        zinfo.file_size = 2000000
+        zinfo.compress_size = size * 1000
+        stats.add(zinfo, 1.0)
+    assert ["Compression by file type:",
+            "  .dat: 2 files, 4000000 -> 1100000 bytes (27.5%), 2.0 MB/s, 1 stored as-is",
+            "  (no extension): 1 files, 0 -> 0 bytes (-), - MB/s"] == stats.log_lines()
+
+
+def test_write_tar_gz_in_parallel():
+    def check(dirname):
+        out_dir = os.path.join(dirname, 'out')
+        project_dir = os.path.join(dirname, 'project')
+        infos = _archive_test_infos(project_dir)
+
+        plain = os.path.join(out_dir, 'plain.tar')
+        archiver._write_tar('proj', infos, plain, compression=None, logs=[])
+        parallel = os.path.join(out_dir, 'parallel.tar.gz')
+        logs = []
+        archiver._write_tar('proj', infos, parallel, compression='gz', logs=logs, workers=3)
+
+        assert len(infos) == len(logs)
+        # the same tarball, just compressed
+        with open(plain, 'rb') as f:
+            plain_bytes = f.read()
+        with gzip.open(parallel, 'rb') as f:
+            assert plain_bytes == f.read()
+        with tarfile.open(parallel, 'r:gz') as tf:
+            assert ('big\n' * 100000).encode('utf-8') == tf.extractfile('proj/lib/big.txt').read()
+
+    with_directory_contents(dict([('project/' + name, content) for (name, content) in _ARCHIVE_TEST_CONTENTS.items()] +
+                                 [('out', None)]), check)
@@ -7,7 +7,9 @@
 from __future__ import absolute_import
 
 from conda_kapsel.conda_manager import (push_conda_manager_class, pop_conda_manager_class, new_conda_manager,
-                                        CondaManager)
+                                        CondaManager, CondaEnvironmentDeviations)
+from conda_kapsel.env_spec import EnvSpec
+from conda_kapsel.internal.test.tmpfile_utils import with_directory_contents
 
 
 def test_use_non_default_conda_manager():
@@ -34,3 +36,83 @@ def test_use_non_default_conda_manager():
                     remove_packages=(None, None)) == called
     finally:
         pop_conda_manager_class()
+
+
+class _PlanningCondaManager(CondaManager):
+    def __init__(self, deviations):
+        self.deviations = deviations
+
+    def find_environment_deviations(self, prefix, spec):
+        return self.deviations
+
+    def fix_environment_deviations(self, prefix, spec, deviations=None):
+        pass
+
+    def remove_packages(self, prefix, packages):
+        pass
+
+
+def _deviations(missing=(), wrong_version=(), missing_pip=(), wrong_version_pip=()):
+    return CondaEnvironmentDeviations(summary="test",
+                                      missing_packages=missing,
+                                      wrong_version_packages=wrong_version,
+                                      missing_pip_packages=missing_pip,
+                                      wrong_version_pip_packages=wrong_version_pip)
+
+
+_spec = EnvSpec(name='foo',
+                conda_packages=['numpy>=1.11', 'six', 'bokeh=0.12'],
+                pip_packages=['flake8==2.5.4', 'pep257'],
+                channels=['chan'])
+
+
+def test_plan_create():
+    def check(dirname):
+        manager = _PlanningCondaManager(None)
+        plan = manager.plan_environment_fix(dirname, _spec)
+        assert plan.create
+        assert not plan.empty
+        assert ('python', 'numpy>=1.11', 'six', 'bokeh=0.12') == plan.conda_packages
+        assert ('flake8==2.5.4', 'pep257') == plan.pip_packages
+        assert ('chan', ) == plan.channels
+        assert ["Create environment with conda packages: python, numpy>=1.11, six, bokeh=0.12",
+                "Install pip packages: flake8==2.5.4, pep257"] == plan.summary_lines
+
+        # we don't add a second python
+        spec = EnvSpec(name='foo', conda_packages=['six', 'python=3.5'], channels=[])
+        plan = manager.plan_environment_fix(dirname, spec)
+        assert ('six', 'python=3.5') == plan.conda_packages
+        assert () == plan.pip_packages
+        assert ["Create environment with conda packages: six, python=3.5"] == plan.summary_lines
+
+    with_directory_contents(dict(), check)
+
+
+def test_plan_changes_to_existing_env():
+    def check(dirname):
+        manager = _PlanningCondaManager(_deviations(missing=['bokeh'],
+                                                    wrong_version=['numpy'],
+                                                    wrong_version_pip=['flake8']))
+        plan = manager.plan_environment_fix(dirname, _spec)
+        assert not plan.create
+        assert ('numpy>=1.11', 'bokeh=0.12') == plan.conda_packages
+        assert ('flake8==2.5.4', ) == plan.pip_packages
+        assert ["Install conda packages: numpy>=1.11, bokeh=0.12",
+                "Install pip packages: flake8==2.5.4"] == plan.summary_lines
+
+        # passing in deviations means we don't look for them again
+        plan = manager.plan_environment_fix(dirname, _spec, _deviations(missing_pip=['pep257']))
+        assert () == plan.conda_packages
+        assert ('pep257', ) == plan.pip_packages
+        assert ["Install pip packages: pep257"] == plan.summary_lines
+
+    with_directory_contents({'conda-meta/foo': ''}, check)
+
+
+def test_plan_nothing_to_do():
+    def check(dirname):
+        plan = _PlanningCondaManager(_deviations()).plan_environment_fix(dirname, _spec)
+        assert plan.empty
+        assert [] == plan.summary_lines
+
+    with_directory_contents({'conda-meta/foo': ''}, check)
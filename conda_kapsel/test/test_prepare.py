@@ -21,8 +21,10 @@ from conda_kapsel.prepare import (prepare_without_interaction, prepare_with_brow
 from conda_kapsel.project import Project
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 from conda_kapsel.project_commands import ProjectCommand
+from conda_kapsel.provide import PROVIDE_MODE_CHECK
 from conda_kapsel.local_state_file import LocalStateFile
 from conda_kapsel.plugins.requirement import (EnvVarRequirement, UserConfigOverrides)
+from conda_kapsel.plugins.requirements.conda_env import CondaEnvRequirement
 from conda_kapsel.conda_manager import (push_conda_manager_class, pop_conda_manager_class, CondaManager,
                                         CondaEnvironmentDeviations)
 import conda_kapsel.internal.keyring as keyring
@@ -698,3 +700,442 @@ def test_prepare_success_properties():
     assert result.status_for('FOO') is None
     assert result.status_for(EnvVarRequirement) is None
     assert result.overrides is not None
+
+
+def test_provide_independent_requirements_concurrently(monkeypatch):
+    import threading
+    from conda_kapsel.plugins.provider import EnvVarProvider, ProvideResult
+
+    arrived = []
+    lock = threading.Lock()
+    everyone_here = threading.Event()
+
+    original_provide = EnvVarProvider.provide
+
+    def mock_provide(self, requirement, context):
+        if requirement.env_var not in ('FOO', 'BAR', 'BAZ'):
+            return original_provide(self, requirement, context)
+        with lock:
+            arrived.append(requirement.env_var)
+            if len(arrived) == 3:
+                everyone_here.set()
+        # this would time out if we provided one at a time
+        assert everyone_here.wait(10)
+        context.environ[requirement.env_var] = "value of " + requirement.env_var
+        return ProvideResult(logs=["provided " + requirement.env_var])
+
+    monkeypatch.setattr(EnvVarProvider, 'provide', mock_provide)
+
+    def prepare_concurrently(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        all_logs = []
+        for i in range(3):
+            del arrived[:]
+            everyone_here.clear()
+            result = prepare_without_interaction(project, environ=environ, force_full_check=True)
+            assert result
+            assert "value of FOO" == result.environ['FOO']
+            assert "value of BAR" == result.environ['BAR']
+            assert "value of BAZ" == result.environ['BAZ']
+            assert sorted(arrived) == ['BAR', 'BAZ', 'FOO']
+            all_logs.append([log for log in result.logs if log.startswith("provided ")])
+        # logs are in a deterministic order, not the order we finished in
+        assert sorted(all_logs[0]) == ["provided BAR", "provided BAZ", "provided FOO"]
+        assert all_logs[0] == all_logs[1] == all_logs[2]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+  BAR: {}
+  BAZ: {}
+"""}, prepare_concurrently)
+
+
+def test_provided_services_see_conda_env_path(monkeypatch):
+    from conda_kapsel.plugins.provider import ProvideResult
+    from conda_kapsel.plugins.providers.redis import RedisProvider
+
+    paths_seen = []
+
+    def mock_provide(self, requirement, context):
+        paths_seen.append(context.environ['PATH'])
+        context.environ[requirement.env_var] = "redis://localhost:6379"
+        return ProvideResult.empty()
+
+    monkeypatch.setattr(RedisProvider, 'provide', mock_provide)
+
+    def can_connect_to_socket(host, port, timeout_seconds=0.5):
+        return True
+
+    monkeypatch.setattr('conda_kapsel.plugins.network_util.can_connect_to_socket', can_connect_to_socket)
+
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        prefix = environ[conda_api.conda_prefix_variable()]
+        # put the env last so that providing it changes PATH
+        bindir = os.path.join(prefix, 'Scripts' if platform.system() == 'Windows' else 'bin')
+        environ['PATH'] = os.pathsep.join([conda_api.set_conda_env_in_path(environ['PATH'], None), bindir])
+        result = prepare_without_interaction(project, environ=environ, force_full_check=True)
+        assert result
+        assert [result.environ['PATH']] == paths_seen
+        assert conda_api.set_conda_env_in_path(environ['PATH'], prefix) == paths_seen[0]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+variables:
+  FOO: { default: "foo" }
+"""}, check)
+
+
+def test_conda_env_is_provided_in_its_own_first_level():
+    from conda_kapsel.prepare import _sort_statuses_into_levels
+
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        # with the env prefix already set, other requirements don't
+        # list the environment as a dependency
+        environ = minimal_environ(PROJECT_DIR=dirname)
+        assert conda_api.conda_prefix_variable() in environ
+        local_state = LocalStateFile.load_for_directory(dirname)
+        overrides = UserConfigOverrides(inherited_env=environ[conda_api.conda_prefix_variable()])
+        statuses = [requirement.check_status(environ, local_state, 'default', overrides)
+                    for requirement in project.requirements]
+
+        def get_missing_to_provide(status):
+            return status.analysis.missing_env_vars_to_provide
+
+        levels = _sort_statuses_into_levels(environ, local_state, statuses, get_missing_to_provide)
+        assert [[conda_api.conda_prefix_variable()], ['FOO', 'REDIS_URL']] == \
+            [sorted([status.requirement.env_var for status in level]) for level in levels]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+variables:
+  FOO: { default: "foo" }
+"""}, check)
+
+
+def test_merge_environ_changes():
+    from conda_kapsel.prepare import _merge_environ_changes
+    environ = dict(A='a', B='b', C='c', D='d')
+    original = dict(A='a', B='b', C='c')
+    _merge_environ_changes(environ, original, dict(A='a', B='changed', E='added'))
+    assert dict(A='a', B='changed', D='d', E='added') == environ
+
+
+def _did_full_prepare(result):
+    return 'stage' in [record.kind for record in result.timings.records]
+
+
+def test_prepare_reuses_result_if_fingerprint_unchanged(monkeypatch):
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(FOO='bar')
+        result = prepare_without_interaction(project, environ=environ, command_name='hello')
+        assert result
+        assert _did_full_prepare(result)
+
+        def mock_internal_prepare(*args, **kwargs):
+            raise AssertionError("should not have done a full prepare")
+
+        with monkeypatch.context() as m:
+            m.setattr('conda_kapsel.prepare._internal_prepare_in_stages', mock_internal_prepare)
+            project = project_no_dedicated_env(dirname)
+            fast_result = prepare_without_interaction(project, environ=environ, command_name='hello')
+            assert fast_result
+            assert [status.requirement.title for status in result.statuses] == \
+                [status.requirement.title for status in fast_result.statuses]
+            assert fast_result.status_for('FOO') is not None
+            assert result.environ == fast_result.environ
+            assert result.command_exec_info.args == fast_result.command_exec_info.args
+            assert result.command_exec_info.cwd == fast_result.command_exec_info.cwd
+            assert result.command_exec_info.shell == fast_result.command_exec_info.shell
+            assert fast_result.environ == fast_result.command_exec_info.env
+
+        # a different command isn't the same prepare
+        assert _did_full_prepare(prepare_without_interaction(project, environ=environ, command_name='bye'))
+        # nor is a different environment
+        assert _did_full_prepare(prepare_without_interaction(project, environ=minimal_environ(FOO='baz'),
+                                                             command_name='hello'))
+        # or when we force it
+        assert _did_full_prepare(prepare_without_interaction(project, environ=environ, command_name='hello',
+                                                             force_full_check=True))
+        # check mode always checks
+        assert _did_full_prepare(prepare_without_interaction(project, environ=environ, command_name='hello',
+                                                             mode=PROVIDE_MODE_CHECK))
+
+        # changing the local state file changes the fingerprint
+        assert not _did_full_prepare(prepare_without_interaction(project, environ=environ, command_name='hello'))
+        local_state = LocalStateFile.load_for_directory(dirname)
+        local_state.set_value(['variables', 'BAR'], 'something')
+        local_state.save()
+        assert _did_full_prepare(prepare_without_interaction(project, environ=environ, command_name='hello'))
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+commands:
+  hello:
+    unix: echo hello
+    windows: echo hello
+  bye:
+    unix: echo bye
+    windows: echo bye
+"""}, check)
+
+
+def test_prepare_fingerprint_does_not_save_passwords():
+    keyring.reset_keyring_module()
+
+    def check(dirname):
+        from conda_kapsel.internal import project_cache
+
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(BAR='caller')
+        keyring.set(environ[conda_api.conda_prefix_variable()], 'FOO_PASSWORD', 'from keyring')
+        result = prepare_without_interaction(project, environ=environ)
+        assert result
+        assert 'from keyring' == result.environ['FOO_PASSWORD']
+
+        for filename in os.listdir(os.path.join(dirname, project_cache.CACHE_DIRECTORY)):
+            with open(os.path.join(dirname, project_cache.CACHE_DIRECTORY, filename)) as f:
+                saved = f.read()
+            assert 'from keyring' not in saved
+            assert 'caller' not in saved
+
+        # the fast path gets the password from the keyring again
+        fast_result = prepare_without_interaction(project, environ=environ)
+        assert fast_result
+        assert not _did_full_prepare(fast_result)
+        assert 'from keyring' == fast_result.environ['FOO_PASSWORD']
+        assert 'caller' == fast_result.environ['BAR']
+        assert result.environ == fast_result.environ
+
+        # taking the password out of the keyring changes the fingerprint
+        keyring.unset(environ[conda_api.conda_prefix_variable()], 'FOO_PASSWORD')
+        result = prepare_without_interaction(project, environ=environ)
+        assert not result
+        assert _did_full_prepare(result)
+
+    keyring.enable_fallback_keyring()
+    try:
+        with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO_PASSWORD: {}
+  BAR: {}
+"""}, check)
+    finally:
+        keyring.disable_fallback_keyring()
+
+
+def test_prepare_fingerprint_rechecks_services(monkeypatch):
+    def mock_can_connect_to_socket(host, port, timeout_seconds=0.5):
+        return port == 6379
+
+    monkeypatch.setattr("conda_kapsel.plugins.network_util.can_connect_to_socket", mock_can_connect_to_socket)
+
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(FOO='bar')
+        assert prepare_without_interaction(project, environ=environ)
+
+        fast_result = prepare_without_interaction(project, environ=environ)
+        assert fast_result
+        assert not _did_full_prepare(fast_result)
+        assert 'REDIS_URL' in [record.name for record in fast_result.timings.records
+                               if record.kind == 'check_status']
+        assert "redis://localhost:6379" == fast_result.environ['REDIS_URL']
+
+        # a service that went away without anything in the
+        # fingerprint changing makes us do a full prepare
+        monkeypatch.setattr("conda_kapsel.plugins.network_util.can_connect_to_socket",
+                            lambda host, port, timeout_seconds=0.5: False)
+        result = prepare_without_interaction(project, environ=environ)
+        assert _did_full_prepare(result)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+services:
+  REDIS_URL: redis
+"""}, check)
+
+
+def test_prepare_fingerprint_reuses_statuses_without_checking(monkeypatch):
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(FOO='bar')
+        result = prepare_without_interaction(project, environ=environ)
+        assert result
+
+        def mock_check_status(self, *args, **kwargs):
+            raise AssertionError("should not have checked %s" % self.title)
+
+        with monkeypatch.context() as m:
+            m.setattr(CondaEnvRequirement, 'check_status', mock_check_status)
+            fast_result = prepare_without_interaction(project, environ=environ)
+        assert fast_result
+        assert not _did_full_prepare(fast_result)
+        assert [(status.requirement.title, bool(status), status.status_description)
+                for status in result.statuses] == \
+            [(status.requirement.title, bool(status), status.status_description)
+             for status in fast_result.statuses]
+        conda_status = fast_result.status_for(CondaEnvRequirement)
+        assert 'CondaEnvProvider' == conda_status.provider.__class__.__name__
+        assert conda_status.analysis is not None
+        assert conda_api.conda_prefix_variable() not in [record.name for record in fast_result.timings.records
+                                                         if record.kind == 'check_status']
+
+        # unprepare can use the statuses from the fast path
+        status = unprepare(project, fast_result)
+        assert status
+        assert "Nothing to clean up for FOO." in status.logs
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+"""}, check)
+
+
+def test_prepare_fingerprint_cache_is_shared_by_extra_command_args():
+    def check(dirname):
+        from conda_kapsel.internal import project_cache
+
+        def cache_files():
+            return sorted(name for name in os.listdir(os.path.join(dirname, project_cache.CACHE_DIRECTORY))
+                          if name.startswith('prepare-'))
+
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        result = prepare_without_interaction(project, environ=environ, command_name='hello', extra_command_args=['a'])
+        assert result
+        files = cache_files()
+        assert 1 == len(files)
+
+        fast_result = prepare_without_interaction(project, environ=environ, command_name='hello',
+                                                  extra_command_args=['a'])
+        assert not _did_full_prepare(fast_result)
+        assert result.command_exec_info.args == fast_result.command_exec_info.args
+
+        # other args don't reuse the result, but don't add a cache file either
+        result = prepare_without_interaction(project, environ=environ, command_name='hello', extra_command_args=['b'])
+        assert _did_full_prepare(result)
+        assert result.command_exec_info.args[-1].endswith('b')
+        assert files == cache_files()
+        fast_result = prepare_without_interaction(project, environ=environ, command_name='hello',
+                                                  extra_command_args=['b'])
+        assert not _did_full_prepare(fast_result)
+        assert fast_result.command_exec_info.args[-1].endswith('b')
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+commands:
+  hello:
+    unix: echo hello
+    windows: echo hello
+"""}, check)
+
+
+def test_prepare_fingerprint_notices_dead_service(monkeypatch):
+    def check(dirname):
+        from conda_kapsel.prepare import _prepare_fingerprint
+
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        service_dir = os.path.join(dirname, "services", "REDIS_URL")
+        os.makedirs(service_dir)
+        with open(os.path.join(service_dir, "redis.pid"), 'w') as f:
+            f.write("%d\n" % os.getpid())
+
+        alive = _prepare_fingerprint(project, environ, environ)
+        assert [[os.path.join(service_dir, "redis.pid"), os.getpid(), True]] == alive['services']
+
+        monkeypatch.setattr('conda_kapsel.prepare._pid_is_alive', lambda pid: False)
+        dead = _prepare_fingerprint(project, environ, environ)
+        assert alive != dead
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+services:
+  REDIS_URL: redis
+"""}, check)
+
+
+def test_prepare_records_timings():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ(FOO='bar')
+        result = prepare_without_interaction(project, environ=environ, command_name='hello', force_full_check=True)
+        assert result
+
+        kinds_and_names = [(record.kind, record.name) for record in result.timings.records]
+        assert ('stage', 'Set up project.') in kinds_and_names
+        assert ('check_status', 'FOO') in kinds_and_names
+        assert ('check_status', conda_api.conda_prefix_variable()) in kinds_and_names
+        assert ('provide', conda_api.conda_prefix_variable()) in kinds_and_names
+        for record in result.timings.records:
+            assert record.duration >= 0
+            assert record.start >= 0
+
+        # the fast path checks the fingerprint and the variables, but not the environment
+        fast_result = prepare_without_interaction(project, environ=environ, command_name='hello')
+        assert fast_result
+        kinds_and_names = [(record.kind, record.name) for record in fast_result.timings.records]
+        kinds = [record.kind for record in fast_result.timings.records]
+        assert 'fingerprint' in kinds
+        assert ('check_status', 'FOO') in kinds_and_names
+        assert ('check_status', conda_api.conda_prefix_variable()) not in kinds_and_names
+        assert 'stage' not in kinds
+        assert 'provide' not in kinds
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+variables:
+  FOO: {}
+commands:
+  hello:
+    unix: echo hello
+    windows: echo hello
+"""}, check)
+
+
+def test_prepare_timings_include_conda_subprocesses(monkeypatch):
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+
+        def mock_installed(prefix):
+            # stand in for running conda without needing the packages
+            conda_api._call_conda(['--version'])
+            return dict()
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.installed_packages', mock_installed)
+        result = prepare_without_interaction(project, environ=minimal_environ(), mode=PROVIDE_MODE_CHECK)
+        assert ('subprocess', 'conda --version') in [(record.kind, record.name) for record in result.timings.records]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "packages: ['foo']\n"}, check)
+
+
+def test_prepare_fingerprint_notices_downloads():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        environ = minimal_environ()
+        result = prepare_without_interaction(project, environ=environ)
+        assert result
+        assert not _did_full_prepare(prepare_without_interaction(project, environ=environ))
+
+        with open(os.path.join(dirname, "data.csv"), 'w') as f:
+            f.write("changed")
+        assert _did_full_prepare(prepare_without_interaction(project, environ=environ))
+
+        os.remove(os.path.join(dirname, "data.csv"))
+        result = prepare_without_interaction(project, environ=environ)
+        assert not result
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+downloads:
+  DATAFILE:
+    url: http://localhost:1/data.csv
+    filename: data.csv
+""",
+                             "data.csv": "original"}, check)
@@ -26,7 +26,7 @@ from conda_kapsel.plugins.requirements.download import DownloadRequirement
 from conda_kapsel.project import Project
 from conda_kapsel.project_file import DEFAULT_PROJECT_FILENAME
 from conda_kapsel.test.environ_utils import minimal_environ
-from conda_kapsel.test.project_utils import project_no_dedicated_env
+from conda_kapsel.test.project_utils import project_no_dedicated_env, project_dir_disable_dedicated_env
 
 
 def test_properties():
@@ -230,10 +230,10 @@ def test_project_dir_not_readable(monkeypatch):
         project_dir = os.path.join(dirname, 'foo')
         os.makedirs(project_dir)
 
-        def mock_os_walk(dirname):
+        def mock_scandir(dirname):
             raise OSError("NOPE")
 
-        monkeypatch.setattr('os.walk', mock_os_walk)
+        monkeypatch.setattr('conda_kapsel.internal.py2_compat.scandir', mock_scandir)
 
         project = Project(project_dir)
 
@@ -1174,6 +1174,102 @@ def test_notebook_guess_command_can_be_default():
         check_notebook_guess_command_can_be_default)
 
 
+def test_notebook_discovery_disabled():
+    def check_notebook_discovery_disabled(dirname):
+        project = project_no_dedicated_env(dirname)
+        assert [] == project.problems
+        assert list(project.commands.keys()) == ['default']
+
+    with_directory_contents(
+        {
+            DEFAULT_PROJECT_FILENAME: "discover_notebooks: false\ncommands:\n default:\n    unix: echo 'pass'\n",
+            'test.ipynb': 'pretend there is notebook data here'
+        }, check_notebook_discovery_disabled)
+
+
+def test_notebook_discovery_not_a_boolean():
+    def check_notebook_discovery_not_a_boolean(dirname):
+        project = project_no_dedicated_env(dirname)
+        assert ["%s: discover_notebooks: field should have a boolean value not 'nope'" %
+                project.project_file.filename] == project.problems
+
+    with_directory_contents(
+        {
+            DEFAULT_PROJECT_FILENAME: "discover_notebooks: nope\n",
+            'test.ipynb': 'pretend there is notebook data here'
+        }, check_notebook_discovery_not_a_boolean)
+
+
+def test_notebook_index_only_rescans_changed_directories(monkeypatch):
+    def check_notebook_index(dirname):
+        # pretend nothing has been touched for a while, so the
+        # index trusts the directory mtimes.
+        def age_directories():
+            for (root, dirs, files) in os.walk(dirname):
+                os.utime(root, (0, 0))
+
+        project_dir_disable_dedicated_env(dirname)
+        project = Project(dirname)
+        assert [] == project.problems
+        assert sorted(project.commands.keys()) == ['a.ipynb', 'sub/b.ipynb', 'sub/nested/c.ipynb']
+
+        # loading created our cache directory, so this load
+        # can't trust the project directory's mtime yet
+        age_directories()
+        project = Project(dirname)
+        assert sorted(project.commands.keys()) == ['a.ipynb', 'sub/b.ipynb', 'sub/nested/c.ipynb']
+
+        from conda_kapsel import archiver
+        original_scan = archiver._scan_notebook_directory
+        scanned = []
+
+        def mock_scan(project_directory, relative_dir, prune_filter):
+            scanned.append(relative_dir)
+            return original_scan(project_directory, relative_dir, prune_filter)
+
+        monkeypatch.setattr('conda_kapsel.archiver._scan_notebook_directory', mock_scan)
+
+        age_directories()
+        project = Project(dirname)
+        assert sorted(project.commands.keys()) == ['a.ipynb', 'sub/b.ipynb', 'sub/nested/c.ipynb']
+        assert [] == scanned
+
+        with open(os.path.join(dirname, 'sub', 'nested', 'd.ipynb'), 'w') as f:
+            f.write('another notebook')
+        os.remove(os.path.join(dirname, 'sub', 'b.ipynb'))
+
+        project = Project(dirname)
+        assert sorted(project.commands.keys()) == ['a.ipynb', 'sub/nested/c.ipynb', 'sub/nested/d.ipynb']
+        assert ['sub', 'sub/nested'] == sorted(scanned)
+
+    with_directory_contents(
+        {
+            'a.ipynb': 'pretend there is notebook data here',
+            'sub/b.ipynb': 'pretend there is notebook data here',
+            'sub/nested/c.ipynb': 'pretend there is notebook data here',
+            'other/not_a_notebook.py': 'print("hi")'
+        }, check_notebook_index)
+
+
+def test_notebook_index_notices_new_ignore_patterns():
+    def check_notebook_index_ignore(dirname):
+        project = project_no_dedicated_env(dirname)
+        assert sorted(project.commands.keys()) == ['a.ipynb', 'sub/b.ipynb']
+
+        with open(os.path.join(dirname, '.kapselignore'), 'w') as f:
+            f.write('/sub\n')
+        os.utime(dirname, (0, 0))
+
+        project = project_no_dedicated_env(dirname)
+        assert sorted(project.commands.keys()) == ['a.ipynb']
+
+    with_directory_contents(
+        {
+            'a.ipynb': 'pretend there is notebook data here',
+            'sub/b.ipynb': 'pretend there is notebook data here'
+        }, check_notebook_index_ignore)
+
+
 def test_notebook_command_conflict():
     def check_notebook_conflict_command(dirname):
         project = project_no_dedicated_env(dirname)
@@ -1787,3 +1883,87 @@ def test_env_var_name_list_properties():
         {DEFAULT_PROJECT_FILENAME: _complicated_project_contents,
          "main.py": "",
          "foo.ipynb": ""}, check_env_var_name_list_properties)
+
+
+def test_config_cached_on_disk(monkeypatch):
+    def check_cached(dirname):
+        project = project_no_dedicated_env(dirname)
+        assert [] == project.problems
+        cache_file = os.path.join(dirname, ".kapsel-cache", "project-config.json")
+        assert os.path.isfile(cache_file)
+
+        def mock_update_from_files(*args, **kwargs):
+            raise AssertionError("should have used the disk cache")
+
+        with monkeypatch.context() as m:
+            m.setattr('conda_kapsel.project._ConfigCache._update_from_files', mock_update_from_files)
+            project2 = project_no_dedicated_env(dirname)
+            assert [] == project2.problems
+            assert project.name == project2.name
+            assert project.description == project2.description
+            assert sorted(project.env_specs.keys()) == sorted(project2.env_specs.keys())
+            assert project.env_specs['foo'].conda_packages == project2.env_specs['foo'].conda_packages
+            assert project.default_env_spec_name == project2.default_env_spec_name
+            assert [type(r) for r in project.requirements] == [type(r) for r in project2.requirements]
+            assert [r.env_var for r in project.requirements] == [r.env_var for r in project2.requirements]
+            assert sorted(project.commands.keys()) == sorted(project2.commands.keys())
+            assert project2.commands['foo'].unix_shell_commandline == 'echo hi'
+            # notebooks aren't part of the cache, they're found every time
+            assert 'test.ipynb' in project2.commands
+            assert project.default_command.name == project2.default_command.name
+
+        # changing the project file invalidates the cache
+        project2.project_file.set_value('description', "Changed")
+        project2.project_file.save()
+        project3 = project_no_dedicated_env(dirname)
+        assert "Changed" == project3.description
+
+    with_directory_contents(
+        {DEFAULT_PROJECT_FILENAME: """
+name: cached
+description: "A cached project"
+variables:
+  FOO: {}
+  BAR: { default: "baz" }
+downloads:
+  DATAFILE: http://example.com/data.csv
+services:
+  REDIS_URL: redis
+env_specs:
+  foo:
+    packages: [ python ]
+commands:
+  foo:
+    unix: echo hi
+""",
+         "test.ipynb": "{}"}, check_cached)
+
+
+def test_config_disk_cache_ignored_if_corrupted():
+    def check_corrupted(dirname):
+        cache_file = os.path.join(dirname, ".kapsel-cache", "project-config.json")
+        os.makedirs(os.path.dirname(cache_file))
+        with open(cache_file, 'w') as f:
+            f.write("{ not json")
+        project = project_no_dedicated_env(dirname)
+        assert [] == project.problems
+        assert "notcorrupted" == project.name
+        # we replaced the broken cache
+        assert "notcorrupted" == project_no_dedicated_env(dirname).name
+        with open(cache_file, 'r') as f:
+            assert "notcorrupted" in f.read()
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "name: notcorrupted\n"}, check_corrupted)
+
+
+def test_config_disk_cache_notices_icon_file():
+    def check_icon(dirname):
+        project = project_no_dedicated_env(dirname)
+        assert ["Icon file %s does not exist." % os.path.join(dirname, "foo.png")] == project.problems
+        with open(os.path.join(dirname, "foo.png"), 'w') as f:
+            f.write("not a real png")
+        project = project_no_dedicated_env(dirname)
+        assert [] == project.problems
+        assert os.path.join(dirname, "foo.png") == project.icon
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "icon: foo.png\n"}, check_icon)
@@ -25,6 +25,8 @@ from conda_kapsel.test.project_utils import project_no_dedicated_env
 from conda_kapsel.internal.test.test_conda_api import monkeypatch_conda_not_to_use_links
 from conda_kapsel.test.fake_server import fake_server
 import conda_kapsel.internal.keyring as keyring
+from conda_kapsel.internal import env_pool
+from conda_kapsel.provide import PROVIDE_MODE_CHECK
 
 
 def test_create(monkeypatch):
@@ -1174,6 +1176,281 @@ env_specs:
 """}, check)
 
 
+def _with_locking_conda_test(f, writes_lock=True, fix_error=None):
+    class LockingCondaManager(CondaManager):
+        def find_environment_deviations(self, prefix, spec):
+            if os.path.isdir(os.path.join(prefix, 'conda-meta')):
+                summary = "fixed"
+                missing = ()
+            else:
+                summary = "not created"
+                missing = tuple(spec.conda_package_names_set)
+            return CondaEnvironmentDeviations(summary=summary,
+                                              missing_packages=missing,
+                                              wrong_version_packages=(),
+                                              missing_pip_packages=(),
+                                              wrong_version_pip_packages=())
+
+        def fix_environment_deviations(self, prefix, spec, deviations=None):
+            if fix_error is not None:
+                raise CondaManagerError(fix_error)
+            if not os.path.isdir(os.path.join(prefix, 'conda-meta')):
+                os.makedirs(os.path.join(prefix, 'conda-meta'))
+            if writes_lock and not os.path.exists(spec.lock_filename):
+                if not os.path.isdir(os.path.dirname(spec.lock_filename)):
+                    os.makedirs(os.path.dirname(spec.lock_filename))
+                with codecs.open(spec.lock_filename, 'w', 'utf-8') as f:
+                    f.write("@EXPLICIT\n")
+
+        def remove_packages(self, prefix, packages):
+            pass
+
+    try:
+        push_conda_manager_class(LockingCondaManager)
+        f()
+    finally:
+        pop_conda_manager_class()
+
+
+def test_refresh_lock():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            env_spec = project.env_specs['foo']
+            env_path = env_spec.path(dirname)
+            os.makedirs(os.path.join(env_path, 'conda-meta'))
+            with codecs.open(os.path.join(env_path, 'old-file'), 'w', 'utf-8') as f:
+                f.write("old")
+            os.makedirs(os.path.dirname(env_spec.lock_filename))
+            with codecs.open(env_spec.lock_filename, 'w', 'utf-8') as f:
+                f.write("stale\n")
+
+            status = project_ops.refresh_lock(project, env_spec_name='foo')
+            assert status
+            assert ("Saved package versions for environment foo in %s." % env_spec.lock_filename) == \
+                status.status_description
+            assert not os.path.exists(os.path.join(env_path, 'old-file'))
+            assert os.path.isdir(os.path.join(env_path, 'conda-meta'))
+            with codecs.open(env_spec.lock_filename, 'r', 'utf-8') as f:
+                assert "@EXPLICIT\n" == f.read()
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "env_specs:\n  foo:\n    packages: [python]\n"}, check)
+
+
+def test_refresh_lock_default_env_spec():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.refresh_lock(project)
+            assert status
+            assert os.path.isfile(project.env_specs['default'].lock_filename)
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_nonexistent_env_spec():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        status = project_ops.refresh_lock(project, env_spec_name='nope')
+        assert not status
+        assert "Environment spec nope doesn't exist." == status.status_description
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_with_project_file_problems():
+    def check(dirname):
+        project = Project(dirname)
+        status = project_ops.refresh_lock(project)
+        assert not status
+        assert ["variables section contains wrong value type 42, should be dict or list of requirements"
+                ] == status.errors
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
+
+
+def test_refresh_lock_cannot_remove_lock(monkeypatch):
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        lock_filename = project.env_specs['default'].lock_filename
+        os.makedirs(os.path.dirname(lock_filename))
+        with codecs.open(lock_filename, 'w', 'utf-8') as f:
+            f.write("stale\n")
+
+        def mock_remove(path):
+            raise OSError("not removing")
+
+        monkeypatch.setattr('os.remove', mock_remove)
+        status = project_ops.refresh_lock(project)
+        monkeypatch.undo()
+        assert not status
+        assert ("Failed to remove %s: not removing." % lock_filename) == status.status_description
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_cannot_remove_env(monkeypatch):
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        env_path = project.env_specs['default'].path(dirname)
+        os.makedirs(env_path)
+
+        def mock_rmtree(path):
+            raise IOError("No rmtree here")
+
+        monkeypatch.setattr('shutil.rmtree', mock_rmtree)
+        status = project_ops.refresh_lock(project)
+        monkeypatch.undo()
+        assert not status
+        assert ("Failed to remove environment files in %s: No rmtree here." % env_path) == \
+            status.status_description
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_fix_fails():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.refresh_lock(project)
+            assert not status
+            assert ['cannot solve'] == status.errors
+
+        _with_locking_conda_test(attempt, fix_error='cannot solve')
+
+    with_directory_contents(dict(), check)
+
+
+def test_refresh_lock_not_saved():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.refresh_lock(project)
+            assert not status
+            assert ("Failed to save package versions for environment default in %s." %
+                    project.env_specs['default'].lock_filename) == status.status_description
+
+        _with_locking_conda_test(attempt, writes_lock=False)
+
+    with_directory_contents(dict(), check)
+
+
+_two_env_specs = "env_specs:\n  foo:\n    packages: [python]\n  bar:\n    packages: [numpy]\n"
+
+
+def test_update_env_specs():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.update_env_specs(project, jobs=2)
+            assert status
+            assert "Updated environments: bar, default, foo." == status.status_description
+            for name in ('foo', 'bar', 'default'):
+                assert os.path.isdir(os.path.join(project.env_specs[name].path(dirname), 'conda-meta'))
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: _two_env_specs}, check)
+
+
+def test_update_env_specs_check_mode():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.update_env_specs(project, mode=PROVIDE_MODE_CHECK)
+            assert not status
+            assert "Some environments need changes." == status.status_description
+            assert [] == status.errors
+            for name in ('bar', 'default', 'foo'):
+                prefix = project.env_specs[name].path(dirname)
+                assert ("Environment %s needs changes:" % prefix) in status.logs
+                assert not os.path.exists(prefix)
+
+            assert project_ops.update_env_specs(project)
+
+            status = project_ops.update_env_specs(project, mode=PROVIDE_MODE_CHECK)
+            assert status
+            assert "Environments are up to date: bar, default, foo." == status.status_description
+            assert [] == status.logs
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: _two_env_specs}, check)
+
+
+def test_update_env_specs_some_names():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.update_env_specs(project, env_spec_names=['foo'], environ=dict())
+            assert status
+            assert "Updated environments: foo." == status.status_description
+            assert not os.path.exists(project.env_specs['bar'].path(dirname))
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: _two_env_specs}, check)
+
+
+def test_update_env_specs_nonexistent_env_spec():
+    def check(dirname):
+        project = project_no_dedicated_env(dirname)
+        status = project_ops.update_env_specs(project, env_spec_names=['foo', 'nope'])
+        assert not status
+        assert "Environment spec nope doesn't exist." == status.status_description
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: _two_env_specs}, check)
+
+
+def test_update_env_specs_with_project_file_problems():
+    def check(dirname):
+        project = Project(dirname)
+        status = project_ops.update_env_specs(project)
+        assert not status
+        assert ["variables section contains wrong value type 42, should be dict or list of requirements"
+                ] == status.errors
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: "variables:\n  42"}, check)
+
+
+def test_update_env_specs_fix_fails():
+    def check(dirname):
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.update_env_specs(project)
+            assert not status
+            assert "Failed to update some environments." == status.status_description
+            assert ["bar: conda broke", "default: conda broke", "foo: conda broke"] == status.errors
+
+        _with_locking_conda_test(attempt, fix_error="conda broke")
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: _two_env_specs}, check)
+
+
+def test_update_env_specs_cannot_share(monkeypatch):
+    def check(dirname):
+        def mock_use_shared_env(self, pool, prefix, env_spec):
+            raise OSError("no sharing")
+
+        monkeypatch.setattr('conda_kapsel.plugins.providers.conda_env.CondaEnvProvider._use_shared_env',
+                            mock_use_shared_env)
+
+        def attempt():
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.update_env_specs(project, environ={env_pool.POOL_DIRECTORY_VARIABLE: dirname})
+            assert not status
+            prefix = project.env_specs['default'].path(dirname)
+            assert ["default: Failed to share environment %s: no sharing" % prefix] == status.errors
+
+        _with_locking_conda_test(attempt)
+
+    with_directory_contents(dict(), check)
+
+
 def test_add_packages_to_all_environments():
     def check(dirname):
         def attempt():
@@ -1613,6 +1890,103 @@ env_specs:
 """}, check)
 
 
+def _monkeypatch_env_pool(monkeypatch, pool):
+    def mock_create(prefix, pkgs, channels):
+        os.makedirs(os.path.join(prefix, "conda-meta"))
+        for pkg in pkgs:
+            open(os.path.join(prefix, "conda-meta", "%s-0.1-pyNN.json" % pkg), 'a').close()
+
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.create', mock_create)
+    monkeypatch.setattr('conda_kapsel.internal.conda_api.list_explicit', lambda prefix: "@EXPLICIT\n")
+    monkeypatch.setenv(env_pool.POOL_DIRECTORY_VARIABLE, pool)
+
+
+def test_clean_shared_envs(monkeypatch):
+    def check(dirname):
+        _monkeypatch_env_pool(monkeypatch, os.path.join(dirname, "pool"))
+        project_dir = os.path.join(dirname, "project")
+        os.makedirs(project_dir)
+        with codecs.open(os.path.join(project_dir, DEFAULT_PROJECT_FILENAME), 'w', 'utf-8') as f:
+            f.write("env_specs:\n  foo: {}\n  bar: {}\n")
+        project = Project(project_dir)
+
+        assert prepare.prepare_without_interaction(project, env_spec_name='foo')
+        result = prepare.prepare_without_interaction(project, env_spec_name='bar')
+        assert result
+
+        # the env specs have the same packages, so they share an env
+        envs_dir = os.path.join(project_dir, "envs")
+        shared = env_pool.shared_prefix_for_link(os.path.join(envs_dir, "foo"))
+        assert shared is not None
+        assert shared == env_pool.shared_prefix_for_link(os.path.join(envs_dir, "bar"))
+
+        status = project_ops.clean(project, result)
+        assert status
+        assert status.logs == [("Stopped using shared environment %s, other projects still use it." % shared),
+                               ("Deleted shared environment files in %s." % shared), ("Removing %s." % envs_dir)]
+        assert not os.path.exists(shared)
+        assert not os.path.exists(envs_dir)
+
+    with_directory_contents(dict(), check)
+
+
+def test_clean_shared_env_fails(monkeypatch):
+    def check(dirname):
+        _monkeypatch_env_pool(monkeypatch, os.path.join(dirname, "pool"))
+        project = Project(dirname)
+        assert prepare.prepare_without_interaction(project, env_spec_name='foo')
+        foo_dir = os.path.join(dirname, "envs", "foo")
+        shared = env_pool.shared_prefix_for_link(foo_dir)
+
+        # bar isn't shared, so unprepare doesn't release anything
+        monkeypatch.delenv(env_pool.POOL_DIRECTORY_VARIABLE)
+        result = prepare.prepare_without_interaction(project, env_spec_name='bar')
+        assert result
+
+        def mock_release(link_path):
+            raise OSError("cannot release")
+
+        monkeypatch.setattr('conda_kapsel.internal.env_pool.release', mock_release)
+        status = project_ops.clean(project, result)
+        assert not status
+        assert status.errors == [("Failed to stop using shared environment %s: cannot release." % shared)]
+
+    with_directory_contents({DEFAULT_PROJECT_FILENAME: """
+env_specs:
+   foo: {}
+   bar: {}
+"""}, check)
+
+
+def test_remove_packages_from_shared_env(monkeypatch):
+    def check(dirname):
+        pool = os.path.join(dirname, "pool")
+        _monkeypatch_env_pool(monkeypatch, pool)
+        project_dir = os.path.join(dirname, "project")
+        os.makedirs(project_dir)
+        with codecs.open(os.path.join(project_dir, DEFAULT_PROJECT_FILENAME), 'w', 'utf-8') as f:
+            f.write("packages:\n  - python\n  - numpy\n")
+        project = Project(project_dir)
+        assert prepare.prepare_without_interaction(project)
+        env_path = os.path.join(project_dir, "envs", "default")
+        old_shared = env_pool.shared_prefix_for_link(env_path)
+        assert os.path.exists(os.path.join(old_shared, "conda-meta", "numpy-0.1-pyNN.json"))
+
+        def mock_remove_packages(prefix, pkgs=None):
+            raise AssertionError("should not have modified the shared env")
+
+        monkeypatch.setattr('conda_kapsel.internal.conda_api.remove', mock_remove_packages)
+        status = project_ops.remove_packages(project, env_spec_name=None, packages=['numpy'])
+        assert status
+
+        new_shared = env_pool.shared_prefix_for_link(env_path)
+        assert new_shared == env_pool.pool_prefix(pool, project.env_specs['default'])
+        assert not os.path.exists(old_shared)
+        assert not os.path.exists(os.path.join(new_shared, "conda-meta", "numpy-0.1-pyNN.json"))
+
+    with_directory_contents(dict(), check)
+
+
 def _strip_prefixes(names):
     return list([name[len("archivedproj/"):] for name in names])
 
@@ -1863,6 +2237,33 @@ name: archivedproj
     with_directory_contents(dict(), archivetest)
 
 
+def test_archive_zip_with_gitignored_directory():
+    def archivetest(archive_dest_dir):
+        archivefile = os.path.join(archive_dest_dir, "foo.zip")
+
+        def check(dirname):
+            project = project_no_dedicated_env(dirname)
+            status = project_ops.archive(project, archivefile)
+
+            assert status
+            _assert_zip_contains(archivefile, ['foo.py', '.gitignore', 'kapsel.yml', 'kapsel-local.yml', 'lib/bar.py',
+                                               'lib/onlyignored/'])
+
+        with_directory_contents(
+            _add_empty_git({DEFAULT_PROJECT_FILENAME: """
+name: archivedproj
+        """,
+                            "foo.py": "print('hello')\n",
+                            '.gitignore': "ignoredenv/\n*.pyc\n",
+                            'ignoredenv/bin/python': '',
+                            'ignoredenv/lib/site.py': '',
+                            'lib/bar.py': '',
+                            'lib/bar.pyc': '',
+                            'lib/onlyignored/baz.pyc': ''}), check)
+
+    with_directory_contents(dict(), archivetest)
+
+
 def test_archive_zip_with_failing_git_command(monkeypatch):
     def archivetest(archive_dest_dir):
         archivefile = os.path.join(archive_dest_dir, "foo.zip")
@@ -1944,10 +2345,10 @@ def test_archive_zip_with_inability_to_walk_directory(monkeypatch):
             project = project_no_dedicated_env(dirname)
             assert project.problems == []
 
-            def mock_os_walk(dirname):
+            def mock_scandir(dirname):
                 raise OSError("NOPE")
 
-            monkeypatch.setattr('os.walk', mock_os_walk)
+            monkeypatch.setattr('conda_kapsel.internal.py2_compat.scandir', mock_scandir)
 
             status = project_ops.archive(project, archivefile)
 
@@ -2140,10 +2541,10 @@ def test_upload_cannot_walk_directory(monkeypatch):
         project = project_no_dedicated_env(dirname)
         assert [] == project.problems
 
-        def mock_os_walk(dirname):
+        def mock_scandir(dirname):
             raise OSError("NOPE")
 
-        monkeypatch.setattr('os.walk', mock_os_walk)
+        monkeypatch.setattr('conda_kapsel.internal.py2_compat.scandir', mock_scandir)
 
         status = project_ops.upload(project, site='unit_test')
         assert not status
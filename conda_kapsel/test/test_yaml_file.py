@@ -542,3 +542,108 @@ def test_read_yaml_file_and_set_get_empty_string():
         assert value == ' '
 
     with_file_contents("", check)
+
+
+def test_read_only_yaml_file_upgrades_to_round_trip_on_set_value():
+    original_content = """
+# comment in front of a
+a:
+  x: y
+  # comment in front of z
+  z: q
+b: [1, 2]
+"""
+
+    def check_read_only(filename):
+        yaml = YamlFile(filename, read_only=True)
+        assert not yaml.corrupted
+        assert "q" == yaml.get_value(["a", "z"])
+        assert [1, 2] == yaml.get_value("b")
+        assert ['a', 'b'] == list(yaml.root.keys())
+        assert not yaml._dirty
+
+        yaml.set_value(["a", "w"], "v")
+        assert yaml._round_trip
+        assert "q" == yaml.get_value(["a", "z"])
+        yaml.save()
+
+        new_content = open(filename, 'r').read()
+        assert "# comment in front of a" in new_content
+        assert "# comment in front of z" in new_content
+        assert "v" == YamlFile(filename).get_value(["a", "w"])
+
+    with_file_contents(original_content, check_read_only)
+
+
+def test_read_only_yaml_file_upgrades_to_round_trip_on_unset_and_transform():
+    original_content = """
+# comment in front of a
+a:
+  x: y
+b: c
+"""
+
+    def check_read_only(filename):
+        yaml = YamlFile(filename, read_only=True)
+        yaml.unset_value("b")
+        assert yaml.get_value("b") is None
+        yaml.save()
+        assert "# comment in front of a" in open(filename, 'r').read()
+
+        yaml = YamlFile(filename, read_only=True)
+
+        def make_changes(tree):
+            tree['d'] = 'e'
+
+        yaml.transform_yaml(make_changes)
+        yaml.save()
+        new_content = open(filename, 'r').read()
+        assert "# comment in front of a" in new_content
+        assert "d: e" in new_content
+
+    with_file_contents(original_content, check_read_only)
+
+
+def test_read_only_yaml_file_save_preserves_comments():
+    original_content = """
+# comment in front of a
+a: b
+"""
+
+    def check_read_only(filename):
+        yaml = YamlFile(filename, read_only=True)
+        assert "b" == yaml.get_value("a")
+        yaml.use_changes_without_saving()
+        yaml.save()
+        assert "# comment in front of a" in open(filename, 'r').read()
+
+    with_file_contents(original_content, check_read_only)
+
+
+def test_read_only_corrupted_yaml_file():
+    def check_corrupted(filename):
+        yaml = YamlFile(filename, read_only=True)
+        assert yaml.corrupted
+        assert yaml.corrupted_error_message == YamlFile(filename).corrupted_error_message
+        assert yaml.get_value(["a", "b"]) is None
+        with pytest.raises(ValueError) as excinfo:
+            yaml.set_value(["foo", "bar"], 42)
+        assert "Cannot modify corrupted" in repr(excinfo.value)
+
+    with_file_contents("""
+^
+a:
+  b: c
+""", check_corrupted)
+
+
+def test_read_only_missing_yaml_file():
+    def check_missing(dirname):
+        filename = os.path.join(dirname, "foo.yaml")
+        yaml = YamlFile(filename, read_only=True)
+        assert yaml.get_value(["a", "b"]) is None
+        yaml.set_value(["a", "b"], 42)
+        yaml.save()
+        assert 42 == YamlFile(filename).get_value(["a", "b"])
+
+    with_directory_contents(dict(), check_missing)
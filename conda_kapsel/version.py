@@ -0,0 +1,3 @@
+"""Version information."""
+
+version = "0.0.0"
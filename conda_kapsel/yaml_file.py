@@ -25,15 +25,44 @@ except ImportError:  # pragma: no cover
 
 import codecs
 import errno
+import functools
+import hashlib
 import os
 import sys
+import threading
 import uuid
 
+from conda_kapsel.internal import timing
 from conda_kapsel.internal.makedirs import makedirs_ok_if_exists
 from conda_kapsel.internal.rename import rename_over_existing
 from conda_kapsel.internal.py2_compat import is_string
 
 
+# The C-accelerated loader is much faster than RoundTripLoader,
+# but gives us plain dicts, so we can only use it when dicts
+# keep their order. If libyaml isn't available we still save the
+# cost of building CommentedMap trees.
+_FAST_LOADER = getattr(ryaml, 'CSafeLoader', ryaml.SafeLoader)
+_fast_load_available = sys.version_info >= (3, 7)
+
+
+def _hash_contents(contents):
+    if contents is None:
+        # a missing file is different from an empty one
+        return "missing"
+    else:
+        return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 def _atomic_replace(path, contents, encoding='utf-8'):
     tmp = path + ".tmp-" + str(uuid.uuid4())
     try:
@@ -58,7 +87,7 @@ class YamlFile(object):
 
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, read_only=False):
         """Load a YamlFile with the given filename.
 
         Raises an exception on an IOError, but if the file is
@@ -70,8 +99,24 @@ class YamlFile(object):
         and attempts to modify the file will raise an
         exception.
 
+        If ``read_only`` is True, the file is loaded with a fast
+        loader that doesn't keep comments or formatting. The first
+        call to ``set_value()``, ``unset_value()``, or
+        ``transform_yaml()`` reloads it in round-trip form, so
+        saving still preserves comments; but in this mode the
+        values from ``get_value()`` and ``root`` must not be
+        modified in place.
+
+        Args:
+            filename (str): path to the file
+            read_only (bool): True to optimize for reading the file rather than modifying it
+
         """
         self.filename = filename
+        self._read_only = read_only
+        # prepare checks and provides requirements from several
+        # threads at once, which can all parse or modify the file
+        self._lock = threading.RLock()
         self._dirty = False
         self._change_count = 0
         self.load()
@@ -84,34 +129,85 @@ class YamlFile(object):
         and attempts to modify the file will raise an
         exception.
 
+        The file contents are read right away, but they are
+        only parsed the first time we need to look at them.
+
         Returns:
             None
         """
         self._corrupted = False
         self._corrupted_error_message = None
         self._change_count = self._change_count + 1
+        self._yaml = None
+        self._round_trip = False
+        self._dirty = False
 
-        # using RoundTripLoader incorporates safe_load
-        # (we don't load code)
-        assert issubclass(ryaml.RoundTripLoader, ryaml.constructor.SafeConstructor)
         try:
             with codecs.open(self.filename, 'r', 'utf-8') as file:
-                contents = file.read()
-            self._yaml = ryaml.load(contents, Loader=ryaml.RoundTripLoader)
-            self._dirty = False
+                self._contents = file.read()
         except IOError as e:
             if e.errno == errno.ENOENT:
-                self._yaml = None
+                self._contents = None
+                self._dirty = True
             else:
                 raise e
+
+        self._contents_hash = _hash_contents(self._contents)
+
+    def _ensure_parsed(self):
+        if self._yaml is not None:
+            return
+
+        with self._lock:
+            if self._yaml is None:
+                with timing.timed(timing.TIMING_KIND_YAML_PARSE, "Parse " + self.filename):
+                    self._parse()
+
+    def _parse(self):
+        if self._contents is not None:
+            if self._read_only and _fast_load_available:
+                assert issubclass(_FAST_LOADER, ryaml.constructor.SafeConstructor)
+                try:
+                    self._yaml = ryaml.load(self._contents, Loader=_FAST_LOADER)
+                except YAMLError:
+                    # parse again below, so the error message is
+                    # the same as in round-trip mode
+                    pass
+                if self._yaml is not None:
+                    # keep the text in case we have to switch to round-trip
+                    return
+            self._parse_round_trip()
+
+        if self._yaml is None:
+            self._yaml = self._default_content()
+            self._round_trip = True
+            self._dirty = True
+
+        # we don't need the text anymore once we have the round-trip tree
+        self._contents = None
+
+    def _parse_round_trip(self):
+        # using RoundTripLoader incorporates safe_load
+        # (we don't load code)
+        assert issubclass(ryaml.RoundTripLoader, ryaml.constructor.SafeConstructor)
+        try:
+            self._yaml = ryaml.load(self._contents, Loader=ryaml.RoundTripLoader)
+            self._round_trip = True
         except YAMLError as e:
             self._corrupted = True
             self._corrupted_error_message = str(e)
             self._yaml = None
 
-        if self._yaml is None:
-            self._yaml = self._default_content()
-            self._dirty = True
+    def _ensure_round_trip(self):
+        self._throw_if_corrupted()
+
+        if not self._round_trip:
+            # we loaded with the fast loader; switch to the round-trip
+            # tree (which will also parse fine) before modifying.
+            with timing.timed(timing.TIMING_KIND_YAML_PARSE, "Parse for editing " + self.filename):
+                self._parse_round_trip()
+            assert self._round_trip
+            self._contents = None
 
     def _default_comment(self):
         return "yaml file"
@@ -124,6 +220,7 @@ class YamlFile(object):
         return root
 
     def _throw_if_corrupted(self):
+        self._ensure_parsed()
         if self._corrupted:
             raise ValueError("Cannot modify corrupted YAML file %s\n%s" %
                              (self.filename, self._corrupted_error_message))
@@ -138,6 +235,7 @@ class YamlFile(object):
         Returns:
             True if file is corrupted.
         """
+        self._ensure_parsed()
         return self._corrupted
 
     @property
@@ -149,6 +247,7 @@ class YamlFile(object):
         Returns:
             Corruption message or None.
         """
+        self._ensure_parsed()
         return self._corrupted_error_message
 
     @property
@@ -161,6 +260,17 @@ class YamlFile(object):
         """
         return self._change_count
 
+    @property
+    def contents_hash(self):
+        """Get a hash of the file contents on disk, or None if we have changes that aren't saved.
+
+        This is used for cache invalidation across processes. A
+        value cached alongside a given ``contents_hash`` can be
+        reused as long as the file still has that hash, without
+        parsing the file again. A missing file has a hash too.
+        """
+        return self._contents_hash
+
     def use_changes_without_saving(self):
         """Apply any in-memory changes as if we'd saved, but don't actually save.
 
@@ -169,7 +279,9 @@ class YamlFile(object):
         """
         self._change_count = self._change_count + 1
         self._dirty = True
+        self._contents_hash = None
 
+    @_locked
     def save(self):
         """Write the file to disk, only if any changes have been made.
 
@@ -183,6 +295,9 @@ class YamlFile(object):
         if not self._dirty:
             return
 
+        # never save the tree from the fast loader, it has no comments
+        self._ensure_round_trip()
+
         contents = ryaml.dump(self._yaml, Dumper=ryaml.RoundTripDumper)
 
         try:
@@ -202,7 +317,9 @@ class YamlFile(object):
         _atomic_replace(self.filename, contents)
         self._change_count = self._change_count + 1
         self._dirty = False
+        self._contents_hash = _hash_contents(contents)
 
+    @_locked
     def transform_yaml(self, transformer):
         """Modify the YAML parse tree.
 
@@ -221,11 +338,11 @@ class YamlFile(object):
             None
 
         """
-        self._throw_if_corrupted()
+        self._ensure_round_trip()
 
         result = transformer(self._yaml)
         if result is not True:
-            self._dirty = True
+            self._mark_dirty()
 
     @classmethod
     def _path(cls, path):
@@ -237,7 +354,12 @@ class YamlFile(object):
             except TypeError:
                 raise ValueError("YAML file path must be a string or an iterable of strings")
 
+    def _mark_dirty(self):
+        self._dirty = True
+        self._contents_hash = None
+
     def _get_dict_or_none(self, pieces):
+        self._ensure_parsed()
         current = self._yaml
         for p in pieces:
             if p in current and isinstance(current[p], dict):
@@ -247,17 +369,18 @@ class YamlFile(object):
         return current
 
     def _ensure_dicts_at_path(self, pieces):
-        self._throw_if_corrupted()
+        self._ensure_round_trip()
 
         current = self._yaml
         for p in pieces:
             if p not in current or not isinstance(current[p], dict):
                 current[p] = dict()
-                self._dirty = True
+                self._mark_dirty()
 
             current = current[p]
         return current
 
+    @_locked
     def set_value(self, path, value):
         """Set a single value at the given path.
 
@@ -269,13 +392,14 @@ class YamlFile(object):
             path (str or list of str): single key, or list of nested keys
             value: any YAML-compatible value type
         """
-        self._throw_if_corrupted()
+        self._ensure_round_trip()
 
         path = self._path(path)
         existing = self._ensure_dicts_at_path(path[:-1])
         existing[path[-1]] = value
-        self._dirty = True
+        self._mark_dirty()
 
+    @_locked
     def unset_value(self, path):
         """Remove a single value at the given path.
 
@@ -284,7 +408,7 @@ class YamlFile(object):
         Args:
             path (str or list of str): single key, or list of nested keys
         """
-        self._throw_if_corrupted()
+        self._ensure_round_trip()
 
         path = self._path(path)
 
@@ -292,7 +416,7 @@ class YamlFile(object):
         key = path[-1]
         if existing is not None and key in existing:
             del existing[key]
-            self._dirty = True
+            self._mark_dirty()
 
     def get_value(self, path, default=None):
         """Get a single value from the YAML file.